@@ -0,0 +1,209 @@
+"""
+One noisy number against everyone else: pipeline admission control and fair
+scheduling (core/pipeline.py) versus the old single FIFO queue, through the
+webhook with the fakes from benchmarks/fakes.py.
+
+    python -m benchmarks.bench_admission
+    python -m benchmarks.bench_admission --bot-messages 200 --users 40 --llm-latency lognormal:2,0.4
+
+A bot sends --bot-messages messages from one number as fast as the webhook
+takes them. Meanwhile --users ordinary numbers each send one question, spread
+over --spread seconds, and one of them reports an emergency. Under 'fifo'
+every job goes into one queue in arrival order, as before. Under 'fair' the
+bot is held to PIPELINE_MAX_QUEUED_PER_NUMBER waiting replies and one running
+flow, numbers take turns, and the emergency goes first. Inbound coalescing is
+off so every POST is a job.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import re
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+REPORT = sys.stdout
+REF_PATTERN = re.compile(r"Ref ID: (TIC-[0-9A-F]+)")
+QUESTIONS = [
+    "My main breaker trips every evening when the heater is on",
+    "How can I reduce my electricity bill this summer?",
+    "The lights in the kitchen flicker whenever the washing machine starts",
+    "Is it worth installing solar panels on a flat roof in Amman?",
+]
+EMERGENCY = "There are sparks and smoke coming from the main panel"
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--policies', nargs='+', default=['fifo', 'fair'], choices=['fifo', 'fair'])
+    parser.add_argument('--bot-messages', type=int, default=100)
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--spread', type=float, default=3.0, help="Seconds over which ordinary users arrive")
+    parser.add_argument('--llm-latency', default='lognormal:1.2,0.4')
+    parser.add_argument('--timeout', type=float, default=300.0)
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from django.conf import settings  # noqa: E402
+
+_scratch = tempfile.mkdtemp(prefix='powerpulse-admission-')
+settings.DATABASES['default'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(_scratch, 'bench.sqlite3'),
+    'OPTIONS': {'timeout': 60},
+}
+settings.MEDIA_ROOT = os.path.join(_scratch, 'media')
+settings.MESSAGE_QUEUE_BACKEND = 'memory'
+settings.CREW_VERBOSE = False
+settings.RESPONSE_CACHE_ENABLED = False
+settings.INBOUND_COALESCE_WINDOW = 0.0
+settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'localhost']
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+
+from benchmarks.fakes import install_fakes  # noqa: E402
+from config.asgi import application  # noqa: E402
+from core.pipeline import get_pipeline  # noqa: E402
+
+
+def say(*parts):
+    print(*parts, file=REPORT, flush=True)
+
+
+def percentile(samples, q):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def post(body, phone):
+    payload = urlencode({"Body": body, "From": f"whatsapp:{phone}"}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/whatsapp/message/", "raw_path": b"/whatsapp/message/",
+        "root_path": "", "query_string": b"", "client": ("127.0.0.1", 40000), "server": ("localhost", 80),
+        "headers": [(b"host", b"localhost"), (b"content-type", b"application/x-www-form-urlencoded")],
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    response = bytearray()
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        response.extend(message.get("body", b""))
+
+    await application(scope, receive, send)
+    return response.decode("utf-8", "replace")
+
+
+def fifo(submit):
+    """The pipeline as it was: one queue, arrival order, no per-number limits."""
+    def submit_in_order(handler, *job_args, key=None, priority="normal", on_shed=None):
+        return submit(handler, *job_args, priority="background" if priority == "background" else "normal")
+    return submit_in_order
+
+
+async def wait_for_idle(quiet_for=0.5):
+    pipeline = get_pipeline()
+    quiet_since = None
+    while True:
+        stats = pipeline.stats()
+        if stats["in_flight"] or stats["queue_depth"]:
+            quiet_since = None
+        elif quiet_since is None:
+            quiet_since = time.monotonic()
+        elif time.monotonic() - quiet_since >= quiet_for:
+            return
+        await asyncio.sleep(0.05)
+
+
+async def run_policy(policy, fakes, round_index):
+    loop = asyncio.get_running_loop()
+    pipeline = get_pipeline()
+    original = pipeline.submit
+    if policy == 'fifo':
+        pipeline.submit = fifo(original)
+    shed_before = dict(pipeline.stats()["shed"])
+    replies = {}
+
+    def listen(phone):
+        future = replies[phone] = loop.create_future()
+
+        def on_delivery(delivery):
+            if not delivery.is_media_follow_up and REF_PATTERN.search(delivery.text):
+                loop.call_soon_threadsafe(lambda: future.done() or future.set_result(delivery.at))
+        fakes.sender.listen(phone, on_delivery)
+        return future
+
+    bot = f"+2016{round_index}0000000"
+    bot_busy = 0
+
+    async def run_bot():
+        nonlocal bot_busy
+        for index in range(args.bot_messages):
+            if settings.PIPELINE_BUSY_MESSAGE in await post(f"{QUESTIONS[index % len(QUESTIONS)]} #{index}", bot):
+                bot_busy += 1
+            await asyncio.sleep(0)
+
+    async def run_user(index):
+        phone = f"+2016{round_index}1{index:06d}"
+        await asyncio.sleep(args.spread * index / max(1, args.users))
+        emergency = index == args.users // 3
+        reply = listen(phone)
+        started = time.perf_counter()
+        if settings.PIPELINE_BUSY_MESSAGE in await post(EMERGENCY if emergency else QUESTIONS[index % len(QUESTIONS)], phone):
+            return "busy", None
+        try:
+            return ("emergency" if emergency else "user"), await asyncio.wait_for(reply, args.timeout) - started
+        except asyncio.TimeoutError:
+            return "timeout", None
+
+    started = time.perf_counter()
+    try:
+        _, *outcomes = await asyncio.gather(run_bot(), *(run_user(i) for i in range(args.users)))
+        await wait_for_idle()
+    finally:
+        pipeline.submit = original
+    elapsed = time.perf_counter() - started
+
+    users = [seconds for kind, seconds in outcomes if kind == "user"]
+    emergency = [seconds for kind, seconds in outcomes if kind == "emergency"]
+    shed = {reason: n - shed_before[reason] for reason, n in pipeline.stats()["shed"].items()}
+    say(
+        f"{policy:<5} users answered {len(users) + len(emergency):>3}/{args.users:<3} "
+        f"p50 {percentile(users, .5):>6.2f}s p95 {percentile(users, .95):>6.2f}s max {percentile(users, 1):>6.2f}s  "
+        f"emergency {emergency[0] if emergency else float('nan'):>6.2f}s  "
+        f"bot turned away {bot_busy:>3}/{args.bot_messages}  shed {shed}  drained in {elapsed:.1f}s"
+    )
+
+
+async def main():
+    fakes = install_fakes(args.llm_latency, seed=args.seed)
+    pipeline = get_pipeline()
+    say(f"bot {args.bot_messages} messages, {args.users} users over {args.spread:g}s, llm {args.llm_latency}, "
+        f"{pipeline.workers} workers, crew stage {pipeline.stage_limits['crew']}\n")
+    try:
+        for round_index, policy in enumerate(args.policies):
+            await run_policy(policy, fakes, round_index)
+    finally:
+        fakes.close()
+
+
+if __name__ == '__main__':
+    # The flow prints progress for every message; keep only the report.
+    call_command('migrate', verbosity=0)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(main())
@@ -0,0 +1,129 @@
+"""
+An outage broadcast (core/broadcast.py) to --recipients consumers against the
+local Twilio stub, interrupted part way and resumed.
+
+    python -m benchmarks.bench_broadcast --recipients 10000
+    python -m benchmarks.bench_broadcast --recipients 2000 --send-rate 120   # dispatcher set too high
+
+Consumers are seeded into a temporary SQLite database, most of them in the
+region the broadcast targets. The run is stopped once --interrupt-at of the
+recipients are reached, then resumed, and the report checks that every
+recipient got the notice exactly once. The stub and the dispatcher share this
+process, which tops out somewhere above 100 msg/s; keep --twilio-rate below that.
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--recipients', type=int, default=10000)
+    parser.add_argument('--twilio-rate', type=float, default=100, help="Stub's per-sender limit (msg/s)")
+    parser.add_argument('--send-rate', type=float, default=95, help="Dispatcher's token bucket rate (msg/s)")
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.02, help="Stub latency per request (s)")
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--window', type=int, default=64)
+    parser.add_argument('--interrupt-at', type=float, default=0.4, help="Stop after this share is reached (0: never)")
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from django.conf import settings  # noqa: E402
+
+_scratch = tempfile.mkdtemp(prefix='powerpulse-broadcast-')
+settings.DATABASES['default'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(_scratch, 'bench.sqlite3'),
+    'OPTIONS': {'timeout': 60},
+}
+settings.TWILIO_ACCOUNT_SID = settings.TWILIO_ACCOUNT_SID or "ACstub"
+settings.TWILIO_AUTH_TOKEN = settings.TWILIO_AUTH_TOKEN or "stub"
+settings.WHATSAPP_SEND_RATE = args.send_rate
+settings.WHATSAPP_SEND_BURST = max(1, int(args.send_rate / 10))
+settings.WHATSAPP_SEND_CONCURRENCY = args.concurrency
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+
+from benchmarks.stub_server import StubServer  # noqa: E402
+from core.broadcast import pending, run_broadcast, targets  # noqa: E402
+from core.dispatch import dispatcher  # noqa: E402
+from core.models import Broadcast, EnergyConsumer  # noqa: E402
+
+DISTRICTS = ["Russeifa", "Hashemiya", "Azraq", "New Zarqa"]
+
+
+def seed(count):
+    EnergyConsumer.objects.bulk_create(
+        [
+            EnergyConsumer(
+                phone_number=f"+9627{index:08d}",
+                meter_number=f"JO-{index:08d}",
+                # One in twenty lives outside the broadcast's region.
+                address=f"Street {index % 300}, {DISTRICTS[index % len(DISTRICTS)]}, "
+                        f"{'Irbid' if index % 20 == 0 else 'Zarqa'}",
+            )
+            for index in range(count)
+        ],
+        batch_size=2000,
+    )
+
+
+def main():
+    call_command('migrate', verbosity=0)
+    started = time.perf_counter()
+    seed(args.recipients)
+    print(f"Seeded {args.recipients} consumers in {time.perf_counter() - started:.1f}s")
+    broadcast = Broadcast.objects.create(
+        title="Planned Power Outage", region="Zarqa",
+        message="Power will be off on Saturday from 09:00 to 13:00 for network maintenance. "
+                "Please unplug sensitive appliances. Reply to this number to report a fault.",
+    )
+    total = targets(broadcast).count()
+    print(f"{total} recipients, Twilio limit {args.twilio_rate:g}/s, dispatcher {args.send_rate:g}/s, "
+          f"{args.concurrency} concurrent, batch {args.batch_size}, window {args.window}\n")
+
+    with StubServer(latency=args.latency, twilio_rate=args.twilio_rate) as server:
+        settings.TWILIO_API_BASE_URL = server.url
+        stop = threading.Event()
+
+        def interrupt(current):
+            if args.interrupt_at and current.sent >= total * args.interrupt_at:
+                stop.set()
+
+        runs = []
+        for label, progress in (("first run", interrupt), ("resumed", None)):
+            started = time.perf_counter()
+            before = len(server.messages)
+            run_broadcast(broadcast, batch_size=args.batch_size, window=args.window, stop=stop, progress=progress)
+            elapsed = time.perf_counter() - started
+            runs.append((label, broadcast.status, len(server.messages) - before, elapsed))
+            stop.clear()
+            if broadcast.status == 'done':
+                break
+
+        for label, status, sent, elapsed in runs:
+            print(f"{label:<10} {status:<8} {sent:>6} sent  {elapsed:>6.2f}s  {sent / elapsed:>7.1f} msg/s")
+
+        per_recipient = Counter(form["To"] for _, form in server.messages)
+        stats = dispatcher.stats()
+        print(
+            f"\nreached {len(per_recipient)}/{total}, sent twice {sum(1 for n in per_recipient.values() if n > 1)}, "
+            f"still pending {pending(broadcast).count()}, recorded {broadcast.sent} sent / {broadcast.failed} failed"
+        )
+        print(f"429s {server.throttled}, retries {stats['retries']}, failed sends {stats['failed']}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""
+Per-request overhead of building a fresh OpenAI / Twilio / HTTP client on every
+call versus reusing the pooled clients from core.clients.
+
+    python -m benchmarks.bench_clients --iterations 200
+
+Runs against a local stub server over plain HTTP, so the numbers exclude the
+TLS handshake a real fresh connection also pays; the real-world gap is larger.
+"""
+import argparse
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+import requests
+from django.conf import settings
+from openai import OpenAI
+from twilio.rest import Client
+
+from benchmarks.stub_server import StubServer
+from core import clients
+
+
+def measure(label, func, iterations):
+    func()  # warm-up
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f"{label:<34} mean {statistics.mean(samples):>9.0f}us  p50 {statistics.median(samples):>9.0f}us  p95 {p95:>9.0f}us")
+    return statistics.mean(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    with StubServer() as server:
+        image_url = f"{server.url}/images/sample.png"
+
+        def openai_fresh():
+            client = OpenAI(api_key="stub", base_url=f"{server.url}/v1")
+            client.images.generate(model="dall-e-3", prompt="breaker panel", n=1, size="1024x1024")
+            client.close()
+
+        shared_openai = clients.get_openai_client()
+        shared_openai.base_url = f"{server.url}/v1"
+
+        def openai_shared():
+            shared_openai.images.generate(model="dall-e-3", prompt="breaker panel", n=1, size="1024x1024")
+
+        def twilio_fresh():
+            client = Client(settings.TWILIO_ACCOUNT_SID or "ACstub", settings.TWILIO_AUTH_TOKEN or "stub")
+            client.api.base_url = server.url
+            client.messages.create(from_="whatsapp:+10000000000", to="whatsapp:+10000000001", body="hi")
+
+        shared_twilio = clients.get_twilio_client()
+        shared_twilio.api.base_url = server.url
+
+        def twilio_shared():
+            shared_twilio.messages.create(from_="whatsapp:+10000000000", to="whatsapp:+10000000001", body="hi")
+
+        def http_fresh():
+            with requests.get(image_url, stream=True, timeout=10) as response:
+                for _ in response.iter_content(1024):
+                    pass
+
+        def http_shared():
+            with clients.get_http_session().get(image_url, stream=True, timeout=10) as response:
+                for _ in response.iter_content(1024):
+                    pass
+
+        print(f"Stub server: {server.url}  iterations: {args.iterations}\n")
+        for name, fresh, shared in (
+            ("OpenAI images.generate", openai_fresh, openai_shared),
+            ("Twilio messages.create", twilio_fresh, twilio_shared),
+            ("Image download (64 KiB)", http_fresh, http_shared),
+        ):
+            before = measure(f"{name} [new client]", fresh, args.iterations)
+            after = measure(f"{name} [pooled]", shared, args.iterations)
+            print(f"{'':<34} saved {before - after:>8.0f}us per request ({before / after:.1f}x)\n")
+
+    clients.registry.close()
+
+
+if __name__ == '__main__':
+    main()
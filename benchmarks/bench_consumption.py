@@ -0,0 +1,180 @@
+"""
+Meter-reading ingest, rollups and anomaly detection (core/consumption.py) on a
+synthetic fleet of meters.
+
+    python -m benchmarks.bench_consumption
+    python -m benchmarks.bench_consumption --consumers 5000 --days 90 --interval 30
+
+Every consumer gets a level, a weekday/weekend pattern and day-to-day noise.
+--anomaly-share of them get a spike or a drop on the last day. The readings
+are bulk-loaded into a temporary SQLite database, one more day is appended the
+way a daily file would be, and the last day is then scored twice:
+  vectorized  the detector: one query, one NumPy pass over all consumers
+  per-row     a query and a Python loop per consumer, with the same rule minus
+              the weekday profile, as a reference point
+Precision and recall are against the injected anomalies.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import django
+import numpy as np
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+REPORT = sys.stdout
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--consumers', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=45, help="Days of history before the appended day")
+    parser.add_argument('--interval', type=int, default=60, help="Minutes between readings")
+    parser.add_argument('--anomaly-share', type=float, default=0.02)
+    parser.add_argument('--batch-size', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from django.conf import settings  # noqa: E402
+
+_scratch = tempfile.mkdtemp(prefix='powerpulse-consumption-')
+settings.DATABASES['default'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(_scratch, 'bench.sqlite3'),
+    'OPTIONS': {'timeout': 60},
+}
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from core.consumption import detect_anomalies, ingest, usage_context  # noqa: E402
+from core.models import ConsumptionRollup, EnergyConsumer, MeterReading  # noqa: E402
+
+
+def say(*parts):
+    print(*parts, file=REPORT, flush=True)
+
+
+def simulate(rng, count, days, first_day):
+    """(count, days, slots) Wh per reading and the injected (consumer, kind) anomalies on the last day."""
+    slots = 24 * 60 // args.interval
+    level = rng.lognormal(np.log(12), 0.5, size=count)                     # kWh/day
+    weekend = rng.uniform(0.8, 1.4, size=count)
+    weekday = np.array([(first_day + timedelta(days=d)).weekday() for d in range(days)])
+    daily = level[:, None] * np.where(weekday >= 4, weekend[:, None], 1.0)  # Fri/Sat weekend
+    daily *= rng.lognormal(0, 0.12, size=(count, days))
+    anomalous = rng.choice(count, size=int(count * args.anomaly_share), replace=False)
+    spikes = anomalous[: len(anomalous) // 2]
+    drops = anomalous[len(anomalous) // 2:]
+    daily[spikes, -1] *= rng.uniform(2.5, 4.0, size=len(spikes))
+    daily[drops, -1] *= rng.uniform(0.0, 0.15, size=len(drops))
+    hourly = 0.6 + 0.8 * np.sin(np.linspace(0, 2 * np.pi, slots, endpoint=False) - 2) ** 2
+    shape = rng.dirichlet(hourly * 20, size=(count, days))
+    return np.rint(daily[..., None] * shape * 1000).astype(np.int64), {int(i) for i in anomalous}
+
+
+def readings(ids, wh, first_day, day_offset=0):
+    slots = wh.shape[2]
+    step = timedelta(minutes=args.interval)
+    for day in range(wh.shape[1]):
+        midnight = timezone.make_aware(datetime.combine(first_day + timedelta(days=day + day_offset), datetime.min.time()))
+        times = [midnight + step * (slot + 1) - timedelta(seconds=1) for slot in range(slots)]
+        for row, consumer_id in enumerate(ids):
+            values = wh[row, day].tolist()
+            for slot in range(slots):
+                yield consumer_id, times[slot], values[slot]
+
+
+def per_row_scores(ids, last_day):
+    """The same threshold, one consumer at a time and without the weekday profile."""
+    flagged = set()
+    first = last_day - timedelta(days=settings.CONSUMPTION_BASELINE_DAYS)
+    for consumer_id in ids:
+        history = dict(
+            ConsumptionRollup.objects.filter(consumer_id=consumer_id, period='day', period_start__gte=first,
+                                             period_start__lte=last_day).values_list('period_start', 'kwh')
+        )
+        today = history.pop(last_day, None)
+        values = list(history.values())
+        if today is None or len(values) < settings.CONSUMPTION_MIN_HISTORY_DAYS:
+            continue
+        mean = statistics.fmean(values)
+        std = max(statistics.stdev(values), 0.1 * mean, 0.25)
+        if abs(today - mean) / std >= settings.CONSUMPTION_ANOMALY_Z and abs(today - mean) >= settings.CONSUMPTION_ANOMALY_MIN_KWH:
+            flagged.add(consumer_id)
+    return flagged
+
+
+def quality(flagged, truth):
+    hits = len(flagged & truth)
+    return f"precision {hits / len(flagged) if flagged else 1:>6.1%}  recall {hits / len(truth) if truth else 1:>6.1%}"
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    call_command('migrate', verbosity=0)
+    EnergyConsumer.objects.bulk_create(
+        [EnergyConsumer(phone_number=f"+9627{i:08d}", meter_number=f"JO-{i:08d}") for i in range(args.consumers)],
+        batch_size=2000,
+    )
+    ids = list(EnergyConsumer.objects.order_by('id').values_list('id', flat=True))
+    last_day = timezone.localdate() - timedelta(days=1)
+    first_day = last_day - timedelta(days=args.days)
+    wh, injected = simulate(rng, args.consumers, args.days + 1, first_day)
+    truth = {ids[i] for i in injected}
+    total = wh[:, :-1].size
+    say(f"{args.consumers} meters x {args.days} days, a reading every {args.interval} min: {total:,} readings\n")
+
+    started = time.perf_counter()
+    result = ingest(readings(ids, wh[:, :-1], first_day), batch_size=args.batch_size)
+    elapsed = time.perf_counter() - started
+    say(f"bulk ingest     {elapsed:>7.2f}s  {result['readings'] / elapsed:>9,.0f} readings/s  {result['days']:,} daily rollups")
+
+    started = time.perf_counter()
+    result = ingest(readings(ids, wh[:, -1:], first_day, day_offset=args.days), batch_size=args.batch_size)
+    elapsed = time.perf_counter() - started
+    say(f"append one day  {elapsed:>7.2f}s  {result['readings'] / elapsed:>9,.0f} readings/s")
+
+    started = time.perf_counter()
+    result = ingest(readings(ids, wh[:, -1:], first_day, day_offset=args.days), batch_size=args.batch_size)
+    elapsed = time.perf_counter() - started
+    stored = MeterReading.objects.count()
+    say(f"same day again  {elapsed:>7.2f}s  {result['inserted']} inserted, {stored:,} readings stored in all")
+
+    connection.close()
+    size = os.path.getsize(settings.DATABASES['default']['NAME'])
+    say(f"database        {size / 1e6:>7.1f} MB  {size / stored:.1f} bytes per reading including indexes and rollups\n")
+
+    started = time.perf_counter()
+    report = detect_anomalies(last_day)
+    vectorized = time.perf_counter() - started
+    flagged = set(
+        EnergyConsumer.objects.filter(anomalies__day=last_day).values_list('id', flat=True)
+    )
+    say(f"vectorized  {vectorized * 1e3:>8.1f}ms  {report['anomalies']:>4} flagged  {quality(flagged, truth)}")
+
+    started = time.perf_counter()
+    naive = per_row_scores(ids, last_day)
+    per_row = time.perf_counter() - started
+    say(f"per-row     {per_row * 1e3:>8.1f}ms  {len(naive):>4} flagged  {quality(naive, truth)}  ({per_row / vectorized:.0f}x slower)")
+
+    sample = next(iter(truth))
+    phone = EnergyConsumer.objects.get(pk=sample).phone_number
+    started = time.perf_counter()
+    context = usage_context(phone)
+    say(f"\nflow context for {phone} in {(time.perf_counter() - started) * 1e3:.1f}ms:\n  {context}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,107 @@
+"""
+Per-request crew setup cost: the old `@CrewBase` class (re-reads both YAML
+files and rebuilds every Agent/Task/Crew) versus the cached templates in
+core.crews.crew_factory, which builds a fresh crew per kickoff from them.
+
+    python -m benchmarks.bench_crew_factory --iterations 200
+"""
+import argparse
+import os
+import statistics
+import time
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from crewai import Agent, Crew, Process, Task
+from crewai.project import CrewBase, agent, crew, task
+
+from core.crews import CONFIG_DIR, CrewFactory
+from core.main_llm import basic_llm
+from core.tools.dalle_tool import energy_visual_tool
+
+
+@CrewBase
+class LegacyPowerPulseCrew():
+    """The pre-factory crew definition, kept here as the baseline."""
+    agents_config = os.path.join(CONFIG_DIR, 'agents.yaml')
+    tasks_config = os.path.join(CONFIG_DIR, 'tasks.yaml')
+
+    @agent
+    def energy_planner(self) -> Agent:
+        return Agent(config=self.agents_config['energy_planner'], llm=basic_llm, verbose=True)
+
+    @agent
+    def energy_advisor(self) -> Agent:
+        return Agent(config=self.agents_config['energy_advisor'], llm=basic_llm, tools=[energy_visual_tool], verbose=True)
+
+    @agent
+    def technical_specialist(self) -> Agent:
+        return Agent(
+            config=self.agents_config['technical_specialist'], llm=basic_llm,
+            tools=[energy_visual_tool], verbose=True, allow_delegation=False,
+        )
+
+    @task
+    def planning_task(self) -> Task:
+        return Task(config=self.tasks_config['planning_task'])
+
+    @task
+    def consultation_task(self) -> Task:
+        return Task(config=self.tasks_config['consultation_task'])
+
+    @task
+    def technical_diagnosis_task(self) -> Task:
+        return Task(config=self.tasks_config['technical_diagnosis_task'])
+
+    @crew
+    def crew(self) -> Crew:
+        return Crew(
+            agents=self.agents,
+            tasks=[self.planning_task(), self.consultation_task(), self.technical_diagnosis_task()],
+            process=Process.sequential,
+            verbose=True,
+        )
+
+
+def measure(label, func, iterations):
+    func()
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1e6)
+    samples.sort()
+    mean = statistics.mean(samples)
+    print(f"{label:<40} mean {mean:>10.1f}us  p50 {statistics.median(samples):>10.1f}us  p99 {samples[int(len(samples) * 0.99) - 1]:>10.1f}us")
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+
+    factory = CrewFactory()
+
+    def checkout():
+        with factory.acquire():
+            pass
+
+    legacy = measure("@CrewBase: PowerPulseCrew().crew()", lambda: LegacyPowerPulseCrew().crew(), args.iterations)
+    built = measure("factory.build() (cached templates)", factory.build, args.iterations)
+    measure("factory.acquire() (per kickoff)", checkout, args.iterations)
+    measure("factory.templates() (mtime check)", factory.templates, args.iterations)
+
+    print(f"\nbuild vs legacy: {legacy / built:.1f}x")
+
+    started = time.perf_counter()
+    os.utime(factory.tasks_path)
+    factory.templates()
+    print(f"Hot reload after touching tasks.yaml: {(time.perf_counter() - started) * 1e3:.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,149 @@
+"""
+Outbound WhatsApp sending during a broadcast: the old direct path (one
+blocking messages.create per message from a thread pool, no retry) versus the
+dispatcher in core/dispatch.py (token bucket per sender, concurrent async sends,
+backoff on 429/5xx, per-message keys).
+
+    python -m benchmarks.bench_dispatch --messages 600 --twilio-rate 50
+    python -m benchmarks.bench_dispatch --send-rate 80 --twilio-rate 50   # dispatcher set too high
+
+Both run against a local stub of Twilio's Messages API that accepts at most
+--twilio-rate messages per second per sender and answers 429 beyond that.
+Each recipient gets --parts messages per broadcast item, which must arrive in
+order. The dispatcher run then re-submits every message with the same keys to
+check that nothing is sent twice.
+"""
+import argparse
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+django.setup()
+
+from django.conf import settings
+from twilio.base.exceptions import TwilioRestException
+from twilio.rest import Client
+
+from benchmarks.stub_server import StubServer
+from core.dispatch import OutboundDispatcher
+
+SENDER = "whatsapp:+10000000000"
+
+
+def broadcast(messages, recipients, parts):
+    """(to, body, key) in submission order: each recipient's parts back to back."""
+    plan = []
+    for index in range(messages // parts):
+        to = f"whatsapp:+2019{index % recipients:07d}"
+        for part in range(parts):
+            plan.append((to, f"Outage notice {index} part {part + 1}/{parts}", f"bench-{index}:{part}"))
+    return plan
+
+
+def order_violations(server):
+    last = {}
+    violations = 0
+    for _, form in server.messages:
+        item, part = form["Body"].split()[2], int(form["Body"].split()[4].split("/")[0])
+        previous = last.get((form["To"], item), 0)
+        if part < previous:
+            violations += 1
+        last[(form["To"], item)] = part
+    return violations
+
+
+def report(label, plan, server, elapsed, latencies, extra=""):
+    delivered = len({form["Body"] + form["To"] for _, form in server.messages})
+    ordered = sorted(latencies)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))] if ordered else float('nan')
+    print(
+        f"{label:<11} {delivered:>5}/{len(plan):<5} delivered  lost {len(plan) - delivered:>5}  "
+        f"429s {server.throttled:>5}  {elapsed:>6.2f}s  {delivered / elapsed:>7.1f} msg/s  "
+        f"p50 {statistics.median(ordered) if ordered else float('nan'):>6.2f}s p99 {p99:>6.2f}s  "
+        f"out of order {order_violations(server)}{extra}"
+    )
+
+
+def run_direct(plan, args):
+    with StubServer(latency=args.latency, twilio_rate=args.twilio_rate) as server:
+        client = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+        client.api.base_url = server.url
+
+        def send(item):
+            to, body, _ = item
+            started = time.perf_counter()
+            try:
+                client.messages.create(from_=SENDER, to=to, body=body)
+            except TwilioRestException:
+                return None
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            results = list(pool.map(send, plan))
+        elapsed = time.perf_counter() - started
+        report("direct", plan, server, elapsed, [r for r in results if r is not None])
+
+
+def run_dispatcher(plan, args):
+    with StubServer(latency=args.latency, twilio_rate=args.twilio_rate) as server:
+        settings.TWILIO_API_BASE_URL = server.url
+        dispatcher = OutboundDispatcher(
+            rate=args.send_rate, burst=args.burst, concurrency=args.concurrency,
+            max_attempts=settings.WHATSAPP_SEND_MAX_ATTEMPTS, backoff=settings.WHATSAPP_SEND_BACKOFF,
+            backoff_max=settings.WHATSAPP_SEND_BACKOFF_MAX,
+        )
+        latencies = []
+
+        def done(future, submitted):
+            if future.result():
+                latencies.append(time.perf_counter() - submitted)
+
+        started = time.perf_counter()
+        futures = []
+        for to, body, key in plan:
+            future = dispatcher.submit(to, body, key=key, from_=SENDER)
+            future.add_done_callback(partial(done, submitted=time.perf_counter()))
+            futures.append(future)
+        sids = [future.result() for future in futures]
+        elapsed = time.perf_counter() - started
+
+        again = [dispatcher.submit(to, body, key=key, from_=SENDER) for to, body, key in plan]
+        duplicates = sum(1 for future, sid in zip(again, sids) if sid and future.result() != sid)
+        stats = dispatcher.stats()
+        report(
+            "dispatcher", plan, server, elapsed, latencies,
+            f"\n{'':<11} retries {stats['retries']}, failed {stats['failed']}, "
+            f"re-submitted {len(plan)}: deduplicated {stats['deduplicated']}, sent twice {duplicates}",
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=600)
+    parser.add_argument('--recipients', type=int, default=200)
+    parser.add_argument('--parts', type=int, default=3, help="Messages per recipient per broadcast item")
+    parser.add_argument('--twilio-rate', type=float, default=50, help="Stub's per-sender limit (msg/s)")
+    parser.add_argument('--send-rate', type=float, default=45, help="Dispatcher's token bucket rate (msg/s)")
+    parser.add_argument('--burst', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--latency', type=float, default=0.05, help="Stub latency per request (s)")
+    args = parser.parse_args()
+
+    settings.TWILIO_ACCOUNT_SID = settings.TWILIO_ACCOUNT_SID or "ACstub"
+    settings.TWILIO_AUTH_TOKEN = settings.TWILIO_AUTH_TOKEN or "stub"
+    plan = broadcast(args.messages, args.recipients, args.parts)
+    print(f"{len(plan)} messages to {min(args.recipients, len(plan) // args.parts)} recipients, "
+          f"Twilio limit {args.twilio_rate:g}/s, dispatcher {args.send_rate:g}/s burst {args.burst}, "
+          f"{args.concurrency} concurrent\n")
+    run_direct(plan, args)
+    run_dispatcher(plan, args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""
+Image variants (core/image_variants.py) on synthetic DALL-E-sized diagrams:
+bytes per variant and what that means for a download on a slow mobile link,
+transcode throughput inline and in the process pool, and the variant URL's
+latency cold, warm, conditional (304) and ranged.
+
+    python -m benchmarks.bench_image_variants
+    python -m benchmarks.bench_image_variants --images 48 --workers 1 2 4 --mbps 0.75
+
+The images are 1024x1024 PNGs with gradients, shapes, labels and sensor noise,
+which compress about as badly as the real ones. Requests go through Django's
+test client against a temporary MEDIA_ROOT; no server or network is involved.
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import django
+import numpy as np
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+REPORT = sys.stdout
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--images', type=int, default=24)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help="Pool sizes to time")
+    parser.add_argument('--mbps', type=float, default=1.0, help="Link speed for the download estimate")
+    parser.add_argument('--repeat', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from django.conf import settings  # noqa: E402
+
+_scratch = tempfile.mkdtemp(prefix='powerpulse-variants-')
+settings.MEDIA_ROOT = os.path.join(_scratch, 'media')
+settings.DATABASES['default'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(_scratch, 'bench.sqlite3'),
+}
+
+django.setup()
+
+from django.test import Client  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+from core.image_variants import VariantStore, image_variants, transcode  # noqa: E402
+
+
+def say(*parts):
+    print(*parts, file=REPORT, flush=True)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def draw(rng, path):
+    x = np.linspace(0, 1, 1024)
+    tint = rng.uniform(0.2, 1.0, size=3)
+    base = np.stack([np.outer(x, 1 - x) * tint[0], np.outer(1 - x, x) * tint[1], np.outer(x, x) * tint[2]], -1) * 255
+    image = Image.fromarray((base + rng.normal(0, 10, base.shape)).clip(0, 255).astype('uint8'))
+    canvas = ImageDraw.Draw(image)
+    for _ in range(rng.integers(15, 40)):
+        x0, y0 = rng.integers(0, 900, size=2)
+        x1, y1 = x0 + rng.integers(30, 300), y0 + rng.integers(30, 300)
+        color = tuple(int(c) for c in rng.integers(0, 255, size=3))
+        if rng.random() < 0.5:
+            canvas.rectangle((x0, y0, x1, y1), outline=color, width=int(rng.integers(2, 8)))
+        else:
+            canvas.ellipse((x0, y0, x1, y1), fill=color)
+        canvas.text((x0 + 4, y0 + 4), f"L{rng.integers(1, 4)} {rng.integers(10, 400)}A", fill=(0, 0, 0))
+    image.save(path)
+
+
+def timed_batch(store_workers, names):
+    """Seconds to make the 'whatsapp' variant of every image with a fresh pool of `store_workers`."""
+    store = VariantStore(settings.IMAGE_VARIANTS, workers=store_workers, subdir=f'bench-{store_workers}')
+    # Start every worker before timing; the pool starts them lazily.
+    pool = store._executor()
+    for future in [pool.submit(time.sleep, 0.3) for _ in range(store_workers)]:
+        future.result()
+    started = time.perf_counter()
+    futures = [store.submit(name, 'whatsapp') for name in names]
+    for future in futures:
+        future.result()
+    elapsed = time.perf_counter() - started
+    store.shutdown()
+    return elapsed
+
+
+def main():
+    rng = np.random.default_rng(args.seed)
+    library = os.path.join(settings.MEDIA_ROOT, 'generated_images')
+    os.makedirs(library)
+    names = []
+    for index in range(args.images):
+        names.append(f'generated_images/diagram_{index:03d}.png')
+        draw(rng, os.path.join(settings.MEDIA_ROOT, names[-1]))
+    originals = [os.path.getsize(os.path.join(settings.MEDIA_ROOT, name)) for name in names]
+
+    say(f"{args.images} images, download time at {args.mbps} Mbit/s\n")
+    say(f"{'variant':<10} {'spec':<16} {'mean size':>10} {'ratio':>7} {'download':>9} {'transcode':>10}")
+    say(f"{'original':<10} {'1024 PNG':<16} {statistics.fmean(originals) / 1e3:>8.0f}kB {1:>7.1%} "
+        f"{statistics.fmean(originals) * 8 / (args.mbps * 1e6):>8.2f}s")
+    for variant, (side, fmt, quality) in image_variants.variants.items():
+        sizes, seconds = [], []
+        for name in names:
+            target = image_variants.path(name, variant)
+            started = time.perf_counter()
+            sizes.append(transcode(os.path.join(settings.MEDIA_ROOT, name), target, side, fmt, quality))
+            seconds.append(time.perf_counter() - started)
+            os.remove(target)
+        mean = statistics.fmean(sizes)
+        say(f"{variant:<10} {f'{side} {fmt} q{quality}':<16} {mean / 1e3:>8.0f}kB {mean / statistics.fmean(originals):>7.1%} "
+            f"{mean * 8 / (args.mbps * 1e6):>8.2f}s {statistics.fmean(seconds) * 1e3:>8.0f}ms")
+
+    say(f"\n'whatsapp' variant of every image ({len(os.sched_getaffinity(0))} CPUs available to the pool):")
+    started = time.perf_counter()
+    for name in names:
+        transcode(os.path.join(settings.MEDIA_ROOT, name), os.path.join(_scratch, 'inline.jpg'), *image_variants.variants['whatsapp'])
+    inline = time.perf_counter() - started
+    say(f"  inline, on the calling thread   {inline:>6.2f}s  {args.images / inline:>6.1f} images/s")
+    for workers in args.workers:
+        elapsed = timed_batch(workers, names)
+        say(f"  process pool, {workers} worker{'s' if workers > 1 else ' '}        {elapsed:>6.2f}s  {args.images / elapsed:>6.1f} images/s")
+
+    client = Client()
+    client.get('/media/variants/thumb/missing.png')  # import the URLconf outside the timings
+    url = f"/media/variants/whatsapp/{names[0]}"
+    started = time.perf_counter()
+    response = client.get(url)
+    cold = time.perf_counter() - started
+    etag = response['ETag']
+
+    def sample(**headers):
+        latencies = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            response = client.get(url, **headers)
+            latencies.append(time.perf_counter() - started)
+        return response, latencies
+
+    say(f"\n{url}")
+    say(f"  cold (transcode)  {cold * 1e3:>7.1f}ms  {response.status_code}  {len(response.content):,} bytes")
+    for label, headers in (
+        ("warm", {}),
+        ("If-None-Match", {"HTTP_IF_NONE_MATCH": etag}),
+        ("Range 0-16383", {"HTTP_RANGE": "bytes=0-16383"}),
+    ):
+        response, latencies = sample(**headers)
+        say(f"  {label:<17} {percentile(latencies, .5) * 1e3:>7.2f}ms  {response.status_code}  {len(response.content):,} bytes "
+            f"(p95 {percentile(latencies, .95) * 1e3:.2f}ms)")
+
+    # Concurrent first requests for one variant share one transcode.
+    before = image_variants.stats()["transcoded"]
+    futures = [image_variants.submit(names[1], 'webp') for _ in range(20)]
+    paths = {future.result() for future in futures}
+    say(f"\n20 simultaneous first requests: {image_variants.stats()['transcoded'] - before} transcode, {len(paths)} file")
+    image_variants.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""
+Bursty WhatsApp users through the webhook with inbound coalescing
+(core/inbound.py) off and on, with the fakes from benchmarks/fakes.py.
+
+    python -m benchmarks.bench_inbound --windows 0 2.5
+    python -m benchmarks.bench_inbound --users 50 --gap lognormal:1.2,0.6 --retry-share 0.2
+
+Each virtual user sends --bursts bursts of several short messages, spaced by
+--gap, the way people type on WhatsApp. --retry-share of the POSTs are
+re-posted a moment later with the same MessageSid, as Twilio does when an ack
+is slow. Every --emergency-every'th burst ends in an emergency, which must
+not wait for the window. After a burst the user waits for a reply, then for
+--think seconds. Reported per window:
+
+  tix         tickets per burst, i.e. flow runs
+  jobs/llm    pipeline jobs (flows plus media follow-ups) and LLM calls per burst
+  reply       last message of a burst -> first reply after it. With the window
+              off, that reply may answer only the burst's first fragment.
+  emergency   the same for bursts ending in an emergency
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import uuid
+from urllib.parse import urlencode
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+REPORT = sys.stdout
+REF_PATTERN = re.compile(r"Ref ID: (TIC-[0-9A-F]+)")
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--windows', type=float, nargs='+', default=[0.0, 2.5], help="INBOUND_COALESCE_WINDOW values")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--bursts', type=int, default=3, help="Bursts per user")
+    parser.add_argument('--gap', default='lognormal:0.7,0.5', help="Between messages of a burst (see benchmarks/fakes.py)")
+    parser.add_argument('--retry-share', type=float, default=0.1, help="Share of POSTs Twilio re-posts")
+    parser.add_argument('--emergency-every', type=int, default=4, help="Every n-th burst ends in an emergency")
+    parser.add_argument('--think', type=float, default=2.0, help="Pause after a reply before the next burst (s)")
+    parser.add_argument('--llm-latency', default='lognormal:1.2,0.4')
+    parser.add_argument('--timeout', type=float, default=60.0)
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from django.conf import settings  # noqa: E402
+
+_scratch = tempfile.mkdtemp(prefix='powerpulse-inbound-')
+settings.DATABASES['default'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(_scratch, 'bench.sqlite3'),
+    'OPTIONS': {'timeout': 60},
+}
+settings.MEDIA_ROOT = os.path.join(_scratch, 'media')
+settings.MESSAGE_QUEUE_BACKEND = 'memory'
+settings.CREW_VERBOSE = False
+# Every burst should reach the crews, not an earlier user's cached answer.
+settings.RESPONSE_CACHE_ENABLED = False
+settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'localhost']
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+
+from benchmarks.fakes import Latency, install_fakes  # noqa: E402
+from config.asgi import application  # noqa: E402
+from core.inbound import coalescer  # noqa: E402
+from core.models import ServiceTicket  # noqa: E402
+from core.pipeline import get_pipeline  # noqa: E402
+
+BURSTS = [
+    ["hi", "my AC", "keeps tripping the breaker every evening"],
+    ["hello", "question about my bill", "it doubled this month", "we were away half of it"],
+    ["good morning", "the kitchen lights flicker", "when the washing machine starts"],
+    ["hey", "is it worth getting solar panels", "flat roof in Amman"],
+]
+EMERGENCY = ["hi", "there's smoke coming out of the breaker panel"]
+
+
+def say(*parts):
+    print(*parts, file=REPORT, flush=True)
+
+
+def percentile(samples, q):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+async def wait_for_idle(quiet_for=0.5):
+    """Until nothing has been buffered, queued or running for `quiet_for` seconds."""
+    pipeline = get_pipeline()
+    quiet_since = None
+    while True:
+        stats = pipeline.stats()
+        if stats["in_flight"] or stats["queue_depth"] or coalescer.stats()["messages_buffered"]:
+            quiet_since = None
+        elif quiet_since is None:
+            quiet_since = time.monotonic()
+        elif time.monotonic() - quiet_since >= quiet_for:
+            return
+        await asyncio.sleep(0.05)
+
+
+async def post(body, phone, sid):
+    payload = urlencode({"Body": body, "From": f"whatsapp:{phone}", "MessageSid": sid}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/whatsapp/message/", "raw_path": b"/whatsapp/message/",
+        "root_path": "", "query_string": b"", "client": ("127.0.0.1", 40000), "server": ("localhost", 80),
+        "headers": [(b"host", b"localhost"), (b"content-type", b"application/x-www-form-urlencoded")],
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await application(scope, receive, send)
+
+
+async def virtual_user(index, window, fakes, results, rng, gap):
+    loop = asyncio.get_running_loop()
+    phone = f"+2017{int(window * 10):02d}{index:05d}"
+    waiting = {}
+
+    def on_delivery(delivery):
+        future = waiting.get("reply")
+        if future is not None and not delivery.is_media_follow_up and REF_PATTERN.search(delivery.text):
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(delivery.at))
+
+    fakes.sender.listen(phone, on_delivery)
+    retries = []
+    for burst_index in range(args.bursts):
+        emergency = args.emergency_every and (index + burst_index) % args.emergency_every == args.emergency_every - 1
+        burst = EMERGENCY if emergency else BURSTS[(index + burst_index) % len(BURSTS)]
+        for position, body in enumerate(burst):
+            if position:
+                await asyncio.sleep(gap.sample())
+            sid = f"SM{uuid.uuid4().hex}"
+            if position == len(burst) - 1:
+                waiting["reply"] = loop.create_future()
+                sent_at = time.perf_counter()
+            await post(body, phone, sid)
+            if rng.random() < args.retry_share:
+                retries.append(asyncio.create_task(_retry(body, phone, sid)))
+        try:
+            replied_at = await asyncio.wait_for(waiting["reply"], args.timeout)
+            results["emergency" if emergency else "reply"].append(replied_at - sent_at)
+        except asyncio.TimeoutError:
+            results["timeouts"] += 1
+        await asyncio.sleep(args.think)
+    await asyncio.gather(*retries)
+
+
+async def _retry(body, phone, sid):
+    await asyncio.sleep(1.0)
+    await post(body, phone, sid)
+
+
+async def run_window(window, fakes):
+    coalescer.window = window
+    coalescer.max_wait = max(settings.INBOUND_COALESCE_MAX_WAIT, window)
+    pipeline = get_pipeline()
+    before = (pipeline.stats()["enqueued"], fakes.llm.calls, await asyncio.to_thread(ServiceTicket.objects.count),
+              coalescer.stats()["duplicates"])
+    results = {"reply": [], "emergency": [], "timeouts": 0}
+    rng = random.Random(args.seed)
+    gap = Latency(args.gap, args.seed)
+
+    await asyncio.gather(*(virtual_user(i, window, fakes, results, rng, gap) for i in range(args.users)))
+    await wait_for_idle()
+
+    bursts = args.users * args.bursts
+    jobs = pipeline.stats()["enqueued"] - before[0]
+    llm_calls = fakes.llm.calls - before[1]
+    tickets = await asyncio.to_thread(ServiceTicket.objects.count) - before[2]
+    s = lambda samples, q: percentile(samples, q)  # noqa: E731
+    say(
+        f"{window:>6g}s  tix {tickets / bursts:>4.2f}  jobs {jobs / bursts:>4.2f}  llm {llm_calls / bursts:>5.2f}  "
+        f"retries dropped {coalescer.stats()['duplicates'] - before[3]:>3}  "
+        f"reply p50 {s(results['reply'], .5):>5.2f}s p95 {s(results['reply'], .95):>5.2f}s  "
+        f"emergency p50 {s(results['emergency'], .5):>5.2f}s p95 {s(results['emergency'], .95):>5.2f}s  "
+        f"timeouts {results['timeouts']}"
+    )
+
+
+async def main():
+    fakes = install_fakes(args.llm_latency, seed=args.seed)
+    say(f"{args.users} users x {args.bursts} bursts, gap {args.gap}, retry share {args.retry_share:g}, "
+        f"llm {args.llm_latency}\n")
+    say(f"{'window':>7}  per burst")
+    try:
+        for window in args.windows:
+            await run_window(window, fakes)
+    finally:
+        fakes.close()
+
+
+if __name__ == '__main__':
+    # The flow prints progress for every message; keep only the report.
+    call_command('migrate', verbosity=0)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(main())
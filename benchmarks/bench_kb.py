@@ -0,0 +1,158 @@
+"""
+Knowledge base (core/knowledge_base.py) over a synthetic corpus: build and
+incremental rebuild time, load time, search latency with and without the IVF
+index, and how much of the exact top-k the IVF index finds.
+
+    python -m benchmarks.bench_kb
+    python -m benchmarks.bench_kb --documents 2000 --paragraphs 40 --probes 4 8 16
+
+The corpus is --documents manuals of --paragraphs paragraphs each, written from
+a shared per-topic vocabulary plus terms of its own, so manuals on one topic
+are related but not identical.
+Queries are a few words taken from a random chunk; 'hit' is the share of
+queries whose own chunk comes back in the top k. After the first build one
+document is edited and the index is rebuilt to show the incremental path.
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import django
+import numpy as np
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+REPORT = sys.stdout
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--documents', type=int, default=1000)
+    parser.add_argument('--paragraphs', type=int, default=30, help="Paragraphs per document")
+    parser.add_argument('--topics', type=int, default=60)
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--ivf', type=int, default=None, help="IVF lists (default: sqrt(chunks))")
+    parser.add_argument('--probes', type=int, nargs='+', default=[4, 8, 16, 32])
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from django.conf import settings  # noqa: E402
+
+_scratch = tempfile.mkdtemp(prefix='powerpulse-kb-')
+settings.KB_SOURCE_DIR = os.path.join(_scratch, 'docs')
+settings.KB_INDEX_DIR = os.path.join(_scratch, 'index')
+settings.KB_EMBEDDING_BACKEND = 'hashed'
+
+django.setup()
+
+from core.knowledge_base import KnowledgeBase, build_index  # noqa: E402
+
+SYLLABLES = ["ka", "lo", "mi", "ru", "te", "vo", "zan", "per", "dis", "tor", "gen", "mal", "sub", "vol", "amp", "ohm"]
+
+
+def say(*parts):
+    print(*parts, file=REPORT, flush=True)
+
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+def write_corpus(rng):
+    words = sorted({"".join(rng.choices(SYLLABLES, k=rng.randint(2, 4))) for _ in range(30000)})
+    common, words = words[:300], words[300:]
+    topics = [rng.sample(words, 150) for _ in range(args.topics)]
+    os.makedirs(settings.KB_SOURCE_DIR)
+    for index in range(args.documents):
+        # A topic's shared terms, this manual's own (model names, part numbers) and filler.
+        topic, own = topics[index % args.topics], rng.sample(words, 40)
+        paragraphs = [
+            " ".join(rng.choice(rng.choices((topic, own, common), weights=(45, 25, 30))[0])
+                     for _ in range(rng.randint(60, 140))) + "."
+            for _ in range(args.paragraphs)
+        ]
+        with open(os.path.join(settings.KB_SOURCE_DIR, f"manual_{index:05d}.md"), "w", encoding="utf-8") as f:
+            f.write(f"# Manual {index}\n\n" + "\n\n".join(paragraphs))
+
+
+def make_queries(kb, rng):
+    index = kb._current()
+    queries = []
+    for _ in range(args.queries):
+        row = rng.randrange(len(index.matrix))
+        words = index.text(row).split()
+        start = rng.randrange(max(1, len(words) - 8))
+        queries.append((" ".join(words[start:start + 8]), row))
+    return queries
+
+
+def measure(kb, queries, probes):
+    kb.probes = probes
+    found, hits, latencies = [], 0, []
+    index = kb._current()
+    for query, row in queries:
+        started = time.perf_counter()
+        top = index.top_k(index.embed_query(query), args.k, probes)
+        latencies.append(time.perf_counter() - started)
+        rows = {int(index.order[r]) for r, _ in top}
+        hits += row in rows
+        found.append(rows)
+    return found, hits / len(queries), latencies
+
+
+def main():
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    write_corpus(rng)
+    size = sum(os.path.getsize(os.path.join(settings.KB_SOURCE_DIR, name)) for name in os.listdir(settings.KB_SOURCE_DIR))
+    say(f"{args.documents} documents, {size / 1e6:.1f} MB, written in {time.perf_counter() - started:.1f}s\n")
+
+    built = build_index(settings.KB_SOURCE_DIR, settings.KB_INDEX_DIR, ivf_lists=0)
+    say(f"full build      {built['seconds']:>7.2f}s  {built['chunks']} chunks")
+    path = os.path.join(settings.KB_SOURCE_DIR, "manual_00000.md")
+    with open(path, "a", encoding="utf-8") as f:
+        f.write("\n\nRevised clause: inverter earthing must be checked annually.")
+    rebuilt = build_index(settings.KB_SOURCE_DIR, settings.KB_INDEX_DIR, ivf_lists=0)
+    say(f"one file edited {rebuilt['seconds']:>7.2f}s  {rebuilt['embedded']} embedded, {rebuilt['reused']} reused")
+    ivf = build_index(settings.KB_SOURCE_DIR, settings.KB_INDEX_DIR, rebuild=True,
+                      ivf_lists=args.ivf if args.ivf is not None else int(np.sqrt(built['chunks'])))
+    say(f"with IVF        {ivf['seconds']:>7.2f}s  {ivf['ivf_lists']} lists")
+
+    version_dir = os.path.join(settings.KB_INDEX_DIR, ivf['version'])
+    matrix_path = os.path.join(version_dir, "index.npy")
+    for label, mmap_mode in (("np.load", None), ("memory-mapped", "r")):
+        started = time.perf_counter()
+        np.load(matrix_path, mmap_mode=mmap_mode)
+        say(f"load {label:<14} {(time.perf_counter() - started) * 1e3:>7.2f}ms  ({os.path.getsize(matrix_path) / 1e6:.0f} MB matrix)")
+    started = time.perf_counter()
+    kb = KnowledgeBase(settings.KB_INDEX_DIR, top_k=args.k, probes=args.probes[0], min_score=0.0)
+    kb._current()
+    say(f"load whole index   {(time.perf_counter() - started) * 1e3:>7.2f}ms\n")
+
+    queries = make_queries(kb, rng)
+    # Exact search is the IVF index with every list probed.
+    exact, exact_hit, latencies = measure(kb, queries, probes=ivf['ivf_lists'] or 1)
+    say(f"{'search':<12} {'p50':>8} {'p95':>8} {'hit@' + str(args.k):>7} {'recall':>7}")
+    say(f"{'exact':<12} {percentile(latencies, .5) * 1e3:>6.2f}ms {percentile(latencies, .95) * 1e3:>6.2f}ms "
+        f"{exact_hit:>7.1%} {1:>7.1%}")
+    for probes in args.probes:
+        found, hit, latencies = measure(kb, queries, probes)
+        recall = sum(len(a & b) for a, b in zip(found, exact)) / sum(len(b) for b in exact)
+        say(f"{'ivf ' + str(probes) + ' probes':<12} {percentile(latencies, .5) * 1e3:>6.2f}ms "
+            f"{percentile(latencies, .95) * 1e3:>6.2f}ms {hit:>7.1%} {recall:>7.1%}")
+
+    context = kb.context(queries[0][0])
+    say(f"\nprompt context {len(context)} chars (KB_MAX_CONTEXT_CHARS {settings.KB_MAX_CONTEXT_CHARS}) "
+        f"instead of a {os.path.getsize(path) / 1e3:.0f} kB manual")
+
+
+if __name__ == '__main__':
+    main()
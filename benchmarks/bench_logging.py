@@ -0,0 +1,163 @@
+"""
+Logging overhead per message (core/logs.py): what the lines one message
+produces cost the thread that logs them, with print() and a synchronous
+FileHandler (the previous setup) against the queue handler, JSON and text.
+
+    python -m benchmarks.bench_logging
+    python -m benchmarks.bench_logging --messages 5000 --threads 1 8 32 --io-latency 0.002
+
+Each "message" logs the dozen lines a flow logs for one WhatsApp message, inside
+a log_context with a number and a ticket, from --threads threads at once.
+--io-latency adds a sleep to every write of the target handler, standing in
+for a slow or contended disk: the synchronous handler makes callers wait for
+it, the queue handler does not (until its queue fills, when it drops records).
+Output goes to files in a temporary directory; stdout for print() is
+redirected there too, so the terminal's speed is not measured.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+
+REPORT = sys.stdout
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=2000, help="Messages per thread count")
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--io-latency', type=float, default=0.0, help="Seconds added to every write of the target")
+    parser.add_argument('--queue-size', type=int, default=10000)
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from core.logs import AsyncQueueHandler, JsonFormatter, TextFormatter, bind, log_context  # noqa: E402
+
+_scratch = tempfile.mkdtemp(prefix='powerpulse-logging-')
+
+LINES = (
+    "🔍 Analyzing Request: my AC keeps tripping the breaker",
+    "⚡ Fast-path classification: technical_fault (1.00 via keywords)",
+    "🎯 Route determined: technical_fault",
+    "🚀 Launching PowerPulseCrew for technical_fault (routed)...",
+    "Agent step: AgentFinish",
+    "📤 Database Persistence & Final Dispatching...",
+    "💾 Record created: Ticket {ticket} for {phone}",
+    "✅ WhatsApp Sent Successfully! SID: SM0123456789abcdef | Recipient: whatsapp:{phone}",
+    "✅ Flow Finished. Response sent to whatsapp:{phone}",
+    "Follow-up media for whatsapp:{phone} stored as generated_images/3f2a.png",
+    "✅ WhatsApp Sent Successfully! SID: SM0123456789abcdee | Recipient: whatsapp:{phone}",
+    "Follow-up media sent to whatsapp:{phone}, SID SM0123456789abcdee",
+)
+
+
+def say(*parts):
+    print(*parts, file=REPORT, flush=True)
+
+
+class SlowFileHandler(logging.FileHandler):
+    """FileHandler whose every write takes at least --io-latency seconds."""
+
+    def emit(self, record):
+        if args.io_latency:
+            time.sleep(args.io_latency)
+        super().emit(record)
+
+
+def target(name, formatter):
+    handler = SlowFileHandler(os.path.join(_scratch, f'{name}.log'), encoding='utf-8')
+    handler.setFormatter(formatter)
+    return handler
+
+
+def run(log_message, threads):
+    """Caller-side seconds per message, one list per thread."""
+    per_thread = args.messages // threads
+    latencies = [[] for _ in range(threads)]
+
+    def worker(index):
+        for n in range(per_thread):
+            phone, ticket = f"+96279{index:03d}{n:04d}", f"TIC-{index:02X}{n:04X}"
+            with log_context(phone=phone):
+                started = time.perf_counter()
+                log_message(phone, ticket)
+                latencies[index].append(time.perf_counter() - started)
+
+    pool = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return sorted(sample for samples in latencies for sample in samples)
+
+
+def logged(logger):
+    def log_message(phone, ticket):
+        for index, line in enumerate(LINES):
+            if index == 6:
+                bind(ticket=ticket)
+            logger.info(line.format(phone=phone, ticket=ticket))
+    return log_message
+
+
+def printed(phone, ticket):
+    for line in LINES:
+        print(line.format(phone=phone, ticket=ticket))
+
+
+def make_logger(name, handler):
+    logger = logging.getLogger(f'bench.{name}')
+    logger.handlers, logger.propagate = [handler], False
+    logger.setLevel(logging.INFO)
+    return logger
+
+
+def _queued(name, formatter):
+    handler = AsyncQueueHandler([target(name, formatter)], args.queue_size)
+    return logged(make_logger(name, handler)), handler
+
+
+def main():
+    setups = {
+        "print": lambda: (printed, None),
+        "sync FileHandler": lambda: (logged(make_logger('sync', target('sync', logging.Formatter()))), None),
+        "queue, text": lambda: _queued('text', TextFormatter()),
+        "queue, JSON": lambda: _queued('json', JsonFormatter()),
+    }
+    say(f"{args.messages} messages x {len(LINES)} lines, io latency {args.io_latency * 1e3:.1f}ms per write\n")
+    say(f"{'setup':<18} {'threads':>7} {'p50/msg':>9} {'p99/msg':>9} {'max':>9} {'msgs/s':>9} {'dropped':>8} {'drain':>7}")
+    for label, setup in setups.items():
+        for threads in args.threads:
+            log_message, handler = setup()
+            stdout = open(os.path.join(_scratch, 'stdout.log'), 'a', encoding='utf-8')
+            started = time.perf_counter()
+            with contextlib.redirect_stdout(stdout):
+                samples = run(log_message, threads)
+            elapsed = time.perf_counter() - started
+            dropped = drain = ""
+            if handler is not None:
+                drained = time.perf_counter()
+                handler.stop()
+                drain = f"{time.perf_counter() - drained:.2f}s"
+                dropped = handler.stats()["dropped"]
+            stdout.close()
+            say(f"{label:<18} {threads:>7} {samples[len(samples) // 2] * 1e6:>7.0f}us "
+                f"{samples[int(len(samples) * .99)] * 1e6:>7.0f}us {samples[-1] * 1e3:>7.1f}ms "
+                f"{len(samples) / elapsed:>9,.0f} {dropped:>8} {drain:>7}")
+
+    with open(os.path.join(_scratch, 'json.log'), encoding='utf-8') as f:
+        sample = [json.loads(line) for _, line in zip(range(len(LINES)), f)]
+    say(f"\nJSON record: {json.dumps(sample[-1], ensure_ascii=False)}")
+    say(f"records carrying a ticket: {sum('ticket' in record for record in sample)} of {len(sample)} "
+        f"(bound when the ticket is allotted)")
+
+
+if __name__ == '__main__':
+    main()
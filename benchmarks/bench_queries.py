@@ -0,0 +1,215 @@
+"""
+Hot ServiceTicket / EnergyConsumer lookups on a seeded database, before and
+after the 0004_ticket_indexes migration, plus the admin changelists with and
+without select_related (query count per page and render time).
+
+    python -m benchmarks.bench_queries --tickets 200000 --consumers 20000
+
+Runs against a throwaway SQLite file (or --pg-dsn for a scratch Postgres
+database) so the project database is never touched.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta
+from urllib.parse import urlparse
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickets', type=int, default=200000)
+    parser.add_argument('--consumers', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--pg-dsn', default=os.environ.get('BENCH_PG_DSN', ''))
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from django.conf import settings  # noqa: E402
+
+if args.pg_dsn:
+    dsn = urlparse(args.pg_dsn)
+    settings.DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': dsn.path.lstrip('/'),
+        'USER': dsn.username or '',
+        'PASSWORD': dsn.password or '',
+        'HOST': dsn.hostname or 'localhost',
+        'PORT': str(dsn.port or 5432),
+    }
+else:
+    settings.DATABASES['default'] = {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(tempfile.mkdtemp(prefix='powerpulse-queries-'), 'bench.sqlite3'),
+    }
+
+django.setup()
+
+from django.contrib import admin  # noqa: E402
+from django.contrib.auth.models import User  # noqa: E402
+from django.core.management import call_command  # noqa: E402
+from django.db import connection  # noqa: E402
+from django.test import Client  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from core.models import EnergyConsumer, GeneratedEnergyContent, ServiceTicket  # noqa: E402
+
+BEFORE_INDEXES = '0003_imageasset'
+
+
+def seed(tickets, consumers):
+    rng = random.Random(7)
+    now = timezone.now()
+    users = User.objects.bulk_create([User(username=f"customer{i}") for i in range(consumers // 10)])
+    EnergyConsumer.objects.bulk_create([
+        EnergyConsumer(
+            phone_number=f"+2010{i:07d}",
+            meter_number=f"MTR-{i:07d}",
+            user=users[i // 10] if i % 10 == 0 and i // 10 < len(users) else None,
+        )
+        for i in range(consumers)
+    ], batch_size=5000)
+    consumer_ids = list(EnergyConsumer.objects.values_list('id', flat=True))
+
+    # bulk_create honours auto_now_add, so spread created_at by hand.
+    created_field = ServiceTicket._meta.get_field('created_at')
+    created_field.auto_now_add = False
+    statuses = ['resolved'] * 7 + ['open'] * 2 + ['in_progress']
+    categories = ['energy_advice', 'technical_fault', 'emergency']
+    batch = []
+    for i in range(tickets):
+        batch.append(ServiceTicket(
+            consumer_id=rng.choice(consumer_ids),
+            ticket_id=f"TIC-{i:08X}",
+            issue_description="Breaker trips when the heater and kettle run together",
+            category=rng.choice(categories),
+            status=rng.choice(statuses),
+            urgency='high' if rng.random() < 0.05 else 'low',
+            created_at=now - timedelta(minutes=rng.randrange(0, 2 * 365 * 24 * 60)),
+        ))
+        if len(batch) == 10000:
+            ServiceTicket.objects.bulk_create(batch)
+            batch = []
+    ServiceTicket.objects.bulk_create(batch)
+    created_field.auto_now_add = True
+
+    ticket_ids = list(ServiceTicket.objects.order_by('-id').values_list('id', flat=True)[:tickets // 4])
+    GeneratedEnergyContent.objects.bulk_create([
+        GeneratedEnergyContent(ticket_id=ticket_id, prompt_used="Breaker trips", generated_text="Check the circuit rating.")
+        for ticket_id in ticket_ids
+    ], batch_size=10000)
+    return consumer_ids
+
+
+def analyze():
+    """Refresh planner statistics so both runs choose plans from real row counts."""
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def plan(queryset) -> str:
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f"EXPLAIN QUERY PLAN {sql}", params)
+            return "; ".join(row[-1] for row in cursor.fetchall())
+        cursor.execute(f"EXPLAIN {sql}", params)
+        return " ".join(row[0].strip() for row in cursor.fetchall()[:2])
+
+
+def timed(func, repeat):
+    func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1e3)
+    return statistics.median(samples)
+
+
+def lookups(consumer_ids):
+    consumer_id = consumer_ids[len(consumer_ids) // 2]
+    return {
+        "open high-urgency, newest 50": ServiceTicket.objects.filter(status='open', urgency='high').order_by('-created_at')[:50],
+        "status=in_progress, newest 100": ServiceTicket.objects.filter(status='in_progress').order_by('-created_at')[:100],
+        "category=emergency, newest 100": ServiceTicket.objects.filter(category='emergency').order_by('-created_at')[:100],
+        "one consumer's history": ServiceTicket.objects.filter(consumer_id=consumer_id).order_by('-created_at')[:20],
+        "consumer by phone": EnergyConsumer.objects.filter(phone_number="+20100001234"),
+    }
+
+
+def run_lookups(label, consumer_ids, repeat):
+    print(f"\n== Lookups: {label}")
+    for name, queryset in lookups(consumer_ids).items():
+        ms = timed(lambda: list(queryset.all()), repeat)
+        print(f"  {name:<34} {ms:>8.2f}ms   {plan(queryset)[:110]}")
+
+
+def run_changelists(label, client, tuned, repeat):
+    print(f"\n== Admin changelists: {label}")
+    ticket_admin = admin.site._registry[ServiceTicket]
+    content_admin = admin.site._registry[GeneratedEnergyContent]
+    originals = {
+        ticket_admin: (ticket_admin.list_select_related, ticket_admin.ordering, ticket_admin.show_full_result_count),
+        content_admin: (content_admin.list_select_related, content_admin.ordering, content_admin.show_full_result_count),
+    }
+    if not tuned:
+        for model_admin in originals:
+            model_admin.list_select_related, model_admin.ordering, model_admin.show_full_result_count = False, None, True
+
+    try:
+        for name, url in (
+            ("tickets, status=open&urgency=high", "/admin/core/serviceticket/?status__exact=open&urgency__exact=high"),
+            ("tickets, category=technical_fault", "/admin/core/serviceticket/?category__exact=technical_fault"),
+            ("generated content", "/admin/core/generatedenergycontent/"),
+        ):
+            queries = []
+            # The test client fires request_started, which clears connection.queries,
+            # so count at the cursor instead of using CaptureQueriesContext.
+            with connection.execute_wrapper(lambda execute, sql, *rest: queries.append(sql) or execute(sql, *rest)):
+                response = client.get(url)
+            assert response.status_code == 200, response.status_code
+            ms = timed(lambda: client.get(url), max(3, repeat // 4))
+            print(f"  {name:<34} {len(queries):>4} queries  {ms:>8.1f}ms")
+    finally:
+        for model_admin, values in originals.items():
+            model_admin.list_select_related, model_admin.ordering, model_admin.show_full_result_count = values
+
+
+def main():
+    call_command('migrate', verbosity=0)
+    call_command('migrate', 'core', BEFORE_INDEXES, verbosity=0)
+
+    started = time.perf_counter()
+    consumer_ids = seed(args.tickets, args.consumers)
+    print(f"Seeded {args.tickets} tickets / {args.consumers} consumers on {connection.vendor} "
+          f"in {time.perf_counter() - started:.1f}s")
+    analyze()
+
+    superuser = User.objects.create_superuser("bench-admin", "bench@example.com", "x")
+    client = Client()
+    client.force_login(superuser)
+
+    run_lookups(f"before indexes ({BEFORE_INDEXES})", consumer_ids, args.repeat)
+    run_changelists("before (no select_related, default ordering, full count)", client, tuned=False, repeat=args.repeat)
+
+    started = time.perf_counter()
+    call_command('migrate', 'core', verbosity=0)
+    print(f"\nApplied index migration in {time.perf_counter() - started:.1f}s")
+    analyze()
+
+    run_lookups("after indexes", consumer_ids, args.repeat)
+    run_changelists("after (list_select_related, -created_at ordering)", client, tuned=True, repeat=args.repeat)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
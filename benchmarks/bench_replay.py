@@ -0,0 +1,285 @@
+"""
+End-to-end replay of WhatsApp conversations through the real webhook ->
+PowerPulseFlow -> database -> dispatch path, with OpenAI, DALL-E and Twilio
+replaced by the local fakes in benchmarks/fakes.py. No network is touched.
+
+    python -m benchmarks.bench_replay --concurrency 1 8 32 --messages 120
+    python -m benchmarks.bench_replay --llm-latency lognormal:2.5,0.5 --dalle-latency fixed:9
+
+Each virtual user owns a phone number and plays whole conversations from the
+corpus (benchmarks/corpus.txt, or --corpus), sending its next message only
+once the reply to the previous one has been dispatched, so follow-ups reach
+the conversation memory like real ones. Messages are POSTed to the project's
+ASGI application in-process. Reported per concurrency level:
+
+  throughput   messages answered per second
+  ack          webhook response time (what Twilio waits for)
+  reply        POST -> text reply (its first message, with --streaming) handed to the WhatsApp sender
+  media        POST -> follow-up diagram handed to the sender
+  rss          resident memory after the level, and the process peak
+
+Runs against a throwaway SQLite file and MEDIA_ROOT.
+"""
+import argparse
+import asyncio
+import contextlib
+import os
+import re
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'corpus.txt')
+REPORT = sys.stdout
+REF_PATTERN = re.compile(r"Ref ID: (TIC-[0-9A-F]+)")
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32], help="Virtual users per level")
+    parser.add_argument('--messages', type=int, default=120, help="Messages sent per level")
+    parser.add_argument('--corpus', default=DEFAULT_CORPUS)
+    parser.add_argument('--llm-latency', default='lognormal:1.2,0.4', help="Per LLM call (see benchmarks/fakes.py)")
+    parser.add_argument('--dalle-latency', default='lognormal:6,0.3', help="Per DALL-E image")
+    parser.add_argument('--twilio-latency', default='lognormal:0.2,0.3', help="Per WhatsApp send")
+    parser.add_argument('--no-cache', action='store_true', help="Disable the semantic response cache")
+    parser.add_argument('--streaming', action='store_true',
+                        help="Stream replies as the LLM writes them (REPLY_STREAMING); reply = first message")
+    parser.add_argument('--coalesce-window', type=float, default=0.0,
+                        help="INBOUND_COALESCE_WINDOW; users here wait for each reply, so it only adds latency")
+    parser.add_argument('--timeout', type=float, default=120.0, help="Give up on a reply after this many seconds")
+    parser.add_argument('--seed', type=int, default=7)
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from django.conf import settings  # noqa: E402
+
+_scratch = tempfile.mkdtemp(prefix='powerpulse-replay-')
+settings.DATABASES['default'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(_scratch, 'bench.sqlite3'),
+    'OPTIONS': {'timeout': 60},
+}
+settings.MEDIA_ROOT = os.path.join(_scratch, 'media')
+settings.MESSAGE_QUEUE_BACKEND = 'memory'
+# Console output is discarded, and verbose crews running concurrently race on crewai's shared trace tree.
+settings.CREW_VERBOSE = False
+settings.ALLOWED_HOSTS = [*settings.ALLOWED_HOSTS, 'localhost']
+settings.INBOUND_COALESCE_WINDOW = args.coalesce_window
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+
+from benchmarks.fakes import install_fakes  # noqa: E402
+from config.asgi import application  # noqa: E402
+from core.pipeline import get_pipeline  # noqa: E402
+from core.profiling import profiler  # noqa: E402
+
+
+def say(*parts):
+    print(*parts, file=REPORT, flush=True)
+
+
+def load_corpus(path):
+    conversations, current = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith('#'):
+                continue
+            if line:
+                current.append(line)
+            elif current:
+                conversations.append(current)
+                current = []
+    if current:
+        conversations.append(current)
+    return conversations
+
+
+def memory_kb():
+    """(current RSS, peak RSS) in kB from /proc; (0, ru_maxrss) elsewhere."""
+    try:
+        with open('/proc/self/status') as f:
+            fields = dict(line.split(':', 1) for line in f if ':' in line)
+        return int(fields['VmRSS'].split()[0]), int(fields['VmHWM'].split()[0])
+    except OSError:
+        import resource
+        return 0, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+async def post_webhook(body, phone):
+    """POST one Twilio-style form to the ASGI app in-process; returns (status, response body)."""
+    payload = urlencode({"Body": body, "From": f"whatsapp:{phone}"}).encode()
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": "POST", "scheme": "http", "path": "/whatsapp/message/", "raw_path": b"/whatsapp/message/",
+        "root_path": "", "query_string": b"", "client": ("127.0.0.1", 40000), "server": ("localhost", 80),
+        "headers": [
+            (b"host", b"localhost"),
+            (b"content-type", b"application/x-www-form-urlencoded"),
+            (b"content-length", str(len(payload)).encode()),
+        ],
+    }
+    messages = [{"type": "http.request", "body": payload, "more_body": False}]
+    response = {"status": None, "body": b""}
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"] += message.get("body", b"")
+
+    await application(scope, receive, send)
+    return response["status"], response["body"].decode("utf-8", "replace")
+
+
+def percentile(samples, q):
+    if not samples:
+        return float('nan')
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * q))]
+
+
+class Level:
+
+    def __init__(self, concurrency, budget):
+        self.concurrency = concurrency
+        self.budget = budget
+        self.sent = 0
+        self.acks, self.replies, self.media = [], [], []
+        self.rejected = self.errors = self.timeouts = 0
+        self.posted_at = {}
+
+
+async def virtual_user(level, index, conversations, fakes, loop):
+    phone = f"+2019{level.concurrency:03d}{index:05d}"
+    pending = {}
+
+    def on_delivery(delivery):
+        ref = REF_PATTERN.search(delivery.text)
+        if delivery.is_media_follow_up:
+            started = level.posted_at.get(ref.group(1)) if ref else None
+            if started is not None:
+                level.media.append(delivery.at - started)
+            return
+        if ref is None:
+            # The rest of a streamed reply; only its first message quotes the ticket.
+            return
+        future, started = pending.pop("reply", (None, None))
+        if future is not None:
+            level.posted_at[ref.group(1)] = started
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(delivery))
+
+    fakes.sender.listen(phone, on_delivery)
+    conversation_index = index
+    while level.sent < level.budget:
+        for body in conversations[conversation_index % len(conversations)]:
+            if level.sent >= level.budget:
+                return
+            level.sent += 1
+            reply = loop.create_future()
+            started = time.perf_counter()
+            pending["reply"] = (reply, started)
+            status, twiml = await post_webhook(body, phone)
+            level.acks.append(time.perf_counter() - started)
+            if status != 200:
+                level.errors += 1
+                continue
+            if settings.PIPELINE_BUSY_MESSAGE in twiml:
+                level.rejected += 1
+                continue
+            try:
+                delivery = await asyncio.wait_for(reply, args.timeout)
+            except asyncio.TimeoutError:
+                level.timeouts += 1
+                continue
+            level.replies.append(delivery.at - started)
+        conversation_index += len(conversations) // 2 + 1
+
+
+async def wait_for_idle(quiet_for=0.5):
+    """Until the pipeline (including follow-up media) has had nothing queued or running for `quiet_for` seconds."""
+    pipeline = get_pipeline()
+    quiet_since = None
+    while True:
+        stats = pipeline.stats()
+        if stats["in_flight"] or stats["queue_depth"]:
+            quiet_since = None
+        elif quiet_since is None:
+            quiet_since = time.monotonic()
+        elif time.monotonic() - quiet_since >= quiet_for:
+            return
+        await asyncio.sleep(0.05)
+
+
+async def run_level(concurrency, conversations, fakes):
+    level = Level(concurrency, args.messages)
+    loop = asyncio.get_running_loop()
+    llm_calls, images, sends = fakes.llm.calls, fakes.visual.calls, len(fakes.sender.deliveries)
+    failed = get_pipeline().stats()["failed"]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(level, i, conversations, fakes, loop) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    await wait_for_idle()
+
+    answered = len(level.replies)
+    rss, peak = memory_kb()
+    ms = lambda samples, q: percentile(samples, q) * 1e3  # noqa: E731
+    say(
+        f"{concurrency:>5} {answered:>5}/{level.sent:<5} {answered / elapsed:>7.2f} msg/s  "
+        f"ack p50 {ms(level.acks, .5):>6.1f}ms p99 {ms(level.acks, .99):>6.1f}ms  "
+        f"reply p50 {ms(level.replies, .5) / 1e3:>6.2f}s p95 {ms(level.replies, .95) / 1e3:>6.2f}s "
+        f"p99 {ms(level.replies, .99) / 1e3:>6.2f}s  "
+        f"media p50 {ms(level.media, .5) / 1e3:>6.2f}s p99 {ms(level.media, .99) / 1e3:>6.2f}s  "
+        f"rss {rss / 1024:>5.0f}MB peak {peak / 1024:>5.0f}MB"
+    )
+    per_message = max(level.sent, 1)
+    say(
+        f"{'':>5} per message: {(fakes.llm.calls - llm_calls) / per_message:.2f} LLM calls, "
+        f"{(fakes.visual.calls - images) / per_message:.2f} images, "
+        f"{(len(fakes.sender.deliveries) - sends) / per_message:.2f} sends; "
+        f"rejected {level.rejected}, errors {level.errors}, failed flows {get_pipeline().stats()['failed'] - failed}, "
+        f"timeouts {level.timeouts}"
+    )
+
+
+async def main():
+    settings.RESPONSE_CACHE_ENABLED = not args.no_cache
+    settings.REPLY_STREAMING = args.streaming
+    conversations = load_corpus(args.corpus)
+    fakes = install_fakes(args.llm_latency, args.dalle_latency, args.twilio_latency, seed=args.seed)
+    say(f"Corpus: {sum(map(len, conversations))} messages in {len(conversations)} conversations  "
+          f"latency: llm {args.llm_latency}, dall-e {args.dalle_latency}, twilio {args.twilio_latency}  "
+          f"crew mode: {settings.CREW_EXECUTION_MODE}, cache {'off' if args.no_cache else 'on'}"
+          f"{', streaming' if args.streaming else ''}\n")
+    say(f"{'users':>5} {'answered':>11} {'throughput':>13}  latency")
+    try:
+        for concurrency in args.concurrency:
+            await run_level(concurrency, conversations, fakes)
+    finally:
+        fakes.close()
+
+    say("\nWhere the time went (all levels, see manage.py flow_profile):")
+    for row in profiler.summary()[:14]:
+        say(f"  {row['kind']:<5} {row['name'][:28]:<28} n={row['count']:<5} "
+              f"p50 {row['p50_s'] * 1e3:>8.0f}ms  p95 {row['p95_s'] * 1e3:>8.0f}ms  p99 {row['p99_s'] * 1e3:>8.0f}ms")
+
+
+if __name__ == '__main__':
+    # The flow and the crews print progress for every message; keep only the report.
+    call_command('migrate', verbosity=0)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        asyncio.run(main())
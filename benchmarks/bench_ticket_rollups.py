@@ -0,0 +1,203 @@
+"""
+Dashboard ticket counts (core/ticket_rollups.py) on a seeded database: the
+hourly TicketRollup buckets against grouping ServiceTicket directly, the
+backfill, and what keeping the buckets current costs each ticket write.
+
+    python -m benchmarks.bench_ticket_rollups
+    python -m benchmarks.bench_ticket_rollups --tickets 1000000 --hours 24 168 720
+
+Tickets are spread over the last --days days. For each window in --hours the
+dashboard summary is computed both ways and the two are checked to agree.
+The write path is measured with persist_interaction() and a status update,
+with the rollup signals connected and disconnected; after the updates the
+buckets are checked against a fresh recount.
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import timedelta, timezone as dt_timezone
+
+import django
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
+
+REPORT = sys.stdout
+
+
+def _parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tickets', type=int, default=300000)
+    parser.add_argument('--consumers', type=int, default=5000)
+    parser.add_argument('--days', type=int, default=365, help="Spread the seeded tickets over this many days")
+    parser.add_argument('--hours', type=int, nargs='+', default=[24, 168, 720], help="Dashboard windows to read")
+    parser.add_argument('--writes', type=int, default=500, help="Tickets written for the write-path comparison")
+    parser.add_argument('--repeat', type=int, default=10)
+    return parser.parse_args()
+
+
+args = _parse_args()
+
+from django.conf import settings  # noqa: E402
+
+settings.DATABASES['default'] = {
+    'ENGINE': 'django.db.backends.sqlite3',
+    'NAME': os.path.join(tempfile.mkdtemp(prefix='powerpulse-rollups-'), 'bench.sqlite3'),
+    'OPTIONS': {'timeout': 60},
+}
+
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+from django.db.models import Count  # noqa: E402
+from django.db.models.functions import TruncHour  # noqa: E402
+from django.db.models.signals import post_delete, post_save, pre_save  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+from core import ticket_rollups  # noqa: E402
+from core.models import EnergyConsumer, ServiceTicket, TicketRollup  # noqa: E402
+from core.persistence import InteractionRecord, persist_interaction  # noqa: E402
+
+SIGNALS = (
+    (pre_save, ticket_rollups.remember_bucket, 'core.ticket_rollups.pre_save'),
+    (post_save, ticket_rollups.count_saved, 'core.ticket_rollups.post_save'),
+    (post_delete, ticket_rollups.count_deleted, 'core.ticket_rollups.post_delete'),
+)
+
+
+def say(*parts):
+    print(*parts, file=REPORT, flush=True)
+
+
+def seed(rng, now):
+    EnergyConsumer.objects.bulk_create(
+        [EnergyConsumer(phone_number=f"+2010{i:07d}", meter_number=f"MTR-{i:07d}") for i in range(args.consumers)],
+        batch_size=5000,
+    )
+    consumer_ids = list(EnergyConsumer.objects.values_list('id', flat=True))
+    # bulk_create honours auto_now_add, so spread created_at by hand.
+    created_field = ServiceTicket._meta.get_field('created_at')
+    created_field.auto_now_add = False
+    statuses = ['resolved'] * 7 + ['open'] * 2 + ['in_progress']
+    categories = ['energy_advice', 'technical_fault', 'emergency']
+    batch = []
+    for i in range(args.tickets):
+        batch.append(ServiceTicket(
+            consumer_id=rng.choice(consumer_ids),
+            ticket_id=f"TIC-{i:08X}",
+            issue_description="Breaker trips when the heater and kettle run together",
+            category=rng.choice(categories),
+            status=rng.choice(statuses),
+            urgency='high' if rng.random() < 0.05 else 'low',
+            created_at=now - timedelta(minutes=rng.randrange(0, args.days * 24 * 60)),
+        ))
+        if len(batch) == 10000:
+            ServiceTicket.objects.bulk_create(batch)
+            batch = []
+    ServiceTicket.objects.bulk_create(batch)
+    created_field.auto_now_add = True
+
+
+def grouped(hours, now):
+    """The dashboard numbers straight from ServiceTicket, as the summary reports them."""
+    last = ticket_rollups.hour_of(now)
+    first = last - timedelta(hours=hours - 1)
+    rows = (
+        ServiceTicket.objects.filter(created_at__gte=first, created_at__lt=last + timedelta(hours=1))
+        .annotate(hour=TruncHour('created_at', tzinfo=dt_timezone.utc))
+        .values('hour', *ticket_rollups.KEY_FIELDS).annotate(n=Count('id')).order_by()
+    )
+    totals = Counter()
+    for row in rows:
+        totals['total'] += row['n']
+        for field in ticket_rollups.KEY_FIELDS:
+            totals[(field, row[field])] += row['n']
+    return totals
+
+
+def flatten(summary):
+    totals = Counter({'total': summary['totals']['total']})
+    for field in ticket_rollups.KEY_FIELDS:
+        for value, n in summary['totals'][field].items():
+            totals[(field, value)] += n
+    return totals
+
+
+def buckets(rollups):
+    return {tuple(row[:-1]): row[-1] for row in rollups.values_list('hour', *ticket_rollups.KEY_FIELDS, 'count')}
+
+
+def timed(func):
+    func()
+    samples = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1e3)
+    return statistics.median(samples)
+
+
+def write_path(label, rng, phones):
+    records = [
+        InteractionRecord(phone_number=rng.choice(phones), user_query="Meter shows zero", category='technical_fault',
+                          generated_text="Check the isolator.")
+        for _ in range(args.writes)
+    ]
+    started = time.perf_counter()
+    for record in records:
+        persist_interaction(record)
+    create = (time.perf_counter() - started) / len(records)
+    tickets = list(ServiceTicket.objects.filter(ticket_id__in=[r.ticket_id for r in records]))
+    started = time.perf_counter()
+    for ticket in tickets:
+        ticket.status = 'resolved'
+        ticket.save()
+    update = (time.perf_counter() - started) / len(tickets)
+    say(f"  {label:<18} create {create * 1e3:>6.2f}ms   status change {update * 1e3:>6.2f}ms")
+    return create, update
+
+
+def main():
+    rng = random.Random(7)
+    now = timezone.now()
+    call_command('migrate', verbosity=0)
+    started = time.perf_counter()
+    seed(rng, now)
+    say(f"Seeded {args.tickets:,} tickets over {args.days} days in {time.perf_counter() - started:.1f}s")
+
+    started = time.perf_counter()
+    result = ticket_rollups.rebuild()
+    say(f"rebuild_ticket_rollups  {time.perf_counter() - started:>6.2f}s  {result['buckets']:,} buckets\n")
+
+    say(f"{'window':<8} {'GROUP BY tickets':>17} {'rollup summary':>15} {'buckets':>8}")
+    for hours in args.hours:
+        summary = ticket_rollups.summary(hours, until=now)
+        assert flatten(summary) == grouped(hours, now), f"rollups disagree with the tickets over {hours}h"
+        direct = timed(lambda: grouped(hours, now))
+        rolled = timed(lambda: ticket_rollups.summary(hours, until=now))
+        say(f"{str(hours) + 'h':<8} {direct:>15.2f}ms {rolled:>13.2f}ms {summary['buckets_read']:>8}  ({direct / rolled:.0f}x)")
+
+    say(f"\nwrite path, per ticket ({args.writes} tickets):")
+    phones = list(EnergyConsumer.objects.values_list('phone_number', flat=True)[:500])
+    for signal, receiver, uid in SIGNALS:
+        signal.disconnect(receiver, sender=ServiceTicket, dispatch_uid=uid)
+    bare = write_path("without rollups", rng, phones)
+    ticket_rollups.rebuild()
+    for signal, receiver, uid in SIGNALS:
+        signal.connect(receiver, sender=ServiceTicket, dispatch_uid=uid)
+    kept = write_path("with rollups", rng, phones)
+    say(f"  overhead           create {(kept[0] - bare[0]) * 1e3:>+6.2f}ms   status change {(kept[1] - bare[1]) * 1e3:>+6.2f}ms")
+
+    ServiceTicket.objects.order_by('-pk').first().delete()
+    live = buckets(TicketRollup.objects.filter(count__gt=0))
+    ticket_rollups.rebuild()
+    recounted = buckets(TicketRollup.objects.all())
+    say(f"\nbuckets after creates, status changes and a delete match a full recount: {live == recounted}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""
+Load test for the WhatsApp webhook: bursts of concurrent Twilio-style POSTs
+against the same code served three ways,
+
+  wsgi         `manage.py runserver` (Django's threaded WSGI server: a thread per request)
+  asgi-django  `uvicorn config.asgi:application` with WEBHOOK_FAST_PATH=False
+               (async view, but still behind Django's middleware stack)
+  asgi         `uvicorn config.asgi:application` (webhook answered by core/asgi.py)
+
+    python -m benchmarks.bench_webhook --levels 100 500 1000 --rounds 3
+
+All servers run with MESSAGE_QUEUE_BACKEND=database against a throwaway
+SQLite file, so each request does exactly the ingest-tier work (parse, insert a
+FlowJob, answer TwiML) and no flow is run. Peak server thread count is sampled
+from /proc while each burst is in flight (Linux only).
+"""
+import argparse
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+UVICORN = [sys.executable, "-m", "uvicorn", "config.asgi:application", "--log-level", "warning",
+           "--no-access-log", "--backlog", "4096", "--port"]
+
+# name -> (command for a port, extra environment)
+SERVERS = {
+    "wsgi": (lambda port: [sys.executable, "manage.py", "runserver", "--noreload", f"127.0.0.1:{port}"], {}),
+    "asgi-django": (lambda port: UVICORN + [str(port)], {"WEBHOOK_FAST_PATH": "False"}),
+    "asgi": (lambda port: UVICORN + [str(port)], {"WEBHOOK_FAST_PATH": "True"}),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def server_env(db_path: str, extra: dict | None = None) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "DJANGO_SETTINGS_MODULE": "config.settings",
+        "SQLITE_PATH": db_path,
+        "MESSAGE_QUEUE_BACKEND": "database",
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.update(extra or {})
+    return env
+
+
+def thread_count(pid: int) -> int:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("Threads:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+async def wait_until_up(port: int, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.2)
+    raise RuntimeError(f"server on port {port} did not start")
+
+
+async def post(session, url, index):
+    data = {"Body": f"My breaker keeps tripping (load test {index})", "From": f"whatsapp:+2010{index:07d}"}
+    started = time.perf_counter()
+    try:
+        async with session.post(url, data=data) as response:
+            await response.read()
+            ok = response.status == 200
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        ok = False
+    return time.perf_counter() - started, ok
+
+
+async def burst(url, concurrency, pid):
+    peak = 0
+    done = asyncio.Event()
+
+    async def sample():
+        nonlocal peak
+        while not done.is_set():
+            peak = max(peak, thread_count(pid))
+            await asyncio.sleep(0.01)
+
+    connector = aiohttp.TCPConnector(limit=0, force_close=True)
+    timeout = aiohttp.ClientTimeout(total=120)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        sampler = asyncio.create_task(sample())
+        started = time.perf_counter()
+        results = await asyncio.gather(*(post(session, url, i) for i in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await sampler
+    return results, elapsed, peak
+
+
+def report(kind, concurrency, samples, elapsed, errors, peak_threads):
+    samples.sort()
+    pct = lambda p: samples[min(len(samples) - 1, int(len(samples) * p))] * 1e3  # noqa: E731
+    print(f"{kind:<11} {concurrency:>5}  {len(samples) / elapsed:>8.0f} req/s  p50 {pct(0.50):>7.1f}ms  "
+          f"p95 {pct(0.95):>7.1f}ms  p99 {pct(0.99):>7.1f}ms  max {samples[-1] * 1e3:>7.1f}ms  "
+          f"errors {errors:>4}  peak threads {peak_threads}")
+
+
+async def run_server(kind, levels, rounds, db_path):
+    port = free_port()
+    command, extra_env = SERVERS[kind]
+    proc = subprocess.Popen(command(port), cwd=ROOT, env=server_env(db_path, extra_env),
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        await wait_until_up(port)
+        url = f"http://127.0.0.1:{port}/whatsapp/message/"
+        await burst(url, 10, proc.pid)  # warm-up: imports, first connection
+        for concurrency in levels:
+            samples, elapsed, errors, peak = [], 0.0, 0, 0
+            for _ in range(rounds):
+                results, took, round_peak = await burst(url, concurrency, proc.pid)
+                samples.extend(latency for latency, _ in results)
+                errors += sum(1 for _, ok in results if not ok)
+                elapsed += took
+                peak = max(peak, round_peak)
+            report(kind, concurrency, samples, elapsed, errors, peak)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", type=int, nargs="+", default=[100, 500, 1000])
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--servers", nargs="+", choices=list(SERVERS), default=list(SERVERS))
+    args = parser.parse_args()
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="powerpulse-webhook-"), "bench.sqlite3")
+    subprocess.run([sys.executable, "manage.py", "migrate", "-v", "0"], cwd=ROOT, env=server_env(db_path), check=True)
+
+    print(f"{'server':<11} {'conc':>5}  {'throughput':>12}  latency\n")
+    for kind in args.servers:
+        asyncio.run(run_server(kind, args.levels, args.rounds, db_path))
+
+
+if __name__ == "__main__":
+    main()
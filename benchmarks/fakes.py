@@ -0,0 +1,276 @@
+"""
+Deterministic local stand-ins for the three network dependencies of a flow:
+basic_llm (OpenAI chat), energy_visual_tool (DALL-E) and
+send_energy_update_to_whatsapp (Twilio). Each sleeps for a latency drawn from
+a configurable distribution, so the harness reproduces the timing of the real
+services without touching the network.
+
+Latency specs (seconds):
+    0                       no delay
+    fixed:0.8               always 0.8
+    uniform:0.5,2           uniform between 0.5 and 2
+    normal:1.2,0.3          normal, mean 1.2, sd 0.3 (clipped at 0)
+    lognormal:1.5,0.4       log-normal with median 1.5 and sigma 0.4 (long right tail)
+
+Call install_fakes() after django.setup() and before the first flow runs;
+Fakes.close() puts the real ones back. core/tests.py uses the same fakes.
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+from crewai.utilities.events import crewai_event_bus
+from crewai.utilities.events.llm_events import (
+    LLMCallCompletedEvent, LLMCallStartedEvent, LLMCallType, LLMStreamChunkEvent,
+)
+from django.conf import settings
+from litellm.types.utils import Usage
+
+from benchmarks.stub_server import StubServer
+from core.main_llm import PowerPulseLLM
+from core.profiling import usage_recorder
+
+MEDIA_CAPTION_PREFIX = "🖼️ Visual guide"
+
+
+class Latency:
+
+    def __init__(self, spec: str, seed: int = 0):
+        self.spec = spec
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        kind, _, args = str(spec).partition(":")
+        params = [float(a) for a in args.split(",") if a.strip()]
+        if kind in ("", "0", "none"):
+            self._draw = lambda r: 0.0
+        elif kind == "fixed" and len(params) == 1:
+            self._draw = lambda r: params[0]
+        elif kind == "uniform" and len(params) == 2:
+            self._draw = lambda r: r.uniform(*params)
+        elif kind == "normal" and len(params) == 2:
+            self._draw = lambda r: max(0.0, r.gauss(*params))
+        elif kind == "lognormal" and len(params) == 2:
+            mu = math.log(params[0])
+            self._draw = lambda r: r.lognormvariate(mu, params[1])
+        else:
+            try:
+                value = float(spec)
+            except ValueError:
+                raise ValueError(f"Unrecognised latency spec {spec!r}") from None
+            self._draw = lambda r: value
+
+    def sample(self) -> float:
+        with self._lock:
+            return self._draw(self._random)
+
+    def sleep(self):
+        delay = self.sample()
+        if delay > 0:
+            time.sleep(delay)
+
+    def __repr__(self):
+        return self.spec
+
+
+class FakeLLM(PowerPulseLLM):
+    """
+    Answers from canned text per category after a sampled delay, and reports
+    token usage estimated from text length. It emits the same events and
+    callbacks as a real call, so the flow, crews and profiler behave the same.
+    A streaming call spends FIRST_TOKEN_SHARE of the delay before the first
+    token and spreads the rest over the tokens.
+    """
+
+    FIRST_TOKEN_SHARE = 0.2
+
+    ANSWERS = {
+        "emergency": "Switch off the main breaker and keep away from the panel until an electrician has checked it.",
+        "technical_fault": (
+            "**Safety first: switch off the affected circuit before touching anything.** "
+            "1. Check whether the breaker trips immediately or only under load. "
+            "2. Unplug high-draw appliances and reset the breaker. "
+            "3. Reconnect them one at a time to find the overloaded circuit.\n\n"
+            "If it trips with nothing plugged in, or you notice heat, buzzing or a burning smell at the panel, "
+            "leave the breaker off and book a certified electrician: that points to a wiring or breaker fault, "
+            "not an overload. Keep a note of when it trips and what was running; it shortens the visit."
+        ),
+        "energy_advice": (
+            "Run heavy appliances outside peak hours, keep the AC at 24-25°C and replace "
+            "remaining halogen bulbs with LEDs; together these typically cut a bill by 15-20%.\n\n"
+            "Next, look at the water heater: a timer that heats only before the morning and evening showers "
+            "saves more than most appliance swaps. Clean the AC filters monthly in summer, seal gaps around "
+            "doors and windows, and switch devices off at the wall instead of leaving them on standby."
+        ),
+    }
+
+    latency: Latency = Latency("0")
+    calls: int = 0
+    _pace = threading.local()
+
+    @staticmethod
+    def _text(messages) -> tuple[str, str]:
+        if isinstance(messages, str):
+            return messages, messages
+        prompt = "\n".join(str(m.get("content", "")) for m in messages)
+        user = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), prompt)
+        return prompt, user
+
+    def respond(self, prompt: str, user: str) -> str:
+        from core.classifier import classify
+
+        delay = self.latency.sample()
+        if self.stream:
+            self._pace.remaining = delay * (1 - self.FIRST_TOKEN_SHARE)
+            delay *= self.FIRST_TOKEN_SHARE
+        if delay > 0:
+            time.sleep(delay)
+        self.calls += 1
+
+        category = classify(user).category
+        if "Final Answer" in prompt:
+            # CrewAI agent prompt: answer in its ReAct format.
+            return f"Thought: I now know the final answer\nFinal Answer: {self.ANSWERS[category]}"
+        if "JSON" in prompt:
+            return json.dumps({"category": category})
+        return self.ANSWERS[category]
+
+    def stream_pieces(self, text: str):
+        """The reply as the token stream a streaming call would deliver (word by word), paced over the delay."""
+        pieces = re.findall(r"\s*\S+", text)
+        pause = getattr(self._pace, "remaining", 0.0) / max(len(pieces), 1)
+        for piece in pieces:
+            if pause > 0:
+                time.sleep(pause)
+            yield piece
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        crewai_event_bus.emit(self, event=LLMCallStartedEvent(
+            messages=messages, tools=tools, callbacks=callbacks, available_functions=available_functions,
+        ))
+        prompt, user = self._text(messages)
+        text = self.respond(prompt, user)
+        if self.stream:
+            for piece in self.stream_pieces(text):
+                crewai_event_bus.emit(self, event=LLMStreamChunkEvent(chunk=piece))
+        prompt_tokens, completion_tokens = len(prompt) // 4 + 1, len(text) // 4 + 1
+        usage = Usage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                      total_tokens=prompt_tokens + completion_tokens)
+        for callback in [*(callbacks or []), usage_recorder]:
+            if hasattr(callback, "log_success_event"):
+                callback.log_success_event(kwargs={}, response_obj={"usage": usage}, start_time=0, end_time=0)
+        crewai_event_bus.emit(self, event=LLMCallCompletedEvent(response=text, call_type=LLMCallType.LLM_CALL))
+        return text
+
+
+class FakeVisualTool:
+    """Replaces energy_visual_tool._run: returns a PNG URL on a local StubServer (the media stage downloads it)."""
+
+    def __init__(self, latency: Latency, server: StubServer):
+        self.latency = latency
+        self.server = server
+        self.calls = 0
+
+    def __call__(self, prompt: str) -> str:
+        self.latency.sleep()
+        self.calls += 1
+        return f"{self.server.url}/images/{uuid.uuid4().hex}.png"
+
+
+@dataclass
+class Delivery:
+    to: str
+    text: str
+    image_url: str | None
+    at: float
+
+    @property
+    def is_media_follow_up(self) -> bool:
+        return self.text.startswith(MEDIA_CAPTION_PREFIX)
+
+
+@dataclass
+class FakeWhatsAppSender:
+    """Replaces send_energy_update_to_whatsapp; records every delivery and wakes whoever waits on that number."""
+
+    latency: Latency
+    deliveries: list = field(default_factory=list)
+    listeners: dict = field(default_factory=dict)
+    _lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __call__(self, to: str, text: str = "", image_url: str = None, key: str = None) -> str | None:
+        self.latency.sleep()
+        delivery = Delivery(to.replace("whatsapp:", ""), text or "", image_url, time.perf_counter())
+        with self._lock:
+            self.deliveries.append(delivery)
+            listener = self.listeners.get(delivery.to)
+        if listener is not None:
+            listener(delivery)
+        return f"SM{uuid.uuid4().hex}"
+
+    def listen(self, phone_number: str, callback):
+        """callback(delivery) runs on the sending thread for each message to `phone_number`."""
+        with self._lock:
+            self.listeners[phone_number] = callback
+
+
+@dataclass
+class Fakes:
+    llm: FakeLLM
+    visual: FakeVisualTool
+    sender: FakeWhatsAppSender
+    server: StubServer
+    # (module, attribute, original value) for everything install_fakes() replaced.
+    replaced: list = field(default_factory=list)
+
+    def close(self):
+        """Stop the stub server and put the real OpenAI, DALL-E and Twilio calls back."""
+        from core.tools.dalle_tool import energy_visual_tool
+
+        for module, name, original in reversed(self.replaced):
+            if module is energy_visual_tool:
+                object.__delattr__(energy_visual_tool, name)
+            else:
+                setattr(module, name, original)
+        self.replaced.clear()
+        self.server.__exit__(None, None, None)
+
+
+def install_fakes(llm_latency="0", dalle_latency="0", twilio_latency="0", seed: int = 7) -> Fakes:
+    """Swap the flow's OpenAI, DALL-E and Twilio calls for local fakes, in every module that imported them."""
+    import core.crews
+    import core.flows.energy_flow
+    import core.main_llm
+    import core.media
+    import core.views
+    from core.tools.dalle_tool import energy_visual_tool
+
+    server = StubServer().__enter__()
+    replaced = []
+
+    def replace(module, name, fake):
+        replaced.append((module, name, getattr(module, name)))
+        setattr(module, name, fake)
+
+    llm = FakeLLM(
+        model=settings.OPENAI_MODEL, temperature=settings.OPENAI_DEFAULT_TEMPERATURE, api_key="offline",
+        stream=settings.REPLY_STREAMING,
+    )
+    llm.latency = Latency(llm_latency, seed)
+    for module in (core.main_llm, core.crews, core.flows.energy_flow):
+        replace(module, "basic_llm", llm)
+
+    visual = FakeVisualTool(Latency(dalle_latency, seed + 1), server)
+    # The tool instance is shared by the flow, the media stage and the agents, so patch it in place.
+    object.__setattr__(energy_visual_tool, "_run", visual)
+    replaced.append((energy_visual_tool, "_run", None))
+
+    sender = FakeWhatsAppSender(Latency(twilio_latency, seed + 2))
+    for module in (core.flows.energy_flow, core.media, core.views):
+        replace(module, "send_energy_update_to_whatsapp", sender)
+
+    return Fakes(llm, visual, sender, server, replaced)
@@ -0,0 +1,178 @@
+"""
+Local stand-ins for the OpenAI and Twilio HTTP APIs used by the benchmarks.
+Speaks HTTP/1.1 with keep-alive so connection reuse can actually be measured.
+"""
+import json
+import threading
+import time
+import uuid
+from collections import deque
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+PNG_BYTES = b"\x89PNG\r\n\x1a\n" + b"\x00" * (64 * 1024)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Buffer each response and disable Nagle so keep-alive connections are not
+    # penalised by delayed ACKs (which would hide the benefit of pooling).
+    wbufsize = 64 * 1024
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, content_type="application/json", headers=None):
+        if isinstance(body, (dict, list)):
+            body = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def do_GET(self):
+        self.server.record(self)
+        url = urlsplit(self.path)
+        if self.path.startswith("/images/"):
+            self._send(200, PNG_BYTES, content_type="image/png")
+        elif url.path.endswith("/Messages.json"):
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+            self._send(200, {"messages": self.server.message_list(
+                query.get("To"), query.get("From"), int(query.get("PageSize", 50)),
+            )})
+        else:
+            self._send(404, {"error": "not found"})
+
+    def do_POST(self):
+        body = self._read_body()
+        self.server.record(self, body)
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        override = self.server.next_override()
+        lose_answer = False
+        if override is not None:
+            status, payload, headers = override
+            if status is not None:
+                self._send(status, payload, headers=headers)
+                return
+            # (None, ...): take the message but close the connection without an answer.
+            lose_answer = True
+
+        host = f"http://{self.server.server_address[0]}:{self.server.server_address[1]}"
+        if self.path.endswith("/images/generations"):
+            self._send(200, {
+                "created": int(time.time()),
+                "data": [{"url": f"{host}/images/{uuid.uuid4().hex}.png", "revised_prompt": "stub"}],
+            })
+        elif self.path.endswith("/chat/completions"):
+            self._send(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": "stub",
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": '{"category": "energy_advice"}'}}],
+                "usage": {"prompt_tokens": 20, "completion_tokens": 8, "total_tokens": 28},
+            })
+        elif self.path.endswith("/Messages.json"):
+            form = {key: values[0] for key, values in parse_qs(body.decode()).items()}
+            if not self.server.admit(form.get("From", "")):
+                self._send(429, {"code": 20429, "message": "Too Many Requests", "status": 429},
+                           headers={"Retry-After": "1"})
+                return
+            sid = f"SM{uuid.uuid4().hex}"
+            self.server.accept(sid, form)
+            if lose_answer:
+                self.close_connection = True
+                return
+            self._send(201, {
+                "sid": sid, "status": "queued", "body": form.get("Body", ""),
+                "account_sid": self.path.split("/")[3], "num_media": "1" if form.get("MediaUrl") else "0",
+            })
+        else:
+            self._send(404, {"error": "not found"})
+
+
+class StubServer(ThreadingHTTPServer):
+    """
+    `latency` delays every POST. `overrides` is a list of (status, payload, headers)
+    tuples answered, in order, before falling back to the normal stub responses
+    (used to simulate 429/5xx from Twilio); a status of None accepts the message
+    and then drops the connection, as when Twilio's answer is lost. `twilio_rate`
+    caps accepted messages per second per From number, answering 429 beyond it
+    as Twilio does; accepted messages are kept in `messages` as (sid, form) in
+    acceptance order, and listed, newest first, by GET .../Messages.json.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency: float = 0.0, overrides=None, twilio_rate: float | None = None):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.latency = latency
+        self.twilio_rate = twilio_rate
+        self._overrides = list(overrides or [])
+        self._lock = threading.Lock()
+        self._windows: dict[str, deque] = {}
+        self.requests = []
+        self.messages = []
+        self._created = {}
+        self.throttled = 0
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def record(self, handler, body=b""):
+        with self._lock:
+            self.requests.append((handler.command, handler.path, body))
+
+    def admit(self, sender: str) -> bool:
+        """Sliding one-second window per sender."""
+        if not self.twilio_rate:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.setdefault(sender, deque())
+            while window and now - window[0] >= 1.0:
+                window.popleft()
+            if len(window) >= self.twilio_rate:
+                self.throttled += 1
+                return False
+            window.append(now)
+            return True
+
+    def accept(self, sid, form):
+        with self._lock:
+            self.messages.append((sid, form))
+            self._created[sid] = formatdate(time.time())
+
+    def message_list(self, to=None, from_=None, page_size=50) -> list:
+        with self._lock:
+            matching = [
+                {"sid": sid, "to": form.get("To"), "from": form.get("From"), "body": form.get("Body", ""),
+                 "date_created": self._created[sid]}
+                for sid, form in reversed(self.messages)
+                if (to is None or form.get("To") == to) and (from_ is None or form.get("From") == from_)
+            ]
+        return matching[:page_size]
+
+    def next_override(self):
+        with self._lock:
+            return self._overrides.pop(0) if self._overrides else None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
@@ -9,8 +9,14 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+if settings.WEBHOOK_FAST_PATH:
+    # Answer Twilio's webhook on the event loop, ahead of Django's middleware.
+    from core.asgi import webhook_router
+    application = webhook_router(application)
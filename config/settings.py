@@ -12,7 +12,7 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 
 import os
 from pathlib import Path
-from decouple import config
+from decouple import config, Csv
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -23,23 +23,63 @@ ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='*').split(',')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Public origin (e.g. the ngrok URL) used to build media links Twilio can fetch.
+PUBLIC_BASE_URL = config('PUBLIC_BASE_URL', default='')
+# Send the text reply first and deliver the diagram as a follow-up message.
+MEDIA_ASYNC = config('MEDIA_ASYNC', default=True, cast=bool)
+
+# Longer replies are split into several WhatsApp messages of at most this many characters.
+WHATSAPP_MAX_CHARS = config('WHATSAPP_MAX_CHARS', default=1550, cast=int)
+# Send the final agent's answer as it streams from the LLM (core/streaming.py),
+# in messages of at least REPLY_STREAM_MIN_CHARS cut on paragraph/sentence breaks.
+REPLY_STREAMING = config('REPLY_STREAMING', default=False, cast=bool)
+REPLY_STREAM_MIN_CHARS = config('REPLY_STREAM_MIN_CHARS', default=400, cast=int)
+
+# Logging (core/logs.py): callers only queue records; one listener thread writes
+# them to LOG_FILE, rotated at LOG_MAX_BYTES. LOG_FORMAT is 'json' (one object
+# per line, with the message's ticket and phone) or 'text'. A full queue drops
+# records instead of blocking; LOG_CONSOLE also echoes them to stderr.
+LOG_FILE = config('LOG_FILE', default=os.path.join(BASE_DIR, 'energy_system.log'))
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_FORMAT = config('LOG_FORMAT', default='json')
+LOG_MAX_BYTES = config('LOG_MAX_BYTES', default=20 * 1024 * 1024, cast=int)
+LOG_BACKUP_COUNT = config('LOG_BACKUP_COUNT', default=5, cast=int)
+LOG_QUEUE_SIZE = config('LOG_QUEUE_SIZE', default=10000, cast=int)
+LOG_CONSOLE = config('LOG_CONSOLE', default=DEBUG, cast=bool)
+# Share of flows whose agent steps are logged to core.crew_trace (0 turns the trace off).
+CREW_TRACE_SAMPLE_RATE = config('CREW_TRACE_SAMPLE_RATE', default=0.05, cast=float)
 
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
+    'filters': {
+        'crew_trace_sample': {
+            '()': 'core.logs.SampleFilter',
+            'rate': CREW_TRACE_SAMPLE_RATE,
+        },
+    },
     'handlers': {
-        'file': {
-            'level': 'INFO',
-            'class': 'logging.FileHandler',
-            'filename': os.path.join(BASE_DIR, 'energy_system.log'),
+        'queue': {
+            '()': 'core.logs.queue_handler',
+            'level': LOG_LEVEL,
+            'filename': LOG_FILE,
+            'max_bytes': LOG_MAX_BYTES,
+            'backup_count': LOG_BACKUP_COUNT,
+            'fmt': LOG_FORMAT,
+            'console': LOG_CONSOLE,
+            'queue_size': LOG_QUEUE_SIZE,
         },
     },
     'loggers': {
         'core': {
-            'handlers': ['file'],
-            'level': 'INFO',
+            'handlers': ['queue'],
+            'level': LOG_LEVEL,
             'propagate': True,
         },
+        'core.crew_trace': {
+            'filters': ['crew_trace_sample'],
+            'level': 'INFO',
+        },
     },
 }
 
@@ -53,6 +93,159 @@ OPENAI_DEFAULT_TEMPERATURE = config('OPENAI_DEFAULT_TEMPERATURE', default=0.3, c
 OPENAI_MAX_RETRIES = config('OPENAI_MAX_RETRIES', default=3, cast=int)
 OPENAI_DEFAULT_ERROR_MESSAGE = config('OPENAI_DEFAULT_ERROR_MESSAGE', default="Error connecting to AI")
 
+# 'routed' runs only the task for the routed category and generates the diagram
+# in parallel; 'sequential' runs the full three-agent pipeline.
+CREW_EXECUTION_MODE = config('CREW_EXECUTION_MODE', default='routed')
+# crewai's console trace is one shared tree; concurrent verbose crews can corrupt it and fail the flow.
+# It prints every agent step to stdout, so it is off unless DEBUG; CREW_TRACE_SAMPLE_RATE logs a sample instead.
+CREW_VERBOSE = config('CREW_VERBOSE', default=DEBUG, cast=bool)
+
+# Shared HTTP clients (core/clients.py)
+HTTP_POOL_CONNECTIONS = config('HTTP_POOL_CONNECTIONS', default=10, cast=int)
+HTTP_POOL_SIZE = config('HTTP_POOL_SIZE', default=20, cast=int)
+HTTP_TIMEOUT = config('HTTP_TIMEOUT', default=30.0, cast=float)
+OPENAI_TIMEOUT = config('OPENAI_TIMEOUT', default=90.0, cast=float)
+TWILIO_TIMEOUT = config('TWILIO_TIMEOUT', default=15.0, cast=float)
+
+# Outbound WhatsApp dispatcher (core/dispatch.py): every send is rate-limited per
+# sender number, retried on 429/5xx with exponential backoff, and deduplicated by key.
+WHATSAPP_DISPATCHER_ENABLED = config('WHATSAPP_DISPATCHER_ENABLED', default=True, cast=bool)
+# Used by both the dispatcher and the SDK client (core/clients.py).
+TWILIO_API_BASE_URL = config('TWILIO_API_BASE_URL', default='https://api.twilio.com')
+WHATSAPP_SEND_RATE = config('WHATSAPP_SEND_RATE', default=20.0, cast=float)
+WHATSAPP_SEND_BURST = config('WHATSAPP_SEND_BURST', default=20, cast=int)
+WHATSAPP_SEND_CONCURRENCY = config('WHATSAPP_SEND_CONCURRENCY', default=16, cast=int)
+WHATSAPP_SEND_MAX_ATTEMPTS = config('WHATSAPP_SEND_MAX_ATTEMPTS', default=6, cast=int)
+WHATSAPP_SEND_BACKOFF = config('WHATSAPP_SEND_BACKOFF', default=0.5, cast=float)
+WHATSAPP_SEND_BACKOFF_MAX = config('WHATSAPP_SEND_BACKOFF_MAX', default=30.0, cast=float)
+
+# Outage broadcasts (core/broadcast.py): recipients are read and their outcomes
+# written BROADCAST_BATCH_SIZE at a time, with at most BROADCAST_WINDOW recipients
+# queued in the dispatcher so live replies never wait behind a whole broadcast.
+BROADCAST_BATCH_SIZE = config('BROADCAST_BATCH_SIZE', default=500, cast=int)
+BROADCAST_WINDOW = config('BROADCAST_WINDOW', default=64, cast=int)
+
+# In-process message pipeline (core/pipeline.py)
+PIPELINE_WORKERS = config('PIPELINE_WORKERS', default=16, cast=int)
+PIPELINE_QUEUE_SIZE = config('PIPELINE_QUEUE_SIZE', default=1000, cast=int)
+PIPELINE_CLASSIFIER_CONCURRENCY = config('PIPELINE_CLASSIFIER_CONCURRENCY', default=8, cast=int)
+PIPELINE_CREW_CONCURRENCY = config('PIPELINE_CREW_CONCURRENCY', default=4, cast=int)
+PIPELINE_DISPATCH_CONCURRENCY = config('PIPELINE_DISPATCH_CONCURRENCY', default=8, cast=int)
+PIPELINE_MEDIA_CONCURRENCY = config('PIPELINE_MEDIA_CONCURRENCY', default=4, cast=int)
+# Admission control: each number may have PIPELINE_MAX_QUEUED_PER_NUMBER replies
+# waiting and PIPELINE_MAX_IN_FLIGHT_PER_NUMBER jobs running; numbers take turns
+# for workers, emergencies go first, and replies get PIPELINE_REPLY_WEIGHT turns
+# for every PIPELINE_BACKGROUND_WEIGHT given to media follow-ups. A reply still
+# queued after PIPELINE_MAX_QUEUE_WAIT seconds is dropped with the busy notice (0: never).
+PIPELINE_MAX_QUEUED_PER_NUMBER = config('PIPELINE_MAX_QUEUED_PER_NUMBER', default=3, cast=int)
+PIPELINE_MAX_IN_FLIGHT_PER_NUMBER = config('PIPELINE_MAX_IN_FLIGHT_PER_NUMBER', default=1, cast=int)
+PIPELINE_REPLY_WEIGHT = config('PIPELINE_REPLY_WEIGHT', default=3, cast=int)
+PIPELINE_BACKGROUND_WEIGHT = config('PIPELINE_BACKGROUND_WEIGHT', default=1, cast=int)
+PIPELINE_MAX_QUEUE_WAIT = config('PIPELINE_MAX_QUEUE_WAIT', default=90.0, cast=float)
+PIPELINE_BUSY_MESSAGE = config(
+    'PIPELINE_BUSY_MESSAGE',
+    default="⚡ PowerPulse AI is handling a high volume of requests. Please resend your message in a few minutes.",
+)
+# Inbound coalescing (core/inbound.py): messages from one number arriving within
+# INBOUND_COALESCE_WINDOW seconds of each other run as one flow; 0 disables it.
+# Emergencies are never held, and Twilio retries are dropped by MessageSid.
+INBOUND_COALESCE_WINDOW = config('INBOUND_COALESCE_WINDOW', default=2.5, cast=float)
+INBOUND_COALESCE_MAX_WAIT = config('INBOUND_COALESCE_MAX_WAIT', default=8.0, cast=float)
+INBOUND_COALESCE_MAX_MESSAGES = config('INBOUND_COALESCE_MAX_MESSAGES', default=8, cast=int)
+# Under ASGI, serve the WhatsApp webhook ahead of Django's middleware (core/asgi.py).
+WEBHOOK_FAST_PATH = config('WEBHOOK_FAST_PATH', default=True, cast=bool)
+
+# 'memory' runs flows in the in-process pipeline; 'database' stores each message
+# as a FlowJob drained by `manage.py run_workers` (core/jobs.py).
+MESSAGE_QUEUE_BACKEND = config('MESSAGE_QUEUE_BACKEND', default='memory')
+JOB_MAX_ATTEMPTS = config('JOB_MAX_ATTEMPTS', default=5, cast=int)
+JOB_LEASE_SECONDS = config('JOB_LEASE_SECONDS', default=300, cast=int)
+JOB_RETRY_BASE_DELAY = config('JOB_RETRY_BASE_DELAY', default=10.0, cast=float)
+JOB_RETRY_MAX_DELAY = config('JOB_RETRY_MAX_DELAY', default=600.0, cast=float)
+
+# Local pre-classifier ahead of the LLM (core/classifier.py)
+CLASSIFIER_CONFIDENCE_THRESHOLD = config('CLASSIFIER_CONFIDENCE_THRESHOLD', default=0.8, cast=float)
+CLASSIFIER_MODEL_PATH = config('CLASSIFIER_MODEL_PATH', default=os.path.join(BASE_DIR, 'var', 'classifier.npz'))
+
+# Semantic response cache in front of PowerPulseCrew (core/response_cache.py)
+RESPONSE_CACHE_ENABLED = config('RESPONSE_CACHE_ENABLED', default=True, cast=bool)
+RESPONSE_CACHE_MAX_ENTRIES = config('RESPONSE_CACHE_MAX_ENTRIES', default=5000, cast=int)
+RESPONSE_CACHE_TTL = config('RESPONSE_CACHE_TTL', default=86400, cast=int)
+RESPONSE_CACHE_SIMILARITY = config('RESPONSE_CACHE_SIMILARITY', default=0.8, cast=float)
+RESPONSE_CACHE_BYPASS_CATEGORIES = config('RESPONSE_CACHE_BYPASS_CATEGORIES', default='technical_fault', cast=Csv())
+RESPONSE_CACHE_HISTORY_REFRESH = config('RESPONSE_CACHE_HISTORY_REFRESH', default=30, cast=int)
+
+# Content-addressed library of generated diagrams (core/image_library.py)
+IMAGE_LIBRARY_ENABLED = config('IMAGE_LIBRARY_ENABLED', default=True, cast=bool)
+IMAGE_REUSE_SIMILARITY = config('IMAGE_REUSE_SIMILARITY', default=0.6, cast=float)
+IMAGE_LIBRARY_REFRESH = config('IMAGE_LIBRARY_REFRESH', default=30, cast=int)
+IMAGE_GC_GRACE_HOURS = config('IMAGE_GC_GRACE_HOURS', default=24, cast=int)
+
+# Smaller copies of stored images (core/image_variants.py), transcoded on first
+# request in a pool of IMAGE_VARIANT_WORKERS processes and cached under
+# MEDIA_ROOT/variants. Each variant is (longest side in px, format, quality).
+IMAGE_VARIANTS = {
+    'whatsapp': (800, 'JPEG', 80),
+    'webp': (800, 'WEBP', 78),
+    'thumb': (256, 'JPEG', 72),
+}
+IMAGE_VARIANTS_ENABLED = config('IMAGE_VARIANTS_ENABLED', default=True, cast=bool)
+# Variant linked in outgoing WhatsApp messages; Twilio delivers JPEG and PNG images, not WebP.
+IMAGE_DISPATCH_VARIANT = config('IMAGE_DISPATCH_VARIANT', default='whatsapp')
+IMAGE_VARIANT_WORKERS = config('IMAGE_VARIANT_WORKERS', default=2, cast=int)
+IMAGE_VARIANT_TIMEOUT = config('IMAGE_VARIANT_TIMEOUT', default=30, cast=int)
+IMAGE_VARIANT_MAX_AGE = config('IMAGE_VARIANT_MAX_AGE', default=30 * 24 * 3600, cast=int)
+
+# Per-number conversation memory fed into the flow (core/conversations.py)
+CONVERSATION_MEMORY_ENABLED = config('CONVERSATION_MEMORY_ENABLED', default=True, cast=bool)
+CONVERSATION_CACHE_SIZE = config('CONVERSATION_CACHE_SIZE', default=10000, cast=int)
+CONVERSATION_CACHE_TTL = config('CONVERSATION_CACHE_TTL', default=30, cast=int)
+CONVERSATION_MAX_TURNS = config('CONVERSATION_MAX_TURNS', default=3, cast=int)
+CONVERSATION_SUMMARY_CHARS = config('CONVERSATION_SUMMARY_CHARS', default=400, cast=int)
+# A message within this many seconds of the last reply may continue its topic.
+CONVERSATION_FOLLOW_UP_WINDOW = config('CONVERSATION_FOLLOW_UP_WINDOW', default=1800, cast=int)
+CONVERSATION_FOLLOW_UP_MAX_WORDS = config('CONVERSATION_FOLLOW_UP_MAX_WORDS', default=8, cast=int)
+CONVERSATION_IDLE_RESET_HOURS = config('CONVERSATION_IDLE_RESET_HOURS', default=72, cast=int)
+
+# Meter readings, daily/monthly rollups and anomaly detection (core/consumption.py).
+# A day is anomalous when it is CONSUMPTION_ANOMALY_Z standard deviations and at
+# least CONSUMPTION_ANOMALY_MIN_KWH away from what the consumer's previous
+# CONSUMPTION_BASELINE_DAYS predict for that weekday.
+CONSUMPTION_CONTEXT_ENABLED = config('CONSUMPTION_CONTEXT_ENABLED', default=True, cast=bool)
+CONSUMPTION_CONTEXT_DAYS = config('CONSUMPTION_CONTEXT_DAYS', default=14, cast=int)
+CONSUMPTION_INGEST_BATCH_SIZE = config('CONSUMPTION_INGEST_BATCH_SIZE', default=5000, cast=int)
+CONSUMPTION_BASELINE_DAYS = config('CONSUMPTION_BASELINE_DAYS', default=28, cast=int)
+CONSUMPTION_MIN_HISTORY_DAYS = config('CONSUMPTION_MIN_HISTORY_DAYS', default=14, cast=int)
+CONSUMPTION_ANOMALY_Z = config('CONSUMPTION_ANOMALY_Z', default=4.0, cast=float)
+CONSUMPTION_ANOMALY_MIN_KWH = config('CONSUMPTION_ANOMALY_MIN_KWH', default=3.0, cast=float)
+# Open a ServiceTicket for each new anomaly when `detect_anomalies` runs.
+CONSUMPTION_ANOMALY_TICKETS = config('CONSUMPTION_ANOMALY_TICKETS', default=False, cast=bool)
+
+# Grid codes and appliance manuals retrieved for the agents (core/knowledge_base.py).
+# `manage.py build_kb` indexes KB_SOURCE_DIR (.md, .txt, .pdf) into KB_INDEX_DIR.
+KB_ENABLED = config('KB_ENABLED', default=True, cast=bool)
+KB_SOURCE_DIR = config('KB_SOURCE_DIR', default=os.path.join(BASE_DIR, 'docs', 'kb'))
+KB_INDEX_DIR = config('KB_INDEX_DIR', default=os.path.join(BASE_DIR, 'var', 'kb'))
+# 'hashed' embeds locally; 'openai' calls KB_EMBEDDING_MODEL. Changing either re-embeds everything.
+KB_EMBEDDING_BACKEND = config('KB_EMBEDDING_BACKEND', default='hashed')
+KB_EMBEDDING_MODEL = config('KB_EMBEDDING_MODEL', default='text-embedding-3-small')
+KB_EMBEDDING_DIM = config('KB_EMBEDDING_DIM', default=1024, cast=int)
+KB_CHUNK_CHARS = config('KB_CHUNK_CHARS', default=900, cast=int)
+KB_CHUNK_OVERLAP = config('KB_CHUNK_OVERLAP', default=150, cast=int)
+KB_TOP_K = config('KB_TOP_K', default=3, cast=int)
+KB_MIN_SCORE = config('KB_MIN_SCORE', default=0.08, cast=float)
+KB_MAX_CONTEXT_CHARS = config('KB_MAX_CONTEXT_CHARS', default=1500, cast=int)
+# Above KB_IVF_MIN_ROWS chunks the index is split into about sqrt(n) lists; a search probes KB_IVF_PROBES of them.
+KB_IVF_MIN_ROWS = config('KB_IVF_MIN_ROWS', default=20000, cast=int)
+KB_IVF_PROBES = config('KB_IVF_PROBES', default=16, cast=int)
+
+# Per-step timing, token and retry accounting (core/profiling.py)
+FLOW_METRICS_ENABLED = config('FLOW_METRICS_ENABLED', default=True, cast=bool)
+FLOW_METRICS_BUFFER_SIZE = config('FLOW_METRICS_BUFFER_SIZE', default=10000, cast=int)
+FLOW_METRICS_PERSIST = config('FLOW_METRICS_PERSIST', default=True, cast=bool)
+# Bearer token for scrapers at /ops/metrics/; staff sessions work without it.
+FLOW_METRICS_TOKEN = config('FLOW_METRICS_TOKEN', default='')
+
 INSTALLED_APPS = [
     'django.contrib.admin',
     'django.contrib.auth',
@@ -103,10 +296,21 @@ WSGI_APPLICATION = 'config.wsgi.application'
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+        'NAME': config('SQLITE_PATH', default=str(BASE_DIR / 'db.sqlite3')),
+        # Several worker processes write to SQLite; wait for the lock instead of failing.
+        'OPTIONS': {'timeout': 20},
     }
 }
 
+# Journal mode applied to every SQLite connection (core/persistence.py); '' keeps SQLite's default.
+SQLITE_JOURNAL_MODE = config('SQLITE_JOURNAL_MODE', default='wal')
+
+# 'atomic' writes each message's ticket and content in one transaction before
+# replying; 'write_behind' queues them and group-commits in batches.
+PERSISTENCE_MODE = config('PERSISTENCE_MODE', default='atomic')
+PERSISTENCE_BATCH_SIZE = config('PERSISTENCE_BATCH_SIZE', default=200, cast=int)
+PERSISTENCE_LINGER_MS = config('PERSISTENCE_LINGER_MS', default=20, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -1,9 +1,20 @@
+from django.conf import settings
+from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import path, include
-from core.views import whatsapp_webhook 
+from core.views import whatsapp_webhook, pipeline_stats, response_cache_stats, image_library_stats, conversation_stats, knowledge_base_stats, ticket_stats, flow_metrics, media_variant
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('whatsapp/message/', whatsapp_webhook, name='whatsapp_webhook'), 
+    path('ops/pipeline/', pipeline_stats, name='pipeline_stats'),
+    path('ops/cache/', response_cache_stats, name='response_cache_stats'),
+    path('ops/images/', image_library_stats, name='image_library_stats'),
+    path('ops/conversations/', conversation_stats, name='conversation_stats'),
+    path('ops/knowledge-base/', knowledge_base_stats, name='knowledge_base_stats'),
+    path('ops/tickets/', ticket_stats, name='ticket_stats'),
+    path('ops/metrics/', flow_metrics, name='flow_metrics'),
+    # Served in production too, ahead of the DEBUG-only static() media route.
+    path(f"{settings.MEDIA_URL.lstrip('/')}variants/<str:variant>/<path:name>", media_variant, name='media_variant'),
     
-]
\ No newline at end of file
+] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
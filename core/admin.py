@@ -1,18 +1,161 @@
 from django.contrib import admin
-from .models import EnergyConsumer, ServiceTicket, GeneratedEnergyContent
+from django.urls import reverse
+from django.utils.html import format_html
+from .models import EnergyConsumer, ServiceTicket, GeneratedEnergyContent, FlowJob, ImageAsset, ConversationSession, FlowMetrics, Broadcast, BroadcastDelivery, MeterReading, ConsumptionRollup, ConsumptionAnomaly, TicketRollup
+from .jobs import requeue_dead_jobs
 
 @admin.register(EnergyConsumer)
 class EnergyConsumerAdmin(admin.ModelAdmin):
     list_display = ('phone_number', 'user', 'meter_number', 'average_consumption')
+    list_select_related = ('user',)
     search_fields = ('phone_number', 'meter_number')
+    raw_id_fields = ('user',)
 
 @admin.register(ServiceTicket)
 class ServiceTicketAdmin(admin.ModelAdmin):
     list_display = ('ticket_id', 'consumer', 'category', 'status', 'urgency', 'created_at')
     list_filter = ('status', 'category', 'urgency')
+    list_select_related = ('consumer__user',)
     search_fields = ('ticket_id', 'consumer__phone_number')
+    # Newest first, matching the (<filter>, -created_at) indexes.
+    ordering = ('-created_at',)
+    raw_id_fields = ('consumer',)
+    # A COUNT(*) over millions of rows on every page load is not worth it.
+    show_full_result_count = False
 
 @admin.register(GeneratedEnergyContent)
 class GeneratedEnergyContentAdmin(admin.ModelAdmin):
     list_display = ('id', 'ticket', 'created_at', 'whatsapp_sid')
-    readonly_fields = ('created_at', 'prompt_used', 'generated_text', 'image_url')
\ No newline at end of file
+    list_select_related = ('ticket__consumer__user',)
+    ordering = ('-created_at',)
+    raw_id_fields = ('ticket',)
+    show_full_result_count = False
+    readonly_fields = ('created_at', 'prompt_used', 'generated_text', 'image_url', 'image_asset')
+
+@admin.register(ImageAsset)
+class ImageAssetAdmin(admin.ModelAdmin):
+    list_display = ('preview', 'sha256', 'category', 'subject', 'reuse_count', 'size_bytes', 'last_used_at')
+    list_filter = ('category',)
+    search_fields = ('subject', 'sha256')
+    readonly_fields = ('sha256', 'file', 'size_bytes', 'subject', 'source_url', 'reuse_count', 'created_at', 'last_used_at')
+    exclude = ('signature',)
+
+    @admin.display(description="Preview")
+    def preview(self, obj):
+        # The 'thumb' variant, so a changelist page does not pull full-size PNGs.
+        url = reverse('media_variant', kwargs={'variant': 'thumb', 'name': obj.file.name})
+        return format_html('<img src="{}" width="64" height="64" loading="lazy" alt="">', url)
+
+@admin.register(FlowJob)
+class FlowJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'from_number', 'status', 'attempts', 'available_at', 'locked_by', 'created_at')
+    list_filter = ('status', 'kind')
+    search_fields = ('from_number', 'ticket_ref')
+    readonly_fields = ('created_at', 'updated_at', 'last_error', 'ticket_ref')
+    actions = ['requeue_dead']
+
+    @admin.action(description="Requeue dead-lettered jobs")
+    def requeue_dead(self, request, queryset):
+        count = requeue_dead_jobs(queryset)
+        self.message_user(request, f"{count} job(s) requeued.")
+
+@admin.register(ConversationSession)
+class ConversationSessionAdmin(admin.ModelAdmin):
+    list_display = ('phone_number', 'last_category', 'last_ticket_id', 'updated_at')
+    list_filter = ('last_category',)
+    search_fields = ('phone_number', 'last_ticket_id')
+    ordering = ('-updated_at',)
+    show_full_result_count = False
+
+@admin.register(FlowMetrics)
+class FlowMetricsAdmin(admin.ModelAdmin):
+    list_display = ('started_at', 'kind', 'name', 'duration_ms', 'prompt_tokens', 'completion_tokens', 'retries', 'ok', 'ticket_id')
+    list_filter = ('kind', 'ok')
+    search_fields = ('ticket_id', 'trace_id', 'name')
+    ordering = ('-started_at',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    # Sent with `manage.py broadcast`; the admin only shows progress.
+    list_display = ('id', 'title', 'region', 'meter_prefix', 'status', 'total', 'sent', 'failed', 'created_at')
+    list_filter = ('status',)
+    search_fields = ('title', 'region', 'meter_prefix')
+    ordering = ('-created_at',)
+    readonly_fields = ('status', 'total', 'sent', 'failed', 'created_at', 'started_at', 'finished_at')
+
+@admin.register(BroadcastDelivery)
+class BroadcastDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('broadcast', 'phone_number', 'status', 'whatsapp_sid', 'updated_at')
+    list_select_related = ('broadcast',)
+    list_filter = ('status',)
+    search_fields = ('phone_number', 'whatsapp_sid')
+    raw_id_fields = ('broadcast', 'consumer')
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(MeterReading)
+class MeterReadingAdmin(admin.ModelAdmin):
+    # Loaded with `manage.py ingest_readings`; editing one would leave its rollups stale.
+    list_display = ('consumer', 'read_at', 'wh')
+    list_select_related = ('consumer__user',)
+    search_fields = ('consumer__phone_number', 'consumer__meter_number')
+    raw_id_fields = ('consumer',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ConsumptionRollup)
+class ConsumptionRollupAdmin(admin.ModelAdmin):
+    list_display = ('consumer', 'period', 'period_start', 'kwh', 'readings', 'peak_wh')
+    list_select_related = ('consumer__user',)
+    list_filter = ('period',)
+    search_fields = ('consumer__phone_number', 'consumer__meter_number')
+    ordering = ('-period_start',)
+    raw_id_fields = ('consumer',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+@admin.register(ConsumptionAnomaly)
+class ConsumptionAnomalyAdmin(admin.ModelAdmin):
+    list_display = ('day', 'consumer', 'kind', 'kwh', 'expected_kwh', 'zscore', 'ticket')
+    list_select_related = ('consumer__user', 'ticket__consumer')
+    list_filter = ('kind',)
+    search_fields = ('consumer__phone_number', 'consumer__meter_number', 'ticket__ticket_id')
+    ordering = ('-day',)
+    raw_id_fields = ('consumer', 'ticket')
+    readonly_fields = ('day', 'kind', 'kwh', 'expected_kwh', 'zscore', 'detected_at')
+    show_full_result_count = False
+
+@admin.register(TicketRollup)
+class TicketRollupAdmin(admin.ModelAdmin):
+    # Maintained by core/ticket_rollups.py; fix drift with `manage.py rebuild_ticket_rollups`.
+    list_display = ('hour', 'category', 'urgency', 'status', 'count')
+    list_filter = ('status', 'category', 'urgency')
+    date_hierarchy = 'hour'
+    ordering = ('-hour',)
+    show_full_result_count = False
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -1,6 +1,18 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save, pre_save
 
 
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from core.persistence import configure_sqlite
+        connection_created.connect(configure_sqlite, dispatch_uid='core.configure_sqlite')
+
+        from core.models import ServiceTicket
+        from core.ticket_rollups import count_deleted, count_saved, remember_bucket
+        pre_save.connect(remember_bucket, sender=ServiceTicket, dispatch_uid='core.ticket_rollups.pre_save')
+        post_save.connect(count_saved, sender=ServiceTicket, dispatch_uid='core.ticket_rollups.post_save')
+        post_delete.connect(count_deleted, sender=ServiceTicket, dispatch_uid='core.ticket_rollups.post_delete')
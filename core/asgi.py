@@ -0,0 +1,88 @@
+"""
+PowerPulse AI - ASGI Webhook Fast Path
+Django 4.2 runs every request's sync pieces (the request_started signal and
+each MiddlewareMixin hook) on a thread private to that request, so under a
+burst of webhooks the server holds one thread per in-flight POST. Twilio's
+webhook needs none of that middleware (no session, auth, CSRF or templates),
+so this router answers it directly on the event loop and passes everything
+else through to Django unchanged.
+"""
+from __future__ import annotations
+import logging
+
+from django.conf import settings
+from django.http import QueryDict
+from django.http.request import split_domain_port, validate_host
+from django.urls import reverse
+
+logger = logging.getLogger(__name__)
+
+FORM_CONTENT_TYPE = b"application/x-www-form-urlencoded"
+
+
+async def _respond(send, status: int, body: bytes, content_type: bytes = b"text/plain; charset=utf-8"):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive, limit: int | None) -> bytes | None:
+    """The whole request body, or None if it grows past `limit`."""
+    chunks, size, more = [], 0, True
+    while more:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if limit is not None and size > limit:
+            return None
+        chunks.append(chunk)
+        more = message.get("more_body", False)
+    return b"".join(chunks)
+
+
+async def handle_webhook(scope, receive, send):
+    from core.views import accept_message
+
+    headers = dict(scope.get("headers") or [])
+    domain, _ = split_domain_port(headers.get(b"host", b"").decode("latin-1"))
+    allowed_hosts = settings.ALLOWED_HOSTS or (['.localhost', '127.0.0.1', '[::1]'] if settings.DEBUG else [])
+    if not domain or not validate_host(domain, allowed_hosts):
+        await _respond(send, 400, b"Bad Request")
+        return
+    if scope["method"] != "POST":
+        await _respond(send, 405, b"Method Not Allowed")
+        return
+    if headers.get(b"content-type", b"").split(b";")[0].strip() != FORM_CONTENT_TYPE:
+        await _respond(send, 415, b"Unsupported Media Type")
+        return
+
+    body = await _read_body(receive, settings.DATA_UPLOAD_MAX_MEMORY_SIZE)
+    if body is None:
+        await _respond(send, 413, b"Payload Too Large")
+        return
+
+    form = QueryDict(body, encoding="utf-8")
+    twiml = await accept_message(form.get("Body", "").strip(), form.get("From", "").strip(), form.get("MessageSid"))
+    await _respond(send, 200, twiml.encode("utf-8"), content_type=b"application/xml")
+
+
+def webhook_router(django_app):
+    """Wrap Django's ASGI application so the WhatsApp webhook skips the middleware stack."""
+    webhook_path = None
+
+    async def application(scope, receive, send):
+        nonlocal webhook_path
+        if scope["type"] == "http":
+            if webhook_path is None:
+                webhook_path = scope.get("root_path", "") + reverse("whatsapp_webhook")
+            if scope["path"] == webhook_path:
+                await handle_webhook(scope, receive, send)
+                return
+        await django_app(scope, receive, send)
+
+    return application
@@ -0,0 +1,144 @@
+"""
+PowerPulse AI - Outage Broadcasts
+Sends one outage notice to every consumer whose address mentions a region
+and/or whose meter number starts with a prefix. The notice is rendered and
+split into WhatsApp messages once. Recipients are streamed from the database in
+id order with .iterator() and handed to the outbound dispatcher (core/dispatch.py),
+which rate-limits and retries them; at most BROADCAST_WINDOW recipients are
+queued there at a time. Each recipient's outcome is written as a
+BroadcastDelivery row in batches, so an interrupted broadcast is resumed by
+running it again: everyone already marked sent is skipped.
+"""
+from __future__ import annotations
+import logging
+from collections import deque
+
+from django.conf import settings
+from django.db.models import Count, Exists, OuterRef, Q
+from django.utils import timezone
+
+from core.dispatch import dispatcher
+from core.models import Broadcast, BroadcastDelivery, EnergyConsumer
+from core.streaming import split_message
+
+logger = logging.getLogger(__name__)
+
+
+def targets(broadcast: Broadcast):
+    """Every consumer the broadcast is addressed to."""
+    consumers = EnergyConsumer.objects.exclude(phone_number__isnull=True).exclude(phone_number='')
+    if broadcast.region:
+        consumers = consumers.filter(address__icontains=broadcast.region)
+    if broadcast.meter_prefix:
+        consumers = consumers.filter(meter_number__startswith=broadcast.meter_prefix)
+    return consumers
+
+
+def pending(broadcast: Broadcast):
+    """Targets the broadcast has not reached yet, in id order."""
+    reached = BroadcastDelivery.objects.filter(broadcast=broadcast, consumer=OuterRef('pk'), status='sent')
+    return targets(broadcast).filter(~Exists(reached)).order_by('id')
+
+
+def render(broadcast: Broadcast) -> list[str]:
+    """The notice as the WhatsApp messages every recipient gets."""
+    return split_message(f"⚠️ *{broadcast.title}*\n\n{broadcast.message.strip()}", settings.WHATSAPP_MAX_CHARS)
+
+
+def _submit(broadcast: Broadcast, parts: list[str], consumer_id: int, phone: str) -> list:
+    return [
+        dispatcher.submit(
+            phone, body,
+            media_url=broadcast.image_url if index == 0 else None,
+            key=f"broadcast-{broadcast.id}:{consumer_id}:{index}",
+        )
+        for index, body in enumerate(parts)
+    ]
+
+
+def _outcome(broadcast: Broadcast, consumer_id: int, phone: str, futures: list) -> BroadcastDelivery:
+    sids = [future.result() for future in futures]
+    return BroadcastDelivery(
+        broadcast=broadcast,
+        consumer_id=consumer_id,
+        phone_number=phone,
+        status='sent' if all(sids) else 'failed',
+        whatsapp_sid=sids[0],
+        updated_at=timezone.now(),
+    )
+
+
+def _record(broadcast: Broadcast, deliveries: list[BroadcastDelivery]):
+    """Write a batch of outcomes and refresh the broadcast's counters."""
+    if deliveries:
+        # A recipient that failed last time and got through now is updated in place.
+        BroadcastDelivery.objects.bulk_create(
+            deliveries,
+            update_conflicts=True,
+            unique_fields=['broadcast', 'consumer'],
+            update_fields=['status', 'whatsapp_sid', 'updated_at'],
+        )
+    counts = BroadcastDelivery.objects.filter(broadcast=broadcast).aggregate(
+        sent=Count('id', filter=Q(status='sent')),
+        failed=Count('id', filter=Q(status='failed')),
+    )
+    broadcast.sent, broadcast.failed = counts['sent'], counts['failed']
+    Broadcast.objects.filter(pk=broadcast.pk).update(sent=broadcast.sent, failed=broadcast.failed)
+
+
+def run_broadcast(broadcast: Broadcast, batch_size: int | None = None, window: int | None = None,
+                  stop=None, progress=None) -> Broadcast:
+    """
+    Send `broadcast` to everyone it has not reached yet and return it with
+    updated counters. Setting the `stop` event ends the run once the recipients
+    already queued are sent and recorded (status 'stopped'); `progress` is
+    called with the broadcast after every batch written.
+    """
+    batch_size = max(1, batch_size or settings.BROADCAST_BATCH_SIZE)
+    window = max(1, window or settings.BROADCAST_WINDOW)
+    parts = render(broadcast)
+
+    broadcast.status = 'running'
+    broadcast.started_at = broadcast.started_at or timezone.now()
+    broadcast.total = targets(broadcast).count()
+    broadcast.save(update_fields=['status', 'started_at', 'total'])
+    logger.info(
+        f"📣 Broadcast {broadcast.id}: {broadcast.total} recipients, {len(parts)} message(s) each, "
+        f"{broadcast.sent} already reached"
+    )
+
+    in_flight = deque()
+    finished = []
+    stopped = False
+
+    def settle(block: bool):
+        # Oldest first, so a full window waits on the recipient most likely to be done.
+        while in_flight and (block or all(future.done() for future in in_flight[0][2])):
+            consumer_id, phone, futures = in_flight.popleft()
+            finished.append(_outcome(broadcast, consumer_id, phone, futures))
+            block = False
+
+    recipients = pending(broadcast).values_list('id', 'phone_number').iterator(chunk_size=batch_size)
+    for consumer_id, phone in recipients:
+        if stop is not None and stop.is_set():
+            stopped = True
+            break
+        in_flight.append((consumer_id, phone, _submit(broadcast, parts, consumer_id, phone)))
+        settle(block=len(in_flight) >= window)
+        if len(finished) >= batch_size:
+            _record(broadcast, finished)
+            finished = []
+            if progress is not None:
+                progress(broadcast)
+
+    while in_flight:
+        settle(block=True)
+    _record(broadcast, finished)
+
+    broadcast.status = 'stopped' if stopped else 'done'
+    broadcast.finished_at = None if stopped else timezone.now()
+    broadcast.save(update_fields=['status', 'finished_at'])
+    if progress is not None:
+        progress(broadcast)
+    logger.info(f"📣 Broadcast {broadcast.id} {broadcast.status}: {broadcast.sent} sent, {broadcast.failed} failed")
+    return broadcast
@@ -0,0 +1,299 @@
+"""
+PowerPulse AI - Fast-path Request Classifier
+Routes messages locally before `basic_llm` is consulted:
+  1. An Aho-Corasick keyword matcher (English + Arabic). Emergency hits are final.
+  2. A hashed character n-gram softmax model trained from stored ServiceTicket labels.
+The LLM is only called when the combined confidence is below
+CLASSIFIER_CONFIDENCE_THRESHOLD.
+"""
+from __future__ import annotations
+import logging
+import os
+import re
+import threading
+import zlib
+from collections import deque
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+CATEGORIES = ("emergency", "technical_fault", "energy_advice")
+
+# (phrase, weight). Weights >= 1.0 are decisive on their own. "fire" and "smoke"
+# are not ("fire up the heater", "my smoke detector keeps beeping"); they count
+# as an emergency in a hazard phrase or next to another hazard word.
+KEYWORDS = {
+    "emergency": [
+        ("spark", 1.0), ("sparks", 1.0), ("sparking", 1.0), ("fire", 0.6), ("smoke", 0.6),
+        ("on fire", 1.0), ("caught fire", 1.0), ("catching fire", 1.0), ("smoke coming", 1.0),
+        ("smoke from", 1.0), ("smoking", 0.6), ("burning smell", 1.0), ("burning", 0.8), ("melting", 1.0), ("melted", 1.0),
+        ("electric shock", 1.0), ("electrocuted", 1.0), ("shocked me", 1.0), ("explosion", 1.0),
+        ("exploded", 1.0), ("arcing", 1.0), ("flames", 1.0), ("live wire", 1.0),
+        ("شرارة", 1.0), ("شرار", 1.0), ("حريق", 1.0), ("نار", 0.6), ("دخان", 0.6), ("طالع دخان", 1.0),
+        ("يطلع دخان", 1.0), ("فيه نار", 1.0),
+        ("رائحة حريق", 1.0), ("ريحة حريق", 1.0), ("صعقة", 1.0), ("صعقني", 1.0), ("ماس كهربائي", 1.0),
+        ("انفجار", 1.0), ("ذاب", 0.8), ("يحترق", 1.0), ("سلك مكشوف", 1.0),
+    ],
+    "technical_fault": [
+        ("breaker", 0.8), ("tripped", 0.9), ("tripping", 0.9), ("trips", 0.8), ("no power", 1.0),
+        ("power outage", 1.0), ("outage", 0.9), ("power cut", 1.0), ("blackout", 1.0), ("flickering", 0.9),
+        ("flicker", 0.8), ("not working", 0.7), ("stopped working", 0.8), ("fuse", 0.8), ("short circuit", 0.9),
+        ("voltage drop", 1.0), ("low voltage", 1.0), ("socket", 0.6), ("outlet", 0.6), ("buzzing", 0.8),
+        ("انقطاع", 1.0), ("مقطوعة", 1.0), ("القاطع", 0.9), ("قاطع", 0.8), ("فصل", 0.7), ("عطل", 0.9),
+        ("فيوز", 0.8), ("تذبذب", 0.9), ("ما في كهربا", 1.0), ("لا يوجد كهرباء", 1.0), ("ضعف الجهد", 1.0),
+        ("الفيش", 0.6), ("لا يعمل", 0.7),
+    ],
+    "energy_advice": [
+        ("bill", 0.9), ("save", 0.8), ("saving", 0.9), ("savings", 0.9), ("reduce", 0.7),
+        ("consumption", 0.8), ("solar", 0.9), ("efficient", 0.9), ("efficiency", 0.9), ("tariff", 1.0),
+        ("kwh", 0.9), ("inverter", 0.6), ("insulation", 0.8), ("cheaper", 0.8), ("cost", 0.6),
+        ("فاتورة", 1.0), ("الفاتورة", 1.0), ("توفير", 1.0), ("تقليل", 0.8), ("استهلاك", 0.9),
+        ("طاقة شمسية", 1.0), ("الطاقة الشمسية", 1.0), ("ألواح شمسية", 1.0), ("تعرفة", 1.0), ("كيلو واط", 0.9),
+    ],
+}
+
+_ARABIC_DIACRITICS = re.compile(r"[ؐ-ًؚ-ٰٟۖ-ۭـ]")
+_ARABIC_FOLD = str.maketrans({"أ": "ا", "إ": "ا", "آ": "ا", "ٱ": "ا", "ة": "ه", "ى": "ي", "ؤ": "و", "ئ": "ي"})
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    text = (text or "").lower()
+    text = _ARABIC_DIACRITICS.sub("", text).translate(_ARABIC_FOLD)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+@dataclass(frozen=True)
+class Classification:
+    category: str
+    confidence: float
+    source: str
+    matched: tuple = ()
+
+
+class AhoCorasickMatcher:
+    """Multi-pattern matcher: one pass over the text regardless of keyword count."""
+
+    def __init__(self, patterns):
+        # patterns: iterable of (phrase, payload)
+        self._goto = [{}]
+        self._fail = [0]
+        self._output = [[]]
+        for phrase, payload in patterns:
+            self._add(phrase, payload)
+        self._build()
+
+    def _add(self, phrase, payload):
+        node = 0
+        for char in phrase:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._output.append([])
+            node = nxt
+        self._output[node].append((phrase, payload))
+
+    def _build(self):
+        queue = deque()
+        for child in self._goto[0].values():
+            self._fail[child] = 0
+            queue.append(child)
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._output[child] = self._output[child] + self._output[self._fail[child]]
+
+    def find(self, text: str):
+        """Yield (phrase, payload) for every whole-word occurrence in `text`."""
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(char, 0)
+            for phrase, payload in self._output[node]:
+                if _is_whole_word(text, end - len(phrase) + 1, end + 1):
+                    yield phrase, payload
+
+
+# Arabic attaches articles/conjunctions and some suffixes to the word itself
+# ("الحريق", "وشرارات"); they must not hide a keyword, while "دينار" must not match "نار".
+_ARABIC_PREFIXES = {"", "ال", "و", "وال", "ب", "بال", "ل", "لل", "ف", "فال", "ك", "كال"}
+_ARABIC_SUFFIXES = {"", "ه", "ات", "ها", "ي", "ين", "ون"}
+
+
+def _is_whole_word(text: str, start: int, end: int) -> bool:
+    word_start = start
+    while word_start > 0 and text[word_start - 1].isalnum():
+        word_start -= 1
+    word_end = end
+    while word_end < len(text) and text[word_end].isalnum():
+        word_end += 1
+    prefix, suffix = text[word_start:start], text[end:word_end]
+    if not prefix and not suffix:
+        return True
+    if text[start:end].isascii():
+        return False
+    return prefix in _ARABIC_PREFIXES and suffix in _ARABIC_SUFFIXES
+
+
+class HashedNgramModel:
+    """Softmax regression over hashed character n-grams, trained with full-batch gradient descent."""
+
+    def __init__(self, n_features: int = 2 ** 18, ngram_range=(2, 5), weights=None, bias=None):
+        self.n_features = n_features
+        self.ngram_range = tuple(ngram_range)
+        self.weights = weights if weights is not None else np.zeros((n_features, len(CATEGORIES)), dtype=np.float32)
+        self.bias = bias if bias is not None else np.zeros(len(CATEGORIES), dtype=np.float32)
+
+    def _features(self, text: str):
+        padded = f" {normalize_text(text)} "
+        low, high = self.ngram_range
+        hashes = [
+            zlib.crc32(padded[i:i + n].encode("utf-8")) % self.n_features
+            for n in range(low, high + 1)
+            for i in range(len(padded) - n + 1)
+        ]
+        if not hashes:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        indices, counts = np.unique(np.asarray(hashes, dtype=np.int64), return_counts=True)
+        values = counts.astype(np.float32)
+        return indices, values / np.linalg.norm(values)
+
+    def _vectorize(self, texts):
+        rows = [self._features(t) for t in texts]
+        lengths = np.array([len(r[0]) for r in rows], dtype=np.int64)
+        indices = np.concatenate([r[0] for r in rows]) if rows else np.zeros(0, dtype=np.int64)
+        values = np.concatenate([r[1] for r in rows]) if rows else np.zeros(0, dtype=np.float32)
+        row_ids = np.repeat(np.arange(len(rows)), lengths)
+        return indices, values, row_ids, len(rows)
+
+    def _logits(self, indices, values, row_ids, n_rows):
+        logits = np.tile(self.bias, (n_rows, 1))
+        np.add.at(logits, row_ids, self.weights[indices] * values[:, None])
+        return logits
+
+    @staticmethod
+    def _softmax(logits):
+        shifted = logits - logits.max(axis=1, keepdims=True)
+        exp = np.exp(shifted)
+        return exp / exp.sum(axis=1, keepdims=True)
+
+    def fit(self, texts, labels, epochs: int = 200, learning_rate: float = 2.0, l2: float = 1e-4):
+        indices, values, row_ids, n_rows = self._vectorize(texts)
+        targets = np.zeros((n_rows, len(CATEGORIES)), dtype=np.float32)
+        targets[np.arange(n_rows), [CATEGORIES.index(label) for label in labels]] = 1.0
+
+        # Train only on the hash buckets that actually occur, then scatter back.
+        used, local = np.unique(indices, return_inverse=True)
+        weights = self.weights[used].copy()
+        for _ in range(epochs):
+            logits = np.tile(self.bias, (n_rows, 1))
+            np.add.at(logits, row_ids, weights[local] * values[:, None])
+            error = (self._softmax(logits) - targets) / n_rows
+            grad = np.zeros_like(weights)
+            np.add.at(grad, local, error[row_ids] * values[:, None])
+            weights -= learning_rate * (grad + l2 * weights)
+            self.bias -= learning_rate * error.sum(axis=0)
+        self.weights[used] = weights
+        return self
+
+    def predict_proba(self, texts) -> np.ndarray:
+        return self._softmax(self._logits(*self._vectorize(texts)))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        rows = np.flatnonzero(np.any(self.weights != 0, axis=1))
+        np.savez_compressed(
+            path, rows=rows, row_weights=self.weights[rows], bias=self.bias,
+            n_features=self.n_features, ngram_range=np.array(self.ngram_range),
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        n_features = int(data["n_features"])
+        weights = np.zeros((n_features, len(CATEGORIES)), dtype=np.float32)
+        weights[data["rows"]] = data["row_weights"]
+        return cls(n_features=n_features, ngram_range=tuple(data["ngram_range"]), weights=weights, bias=data["bias"])
+
+
+_matcher = AhoCorasickMatcher(
+    (normalize_text(phrase), (category, weight))
+    for category, phrases in KEYWORDS.items()
+    for phrase, weight in phrases
+)
+
+_model = None
+_model_mtime = None
+_model_lock = threading.Lock()
+
+
+def get_model() -> HashedNgramModel | None:
+    """Load the trained model, reloading it when `train_classifier` rewrites the file."""
+    global _model, _model_mtime
+    path = str(settings.CLASSIFIER_MODEL_PATH)
+    try:
+        mtime = os.stat(path).st_mtime
+    except OSError:
+        return None
+    if mtime != _model_mtime:
+        with _model_lock:
+            if mtime != _model_mtime:
+                _model = HashedNgramModel.load(path)
+                _model_mtime = mtime
+                logger.info(f"Loaded classifier model from {path}")
+    return _model
+
+
+def keyword_scores(text: str):
+    scores = dict.fromkeys(CATEGORIES, 0.0)
+    matched = []
+    for phrase, (category, weight) in _matcher.find(normalize_text(text)):
+        scores[category] += weight
+        matched.append(phrase)
+    return scores, tuple(matched)
+
+
+def detect_emergency(text: str) -> bool:
+    scores, _ = keyword_scores(text)
+    return scores["emergency"] >= 1.0
+
+
+def classify(text: str) -> Classification:
+    scores, matched = keyword_scores(text)
+
+    # Safety-critical path: a decisive emergency keyword never waits for a model.
+    if scores["emergency"] >= 1.0:
+        return Classification("emergency", 1.0, "keywords", matched)
+
+    total = sum(scores.values())
+    keyword_dist = None
+    if total:
+        top = max(scores.values())
+        keyword_dist = np.array([scores[c] / total for c in CATEGORIES]) * min(1.0, top)
+
+    model = get_model()
+    model_dist = model.predict_proba([text])[0] if model is not None else None
+
+    if keyword_dist is not None and model_dist is not None:
+        combined, source = (keyword_dist + model_dist) / 2, "keywords+model"
+    elif keyword_dist is not None:
+        combined, source = keyword_dist, "keywords"
+    elif model_dist is not None:
+        combined, source = model_dist, "model"
+    else:
+        return Classification("energy_advice", 0.0, "none", matched)
+
+    best = int(np.argmax(combined))
+    return Classification(CATEGORIES[best], float(combined[best]), source, matched)
@@ -0,0 +1,147 @@
+"""
+PowerPulse AI - Shared Client Registry
+Process-wide OpenAI, Twilio and HTTP clients with keep-alive connection pools,
+so each call reuses warm TLS connections instead of paying the handshake again.
+All three clients are safe to share between threads; the registry is reset in
+forked children (e.g. `run_workers`) so pools are never shared across processes.
+
+Twilio is called through the SDK client here when the dispatcher is off, and by
+the dispatcher's async client (core/dispatch.py) when it is on. Both are built
+from twilio_http_options(), so the base URL, credentials, timeout and pool size
+are set in one place.
+"""
+from __future__ import annotations
+import os
+import threading
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class ClientRegistry:
+
+    def __init__(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, factory):
+        client = self._clients.get(name)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(name)
+                if client is None:
+                    client = factory()
+                    self._clients[name] = client
+        return client
+
+    def reset(self):
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def close(self):
+        with self._lock:
+            for client in self._clients.values():
+                close = getattr(client, "close", None)
+                if callable(close):
+                    close()
+            self._clients = {}
+
+
+registry = ClientRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry.reset)
+
+
+def _pooled_adapter(max_retries=0) -> HTTPAdapter:
+    return HTTPAdapter(
+        pool_connections=settings.HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.HTTP_POOL_SIZE,
+        max_retries=max_retries,
+    )
+
+
+def _build_http_session() -> requests.Session:
+    session = requests.Session()
+    retry = Retry(total=2, backoff_factor=0.5, status_forcelist=(502, 503, 504), allowed_methods=("GET", "HEAD"))
+    session.mount("https://", _pooled_adapter(retry))
+    session.mount("http://", _pooled_adapter(retry))
+    return session
+
+
+def _build_openai_client():
+    import httpx
+    from openai import OpenAI
+
+    http_client = httpx.Client(
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_POOL_SIZE,
+            max_keepalive_connections=settings.HTTP_POOL_SIZE,
+        ),
+        timeout=settings.OPENAI_TIMEOUT,
+    )
+    return OpenAI(
+        api_key=settings.OPENAI_API_KEY,
+        max_retries=settings.OPENAI_MAX_RETRIES,
+        timeout=settings.OPENAI_TIMEOUT,
+        http_client=http_client,
+    )
+
+
+TWILIO_API_DEFAULT = "https://api.twilio.com"
+
+
+def twilio_http_options() -> dict:
+    """Base URL, credentials and timeout of every Twilio request."""
+    return {
+        "base_url": settings.TWILIO_API_BASE_URL.rstrip("/"),
+        "auth": (settings.TWILIO_ACCOUNT_SID or "", settings.TWILIO_AUTH_TOKEN or ""),
+        "timeout": settings.TWILIO_TIMEOUT,
+    }
+
+
+def build_twilio_async_client(max_connections: int | None = None):
+    """
+    The dispatcher's client. An httpx.AsyncClient belongs to the event loop it
+    is used on, so the dispatcher builds its own rather than share one here.
+    """
+    import httpx
+
+    size = max(max_connections or 0, settings.HTTP_POOL_SIZE)
+    return httpx.AsyncClient(
+        **twilio_http_options(),
+        limits=httpx.Limits(max_connections=size, max_keepalive_connections=size),
+    )
+
+
+def _build_twilio_client():
+    from twilio.http.http_client import TwilioHttpClient
+    from twilio.rest import Client
+
+    options = twilio_http_options()
+
+    class _HttpClient(TwilioHttpClient):
+        # The SDK always addresses api.twilio.com; send to TWILIO_API_BASE_URL like the dispatcher.
+        def request(self, method, url, *args, **kwargs):
+            if url.startswith(TWILIO_API_DEFAULT):
+                url = twilio_http_options()["base_url"] + url[len(TWILIO_API_DEFAULT):]
+            return super().request(method, url, *args, **kwargs)
+
+    http_client = _HttpClient(pool_connections=True, timeout=options["timeout"])
+    http_client.session.mount("https://", _pooled_adapter())
+    http_client.session.mount("http://", _pooled_adapter())
+    return Client(*options["auth"], http_client=http_client)
+
+
+def get_http_session() -> requests.Session:
+    return registry.get("http", _build_http_session)
+
+
+def get_openai_client():
+    return registry.get("openai", _build_openai_client)
+
+
+def get_twilio_client():
+    return registry.get("twilio", _build_twilio_client)
@@ -0,0 +1,360 @@
+"""
+PowerPulse AI - Meter Readings & Consumption Anomalies
+Interval readings are appended in bulk with executemany (duplicates ignored) and rolled up per
+consumer per day and per month as they arrive, so nothing downstream scans raw
+readings. EnergyConsumer.average_consumption follows the monthly rollups.
+
+The anomaly detector loads one window of daily rollups for every consumer as a
+single (consumers x days) matrix and scores it in one NumPy pass: each
+consumer's baseline is the mean of their previous CONSUMPTION_BASELINE_DAYS
+scaled by their own weekday profile (shrunk towards flat while there are few
+weeks), and a day is flagged when it is CONSUMPTION_ANOMALY_Z residual standard
+deviations and CONSUMPTION_ANOMALY_MIN_KWH away from it. Flagged days become
+ConsumptionAnomaly rows, optionally with a ServiceTicket each, and the flow
+gives the crew a short summary of the consumer's usage and recent anomalies.
+"""
+from __future__ import annotations
+import logging
+from dataclasses import dataclass
+from datetime import date, datetime, time as dt_time, timedelta
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Avg, Count, Max, Sum
+from django.db.models.constants import OnConflict
+from django.db.models.functions import TruncDate, TruncMonth
+from django.utils import timezone
+
+from core.models import ConsumptionAnomaly, ConsumptionRollup, EnergyConsumer, MeterReading, ServiceTicket
+from core.persistence import new_ticket_id
+from core.ticket_rollups import record_created
+
+logger = logging.getLogger(__name__)
+
+# Weeks of history at which a consumer's weekday profile gets half its weight.
+PROFILE_SHRINK = 2.0
+# Residual deviation never counts as smaller than this share of the level, or this many kWh.
+STD_FLOOR_SHARE = 0.1
+STD_FLOOR_KWH = 0.25
+# SQLite limits the number of parameters per query.
+_ID_CHUNK = 500
+
+
+# -- ingest ------------------------------------------------------------------------
+
+def ingest(readings, batch_size: int | None = None) -> dict:
+    """
+    Append (consumer_id, read_at, wh) readings in batches and refresh the day and
+    month rollups they fall into. Readings already stored are skipped, so a file
+    can safely be loaded twice.
+    """
+    batch_size = batch_size or settings.CONSUMPTION_INGEST_BATCH_SIZE
+    adapt = connection.ops.adapt_datetimefield_value
+    spans: dict[int, list] = {}
+    batch, rows, inserted = [], 0, 0
+    for consumer_id, read_at, wh in readings:
+        batch.append((consumer_id, adapt(read_at), wh))
+        span = spans.get(consumer_id)
+        if span is None:
+            spans[consumer_id] = [read_at, read_at]
+        elif read_at < span[0]:
+            span[0] = read_at
+        elif read_at > span[1]:
+            span[1] = read_at
+        if len(batch) >= batch_size:
+            inserted += _insert(batch)
+            rows += len(batch)
+            batch = []
+    if batch:
+        inserted += _insert(batch)
+        rows += len(batch)
+
+    days = refresh_rollups(spans)
+    return {"readings": rows, "inserted": inserted, "consumers": len(spans), "days": days}
+
+
+def _insert(rows: list[tuple]) -> int:
+    """
+    INSERT ... ON CONFLICT DO NOTHING through executemany. bulk_create would build
+    a model instance and prepare every value through its field, which costs more
+    than the write itself at millions of rows.
+    """
+    ops, quote = connection.ops, connection.ops.quote_name
+    fields = [MeterReading._meta.get_field(name) for name in ('consumer', 'read_at', 'wh')]
+    sql = (
+        f"{ops.insert_statement(on_conflict=OnConflict.IGNORE)} {quote(MeterReading._meta.db_table)} "
+        f"({', '.join(quote(field.column) for field in fields)}) VALUES (%s, %s, %s) "
+        f"{ops.on_conflict_suffix_sql(fields, OnConflict.IGNORE, None, None)}"
+    )
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.executemany(sql, rows)
+        return max(cursor.rowcount, 0)
+
+
+def _day(value: datetime) -> date:
+    return timezone.localtime(value).date() if timezone.is_aware(value) else value.date()
+
+
+def _midnight(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, dt_time.min))
+
+
+def refresh_rollups(spans: dict) -> int:
+    """Recompute the day and month rollups covering consumer_id -> [first, last] reading times; returns day rows written."""
+    written = 0
+    consumer_ids = sorted(spans)
+    for start in range(0, len(consumer_ids), _ID_CHUNK):
+        chunk = consumer_ids[start:start + _ID_CHUNK]
+        first = min(_day(spans[consumer_id][0]) for consumer_id in chunk)
+        last = max(_day(spans[consumer_id][1]) for consumer_id in chunk)
+        with transaction.atomic():
+            written += _refresh_days(chunk, first, last)
+            _refresh_months(chunk, first, last)
+            _refresh_averages(chunk)
+    return written
+
+
+def _upsert(rollups: list[ConsumptionRollup]):
+    ConsumptionRollup.objects.bulk_create(
+        rollups,
+        update_conflicts=True,
+        unique_fields=['consumer', 'period', 'period_start'],
+        update_fields=['kwh', 'readings', 'peak_wh'],
+    )
+
+
+def _refresh_days(consumer_ids: list[int], first: date, last: date) -> int:
+    rows = (
+        MeterReading.objects
+        .filter(consumer_id__in=consumer_ids, read_at__gte=_midnight(first), read_at__lt=_midnight(last + timedelta(days=1)))
+        .annotate(day=TruncDate('read_at'))
+        .values('consumer_id', 'day')
+        .annotate(total=Sum('wh'), count=Count('id'), peak=Max('wh'))
+    )
+    rollups = [
+        ConsumptionRollup(consumer_id=row['consumer_id'], period='day', period_start=row['day'],
+                          kwh=row['total'] / 1000, readings=row['count'], peak_wh=row['peak'])
+        for row in rows
+    ]
+    _upsert(rollups)
+    return len(rollups)
+
+
+def _refresh_months(consumer_ids: list[int], first: date, last: date):
+    # Whole months: days outside [first, last] may already be stored from earlier files.
+    after = (last.replace(day=28) + timedelta(days=4)).replace(day=1)
+    rows = (
+        ConsumptionRollup.objects
+        .filter(consumer_id__in=consumer_ids, period='day', period_start__gte=first.replace(day=1), period_start__lt=after)
+        .annotate(month=TruncMonth('period_start'))
+        .values('consumer_id', 'month')
+        .annotate(kwh=Sum('kwh'), count=Sum('readings'), peak=Max('peak_wh'))
+    )
+    _upsert([
+        ConsumptionRollup(consumer_id=row['consumer_id'], period='month', period_start=row['month'],
+                          kwh=row['kwh'], readings=row['count'], peak_wh=row['peak'])
+        for row in rows
+    ])
+
+
+def _refresh_averages(consumer_ids: list[int]):
+    """average_consumption is the mean of the last twelve complete months."""
+    this_month = timezone.localdate().replace(day=1)
+    averages = (
+        ConsumptionRollup.objects
+        .filter(consumer_id__in=consumer_ids, period='month', period_start__lt=this_month,
+                period_start__gte=(this_month - timedelta(days=365)).replace(day=1))
+        .values('consumer_id')
+        .annotate(average=Avg('kwh'))
+    )
+    EnergyConsumer.objects.bulk_update(
+        [EnergyConsumer(id=row['consumer_id'], average_consumption=round(row['average'], 1)) for row in averages],
+        ['average_consumption'],
+    )
+
+
+# -- detection ---------------------------------------------------------------------
+
+@dataclass
+class Scores:
+    consumer_ids: np.ndarray    # (n,)
+    days: list                  # the d scored days
+    kwh: np.ndarray             # (n, d); nan where the day has no rollup
+    expected: np.ndarray        # (n, d)
+    z: np.ndarray               # (n, d); nan without enough history
+    flagged: np.ndarray         # (n, d) bool
+
+
+def daily_matrix(first: date, last: date, consumer_ids=None) -> tuple[np.ndarray, np.ndarray]:
+    """Consumer ids and a (consumers x days) kWh matrix from the day rollups, nan where a day is missing."""
+    rollups = ConsumptionRollup.objects.filter(period='day', period_start__gte=first, period_start__lte=last)
+    if consumer_ids is not None:
+        rollups = rollups.filter(consumer_id__in=consumer_ids)
+    rows = list(rollups.values_list('consumer_id', 'period_start', 'kwh').iterator(chunk_size=20000))
+    width = (last - first).days + 1
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.full((0, width), np.nan)
+    ids, days, kwh = zip(*rows)
+    consumers, row_index = np.unique(np.asarray(ids, dtype=np.int64), return_inverse=True)
+    columns = np.fromiter((day.toordinal() for day in days), dtype=np.int64, count=len(days)) - first.toordinal()
+    matrix = np.full((len(consumers), width), np.nan)
+    matrix[row_index, columns] = kwh
+    return consumers, matrix
+
+
+def score(matrix: np.ndarray, first_weekday: int, window: int, min_days: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Expected kWh and z-scores for every column after the first `window` of
+    `matrix`, each against the `window` days before it. `first_weekday` is the
+    weekday (Monday 0) of column 0.
+    """
+    scored = matrix.shape[1] - window
+    history = sliding_window_view(matrix, window, axis=1)[:, :scored]            # (n, d, window)
+    targets = matrix[:, window:]                                                   # (n, d)
+
+    weekday = (first_weekday + np.arange(scored)[:, None] + np.arange(window)) % 7  # (d, window)
+    onehot = np.eye(7)[weekday]                                                    # (d, window, 7)
+    target_onehot = np.eye(7)[(first_weekday + window + np.arange(scored)) % 7]   # (d, 7)
+
+    valid = ~np.isnan(history)
+    values = np.where(valid, history, 0.0)
+    count = valid.sum(axis=2)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        level = values.sum(axis=2) / count
+        per_weekday = np.einsum('ndw,dwk->ndk', values, onehot)
+        seen = np.einsum('ndw,dwk->ndk', valid.astype(float), onehot)
+        raw = per_weekday / seen / level[..., None]
+        weight = seen / (seen + PROFILE_SHRINK)
+        profile = 1.0 + (np.nan_to_num(raw, nan=1.0, posinf=1.0) - 1.0) * weight
+
+        baseline = level[..., None] * np.einsum('ndk,dwk->ndw', profile, onehot)
+        residual = np.where(valid, history - baseline, 0.0)
+        # The level and the (shrunk) weekday profile were fitted to these same days.
+        freedom = np.maximum(count - 1 - weight.sum(axis=2), 1.0)
+        std = np.sqrt((residual ** 2).sum(axis=2) / freedom)
+        std = np.maximum(std, np.maximum(STD_FLOOR_SHARE * level, STD_FLOOR_KWH))
+
+        expected = level * np.einsum('ndk,dk->nd', profile, target_onehot)
+        z = (targets - expected) / std
+    z[count < min_days] = np.nan
+    return expected, z
+
+
+def score_days(last: date, days: int = 1, consumer_ids=None, window: int | None = None,
+               min_days: int | None = None, threshold: float | None = None, min_kwh: float | None = None) -> Scores:
+    window = window or settings.CONSUMPTION_BASELINE_DAYS
+    first = last - timedelta(days=window + days - 1)
+    ids, matrix = daily_matrix(first, last, consumer_ids)
+    expected, z = score(matrix, first.weekday(), window, min_days or settings.CONSUMPTION_MIN_HISTORY_DAYS)
+    kwh = matrix[:, window:]
+    threshold = threshold or settings.CONSUMPTION_ANOMALY_Z
+    min_kwh = settings.CONSUMPTION_ANOMALY_MIN_KWH if min_kwh is None else min_kwh
+    with np.errstate(invalid='ignore'):
+        flagged = (np.abs(z) >= threshold) & (np.abs(kwh - expected) >= min_kwh)
+    return Scores(ids, [first + timedelta(days=window + i) for i in range(days)], kwh, expected, z, flagged)
+
+
+def detect_anomalies(last: date | None = None, days: int = 1, create_tickets: bool | None = None,
+                     dry_run: bool = False, **thresholds) -> dict:
+    """
+    Score every consumer for the `days` days ending `last` (default yesterday)
+    and store the flagged days. With `create_tickets`, each anomaly that has no
+    ticket yet gets an open technical_fault ticket.
+    """
+    last = last or timezone.localdate() - timedelta(days=1)
+    scores = score_days(last, days, **thresholds)
+    rows, columns = np.nonzero(scores.flagged)
+    anomalies = [
+        ConsumptionAnomaly(
+            consumer_id=int(scores.consumer_ids[row]),
+            day=scores.days[column],
+            kind='spike' if scores.z[row, column] > 0 else 'drop',
+            kwh=round(float(scores.kwh[row, column]), 2),
+            expected_kwh=round(float(scores.expected[row, column]), 2),
+            zscore=round(float(scores.z[row, column]), 2),
+        )
+        for row, column in zip(rows, columns)
+    ]
+    report = {
+        "consumers": len(scores.consumer_ids),
+        "days": days,
+        "scored": int(np.count_nonzero(~np.isnan(scores.z))),
+        "anomalies": len(anomalies),
+        "spikes": sum(anomaly.kind == 'spike' for anomaly in anomalies),
+        "tickets": 0,
+    }
+    if dry_run or not anomalies:
+        report["sample"] = anomalies[:10]
+        return report
+
+    with transaction.atomic():
+        ConsumptionAnomaly.objects.bulk_create(
+            anomalies,
+            update_conflicts=True,
+            unique_fields=['consumer', 'day'],
+            update_fields=['kind', 'kwh', 'expected_kwh', 'zscore', 'detected_at'],
+        )
+        if settings.CONSUMPTION_ANOMALY_TICKETS if create_tickets is None else create_tickets:
+            report["tickets"] = _open_tickets(scores.days[0], scores.days[-1])
+    report["sample"] = anomalies[:10]
+    return report
+
+
+def describe(anomaly: ConsumptionAnomaly) -> str:
+    ratio = anomaly.kwh / anomaly.expected_kwh if anomaly.expected_kwh > 0 else float('inf')
+    size = f"{ratio:.1f}x" if anomaly.kind == 'spike' else f"{ratio:.0%} of"
+    return (f"{anomaly.day:%d %b}: {anomaly.kwh:.1f} kWh, {size} the usual "
+            f"{anomaly.expected_kwh:.1f} kWh for that day")
+
+
+def _open_tickets(first: date, last: date) -> int:
+    anomalies = list(ConsumptionAnomaly.objects.filter(day__gte=first, day__lte=last, ticket__isnull=True))
+    tickets = ServiceTicket.objects.bulk_create([
+        ServiceTicket(
+            consumer_id=anomaly.consumer_id,
+            ticket_id=new_ticket_id(),
+            issue_description=f"Consumption {anomaly.kind} detected from meter readings. {describe(anomaly)}.",
+            category='technical_fault',
+            urgency='low',
+            status='open',
+        )
+        for anomaly in anomalies
+    ])
+    record_created(tickets)
+    for anomaly, ticket in zip(anomalies, tickets):
+        anomaly.ticket = ticket
+    ConsumptionAnomaly.objects.bulk_update(anomalies, ['ticket'])
+    return len(tickets)
+
+
+# -- flow context ------------------------------------------------------------------
+
+def usage_context(phone_number: str) -> str:
+    """Recent usage and anomalies for the consumer behind `phone_number`, for a prompt; '' without readings."""
+    consumer = (
+        EnergyConsumer.objects.filter(phone_number=phone_number)
+        .values('id', 'meter_number', 'average_consumption').first()
+    )
+    if consumer is None:
+        return ""
+    months = list(
+        ConsumptionRollup.objects.filter(consumer_id=consumer['id'], period='month')
+        .order_by('-period_start').values_list('period_start', 'kwh')[:2]
+    )
+    if not months:
+        return ""
+
+    parts = [f"Meter {consumer['meter_number'] or 'on file'}: {months[0][1]:.0f} kWh in {months[0][0]:%B %Y}"
+             + (" so far" if months[0][0] == timezone.localdate().replace(day=1) else "")]
+    if len(months) > 1:
+        parts.append(f"{months[1][1]:.0f} kWh in {months[1][0]:%B %Y}")
+    if consumer['average_consumption']:
+        parts.append(f"usual month {consumer['average_consumption']:.0f} kWh")
+    text = ", ".join(parts) + "."
+
+    since = timezone.localdate() - timedelta(days=settings.CONSUMPTION_CONTEXT_DAYS)
+    anomalies = ConsumptionAnomaly.objects.filter(consumer_id=consumer['id'], day__gte=since).order_by('-day')[:3]
+    unusual = "; ".join(describe(anomaly) for anomaly in anomalies)
+    return f"{text} Unusual days: {unusual}." if unusual else text
@@ -0,0 +1,217 @@
+"""
+PowerPulse AI - Conversation Memory
+Per-number sessions: a compact rolling summary plus the last few exchanges, so
+a follow-up ("it's still sparking") is answered in context instead of from
+scratch. Sessions are held in a bounded LRU in front of the ConversationSession
+table; a cached session is re-read after CONVERSATION_CACHE_TTL seconds so
+workers in other processes see each other's turns. Exchanges that fall out of
+the window are folded into the summary as one clipped line each (no LLM call),
+and the summary itself is capped, so the context added to a prompt stays small.
+"""
+from __future__ import annotations
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+
+from core.classifier import Classification
+
+logger = logging.getLogger(__name__)
+
+# Categories whose answers a follow-up can continue; emergencies are always re-checked.
+CONTINUABLE_CATEGORIES = ("energy_advice", "technical_fault")
+
+_REF_PREFIX = re.compile(r"^\*Ref ID: [^*]*\*\s*")
+_MARKUP = re.compile(r"[*_~`]+")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s")
+
+
+def clip(text: str, limit: int) -> str:
+    """Single-line `text`, cut at a word boundary to at most `limit` characters."""
+    text = " ".join(_MARKUP.sub("", text or "").split())
+    if len(text) <= limit:
+        return text
+    cut = text[:limit - 1].rsplit(" ", 1)[0]
+    return f"{cut}…"
+
+
+def first_sentence(text: str, limit: int) -> str:
+    text = " ".join(_MARKUP.sub("", _REF_PREFIX.sub("", text or "")).split())
+    return clip(_SENTENCE_END.split(text, 1)[0], limit)
+
+
+@dataclass
+class Session:
+    phone_number: str
+    summary: str = ""
+    turns: list = field(default_factory=list)
+    last_category: str = ""
+    last_ticket_id: str = ""
+    updated_at: float = 0.0
+    loaded_at: float = field(default=0.0, repr=False)
+
+    def is_active(self, window: float, now: float | None = None) -> bool:
+        """True while the last exchange is recent enough for a new message to be a follow-up."""
+        return bool(self.turns) and (now or time.time()) - self.updated_at <= window
+
+    def context(self) -> str:
+        """The conversation so far, compact enough to prepend to a prompt; '' for a new conversation."""
+        lines = [f"Earlier: {self.summary}"] if self.summary else []
+        for turn in self.turns:
+            lines.append(f"User: {turn['q']}")
+            lines.append(f"PowerPulse ({turn['c']}, {turn['t'] or 'no ref'}): {turn['a']}")
+        return "\n".join(lines)
+
+
+class ConversationStore:
+
+    def __init__(self, max_entries: int, cache_ttl: float, max_turns: int, summary_chars: int,
+                 follow_up_window: float, follow_up_max_words: int, idle_reset: float):
+        self.max_entries = max_entries
+        self.cache_ttl = cache_ttl
+        self.max_turns = max_turns
+        self.summary_chars = summary_chars
+        self.follow_up_window = follow_up_window
+        self.follow_up_max_words = follow_up_max_words
+        self.idle_reset = idle_reset
+
+        self._sessions: OrderedDict[str, Session] = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = dict.fromkeys(("hits", "loads", "resets", "evictions", "turns", "follow_ups", "write_errors"), 0)
+
+    def _cached(self, phone_number: str, now: float) -> Session | None:
+        with self._lock:
+            session = self._sessions.get(phone_number)
+            if session is None or now - session.loaded_at > self.cache_ttl:
+                return None
+            self._sessions.move_to_end(phone_number)
+            self.metrics["hits"] += 1
+            return session
+
+    def _remember(self, session: Session):
+        with self._lock:
+            self._sessions[session.phone_number] = session
+            self._sessions.move_to_end(session.phone_number)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+                self.metrics["evictions"] += 1
+
+    def _load(self, phone_number: str) -> Session:
+        from core.models import ConversationSession
+
+        row = (
+            ConversationSession.objects.filter(phone_number=phone_number)
+            .values('summary', 'turns', 'last_category', 'last_ticket_id', 'updated_at')
+            .first()
+        )
+        self.metrics["loads"] += 1
+        session = Session(phone_number, loaded_at=time.monotonic())
+        if row is None:
+            return session
+        updated_at = row['updated_at'].timestamp()
+        if time.time() - updated_at > self.idle_reset:
+            # Long idle: whatever the user asks now starts a new conversation.
+            self.metrics["resets"] += 1
+            return session
+        session.summary = row['summary']
+        session.turns = list(row['turns'] or [])[-self.max_turns:]
+        session.last_category = row['last_category']
+        session.last_ticket_id = row['last_ticket_id']
+        session.updated_at = updated_at
+        return session
+
+    def get(self, phone_number: str) -> Session:
+        """The session for a number (blocking: may read the database)."""
+        session = self._cached(phone_number, time.monotonic())
+        if session is None:
+            session = self._load(phone_number)
+            self._remember(session)
+        return session
+
+    def follow_up_category(self, session: Session, text: str, fast: Classification) -> str | None:
+        """
+        The previous category when `text` continues the active conversation on
+        the same topic, so the classifier LLM can be skipped: the local
+        classifier leans the same way, or the message is too short to carry a
+        topic of its own ("still the same", "what about at night?").
+        """
+        if session.last_category not in CONTINUABLE_CATEGORIES or not session.is_active(self.follow_up_window):
+            return None
+        if fast.category == "emergency":
+            return None
+        if fast.category == session.last_category or len(text.split()) <= self.follow_up_max_words:
+            self.metrics["follow_ups"] += 1
+            return session.last_category
+        return None
+
+    def record_turn(self, phone_number: str, query: str, answer: str, category: str, ticket_id: str | None = None):
+        """Append one exchange and write the session through to the database (blocking)."""
+        from core.models import ConversationSession
+
+        now = time.time()
+        session = self.get(phone_number)
+        with self._lock:
+            session.turns.append({
+                "q": clip(query, 160),
+                "a": clip(_REF_PREFIX.sub("", answer or ""), 200),
+                "c": category,
+                "t": ticket_id or "",
+            })
+            summary_lines = [line for line in session.summary.split(" | ") if line]
+            while len(session.turns) > self.max_turns:
+                # Oldest exchange leaves the window: keep one clipped line of it.
+                old = session.turns.pop(0)
+                summary_lines.append(f"{old['c']}: {clip(old['q'], 80)} → {first_sentence(old['a'], 80)}")
+            while summary_lines and len(" | ".join(summary_lines)) > self.summary_chars:
+                summary_lines.pop(0)
+            session.summary = " | ".join(summary_lines)
+            session.last_category = category
+            session.last_ticket_id = ticket_id or ""
+            session.updated_at = now
+            row = ConversationSession(
+                phone_number=phone_number,
+                summary=session.summary,
+                turns=list(session.turns),
+                last_category=category,
+                last_ticket_id=session.last_ticket_id,
+                updated_at=datetime.fromtimestamp(now, tz=dt_timezone.utc),
+            )
+            self.metrics["turns"] += 1
+
+        try:
+            # One upsert statement: no read-then-write, so concurrent writers cannot deadlock on SQLite.
+            ConversationSession.objects.bulk_create(
+                [row],
+                update_conflicts=True,
+                unique_fields=['phone_number'],
+                update_fields=['summary', 'turns', 'last_category', 'last_ticket_id', 'updated_at'],
+            )
+        except Exception as e:
+            self.metrics["write_errors"] += 1
+            logger.warning(f"Could not save conversation for {phone_number}: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            cached = len(self._sessions)
+        lookups = self.metrics["hits"] + self.metrics["loads"]
+        return {
+            **self.metrics,
+            "cached_sessions": cached,
+            "hit_rate": round(self.metrics["hits"] / lookups, 3) if lookups else 0.0,
+        }
+
+
+conversations = ConversationStore(
+    max_entries=settings.CONVERSATION_CACHE_SIZE,
+    cache_ttl=settings.CONVERSATION_CACHE_TTL,
+    max_turns=settings.CONVERSATION_MAX_TURNS,
+    summary_chars=settings.CONVERSATION_SUMMARY_CHARS,
+    follow_up_window=settings.CONVERSATION_FOLLOW_UP_WINDOW,
+    follow_up_max_words=settings.CONVERSATION_FOLLOW_UP_MAX_WORDS,
+    idle_reset=timedelta(hours=settings.CONVERSATION_IDLE_RESET_HOURS).total_seconds(),
+)
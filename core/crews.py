@@ -1,62 +1,201 @@
+"""
+PowerPulse AI - Crew Factory
+agents.yaml / tasks.yaml are parsed and validated once into immutable templates
+(and re-parsed only when the files change on disk). Those templates are the
+only thing kept between requests: every kickoff gets a Crew freshly built from
+them (a few milliseconds, next to seconds of LLM time), so no Agent or Task
+state from an earlier run can leak into the next one and nothing here depends
+on how CrewAI tracks execution state internally. crewai is pinned in
+requirements.txt; re-run `python -m benchmarks.bench_crew_factory` and the test
+suite when bumping it.
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from types import MappingProxyType
+
+import yaml
 from crewai import Agent, Crew, Process, Task
-from crewai.project import CrewBase, agent, crew, task
-from core.main_llm import basic_llm 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from core.main_llm import basic_llm
 from .tools.dalle_tool import energy_visual_tool
+from .tools.kb_tool import knowledge_base_tool
 
-@CrewBase
-class PowerPulseCrew():
-    agents_config = 'config/agents.yaml'
-    tasks_config = 'config/tasks.yaml'
+logger = logging.getLogger(__name__)
+# Agent steps, sampled per flow by CREW_TRACE_SAMPLE_RATE (see LOGGING).
+trace_logger = logging.getLogger('core.crew_trace')
 
+CONFIG_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config')
 
-    @agent
-    def energy_planner(self) -> Agent:
-        return Agent(config=self.agents_config['energy_planner'], llm=basic_llm, verbose=True)
+TASK_ORDER = ("planning_task", "consultation_task", "technical_diagnosis_task")
 
-    @agent
-    def energy_advisor(self) -> Agent:
-        return Agent(
-            config=self.agents_config['energy_advisor'], 
-            llm=basic_llm, 
-            tools=[energy_visual_tool],
-            verbose=True
-        )
+# Routed mode: category -> (single text task, DALL-E prompt generated alongside it).
+ROUTED_TASKS = MappingProxyType({
+    "energy_advice": ("consultation_brief_task", "Energy-efficient home setup illustrating: {user_query}"),
+    "technical_fault": ("diagnosis_brief_task", "Electrical safety poster and troubleshooting schematic for: {user_query}"),
+})
+
+# Code-level agent options that do not belong in YAML (tools are Python objects).
+AGENT_OPTIONS = MappingProxyType({
+    "energy_planner": MappingProxyType({}),
+    "energy_advisor": MappingProxyType({"tools": (energy_visual_tool, knowledge_base_tool)}),
+    "technical_specialist": MappingProxyType({"tools": (energy_visual_tool, knowledge_base_tool), "allow_delegation": False}),
+})
+
+AGENT_FIELDS = ("role", "goal", "backstory")
+TASK_FIELDS = ("description", "expected_output", "agent")
+
+
+@dataclass(frozen=True)
+class AgentTemplate:
+    name: str
+    role: str
+    goal: str
+    backstory: str
+
+
+@dataclass(frozen=True)
+class TaskTemplate:
+    name: str
+    description: str
+    expected_output: str
+    agent: str
+
+
+@dataclass(frozen=True)
+class CrewTemplates:
+    version: tuple
+    agents: MappingProxyType
+    tasks: MappingProxyType
+
+
+def _read_yaml(path):
+    with open(path, encoding='utf-8') as f:
+        data = yaml.safe_load(f) or {}
+    if not isinstance(data, dict):
+        raise ImproperlyConfigured(f"{path} must contain a mapping at the top level")
+    return data
+
+
+def _require(section: str, name: str, entry, fields):
+    if not isinstance(entry, dict):
+        raise ImproperlyConfigured(f"{section}.{name} must be a mapping")
+    missing = [f for f in fields if not str(entry.get(f) or '').strip()]
+    if missing:
+        raise ImproperlyConfigured(f"{section}.{name} is missing: {', '.join(missing)}")
 
-    @agent
-    def technical_specialist(self) -> Agent:
-        return Agent(
-            config=self.agents_config['technical_specialist'],
-            llm=basic_llm,
-            tools=[energy_visual_tool], 
-            verbose=True,
-            allow_delegation=False
+
+def load_templates(agents_path: str, tasks_path: str) -> CrewTemplates:
+    version = (os.stat(agents_path).st_mtime_ns, os.stat(tasks_path).st_mtime_ns)
+    agents_config = _read_yaml(agents_path)
+    tasks_config = _read_yaml(tasks_path)
+
+    agents = {}
+    for name, entry in agents_config.items():
+        _require("agents", name, entry, AGENT_FIELDS)
+        if name not in AGENT_OPTIONS:
+            raise ImproperlyConfigured(f"agents.{name} has no entry in core.crews.AGENT_OPTIONS")
+        agents[name] = AgentTemplate(name, *(entry[f].strip() for f in AGENT_FIELDS))
+
+    tasks = {}
+    for name, entry in tasks_config.items():
+        _require("tasks", name, entry, TASK_FIELDS)
+        if entry["agent"] not in agents:
+            raise ImproperlyConfigured(f"tasks.{name} refers to unknown agent '{entry['agent']}'")
+        tasks[name] = TaskTemplate(name, *(entry[f].strip() for f in TASK_FIELDS))
+
+    required = TASK_ORDER + tuple(task_name for task_name, _ in ROUTED_TASKS.values())
+    missing_tasks = [name for name in required if name not in tasks]
+    if missing_tasks:
+        raise ImproperlyConfigured(f"tasks.yaml is missing: {', '.join(missing_tasks)}")
+
+    return CrewTemplates(version, MappingProxyType(agents), MappingProxyType(tasks))
+
+
+class CrewFactory:
+
+    def __init__(self, config_dir: str = CONFIG_DIR):
+        self.agents_path = os.path.join(config_dir, 'agents.yaml')
+        self.tasks_path = os.path.join(config_dir, 'tasks.yaml')
+        self._lock = threading.Lock()
+        self._templates = load_templates(self.agents_path, self.tasks_path)
+
+    def templates(self) -> CrewTemplates:
+        """Current templates, re-parsed if either YAML file changed since the last load."""
+        try:
+            version = (os.stat(self.agents_path).st_mtime_ns, os.stat(self.tasks_path).st_mtime_ns)
+        except OSError:
+            return self._templates
+        if version != self._templates.version:
+            with self._lock:
+                if version != self._templates.version:
+                    try:
+                        self._templates = load_templates(self.agents_path, self.tasks_path)
+                        logger.info("Crew configuration reloaded from YAML")
+                    except (ImproperlyConfigured, yaml.YAMLError) as e:
+                        logger.error(f"Invalid crew configuration, keeping previous version: {e}")
+        return self._templates
+
+    def build(self, task_names=TASK_ORDER, templates: CrewTemplates | None = None, tools: bool = True) -> Crew:
+        templates = templates or self.templates()
+        task_templates = [templates.tasks[name] for name in task_names]
+
+        agents = {}
+        for task_template in task_templates:
+            if task_template.agent not in agents:
+                template = templates.agents[task_template.agent]
+                options = {k: v for k, v in AGENT_OPTIONS[template.name].items() if tools or k != "tools"}
+                agents[template.name] = Agent(
+                    role=template.role,
+                    goal=template.goal,
+                    backstory=template.backstory,
+                    llm=basic_llm,
+                    verbose=settings.CREW_VERBOSE,
+                    **{key: list(value) if isinstance(value, tuple) else value for key, value in options.items()},
+                )
+
+        tasks = [
+            Task(
+                name=t.name,
+                description=t.description,
+                expected_output=t.expected_output,
+                agent=agents[t.agent],
+            )
+            for t in task_templates
+        ]
+        return Crew(
+            agents=list(agents.values()), tasks=tasks, process=Process.sequential, verbose=settings.CREW_VERBOSE,
+            step_callback=log_step if settings.CREW_TRACE_SAMPLE_RATE > 0 else None,
         )
 
+    @contextmanager
+    def acquire(self, task_names=TASK_ORDER, tools: bool = True):
+        """A crew for one kickoff, built from the current templates and dropped afterwards."""
+        yield self.build(task_names, self.templates(), tools)
 
 
-    @task
-    def planning_task(self) -> Task:
-        return Task(config=self.tasks_config['planning_task'])
+def log_step(step):
+    """Crew step_callback: one record per agent step (thought, tool call or answer), for the sampled flows."""
+    if not trace_logger.isEnabledFor(logging.INFO):
+        return
+    tool = getattr(step, 'tool', None)
+    text = getattr(step, 'text', None) or getattr(step, 'output', None) or getattr(step, 'result', None) or ''
+    trace_logger.info(
+        f"Agent step: {type(step).__name__}{f' ({tool})' if tool else ''}",
+        extra={"step": type(step).__name__, "tool": tool, "text": str(text)[:2000]},
+    )
 
-    @task
-    def consultation_task(self) -> Task:
-        return Task(config=self.tasks_config['consultation_task'])
 
-    @task
-    def technical_diagnosis_task(self) -> Task:
-        return Task(config=self.tasks_config['technical_diagnosis_task'])
+crew_factory = CrewFactory()
 
 
+class PowerPulseCrew():
+    """Compatibility wrapper for the old `PowerPulseCrew().crew()` entry point."""
 
-    @crew
     def crew(self) -> Crew:
-        return Crew(
-            agents=self.agents,
-            tasks=[
-                self.planning_task(), 
-                self.consultation_task(), 
-                self.technical_diagnosis_task()
-            ], 
-            process=Process.sequential,
-            verbose=True
-        )
\ No newline at end of file
+        return crew_factory.build()
@@ -0,0 +1,395 @@
+"""
+PowerPulse AI - Outbound WhatsApp Dispatcher
+Every outbound message goes through one scheduler running on its own event
+loop. A token bucket per sender number keeps us under Twilio's per-sender
+throughput; sends run concurrently up to WHATSAPP_SEND_CONCURRENCY while
+messages to the same recipient keep their order; 429 and 5xx answers (and
+connection errors) are retried with exponential backoff, honouring
+Retry-After, and a 429 also pauses that sender's bucket.
+
+Twilio's Messages API does not deduplicate requests, so a POST whose answer
+was lost (a read timeout, a dropped connection, a gateway 5xx) may have been
+sent all the same. Before such a message is sent again, Twilio's message list
+for the recipient is searched for it, and if it is there its SID is used
+instead. A message submitted with a key this process has already queued or
+sent resolves to the original SID instead of going out twice; the keys are
+kept in memory, per process. SIDs are written back to
+GeneratedEnergyContent.whatsapp_sid in batches.
+"""
+from __future__ import annotations
+import asyncio
+import atexit
+import logging
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from email.utils import parsedate_to_datetime
+
+from django.conf import settings
+
+from core.clients import build_twilio_async_client
+from core.persistence import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS = frozenset({429, 500, 502, 503, 504})
+# Errors after which Twilio may have created the message anyway.
+AMBIGUOUS_STATUS = frozenset({500, 502, 504})
+# How far Twilio's date_created may lag our clock when looking for a message.
+LOOKUP_CLOCK_SKEW = 30.0
+
+
+class SendError(Exception):
+
+    def __init__(self, message: str, status: int | None = None, code=None, retry_after: float | None = None,
+                 reached_server: bool = True):
+        super().__init__(message)
+        self.status = status
+        self.code = code
+        self.retry_after = retry_after
+        self.reached_server = reached_server
+
+    @property
+    def retryable(self) -> bool:
+        # No status: the request never got an answer (timeout, connection reset).
+        return self.status is None or self.status in RETRYABLE_STATUS
+
+    @property
+    def ambiguous(self) -> bool:
+        """The request went out but no clear answer came back, so the message may have been sent."""
+        return self.reached_server and (self.status is None or self.status in AMBIGUOUS_STATUS)
+
+
+class TokenBucket:
+    """`rate` sends per second with bursts of up to `burst`; used from the dispatcher loop only."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            if now < self.paused_until:
+                await asyncio.sleep(self.paused_until - now)
+                continue
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def pause(self, seconds: float):
+        """Twilio said slow down: nothing leaves this sender for `seconds`, then the bucket starts empty."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self.updated = self.paused_until
+
+
+@dataclass
+class OutboundMessage:
+    to: str
+    body: str
+    media_url: str | None
+    from_: str
+    key: str | None
+    future: Future = field(default_factory=Future)
+    attempts: int = 0
+    queued_at: float = field(default_factory=time.monotonic)
+    # Wall-clock time of the first POST that may have gone through (see SendError.ambiguous).
+    unconfirmed_since: float | None = None
+
+
+def _write_sids(items: list) -> list:
+    from core.models import GeneratedEnergyContent
+
+    GeneratedEnergyContent.objects.bulk_update(
+        [GeneratedEnergyContent(id=content_id, whatsapp_sid=sid) for content_id, sid in items],
+        ['whatsapp_sid'],
+    )
+    return [sid for _, sid in items]
+
+
+def _write_sid(item) -> str:
+    from core.models import GeneratedEnergyContent
+
+    content_id, sid = item
+    GeneratedEnergyContent.objects.filter(id=content_id).update(whatsapp_sid=sid)
+    return sid
+
+
+class OutboundDispatcher:
+
+    def __init__(self, rate: float, burst: int, concurrency: int, max_attempts: int,
+                 backoff: float, backoff_max: float, idempotency_size: int = 10000):
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.idempotency_size = idempotency_size
+
+        self._lock = threading.Lock()
+        self._started = threading.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._pid = None
+        self._client = None
+        self._slots: asyncio.Semaphore | None = None
+        self._buckets: dict[str, TokenBucket] = {}
+        self._recipients: dict[str, list] = {}
+        self._keys: OrderedDict[str, Future] = OrderedDict()
+
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.retries = 0
+        self.throttled = 0
+        self.deduplicated = 0
+        self.recovered = 0
+        self.in_flight = 0
+        self.sid_writer = WriteBehindBuffer(
+            commit_batch=_write_sids, commit_one=_write_sid, batch_size=200, linger=0.05, name="sid-writer",
+        )
+
+    # -- lifecycle ------------------------------------------------------------
+
+    def start(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # A forked child (run_workers) gets its own loop and connection pool.
+            self._pid = os.getpid()
+            self._started.clear()
+            self._thread = threading.Thread(target=self._run_loop, name="powerpulse-dispatch", daemon=True)
+            self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # Configured with the SDK client's settings (core/clients.py).
+        self._client = build_twilio_async_client(self.concurrency)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._buckets = {}
+        self._recipients = {}
+        self._loop = loop
+        self._started.set()
+        logger.info(f"Dispatcher started: {self.rate}/s per sender (burst {self.burst}), {self.concurrency} concurrent sends")
+        loop.run_forever()
+
+    # -- submission (any thread) ------------------------------------------------
+
+    def submit(self, to: str, body: str = "", media_url: str | None = None, key: str | None = None,
+               from_: str | None = None) -> Future:
+        """Queue one message; the future resolves to its SID, or None once it has finally failed."""
+        from_ = from_ or settings.TWILIO_WHATSAPP_NUMBER
+        message = OutboundMessage(_whatsapp(to), body, media_url, _whatsapp(from_), key)
+        if key is not None:
+            with self._lock:
+                existing = self._keys.get(key)
+                if existing is not None and not (existing.done() and existing.result() is None):
+                    self.deduplicated += 1
+                    return existing
+                self._keys[key] = message.future
+                self._keys.move_to_end(key)
+                while len(self._keys) > self.idempotency_size:
+                    self._keys.popitem(last=False)
+        self.start()
+        with self._lock:
+            self.submitted += 1
+        self._loop.call_soon_threadsafe(self._loop.create_task, self._deliver(message))
+        return message.future
+
+    def send(self, to: str, body: str = "", media_url: str | None = None, key: str | None = None,
+             from_: str | None = None) -> str | None:
+        """submit() and wait for the outcome (callers already off the event loop: to_thread, workers)."""
+        return self.submit(to, body, media_url, key, from_).result()
+
+    def record_sid(self, content_ref, sid: str | None):
+        """Store `sid` on the content row; `content_ref` is its id or a write-behind Future of one."""
+        if not sid or content_ref is None:
+            return
+        if isinstance(content_ref, Future):
+            content_ref.add_done_callback(
+                lambda done: done.exception() is None and self.record_sid(done.result(), sid)
+            )
+            return
+        self.sid_writer.submit((content_ref, sid))
+
+    # -- dispatcher loop ------------------------------------------------------
+
+    def _bucket(self, sender: str) -> TokenBucket:
+        bucket = self._buckets.get(sender)
+        if bucket is None:
+            bucket = self._buckets[sender] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def _deliver(self, message: OutboundMessage):
+        # One lock per recipient, shared by everyone waiting on it; asyncio.Lock is FIFO,
+        # so a long reply split into several messages arrives in order.
+        entry = self._recipients.setdefault(message.to, [asyncio.Lock(), 0])
+        entry[1] += 1
+        sid = None
+        try:
+            async with entry[0]:
+                sid = await self._send_with_retries(message)
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"❌ Unexpected Error during WhatsApp dispatch to {message.to}: {e}")
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._recipients.pop(message.to, None)
+        message.future.set_result(sid)
+
+    async def _send_with_retries(self, message: OutboundMessage) -> str | None:
+        bucket = self._bucket(message.from_)
+        while True:
+            message.attempts += 1
+            async with self._slots:
+                self.in_flight += 1
+                try:
+                    sid = await self._attempt(message, bucket)
+                    self.sent += 1
+                    logger.info(f"✅ WhatsApp Sent Successfully! SID: {sid} | Recipient: {message.to}")
+                    return sid
+                except SendError as e:
+                    error = e
+                finally:
+                    self.in_flight -= 1
+
+            if error.status == 429:
+                self.throttled += 1
+            if not error.retryable or message.attempts >= self.max_attempts:
+                self.failed += 1
+                logger.error(
+                    f"❌ WhatsApp send to {message.to} failed after {message.attempts} attempt(s): {error}"
+                    + (f" (Code: {error.code})" if error.code else "")
+                    + (" - it may have been sent anyway" if message.unconfirmed_since is not None else "")
+                )
+                return None
+
+            delay = min(self.backoff_max, self.backoff * 2 ** (message.attempts - 1)) * random.uniform(0.5, 1.0)
+            if error.retry_after is not None:
+                delay = max(delay, error.retry_after)
+            if error.status == 429:
+                bucket.pause(delay)
+            self.retries += 1
+            logger.warning(f"WhatsApp send to {message.to} got {error}; retry {message.attempts} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+    async def _attempt(self, message: OutboundMessage, bucket: TokenBucket) -> str:
+        if message.unconfirmed_since is not None:
+            # An earlier POST may have gone through; sending it blind would deliver it twice.
+            sid = await self._find_sent(message)
+            if sid is not None:
+                self.recovered += 1
+                logger.info(f"Found the unconfirmed message to {message.to} at Twilio ({sid}); not sending it again")
+                return sid
+        await bucket.acquire()
+        posted_at = time.time()
+        try:
+            return await self._post(message)
+        except SendError as e:
+            if e.ambiguous and message.unconfirmed_since is None:
+                message.unconfirmed_since = posted_at
+            raise
+
+    async def _post(self, message: OutboundMessage) -> str:
+        import httpx
+
+        data = {"From": message.from_, "To": message.to, "Body": message.body or ""}
+        if message.media_url:
+            data["MediaUrl"] = message.media_url
+        try:
+            response = await self._client.post(_messages_path(), data=data)
+        except (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout) as e:
+            # Nothing was sent: safe to send again.
+            raise SendError(f"{type(e).__name__}: {e}", reached_server=False) from e
+        except httpx.HTTPError as e:
+            raise SendError(f"{type(e).__name__}: {e}") from e
+
+        if response.status_code in (200, 201):
+            return response.json()["sid"]
+        raise _error(response)
+
+    async def _find_sent(self, message: OutboundMessage) -> str | None:
+        """SID of a message Twilio created for `message` since its first unconfirmed POST, if any."""
+        import httpx
+
+        params = {"To": message.to, "From": message.from_, "PageSize": 20}
+        try:
+            response = await self._client.get(_messages_path(), params=params)
+        except httpx.HTTPError as e:
+            raise SendError(f"Lookup failed: {type(e).__name__}: {e}", reached_server=False) from e
+        if response.status_code != 200:
+            raise _error(response)
+
+        since = message.unconfirmed_since - LOOKUP_CLOCK_SKEW
+        for sent in response.json().get("messages", []):
+            created = sent.get("date_created")
+            if sent.get("body") == (message.body or "") and created and parsedate_to_datetime(created).timestamp() >= since:
+                return sent["sid"]
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "rate_per_sender": self.rate,
+            "burst": self.burst,
+            "concurrency": self.concurrency,
+            "submitted": self.submitted,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retries": self.retries,
+            "throttled": self.throttled,
+            "deduplicated": self.deduplicated,
+            "recovered": self.recovered,
+            "in_flight": self.in_flight,
+            "pending": self.submitted - self.sent - self.failed,
+            "sid_writer": self.sid_writer.stats(),
+        }
+
+
+def _messages_path() -> str:
+    return f"/2010-04-01/Accounts/{settings.TWILIO_ACCOUNT_SID}/Messages.json"
+
+
+def _error(response) -> SendError:
+    try:
+        payload = response.json()
+    except ValueError:
+        payload = {}
+    retry_after = response.headers.get("Retry-After")
+    return SendError(
+        f"HTTP {response.status_code}: {payload.get('message') or response.text[:200]}",
+        status=response.status_code,
+        code=payload.get("code"),
+        retry_after=float(retry_after) if retry_after and retry_after.replace(".", "", 1).isdigit() else None,
+    )
+
+
+def _whatsapp(number: str) -> str:
+    return number if number.startswith("whatsapp:") else f"whatsapp:{number}"
+
+
+dispatcher = OutboundDispatcher(
+    rate=settings.WHATSAPP_SEND_RATE,
+    burst=settings.WHATSAPP_SEND_BURST,
+    concurrency=settings.WHATSAPP_SEND_CONCURRENCY,
+    max_attempts=settings.WHATSAPP_SEND_MAX_ATTEMPTS,
+    backoff=settings.WHATSAPP_SEND_BACKOFF,
+    backoff_max=settings.WHATSAPP_SEND_BACKOFF_MAX,
+)
+atexit.register(dispatcher.sid_writer.flush, 5.0)
@@ -1,24 +1,81 @@
 import asyncio
+import itertools
 import json
 import logging
 import re
 from django.conf import settings
 from crewai.flow import Flow, listen, start, router, or_
-import uuid
-from core.models import EnergyConsumer, ServiceTicket, GeneratedEnergyContent
+from core.persistence import InteractionRecord, new_ticket_id, save_interaction
 
-from core.crews import PowerPulseCrew 
+from core.crews import ROUTED_TASKS, TASK_ORDER, crew_factory
+from core.tools.dalle_tool import energy_visual_tool
 from core.tools.whatsapp_sender import send_energy_update_to_whatsapp
 from .schema import ContentGenerationState
 from core.main_llm import basic_llm 
+from core.pipeline import stage
+from core.media import schedule_image_delivery
+from core.classifier import classify
+from core.response_cache import response_cache
+from core.conversations import conversations
+from core.knowledge_base import knowledge_base
+from core.consumption import usage_context
+from core.profiling import profiler
+from core.streaming import attached, open_stream
+from core.dispatch import dispatcher
+from core.logs import bind, log_context
 
 logger = logging.getLogger(__name__)
 
+
+class ReplyNotSent(RuntimeError):
+    """
+    The flow ran to the end but no reply reached the customer. `ticket_ref` is
+    set when the answer was stored, so a retry can resend it (views.resend_reply).
+    """
+
+    def __init__(self, message: str, ticket_ref: str | None = None):
+        super().__init__(message)
+        self.ticket_ref = ticket_ref
+
+
 class PowerPulseFlow(Flow[ContentGenerationState]):
 
+    # The reply being streamed to WhatsApp while the crew writes it (REPLY_STREAMING).
+    _stream = None
+    # The exception behind state.error.
+    _failure = None
+
+    async def _execute_method(self, method_name, method, *args, **kwargs):
+        # CrewAI's Flow prints and swallows exceptions raised by listeners, so a
+        # failed crew run would look like a finished flow to the job queue and the
+        # pipeline. Keep the first one; kickoff_async() raises it.
+        try:
+            return await super()._execute_method(method_name, method, *args, **kwargs)
+        except Exception as e:
+            if self._failure is None:
+                self._failure = e
+                self.state.error = f"{method_name}: {type(e).__name__}: {e}"
+            raise
+
     @start()
-    def analyze_request(self):
-        print(f"🔍 Analyzing Request: {self.state.user_query}")
+    async def analyze_request(self):
+        logger.info(f"🔍 Analyzing Request: {self.state.user_query}")
+        session = await self._load_session()
+
+        fast = classify(self.state.user_query)
+        if fast.confidence >= settings.CLASSIFIER_CONFIDENCE_THRESHOLD:
+            logger.info(f"⚡ Fast-path classification: {fast.category} ({fast.confidence:.2f} via {fast.source})")
+            self.state.planner_output = {"category": fast.category, "confidence": fast.confidence, "source": fast.source}
+            self.state.follow_up = self._continues(session, fast.category)
+            return self.state.planner_output
+
+        follow_up = conversations.follow_up_category(session, self.state.user_query, fast) if session else None
+        if follow_up:
+            logger.info(f"🔁 Follow-up on the {follow_up} conversation; classification skipped")
+            self.state.planner_output = {"category": follow_up, "source": "conversation"}
+            self.state.follow_up = True
+            return self.state.planner_output
+
         try:
             messages = [
                 {
@@ -34,54 +91,202 @@ class PowerPulseFlow(Flow[ContentGenerationState]):
                     "content": self.state.user_query
                 },
             ]
-            response = basic_llm.call(messages=messages)
+            async with stage("classifier"):
+                response = await asyncio.to_thread(basic_llm.call, messages=messages)
             
             if isinstance(response, dict):
                 self.state.planner_output = response
             else:
                 self.state.planner_output = json.loads(response)
+            self.state.planner_output["source"] = "llm"
+            self.state.follow_up = self._continues(session, self.state.planner_output.get("category"))
                 
             return self.state.planner_output
 
         except Exception as e:
             logger.error(f"Analysis failed: {e}")
-            self.state.planner_output = {"category": "energy_advice"}
+            self.state.planner_output = {"category": "energy_advice", "source": "default"}
             return self.state.planner_output
 
+    def _phone_number(self) -> str:
+        return (self.state.whatsapp_to or settings.TWILIO_WHATSAPP_TO).replace("whatsapp:", "").strip()
+
+    async def _load_session(self):
+        """This number's conversation so far, into state.conversation_context; None if memory is off."""
+        if not settings.CONVERSATION_MEMORY_ENABLED:
+            return None
+        try:
+            session = await asyncio.to_thread(conversations.get, self._phone_number())
+        except Exception as e:
+            logger.warning(f"Conversation lookup failed: {e}")
+            return None
+        self.state.conversation_context = session.context()
+        return session
+
+    def _continues(self, session, category) -> bool:
+        return (
+            session is not None
+            and session.last_category == category
+            and session.is_active(settings.CONVERSATION_FOLLOW_UP_WINDOW)
+        )
+
+    def _crew_inputs(self) -> dict:
+        # An answer that may be cached is served to other numbers, so it must not
+        # draw on this number's earlier questions, answers and ticket IDs.
+        conversation = "" if self.state.cacheable else self.state.conversation_context
+        return {
+            "user_query": self.state.user_query,
+            "conversation_context": conversation or "none (first message)",
+            "reference_material": self.state.reference_material or "none",
+            "usage_context": self.state.usage_context or "no meter readings on file",
+        }
+
+    async def _load_usage_context(self):
+        """This consumer's recent usage and anomalies, into state.usage_context."""
+        if not settings.CONSUMPTION_CONTEXT_ENABLED:
+            return
+        try:
+            self.state.usage_context = await asyncio.to_thread(
+                profiler.call, "io", "usage_context", usage_context, self._phone_number(),
+            )
+        except Exception as e:
+            logger.warning(f"Usage lookup failed: {e}")
+
+    async def _load_reference_material(self):
+        """The knowledge base passages for this query, into state.reference_material."""
+        if not settings.KB_ENABLED:
+            return
+        try:
+            self.state.reference_material = await asyncio.to_thread(
+                profiler.call, "tool", "knowledge_base", knowledge_base.context, self.state.user_query,
+            )
+        except Exception as e:
+            logger.warning(f"Knowledge base lookup failed: {e}")
+            return
+        if self.state.reference_material:
+            logger.info(f"📚 Grounding the answer in {len(self.state.reference_material)} chars of reference material")
+
     @router(analyze_request)
     def energy_router(self):
         category = self.state.planner_output.get("category", "energy_advice")
-        print(f"🎯 Route determined: {category}")
+        logger.info(f"🎯 Route determined: {category}")
         return category
 
     @listen(or_("energy_advice", "technical_fault"))
     async def run_power_pulse_crew(self):
-        print(f"🚀 Launching PowerPulseCrew for {self.state.planner_output['category']}...")
+        category = self.state.planner_output['category']
+
+        await self._load_usage_context()
+
+        # A follow-up's answer depends on the conversation, and an answer built on
+        # this consumer's meter readings is theirs alone; neither is cached.
+        # Any other answer is written without the conversation (_crew_inputs).
+        # `cacheable` is persisted with the answer so the cache's history refresh
+        # does not load the others either.
+        self.state.cacheable = not self.state.follow_up and not self.state.usage_context
+        use_cache = settings.RESPONSE_CACHE_ENABLED and self.state.cacheable
+
+        if use_cache:
+            cached = await asyncio.to_thread(response_cache.lookup, self.state.user_query, category)
+            if cached:
+                logger.info(f"♻️ Serving cached answer ({cached.kind} match, similarity {cached.similarity:.2f})")
+                # Its copy is stored without the flag: reloaded by the history
+                # refresh with a fresh created_at, the answer would never expire.
+                self.state.cacheable = False
+                self.state.text_generation_output = {"text": cached.text}
+                if cached.image_url:
+                    self.state.image_generation_output = {"url": cached.image_url}
+                return
+
+        await self._load_reference_material()
+
+        routed = settings.CREW_EXECUTION_MODE == "routed" and category in ROUTED_TASKS
+        logger.info(f"🚀 Launching PowerPulseCrew for {category} ({'routed' if routed else 'sequential'})...")
         
-        result = await PowerPulseCrew().crew().kickoff_async(
-            inputs={"user_query": self.state.user_query}
-        )
+        if settings.REPLY_STREAMING:
+            self._stream = self._open_stream(ROUTED_TASKS[category][0] if routed else TASK_ORDER[-1])
+
+        async with stage("crew"):
+            try:
+                with attached(self._stream):
+                    if routed:
+                        result = await self._run_routed_crew(category)
+                    else:
+                        with crew_factory.acquire() as crew:
+                            result = await crew.kickoff_async(inputs=self._crew_inputs())
+            except Exception:
+                if self._stream is not None:
+                    await self._stream.finish()
+                raise
         
         self.state.text_generation_output = {"text": result.raw}
         
         
-        if "http" in result.raw:
+        if not self.state.image_generation_output and "http" in result.raw:
             image_pattern = r'(https?://\S+\.(?:png|jpe?g|gif|webp)(?:\?\S*)?)'
             links = re.findall(image_pattern, result.raw, re.IGNORECASE)
             
             if links:
                 clean_link = links[0].strip('()[]{},. ')
                 self.state.image_generation_output = {"url": clean_link}
-                print(f"🖼️ Image URL extracted successfully: {clean_link}")
+                logger.info(f"🖼️ Image URL extracted successfully: {clean_link}")
             else:
                 all_links = re.findall(r'(https?://\S+)', result.raw)
                 if all_links:
                     self.state.image_generation_output = {"url": all_links[0].strip('()[]{},. ')}
-                    print(f"🖼️ Potential Image URL found (no extension): {all_links[0]}")
+                    logger.info(f"🖼️ Potential Image URL found (no extension): {all_links[0]}")
+
+        if use_cache:
+            image_url = self.state.image_generation_output.get("url") if self.state.image_generation_output else None
+            response_cache.store(self.state.user_query, category, result.raw, image_url)
+
+    def _open_stream(self, task_name):
+        """Stream `task_name`'s answer as it is written; the first message quotes a ticket ID allotted now."""
+        to_number = self.state.whatsapp_to or settings.TWILIO_WHATSAPP_TO
+        self.state.ticket_ref = new_ticket_id()
+        bind(ticket=self.state.ticket_ref)
+
+        parts = itertools.count()
+
+        def send(text):
+            with profiler.span("io", "twilio_send"):
+                return send_energy_update_to_whatsapp(
+                    to=to_number, text=text, key=f"{self.state.ticket_ref}:stream:{next(parts)}",
+                )
+
+        logger.info(f"📡 Streaming the {task_name} answer as it is written...")
+        return open_stream(send, task_name, prefix=f"*Ref ID: {self.state.ticket_ref}*\n\n")
+
+    async def _run_routed_crew(self, category):
+        """Run only the task for `category`; the diagram is drawn concurrently or deferred to the media stage."""
+        task_name, visual_prompt = ROUTED_TASKS[category]
+        inputs = self._crew_inputs()
+
+        self.state.image_prompt = visual_prompt.format(**inputs)
+
+        async def write_answer():
+            with crew_factory.acquire((task_name,), tools=False) as crew:
+                return await crew.kickoff_async(inputs=inputs)
+
+        if settings.MEDIA_ASYNC:
+            # The media stage draws the diagram after the text reply is out.
+            return await write_answer()
+
+        result, image = await asyncio.gather(
+            write_answer(),
+            asyncio.to_thread(profiler.call, "tool", "energy_visual_tool", energy_visual_tool._run, self.state.image_prompt),
+        )
+
+        if image.startswith("http"):
+            self.state.image_generation_output = {"url": image}
+            logger.info(f"🖼️ Diagram generated in parallel: {image}")
+        else:
+            logger.warning(image)
+        return result
 
     @listen("emergency")
     async def handle_emergency(self):
-        print("🚨 Emergency Path Triggered!")
+        logger.info("🚨 Emergency Path Triggered!")
         emergency_text = (
             "🚨 *URGENT WARNING FROM POWERPULSE AI* 🚨\n\n"
             "Dangerous electrical condition detected!\n"
@@ -92,63 +297,111 @@ class PowerPulseFlow(Flow[ContentGenerationState]):
         self.state.text_generation_output = {"text": emergency_text}
 
     @listen(or_(run_power_pulse_crew, handle_emergency))
-    def finalize_and_dispatch(self):
-        print("📤 Database Persistence & Final Dispatching...")
+    async def finalize_and_dispatch(self):
+        # ORM writes and the Twilio call are blocking; keep them off the event loop.
+        async with stage("dispatch"):
+            return await asyncio.to_thread(self._persist_and_dispatch)
+
+    def _persist_and_dispatch(self):
+        logger.info("📤 Database Persistence & Final Dispatching...")
         
         final_text = self.state.text_generation_output.get("text", "")
         final_image = self.state.image_generation_output.get("url") if self.state.image_generation_output else None
         to_number = self.state.whatsapp_to or settings.TWILIO_WHATSAPP_TO
 
+        clean_phone = self._phone_number()
+        category = self.state.planner_output.get('category', 'energy_advice')
+
+        stream = self._stream
+        content_ref = None
         try:
-            clean_phone = to_number.replace("whatsapp:", "").strip()
-            
-            consumer, created = EnergyConsumer.objects.get_or_create(
+            record = InteractionRecord(
                 phone_number=clean_phone,
-                defaults={'average_consumption': 0.0} 
-            )
-
-            new_ticket_id = f"TIC-{uuid.uuid4().hex[:6].upper()}"
-            
-            ticket = ServiceTicket.objects.create(
-                consumer=consumer,
-                ticket_id=new_ticket_id,
-                issue_description=self.state.user_query,
-                category=self.state.planner_output.get('category', 'energy_advice'),
-                urgency='high' if self.state.planner_output.get('category') == 'emergency' else 'low',
-                status='open'
-            )
-
-            GeneratedEnergyContent.objects.create(
-                ticket=ticket,
-                prompt_used=self.state.user_query,
+                user_query=self.state.user_query,
+                category=category,
                 generated_text=final_text,
-                image_url=final_image
+                image_url=final_image,
+                cacheable=self.state.cacheable,
+                classified_by=self.state.planner_output.get('source', ''),
+                # Allotted when streaming began.
+                **({"ticket_id": self.state.ticket_ref} if self.state.ticket_ref else {}),
             )
-            print(f"💾 Record created: Ticket {new_ticket_id} for {clean_phone}")
+            # An id in 'atomic' mode, a future of one in 'write_behind' mode.
+            with profiler.span("io", "orm_write"):
+                content_ref = save_interaction(record, reassign_ticket_id=not (stream and stream.started))
+            self.state.ticket_ref = record.ticket_id
+            bind(ticket=record.ticket_id)
+            if stream is not None and not stream.started:
+                stream.prefix = f"*Ref ID: {record.ticket_id}*\n\n"
+            if isinstance(content_ref, int):
+                self.state.content_id = content_ref
+            logger.info(f"💾 Record {'created' if self.state.content_id else 'queued'}: Ticket {record.ticket_id} for {clean_phone}")
             
-            final_text = f"*Ref ID: {new_ticket_id}*\n\n{final_text}"
+            final_text = f"*Ref ID: {record.ticket_id}*\n\n{final_text}"
 
         except Exception as e:
-            print(f"⚠️ Database Error: {e}")
-            pass
+            logger.exception(f"⚠️ Database Error: {e}")
 
         self.state.final_output = {
             "text": final_text,
             "image": final_image
         }
 
-        sid = send_energy_update_to_whatsapp(
-            to=to_number,
-            text=final_text,
-            image_url=final_image
-        )
+        defer_media = settings.MEDIA_ASYNC and bool(final_image or self.state.image_prompt)
+
+        if stream is not None:
+            # Part of the answer may be out already; send only what is still owed.
+            sids = stream.finish_threadsafe(self.state.text_generation_output.get("text", ""))
+            sid = next((s for s in sids if s), None)
+            if final_image and not defer_media:
+                with profiler.span("io", "twilio_send"):
+                    send_energy_update_to_whatsapp(to=to_number, image_url=final_image)
+        else:
+            with profiler.span("io", "twilio_send"):
+                sid = send_energy_update_to_whatsapp(
+                    to=to_number,
+                    text=final_text,
+                    image_url=None if defer_media else final_image,
+                    key=f"{self.state.ticket_ref}:reply" if self.state.ticket_ref else None,
+                )
+        dispatcher.record_sid(content_ref, sid)
         
+        if defer_media:
+            schedule_image_delivery(
+                content_ref, to_number, self.state.ticket_ref,
+                image_url=final_image, prompt=self.state.image_prompt,
+            )
+
+        if settings.CONVERSATION_MEMORY_ENABLED:
+            with profiler.span("io", "conversation_write"):
+                conversations.record_turn(
+                    clean_phone, self.state.user_query, self.state.text_generation_output.get("text", ""),
+                    category, self.state.ticket_ref,
+                )
+
         self.state.whatsapp_send_output = [f"Sent: {sid}" if sid else "Failed"]
-        print(f"✅ Flow Finished. Response sent to {to_number}")
+        if not sid:
+            raise ReplyNotSent(
+                f"No reply could be sent to {to_number} (Ticket {self.state.ticket_ref})",
+                ticket_ref=self.state.ticket_ref if content_ref is not None else None,
+            )
+        logger.info(f"✅ Flow Finished. Response sent to {to_number}")
         
         return self.state.final_output
 
     async def kickoff_async(self, user_query: str, whatsapp_to: str = None):
         self.state.user_query = user_query
         self.state.whatsapp_to = whatsapp_to
-        return await super().kickoff_async()
\ No newline at end of file
+        # Every record this message produces, in any task or thread, carries its number and ticket.
+        with log_context(phone=self._phone_number()), profiler.trace(type(self).__name__) as trace:
+            try:
+                result = await super().kickoff_async()
+            finally:
+                if trace is not None:
+                    trace.ticket_id = self.state.ticket_ref or ""
+        if self._failure is not None:
+            raise self._failure
+        if not self.state.final_output:
+            # Every route ends in finalize_and_dispatch; reaching here means a step was skipped.
+            raise ReplyNotSent(f"Flow ended without a reply: {self.state.error or 'no step failed'}")
+        return result
\ No newline at end of file
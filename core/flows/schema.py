@@ -7,10 +7,28 @@ class ContentGenerationState(BaseModel):
     user_query: str = ""
     whatsapp_to: Optional[str] = None 
 
+    # Compact summary + recent turns for this number (core/conversations.py).
+    conversation_context: str = ""
+    follow_up: bool = False
+    # Whether the answer may be reused for other numbers (core/response_cache.py).
+    cacheable: bool = False
+
+    # Passages from the grid codes and manuals for this query (core/knowledge_base.py).
+    reference_material: str = ""
+    # This consumer's recent usage and consumption anomalies (core/consumption.py).
+    usage_context: str = ""
+
     planner_output: Dict = {} 
 
     text_generation_output: Dict = {}  
     image_generation_output: Optional[Dict] = None  
+    image_prompt: Optional[str] = None
+
+    ticket_ref: Optional[str] = None
+    content_id: Optional[int] = None
 
     final_output: Dict = {}  
-    whatsapp_send_output: Optional[List[str]] = None  
\ No newline at end of file
+    whatsapp_send_output: Optional[List[str]] = None
+
+    # The first step that failed; kickoff_async() raises it once the flow ends.
+    error: Optional[str] = None  
\ No newline at end of file
@@ -0,0 +1,278 @@
+"""
+PowerPulse AI - Image Library
+Generated diagrams are stored once under MEDIA_ROOT/generated_images, named by
+the SHA-256 of their bytes. Each stored image (ImageAsset) remembers the
+normalized user query it was drawn for, and new requests in the same category
+whose query is within IMAGE_REUSE_SIMILARITY of a stored one (MinHash/LSH, see
+core/similarity.py) reuse that image instead of paying for a fresh DALL-E
+generation. Each asset is the representative of its cluster of prompts: a
+reuse only bumps its counter, a miss starts a new cluster.
+"""
+from __future__ import annotations
+import logging
+import os
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from core.image_variants import image_variants
+from core.similarity import band_keys, estimate_similarity, minhash_signature, normalize_query
+from core.utils import fetch_to_file
+
+logger = logging.getLogger(__name__)
+
+LIBRARY_DIR = 'generated_images'
+
+
+def _signature_from_bytes(raw) -> np.ndarray:
+    return np.frombuffer(bytes(raw), dtype=np.uint64)
+
+
+class ImageLibrary:
+
+    def __init__(self, similarity_threshold: float, subdir: str = LIBRARY_DIR):
+        self.similarity_threshold = similarity_threshold
+        self.subdir = subdir
+
+        self._signatures: dict[int, tuple[str, np.ndarray]] = {}
+        self._bands: dict[tuple, set] = {}
+        self._lock = threading.RLock()
+        self._cursor = 0
+        self._checked_at = 0.0
+
+        self.metrics = dict.fromkeys(("hits", "misses", "stored", "deduplicated", "bytes_saved"), 0)
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(settings.MEDIA_ROOT, self.subdir)
+
+    def _index(self, asset_id: int, category: str, signature: np.ndarray):
+        with self._lock:
+            if asset_id in self._signatures:
+                return
+            self._signatures[asset_id] = (category, signature)
+            for band_key in band_keys(signature):
+                self._bands.setdefault((category,) + band_key, set()).add(asset_id)
+            self._cursor = max(self._cursor, asset_id)
+
+    def _forget(self, asset_id: int):
+        with self._lock:
+            entry = self._signatures.pop(asset_id, None)
+            if entry is None:
+                return
+            category, signature = entry
+            for band_key in band_keys(signature):
+                bucket = self._bands.get((category,) + band_key)
+                if bucket is not None:
+                    bucket.discard(asset_id)
+                    if not bucket:
+                        del self._bands[(category,) + band_key]
+
+    def _refresh(self):
+        """Index assets stored since the last refresh (by any process)."""
+        now = time.time()
+        if now - self._checked_at < settings.IMAGE_LIBRARY_REFRESH:
+            return
+        self._checked_at = now
+
+        from core.models import ImageAsset
+
+        try:
+            rows = list(
+                ImageAsset.objects.filter(id__gt=self._cursor)
+                .order_by('id')
+                .values_list('id', 'category', 'signature')
+            )
+        except Exception as e:
+            logger.warning(f"Image library refresh failed: {e}")
+            return
+        for asset_id, category, signature in rows:
+            self._index(asset_id, category, _signature_from_bytes(signature))
+
+    def find(self, subject: str, category: str):
+        """Best stored asset for `subject` within the similarity threshold, as (asset, score), or None."""
+        from core.models import ImageAsset
+
+        key = normalize_query(subject or '')
+        if not key:
+            return None
+        self._refresh()
+        signature = minhash_signature(key)
+
+        with self._lock:
+            candidates = set()
+            for band_key in band_keys(signature):
+                candidates |= self._bands.get((category,) + band_key, set())
+            scored = sorted(
+                ((estimate_similarity(signature, self._signatures[asset_id][1]), asset_id) for asset_id in candidates),
+                reverse=True,
+            )
+
+        for score, asset_id in scored:
+            if score < self.similarity_threshold:
+                break
+            asset = ImageAsset.objects.filter(id=asset_id).first()
+            if asset is None or not os.path.exists(asset.file.path):
+                # Garbage-collected by another process since it was indexed.
+                self._forget(asset_id)
+                continue
+            return asset, score
+
+        with self._lock:
+            self.metrics["misses"] += 1
+        return None
+
+    def _link(self, asset, content_id: int | None, image_url: str | None = None):
+        from core.models import GeneratedEnergyContent
+
+        if not content_id:
+            return
+        update = {"image_asset": asset, "generated_image": asset.file.name}
+        if image_url:
+            update["image_url"] = image_url
+        GeneratedEnergyContent.objects.filter(id=content_id).update(**update)
+
+    def reuse(self, asset, content_id: int | None = None):
+        """Attach an existing asset to a response in place of a new generation."""
+        from core.models import ImageAsset
+
+        ImageAsset.objects.filter(id=asset.id).update(reuse_count=F('reuse_count') + 1, last_used_at=timezone.now())
+        self._link(asset, content_id)
+        with self._lock:
+            self.metrics["hits"] += 1
+            self.metrics["bytes_saved"] += asset.size_bytes
+
+    def store(self, image_url: str, subject: str, category: str, content_id: int | None = None):
+        """Download a freshly generated image into the library (once per distinct file) and link it."""
+        from core.models import ImageAsset
+
+        os.makedirs(self.directory, exist_ok=True)
+        incoming = os.path.join(self.directory, f'incoming-{uuid.uuid4().hex}.png')
+        fetched = fetch_to_file(image_url, incoming)
+        if fetched is None:
+            return None
+        sha256, size = fetched
+        name = f'{self.subdir}/{sha256}.png'
+        final_path = os.path.join(settings.MEDIA_ROOT, name)
+
+        if os.path.exists(final_path):
+            os.remove(incoming)
+        else:
+            os.replace(incoming, final_path)
+
+        key = normalize_query(subject or '')
+        signature = minhash_signature(key)
+        asset, created = ImageAsset.objects.get_or_create(
+            sha256=sha256,
+            defaults={
+                "file": name,
+                "size_bytes": size,
+                "category": category or '',
+                "subject": key,
+                "signature": signature.tobytes(),
+                "source_url": image_url,
+            },
+        )
+        with self._lock:
+            if created:
+                self.metrics["stored"] += 1
+            else:
+                self.metrics["deduplicated"] += 1
+                self.metrics["bytes_saved"] += size
+        if not created:
+            ImageAsset.objects.filter(id=asset.id).update(last_used_at=timezone.now())
+        self._index(asset.id, asset.category, _signature_from_bytes(asset.signature))
+        self._link(asset, content_id, image_url)
+        return asset
+
+    def collect_garbage(self, grace: timedelta, dry_run: bool = False) -> dict:
+        """
+        Delete assets no response points at any more, plus stray files in the
+        library directory that no row references, and their cached variants.
+        Anything touched within `grace` is kept so in-flight deliveries are never
+        pulled out from under.
+        """
+        from core.models import GeneratedEnergyContent, ImageAsset
+
+        cutoff = timezone.now() - grace
+        report = {"assets_deleted": 0, "files_deleted": 0, "bytes_freed": 0}
+
+        stale = ImageAsset.objects.filter(contents__isnull=True, last_used_at__lt=cutoff)
+        for asset in stale.iterator():
+            path = os.path.join(settings.MEDIA_ROOT, asset.file.name)
+            if not dry_run:
+                # Re-check at delete time in case a reuse landed in between.
+                deleted, _ = ImageAsset.objects.filter(id=asset.id, contents__isnull=True, last_used_at__lt=cutoff).delete()
+                if not deleted:
+                    continue
+                self._forget(asset.id)
+                if os.path.exists(path):
+                    os.remove(path)
+                report["bytes_freed"] += image_variants.discard(asset.file.name)
+            report["assets_deleted"] += 1
+            report["files_deleted"] += 1
+            report["bytes_freed"] += asset.size_bytes
+
+        if not os.path.isdir(self.directory):
+            return report
+
+        referenced = set(ImageAsset.objects.values_list('file', flat=True).iterator())
+        referenced.update(
+            GeneratedEnergyContent.objects.exclude(generated_image='').exclude(generated_image__isnull=True)
+            .values_list('generated_image', flat=True).iterator()
+        )
+        cutoff_ts = cutoff.timestamp()
+        for entry in os.scandir(self.directory):
+            if not entry.is_file() or f'{self.subdir}/{entry.name}' in referenced:
+                continue
+            stat = entry.stat()
+            if stat.st_mtime >= cutoff_ts:
+                continue
+            if not dry_run:
+                os.remove(entry.path)
+            report["files_deleted"] += 1
+            report["bytes_freed"] += stat.st_size
+
+        # Variants of whatever was deleted above, or of files removed by hand.
+        variants = image_variants.collect_garbage(cutoff_ts, dry_run=dry_run)
+        report["files_deleted"] += variants["files_deleted"]
+        report["bytes_freed"] += variants["bytes_freed"]
+        return report
+
+    def stats(self) -> dict:
+        """Library totals from the database (all processes) plus this process's counters."""
+        from core.models import ImageAsset
+
+        totals = ImageAsset.objects.aggregate(
+            bytes_stored=Sum('size_bytes'),
+            reuses=Sum('reuse_count'),
+            bytes_saved=Sum(F('size_bytes') * F('reuse_count')),
+        )
+        assets = ImageAsset.objects.count()
+        reuses = totals["reuses"] or 0
+        with self._lock:
+            lookups = self.metrics["hits"] + self.metrics["misses"]
+            process = {
+                **self.metrics,
+                "indexed": len(self._signatures),
+                "hit_rate": round(self.metrics["hits"] / lookups, 4) if lookups else 0.0,
+            }
+        return {
+            "assets": assets,
+            "bytes_stored": totals["bytes_stored"] or 0,
+            "reuses": reuses,
+            "bytes_saved": totals["bytes_saved"] or 0,
+            # Every asset cost one generation; every reuse avoided one.
+            "hit_rate": round(reuses / (reuses + assets), 4) if assets else 0.0,
+            "similarity_threshold": self.similarity_threshold,
+            "process": process,
+        }
+
+
+image_library = ImageLibrary(similarity_threshold=settings.IMAGE_REUSE_SIMILARITY)
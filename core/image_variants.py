@@ -0,0 +1,228 @@
+"""
+PowerPulse AI - Image Variants
+DALL-E returns 1024x1024 PNGs of a megabyte or more, which is slow to fetch on
+a phone. Every stored image can also be served as a smaller variant (see
+IMAGE_VARIANTS: a WhatsApp-sized JPEG, a WebP and a thumbnail) at
+MEDIA_URL/variants/<variant>/<name>. A variant is transcoded the first time it
+is asked for, in a process pool so the work never runs on a request thread,
+and is then kept on disk under MEDIA_ROOT/variants. Concurrent first requests
+for one variant share a single transcode.
+
+The file name of a cached variant includes its size, format and quality, so
+changing IMAGE_VARIANTS produces new files instead of serving stale ones.
+"""
+from __future__ import annotations
+import asyncio
+import atexit
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+VARIANT_DIR = 'variants'
+CONTENT_TYPES = {'JPEG': 'image/jpeg', 'WEBP': 'image/webp', 'PNG': 'image/png'}
+EXTENSIONS = {'JPEG': 'jpg', 'WEBP': 'webp', 'PNG': 'png'}
+
+
+def transcode(source: str, target: str, max_side: int, fmt: str, quality: int) -> int:
+    """Write `source` scaled to fit `max_side` as `fmt` to `target` (atomically); returns the new size. Runs in the pool."""
+    with Image.open(source) as image:
+        image.draft('RGB', (max_side, max_side))
+        image = image.convert('RGBA' if fmt != 'JPEG' and image.mode in ('RGBA', 'LA', 'P') else 'RGB')
+        image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        options = {'quality': quality, 'optimize': True}
+        if fmt == 'JPEG':
+            options['progressive'] = True
+        elif fmt == 'WEBP':
+            options = {'quality': quality, 'method': 4}
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        partial = f'{target}.{uuid.uuid4().hex[:8]}.part'
+        try:
+            image.save(partial, fmt, **options)
+            os.replace(partial, target)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+    return os.path.getsize(target)
+
+
+class VariantStore:
+
+    def __init__(self, variants: dict, workers: int, subdir: str = VARIANT_DIR):
+        self.variants = {name: (int(side), fmt.upper(), int(quality)) for name, (side, fmt, quality) in variants.items()}
+        self.workers = workers
+        self.subdir = subdir
+
+        self._pool: ProcessPoolExecutor | None = None
+        self._pending: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+        self.metrics = dict.fromkeys(("hits", "transcoded", "failed", "bytes_source", "bytes_variant"), 0)
+
+    @property
+    def directory(self) -> str:
+        return os.path.join(settings.MEDIA_ROOT, self.subdir)
+
+    def content_type(self, variant: str) -> str:
+        return CONTENT_TYPES[self.variants[variant][1]]
+
+    def path(self, name: str, variant: str) -> str:
+        """Where the variant of the stored file `name` (relative to MEDIA_ROOT) is cached."""
+        side, fmt, quality = self.variants[variant]
+        return os.path.join(self.directory, variant, f'{name}.{side}-q{quality}.{EXTENSIONS[fmt]}')
+
+    def url_name(self, name: str, variant: str) -> str:
+        """`name` of the variant relative to MEDIA_URL, e.g. for core.media.public_media_url()."""
+        return f'{self.subdir}/{variant}/{name}'
+
+    def _executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: the workers never inherit the server's threads, sockets or DB connections.
+                self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._pool
+
+    def _reset(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, name: str, variant: str) -> Future:
+        """A future of the variant's path, transcoding it in the pool unless it is cached or already in progress."""
+        target = self.path(name, variant)
+        if os.path.exists(target):
+            with self._lock:
+                self.metrics["hits"] += 1
+            done = Future()
+            done.set_result(target)
+            return done
+
+        with self._lock:
+            future = self._pending.get(target)
+            if future is not None:
+                return future
+            future = Future()
+            self._pending[target] = future
+
+        source = os.path.join(settings.MEDIA_ROOT, name)
+        if not os.path.isfile(source):
+            self._finish(future, target, source, error=FileNotFoundError(name))
+            return future
+        pool = self._executor()
+        try:
+            work = pool.submit(transcode, source, target, *self.variants[variant])
+        except (BrokenProcessPool, RuntimeError) as e:
+            self._reset(pool)
+            self._finish(future, target, source, error=e)
+            return future
+        work.add_done_callback(lambda done: self._finish(future, target, source, done=done, pool=pool))
+        return future
+
+    def _finish(self, future, target, source, done=None, pool=None, error=None):
+        if done is not None:
+            error = done.exception()
+        with self._lock:
+            self._pending.pop(target, None)
+            if error is None:
+                self.metrics["transcoded"] += 1
+                self.metrics["bytes_variant"] += done.result()
+                self.metrics["bytes_source"] += os.path.getsize(source)
+            else:
+                self.metrics["failed"] += 1
+        if error is None:
+            future.set_result(target)
+            return
+        if isinstance(error, BrokenProcessPool) and pool is not None:
+            self._reset(pool)
+        logger.warning(f"Could not make {os.path.basename(target)} from {source}: {error}")
+        future.set_exception(error)
+
+    def ensure(self, name: str, variant: str, timeout: float | None = None) -> str | None:
+        """Path of the variant, waiting up to `timeout` for a transcode; None if it could not be made."""
+        try:
+            return self.submit(name, variant).result(timeout or settings.IMAGE_VARIANT_TIMEOUT)
+        except Exception:
+            return None
+
+    async def aensure(self, name: str, variant: str) -> str | None:
+        """ensure() for async callers: the event loop keeps running while the pool works."""
+        try:
+            # shield: giving up must not cancel the transcode other requests are waiting on.
+            return await asyncio.wait_for(
+                asyncio.shield(asyncio.wrap_future(self.submit(name, variant))), settings.IMAGE_VARIANT_TIMEOUT,
+            )
+        except Exception:
+            return None
+
+    def discard(self, name: str) -> int:
+        """Delete every cached variant of `name`; returns the bytes freed."""
+        freed = 0
+        for variant in self.variants:
+            path = self.path(name, variant)
+            if os.path.exists(path):
+                freed += os.path.getsize(path)
+                os.remove(path)
+        return freed
+
+    def collect_garbage(self, cutoff_ts: float, dry_run: bool = False) -> dict:
+        """
+        Delete cached variants older than `cutoff_ts` whose original is gone or
+        whose variant spec is no longer in IMAGE_VARIANTS.
+        """
+        report = {"files_deleted": 0, "bytes_freed": 0}
+        if not os.path.isdir(self.directory):
+            return report
+        for root, _, files in os.walk(self.directory):
+            variant_dir = os.path.relpath(root, self.directory).split(os.sep)
+            for filename in files:
+                path = os.path.join(root, filename)
+                stat = os.stat(path)
+                if stat.st_mtime >= cutoff_ts:
+                    continue
+                variant, name = variant_dir[0], '/'.join(variant_dir[1:] + [filename])
+                source = name.rsplit('.', 2)[0]
+                current = (
+                    variant in self.variants
+                    and path == self.path(source, variant)
+                    and os.path.isfile(os.path.join(settings.MEDIA_ROOT, source))
+                )
+                if current:
+                    continue
+                if not dry_run:
+                    os.remove(path)
+                report["files_deleted"] += 1
+                report["bytes_freed"] += stat.st_size
+        return report
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            metrics = dict(self.metrics)
+            pending = len(self._pending)
+        source, variant = metrics["bytes_source"], metrics["bytes_variant"]
+        return {
+            **metrics,
+            "pending": pending,
+            "compression": round(variant / source, 4) if source else 0.0,
+            "variants": {name: {"max_side": side, "format": fmt, "quality": quality}
+                         for name, (side, fmt, quality) in self.variants.items()},
+            "dispatch_variant": settings.IMAGE_DISPATCH_VARIANT if settings.IMAGE_VARIANTS_ENABLED else None,
+        }
+
+
+image_variants = VariantStore(settings.IMAGE_VARIANTS, workers=settings.IMAGE_VARIANT_WORKERS)
+atexit.register(image_variants.shutdown)
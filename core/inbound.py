@@ -0,0 +1,232 @@
+"""
+PowerPulse AI - Inbound Coalescing
+People type in bursts ("hi", "my AC", "is sparking"), and Twilio re-posts a
+webhook it thinks we were too slow to acknowledge. Both used to start one flow,
+one LLM conversation and one ticket per POST. Here a retry is recognised by its
+MessageSid and dropped, and messages from the same number are held for
+INBOUND_COALESCE_WINDOW seconds after the latest one (never longer than
+INBOUND_COALESCE_MAX_WAIT after the first) and handed on as a single query.
+A message that reads as an emergency is never held: it takes whatever is
+buffered for that number along with it and goes out at once. A MessageSid is
+only recorded once its message has been held or queued, so if that fails
+Twilio's retry is processed instead of being dropped.
+
+With the in-process pipeline, bursts are held in memory on timers that run on
+the pipeline's event loop, which lives as long as the process (the webhook's
+own loop may be a short-lived one per request under WSGI). With
+MESSAGE_QUEUE_BACKEND=database a burst is held in the queue itself instead,
+as one FlowJob that no worker may claim until the burst is over, so a restart
+loses nothing.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from core.classifier import detect_emergency
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _Burst:
+    messages: list = field(default_factory=list)
+    first_at: float = field(default_factory=time.monotonic)
+    deadline: float = 0.0
+
+
+@dataclass
+class _HeldJob:
+    job_id: int
+    first_at: datetime
+    messages: int = 1
+
+
+class InboundCoalescer:
+
+    def __init__(self, window: float, max_wait: float, max_messages: int, seen_size: int = 10000):
+        self.window = window
+        self.max_wait = max(max_wait, window)
+        self.max_messages = max(1, max_messages)
+        self.seen_size = seen_size
+
+        self._lock = threading.Lock()
+        self._bursts: dict[str, _Burst] = {}
+        self._held: dict[str, _HeldJob] = {}
+        self._seen: OrderedDict[str, None] = OrderedDict()
+        self._accepting: set[str] = set()
+
+        self.received = 0
+        self.duplicates = 0
+        self.bursts = 0
+        self.coalesced = 0
+        self.bypassed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def seen(self, message_sid: str | None) -> bool:
+        """
+        True if `message_sid` was already accepted, or is being accepted right now
+        (a Twilio retry). Otherwise the caller must report the outcome with
+        accepted(), which records the SID only if the message was held or queued.
+        """
+        with self._lock:
+            self.received += 1
+            if not message_sid:
+                return False
+            if message_sid in self._seen or message_sid in self._accepting:
+                if message_sid in self._seen:
+                    self._seen.move_to_end(message_sid)
+                self.duplicates += 1
+                return True
+            self._accepting.add(message_sid)
+            return False
+
+    def accepted(self, message_sid: str | None, ok: bool = True):
+        """Close what seen() opened: remember the SID, or forget it so Twilio's retry is processed."""
+        if not message_sid:
+            return
+        with self._lock:
+            self._accepting.discard(message_sid)
+            if not ok:
+                return
+            self._seen[message_sid] = None
+            while len(self._seen) > self.seen_size:
+                self._seen.popitem(last=False)
+
+    def hold(self, from_number: str, body: str) -> str | None:
+        """
+        Buffer `body` and return None, or return the query to run right away:
+        an emergency or a burst that reached INBOUND_COALESCE_MAX_MESSAGES, merged
+        with whatever was buffered before it.
+        """
+        if not self.enabled:
+            return body
+        emergency = detect_emergency(body)
+        now = time.monotonic()
+        with self._lock:
+            burst = self._bursts.get(from_number)
+            if emergency or (burst is not None and len(burst.messages) + 1 >= self.max_messages):
+                self.bypassed += emergency
+                burst = self._bursts.pop(from_number, None)
+                return self._merge(burst.messages + [body]) if burst is not None else body
+
+            schedule = burst is None
+            if schedule:
+                burst = self._bursts[from_number] = _Burst(first_at=now)
+            burst.messages.append(body)
+            burst.deadline = min(now + self.window, burst.first_at + self.max_wait)
+        if schedule:
+            self._call_at(burst.deadline, from_number)
+        return None
+
+    async def hold_queued(self, from_number: str, body: str) -> int:
+        """
+        hold() for MESSAGE_QUEUE_BACKEND=database; returns the id of the FlowJob
+        holding `body`. The first message of a burst is queued at once, but not
+        claimable until INBOUND_COALESCE_WINDOW later; the next ones are appended
+        to that job, each moving its start back (never past
+        INBOUND_COALESCE_MAX_WAIT after the first). An emergency, or the
+        INBOUND_COALESCE_MAX_MESSAGES-th message, makes it claimable at once. If a
+        worker has claimed the job already, the message starts a new one.
+        """
+        from core.jobs import aenqueue_message, append_to_job
+
+        emergency = detect_emergency(body)
+        now = timezone.now()
+        max_wait = timedelta(seconds=self.max_wait)
+        with self._lock:
+            for number in [n for n, held in self._held.items() if now - held.first_at >= max_wait]:
+                del self._held[number]
+            held = self._held.get(from_number)
+            release = emergency or (held is not None and held.messages + 1 >= self.max_messages)
+            if release:
+                self.bypassed += emergency
+                self._held.pop(from_number, None)
+        first_at = held.first_at if held is not None else now
+        available_at = now if release else min(now + timedelta(seconds=self.window), first_at + max_wait)
+
+        if held is not None and await asyncio.to_thread(append_to_job, held.job_id, body, available_at):
+            with self._lock:
+                held.messages += 1
+                self.bursts += held.messages == 2
+                self.coalesced += 1
+            return held.job_id
+
+        job_id = await aenqueue_message(body, from_number, available_at)
+        if not release:
+            with self._lock:
+                self._held[from_number] = _HeldJob(job_id, now)
+        return job_id
+
+    def _merge(self, messages: list[str]) -> str:
+        self.bursts += 1
+        self.coalesced += len(messages) - 1
+        return "\n".join(message for message in messages if message)
+
+    # -- pipeline loop ----------------------------------------------------------
+
+    def _call_at(self, deadline: float, from_number: str):
+        from core.pipeline import get_pipeline
+
+        pipeline = get_pipeline()
+        pipeline.start()
+        delay = max(0.0, deadline - time.monotonic())
+        pipeline.loop.call_soon_threadsafe(pipeline.loop.call_later, delay, self._due, from_number)
+
+    def _due(self, from_number: str):
+        # Each message moves the deadline back instead of cancelling the timer; fire again if it did.
+        with self._lock:
+            burst = self._bursts.get(from_number)
+            if burst is None:
+                return
+            remaining = burst.deadline - time.monotonic()
+            if remaining > 0:
+                asyncio.get_running_loop().call_later(remaining, self._due, from_number)
+                return
+            del self._bursts[from_number]
+            query = self._merge(burst.messages)
+        asyncio.get_running_loop().create_task(self._release(from_number, query))
+
+    async def _release(self, from_number: str, query: str):
+        from core.views import enqueue_message, notify_busy
+
+        try:
+            accepted = await enqueue_message(query, from_number)
+        except Exception as e:
+            logger.error(f"Could not queue coalesced message from {from_number}: {e}")
+            accepted = False
+        if not accepted:
+            await notify_busy(from_number)
+
+    def stats(self) -> dict:
+        with self._lock:
+            buffered = sum(len(burst.messages) for burst in self._bursts.values())
+            holding = len(self._bursts) + len(self._held)
+        return {
+            "window_s": self.window,
+            "max_wait_s": self.max_wait,
+            "received": self.received,
+            "duplicates": self.duplicates,
+            "bursts": self.bursts,
+            "coalesced": self.coalesced,
+            "emergency_bypass": self.bypassed,
+            "numbers_holding": holding,
+            "messages_buffered": buffered,
+        }
+
+
+coalescer = InboundCoalescer(
+    window=settings.INBOUND_COALESCE_WINDOW,
+    max_wait=settings.INBOUND_COALESCE_MAX_WAIT,
+    max_messages=settings.INBOUND_COALESCE_MAX_MESSAGES,
+)
@@ -0,0 +1,166 @@
+"""
+PowerPulse AI - Durable Job Queue
+Accepted webhooks are stored as FlowJob rows and drained by `manage.py run_workers`.
+Claiming uses a conditional UPDATE (compare-and-swap) so it is safe across
+processes on both SQLite and Postgres.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import random
+from datetime import timedelta
+from django.conf import settings
+from django.db.models import F, Q, Value
+from django.db.models.functions import Concat
+from django.utils import timezone
+
+from core.models import FlowJob
+from core.persistence import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_message(message_body: str, from_number: str, available_at=None) -> FlowJob:
+    return FlowJob.objects.create(
+        message_body=message_body,
+        from_number=from_number,
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+        available_at=available_at or timezone.now(),
+    )
+
+
+def enqueue_media(to_number: str, ticket_ref: str | None, content_id: int | None = None,
+                  image_url: str | None = None, prompt: str | None = None) -> FlowJob:
+    """Queue a follow-up diagram (core/media.py) so it outlives the worker process that sent the text."""
+    return FlowJob.objects.create(
+        kind='media',
+        message_body=f"Diagram for Ticket {ticket_ref}",
+        from_number=to_number,
+        payload={"content_id": content_id, "ticket_ref": ticket_ref, "image_url": image_url, "prompt": prompt},
+        max_attempts=settings.JOB_MAX_ATTEMPTS,
+    )
+
+
+def _insert_jobs(messages: list[tuple]) -> list[int]:
+    jobs = FlowJob.objects.bulk_create([
+        FlowJob(message_body=body, from_number=number, max_attempts=settings.JOB_MAX_ATTEMPTS,
+                available_at=available_at or timezone.now())
+        for body, number, available_at in messages
+    ])
+    return [job.id for job in jobs]
+
+
+# Under ASGI every sync_to_async hop (including QuerySet.acreate() in Django
+# 4.2) runs on a thread private to the request, which also opens its own
+# database connection. Webhooks instead hand their row to this writer, which
+# group-commits whatever has arrived on one thread and one connection.
+job_writer = WriteBehindBuffer(
+    commit_batch=_insert_jobs,
+    commit_one=lambda message: enqueue_message(*message).id,
+    batch_size=settings.PERSISTENCE_BATCH_SIZE,
+    linger=0,
+    name="job-writer",
+)
+
+
+async def aenqueue_message(message_body: str, from_number: str, available_at=None) -> int:
+    """Store a FlowJob without blocking the event loop; returns its id once committed."""
+    return await asyncio.wrap_future(job_writer.submit((message_body, from_number, available_at)))
+
+
+def append_to_job(job_id: int, message_body: str, available_at) -> bool:
+    """
+    Add `message_body` as a new line of a job no worker has claimed yet and move
+    its start to `available_at` (core/inbound.py); False if it was claimed already.
+    """
+    return bool(FlowJob.objects.filter(id=job_id, status='pending', attempts=0).update(
+        message_body=Concat(F('message_body'), Value('\n' + message_body)),
+        available_at=available_at,
+        updated_at=timezone.now(),
+    ))
+
+
+def _claimable(now):
+    return FlowJob.objects.filter(
+        Q(status='pending', available_at__lte=now) | Q(status='running', locked_until__lt=now),
+        attempts__lt=F('max_attempts'),
+    )
+
+
+def claim_job(worker_id: str, lease_seconds: int | None = None) -> FlowJob | None:
+    """Lease the oldest available job to `worker_id`, or return None if the queue is empty."""
+    lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+    now = timezone.now()
+    candidates = list(_claimable(now).order_by('available_at', 'id').values_list('id', flat=True)[:10])
+    for job_id in candidates:
+        claimed = _claimable(now).filter(id=job_id).update(
+            status='running',
+            attempts=F('attempts') + 1,
+            locked_by=worker_id,
+            locked_until=now + timedelta(seconds=lease_seconds),
+            updated_at=now,
+        )
+        if claimed:
+            return FlowJob.objects.get(id=job_id)
+    return None
+
+
+def extend_lease(job: FlowJob, lease_seconds: int | None = None) -> bool:
+    lease_seconds = lease_seconds or settings.JOB_LEASE_SECONDS
+    return bool(FlowJob.objects.filter(id=job.id, status='running', locked_by=job.locked_by).update(
+        locked_until=timezone.now() + timedelta(seconds=lease_seconds),
+    ))
+
+
+def complete_job(job: FlowJob):
+    FlowJob.objects.filter(id=job.id, locked_by=job.locked_by).update(
+        status='done',
+        locked_by=None,
+        locked_until=None,
+        updated_at=timezone.now(),
+    )
+
+
+def backoff_delay(attempts: int) -> float:
+    """Exponential backoff with jitter, capped at JOB_RETRY_MAX_DELAY."""
+    ceiling = min(settings.JOB_RETRY_MAX_DELAY, settings.JOB_RETRY_BASE_DELAY * (2 ** (attempts - 1)))
+    return random.uniform(ceiling / 2, ceiling)
+
+
+def fail_job(job: FlowJob, error: str, ticket_ref: str | None = None):
+    """Retry `job` after a backoff, or dead-letter it; `ticket_ref` marks its answer as stored already."""
+    attempts = job.attempts
+    now = timezone.now()
+    if attempts >= job.max_attempts:
+        status, available_at = 'dead', now
+        logger.error(f"Job {job.id} dead-lettered after {attempts} attempts: {error}")
+    else:
+        status, available_at = 'pending', now + timedelta(seconds=backoff_delay(attempts))
+        logger.warning(f"Job {job.id} failed (attempt {attempts}/{job.max_attempts}), retrying at {available_at}: {error}")
+
+    FlowJob.objects.filter(id=job.id, locked_by=job.locked_by).update(
+        status=status,
+        available_at=available_at,
+        locked_by=None,
+        locked_until=None,
+        last_error=error[:5000],
+        updated_at=now,
+        **({"ticket_ref": ticket_ref} if ticket_ref else {}),
+    )
+
+
+def dead_letter_abandoned_jobs() -> int:
+    """Dead-letter jobs whose lease expired on their final attempt (e.g. the worker crashed)."""
+    count = FlowJob.objects.filter(
+        status='running', locked_until__lt=timezone.now(), attempts__gte=F('max_attempts'),
+    ).update(status='dead', locked_by=None, locked_until=None, last_error='Lease expired on final attempt')
+    if count:
+        logger.error(f"Dead-lettered {count} abandoned job(s)")
+    return count
+
+
+def requeue_dead_jobs(queryset=None) -> int:
+    queryset = FlowJob.objects.all() if queryset is None else queryset
+    return queryset.filter(status='dead').update(
+        status='pending', attempts=0, available_at=timezone.now(), last_error=None,
+    )
@@ -0,0 +1,423 @@
+"""
+PowerPulse AI - Knowledge Base
+Retrieval over grid codes and appliance manuals so the agents answer from the
+documents instead of from memory. `manage.py build_kb` splits the files under
+KB_SOURCE_DIR into overlapping chunks, embeds them and writes a versioned index
+under KB_INDEX_DIR; files whose hash has not changed keep their embeddings.
+Workers open the index with np.load(mmap_mode='r'), so loading is zero-copy
+and every process shares the same page cache, and pick up a new version when
+build_kb switches the CURRENT pointer.
+
+Search is a cosine top-k over the L2-normalised matrix: one matrix-vector
+product, or with an IVF index (spherical k-means, rows stored contiguously per
+list) only over the KB_IVF_PROBES lists closest to the query.
+
+Embeddings come from KB_EMBEDDING_BACKEND: 'hashed' (default) is a local,
+signed feature-hashing model over words, word pairs and character n-grams,
+weighted by IDF, which needs no network and embeds a query in microseconds;
+'openai' uses KB_EMBEDDING_MODEL through the shared OpenAI client.
+"""
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+
+from core.classifier import normalize_text
+
+logger = logging.getLogger(__name__)
+
+try:
+    from pypdf import PdfReader
+    _PDF_AVAILABLE = True
+except ImportError:
+    PdfReader = None
+    _PDF_AVAILABLE = False
+
+SUPPORTED_EXTENSIONS = (".md", ".txt", ".pdf")
+FORMAT_VERSION = 1
+
+_WORD = re.compile(r"\w+")
+_PARAGRAPH = re.compile(r"\n\s*\n")
+
+
+# -- documents -------------------------------------------------------------------
+
+def read_document(path: str) -> str:
+    if path.lower().endswith(".pdf"):
+        if not _PDF_AVAILABLE:
+            logger.warning(f"Skipping {path}: pypdf not installed. Run: pip install pypdf")
+            return ""
+        return "\n\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+    with open(path, encoding="utf-8", errors="replace") as f:
+        return f.read()
+
+
+def chunk_text(text: str, chunk_chars: int, overlap: int) -> list[str]:
+    """Pack paragraphs into chunks of about `chunk_chars`; each chunk repeats the last `overlap` chars of the previous one."""
+    paragraphs = [" ".join(p.split()) for p in _PARAGRAPH.split(text)]
+    pieces = []
+    for paragraph in filter(None, paragraphs):
+        while len(paragraph) > chunk_chars:
+            cut = paragraph.rfind(" ", chunk_chars // 2, chunk_chars)
+            cut = cut if cut > 0 else chunk_chars
+            pieces.append(paragraph[:cut])
+            paragraph = paragraph[cut:].lstrip()
+        pieces.append(paragraph)
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 2 > chunk_chars:
+            chunks.append(current)
+            tail = current[-overlap:] if overlap else ""
+            current = tail[tail.find(" ") + 1:] if " " in tail else tail
+        current = f"{current}\n\n{piece}" if current else piece
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+# -- embeddings ------------------------------------------------------------------
+
+def _features(text: str) -> list[str]:
+    words = _WORD.findall(normalize_text(text))
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    # Character 4-grams of longer words tolerate plurals, typos and Arabic prefixes.
+    for word in words:
+        if len(word) > 5:
+            padded = f"<{word}>"
+            features.extend(padded[i:i + 4] for i in range(len(padded) - 3))
+    return features
+
+
+def hashed_embedding(text: str, dim: int) -> np.ndarray:
+    """Signed feature hashing with sublinear term frequency; not normalised."""
+    vector = np.zeros(dim, dtype=np.float32)
+    features = _features(text)
+    if not features:
+        return vector
+    hashes = np.fromiter((zlib.crc32(f.encode("utf-8")) for f in features), dtype=np.uint32, count=len(features))
+    buckets, counts = np.unique(hashes, return_counts=True)
+    signs = np.where(buckets & 0x80000000, -1.0, 1.0).astype(np.float32)
+    np.add.at(vector, (buckets % dim).astype(np.int64), signs * (1.0 + np.log(counts, dtype=np.float32)))
+    return vector
+
+
+def embed_texts(texts: list[str], backend: str, dim: int, model: str, batch_size: int = 128) -> np.ndarray:
+    if backend == "hashed":
+        if not texts:
+            return np.zeros((0, dim), dtype=np.float32)
+        return np.stack([hashed_embedding(text, dim) for text in texts])
+    if backend == "openai":
+        from core.clients import get_openai_client
+
+        client = get_openai_client()
+        rows = []
+        for start in range(0, len(texts), batch_size):
+            response = client.embeddings.create(model=model, input=texts[start:start + batch_size])
+            rows.extend(item.embedding for item in response.data)
+        return np.asarray(rows, dtype=np.float32).reshape(len(texts), -1)
+    raise ValueError(f"Unknown KB_EMBEDDING_BACKEND {backend!r} (expected 'hashed' or 'openai')")
+
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
+
+def _idf(embeddings: np.ndarray) -> np.ndarray:
+    """Per-dimension IDF from how many chunks touch each hash bucket (all ones for dense embeddings)."""
+    df = np.count_nonzero(embeddings, axis=0)
+    if not len(embeddings) or df.min() == len(embeddings):
+        return np.ones(embeddings.shape[1], dtype=np.float32)
+    return np.log((1 + len(embeddings)) / (1 + df)).astype(np.float32) + 1.0
+
+
+def _kmeans(matrix: np.ndarray, lists: int, iterations: int = 12, seed: int = 1337) -> tuple[np.ndarray, np.ndarray]:
+    """Spherical k-means; returns the list assigned to each row and the centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = matrix[rng.choice(len(matrix), size=lists, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = np.argmax(matrix @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, matrix)
+        empty = ~sums.any(axis=1)
+        sums[empty] = matrix[rng.choice(len(matrix), size=int(empty.sum()), replace=False)]
+        centroids = _normalize_rows(sums)
+    return np.argmax(matrix @ centroids.T, axis=1), centroids
+
+
+# -- index build -------------------------------------------------------------------
+
+def _current_dir(index_dir: str) -> str | None:
+    try:
+        with open(os.path.join(index_dir, "CURRENT"), encoding="utf-8") as f:
+            name = f.read().strip()
+    except OSError:
+        return None
+    path = os.path.join(index_dir, name)
+    return path if name and os.path.isdir(path) else None
+
+
+def _read_texts(version_dir: str) -> list[str]:
+    blob = np.memmap(os.path.join(version_dir, "texts.bin"), dtype=np.uint8, mode="r") \
+        if os.path.getsize(os.path.join(version_dir, "texts.bin")) else np.zeros(0, dtype=np.uint8)
+    offsets = np.load(os.path.join(version_dir, "text_offsets.npy"))
+    return [bytes(blob[offsets[i]:offsets[i + 1]]).decode("utf-8") for i in range(len(offsets) - 1)]
+
+
+def build_index(source_dir: str, index_dir: str, rebuild: bool = False, ivf_lists: int | None = None) -> dict:
+    """
+    (Re)index every supported file under `source_dir` into a new version of
+    `index_dir` and point CURRENT at it. Returns counts of files embedded,
+    reused and removed, chunks, and seconds taken.
+    """
+    started = time.perf_counter()
+    config = {
+        "format": FORMAT_VERSION,
+        "backend": settings.KB_EMBEDDING_BACKEND,
+        "model": settings.KB_EMBEDDING_MODEL if settings.KB_EMBEDDING_BACKEND == "openai" else "",
+        "dim": settings.KB_EMBEDDING_DIM,
+        "chunk_chars": settings.KB_CHUNK_CHARS,
+        "chunk_overlap": settings.KB_CHUNK_OVERLAP,
+    }
+
+    # Embeddings of unchanged files are copied from the current version.
+    os.makedirs(index_dir, exist_ok=True)
+    current_dir = _current_dir(index_dir)
+    previous, previous_dir = {}, None if rebuild else current_dir
+    if previous_dir is not None:
+        with open(os.path.join(previous_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("config") == config:
+            previous = manifest["files"]
+            previous_embeddings = np.load(os.path.join(previous_dir, "embeddings.npy"), mmap_mode="r")
+            previous_texts = _read_texts(previous_dir)
+
+    paths = sorted(
+        os.path.relpath(os.path.join(root, name), source_dir)
+        for root, _, names in os.walk(source_dir)
+        for name in names
+        if name.lower().endswith(SUPPORTED_EXTENSIONS)
+    ) if os.path.isdir(source_dir) else []
+
+    files, blocks, texts, sources = {}, [], [], []
+    embedded = reused = 0
+    for path in paths:
+        with open(os.path.join(source_dir, path), "rb") as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        old = previous.get(path)
+        if old is not None and old["sha256"] == digest:
+            block = np.asarray(previous_embeddings[old["start"]:old["end"]])
+            chunks = previous_texts[old["start"]:old["end"]]
+            reused += 1
+        else:
+            chunks = chunk_text(read_document(os.path.join(source_dir, path)), config["chunk_chars"], config["chunk_overlap"])
+            block = embed_texts(chunks, config["backend"], config["dim"], settings.KB_EMBEDDING_MODEL)
+            embedded += 1
+        files[path] = {"sha256": digest, "start": len(texts), "end": len(texts) + len(chunks)}
+        blocks.append(block)
+        texts.extend(chunks)
+        sources.extend([path] * len(chunks))
+
+    dim = blocks[0].shape[1] if blocks and blocks[0].size else config["dim"]
+    embeddings = np.concatenate(blocks).astype(np.float32) if texts else np.zeros((0, dim), dtype=np.float32)
+    weights = _idf(embeddings) if config["backend"] == "hashed" else np.ones(dim, dtype=np.float32)
+    matrix = _normalize_rows(embeddings * weights).astype(np.float32)
+
+    if ivf_lists is None and len(matrix) >= settings.KB_IVF_MIN_ROWS:
+        ivf_lists = int(math.sqrt(len(matrix)))
+    ivf_lists = min(ivf_lists or 0, len(matrix))
+    if ivf_lists > 1:
+        assignment, centroids = _kmeans(matrix, ivf_lists)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[order], np.arange(ivf_lists + 1))
+    else:
+        order = np.arange(len(matrix))
+        centroids = np.zeros((0, dim), dtype=np.float32)
+        offsets = np.zeros(0, dtype=np.int64)
+
+    version = f"v{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    version_dir = os.path.join(index_dir, version)
+    os.makedirs(version_dir)
+    np.save(os.path.join(version_dir, "embeddings.npy"), embeddings)
+    np.save(os.path.join(version_dir, "index.npy"), matrix[order])
+    np.save(os.path.join(version_dir, "order.npy"), order.astype(np.int64))
+    np.save(os.path.join(version_dir, "weights.npy"), weights)
+    np.save(os.path.join(version_dir, "centroids.npy"), centroids.astype(np.float32))
+    np.save(os.path.join(version_dir, "offsets.npy"), offsets.astype(np.int64))
+    encoded = [text.encode("utf-8") for text in texts]
+    with open(os.path.join(version_dir, "texts.bin"), "wb") as f:
+        f.write(b"".join(encoded))
+    np.save(os.path.join(version_dir, "text_offsets.npy"), np.cumsum([0] + [len(e) for e in encoded]).astype(np.int64))
+    with open(os.path.join(version_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"config": config, "files": files, "sources": sources, "ivf_lists": int(max(ivf_lists, 0)),
+                   "built_at": time.time()}, f)
+
+    # Switch atomically; keep the version workers may still have mapped.
+    pointer = os.path.join(index_dir, "CURRENT.tmp")
+    with open(pointer, "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(index_dir, "CURRENT"))
+    keep = {version, os.path.basename(current_dir or "")}
+    for name in os.listdir(index_dir):
+        if name.startswith("v") and name not in keep and os.path.isdir(os.path.join(index_dir, name)):
+            shutil.rmtree(os.path.join(index_dir, name), ignore_errors=True)
+
+    return {
+        "version": version, "files": len(paths), "embedded": embedded, "reused": reused,
+        "removed": len(set(previous) - set(files)), "chunks": len(texts), "ivf_lists": int(max(ivf_lists, 0)),
+        "seconds": time.perf_counter() - started,
+    }
+
+
+# -- search ------------------------------------------------------------------------
+
+@dataclass(frozen=True)
+class Passage:
+    source: str
+    text: str
+    score: float
+
+
+class _Index:
+    """One loaded version: arrays are memory-mapped, texts decoded on demand."""
+
+    def __init__(self, version_dir: str):
+        self.version = os.path.basename(version_dir)
+        with open(os.path.join(version_dir, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        self.config = manifest["config"]
+        self.sources = manifest["sources"]
+        self.matrix = np.load(os.path.join(version_dir, "index.npy"), mmap_mode="r")
+        self.order = np.load(os.path.join(version_dir, "order.npy"), mmap_mode="r")
+        self.weights = np.load(os.path.join(version_dir, "weights.npy"))
+        self.centroids = np.load(os.path.join(version_dir, "centroids.npy"))
+        self.offsets = np.load(os.path.join(version_dir, "offsets.npy"))
+        size = os.path.getsize(os.path.join(version_dir, "texts.bin"))
+        self.texts = np.memmap(os.path.join(version_dir, "texts.bin"), dtype=np.uint8, mode="r") if size else None
+        self.text_offsets = np.load(os.path.join(version_dir, "text_offsets.npy"), mmap_mode="r")
+
+    def text(self, row: int) -> str:
+        return bytes(self.texts[self.text_offsets[row]:self.text_offsets[row + 1]]).decode("utf-8")
+
+    def embed_query(self, query: str) -> np.ndarray:
+        config = self.config
+        vector = embed_texts([query], config["backend"], config["dim"], config["model"] or settings.KB_EMBEDDING_MODEL)[0]
+        vector = vector * self.weights
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def top_k(self, vector: np.ndarray, k: int, probes: int) -> list[tuple[int, float]]:
+        if len(self.centroids) and probes < len(self.centroids):
+            lists = np.argpartition(self.centroids @ vector, -probes)[-probes:]
+            # Each list is a contiguous slice of the memory-mapped matrix.
+            rows = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in lists])
+            scores = np.concatenate([self.matrix[self.offsets[i]:self.offsets[i + 1]] @ vector for i in lists])
+        else:
+            rows = None
+            scores = self.matrix @ vector
+        k = min(k, len(scores))
+        if not k:
+            return []
+        best = np.argpartition(scores, -k)[-k:]
+        best = best[np.argsort(scores[best])[::-1]]
+        return [(int(rows[i] if rows is not None else i), float(scores[i])) for i in best]
+
+
+class KnowledgeBase:
+
+    def __init__(self, index_dir: str, top_k: int, probes: int, min_score: float, check_interval: float = 30.0):
+        self.index_dir = index_dir
+        self.top_k = top_k
+        self.probes = probes
+        self.min_score = min_score
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._index: _Index | None = None
+        self._checked_at = 0.0
+        self.searches = 0
+        self.search_seconds = 0.0
+        self.loads = 0
+
+    def _current(self) -> _Index | None:
+        now = time.monotonic()
+        if now - self._checked_at < self.check_interval and self._checked_at:
+            return self._index
+        with self._lock:
+            if now - self._checked_at < self.check_interval and self._checked_at:
+                return self._index
+            self._checked_at = now
+            version_dir = _current_dir(self.index_dir)
+            if version_dir is None:
+                self._index = None
+            elif self._index is None or self._index.version != os.path.basename(version_dir):
+                try:
+                    self._index = _Index(version_dir)
+                    self.loads += 1
+                    logger.info(f"Knowledge base {self._index.version} loaded: {len(self._index.matrix)} chunks")
+                except (OSError, ValueError, KeyError) as e:
+                    logger.error(f"Could not load knowledge base {version_dir}: {e}")
+            return self._index
+
+    def search(self, query: str, k: int | None = None) -> list[Passage]:
+        index = self._current()
+        if index is None or not len(index.matrix) or not query.strip():
+            return []
+        started = time.perf_counter()
+        vector = index.embed_query(query)
+        passages = []
+        for row, score in index.top_k(vector, k or self.top_k, self.probes):
+            if score < self.min_score:
+                break
+            raw = int(index.order[row])
+            passages.append(Passage(index.sources[raw], index.text(raw), score))
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+        return passages
+
+    def context(self, query: str, k: int | None = None, max_chars: int | None = None) -> str:
+        """The top passages formatted for a prompt, at most `max_chars` long; '' when nothing relevant is indexed."""
+        max_chars = max_chars or settings.KB_MAX_CONTEXT_CHARS
+        parts, used = [], 0
+        for passage in self.search(query, k):
+            room = max_chars - used - (2 if parts else 0)
+            entry = f"[{passage.source}] {passage.text}"
+            if len(entry) > room:
+                entry = entry[:room].rsplit(" ", 1)[0] if room > len(passage.source) + 40 else ""
+            if not entry:
+                break
+            parts.append(entry)
+            used += len(entry) + (2 if len(parts) > 1 else 0)
+        return "\n\n".join(parts)
+
+    def stats(self) -> dict:
+        index = self._current()
+        return {
+            "version": index.version if index else None,
+            "chunks": len(index.matrix) if index else 0,
+            "ivf_lists": len(index.centroids) if index else 0,
+            "backend": index.config["backend"] if index else settings.KB_EMBEDDING_BACKEND,
+            "searches": self.searches,
+            "avg_search_ms": round(self.search_seconds / self.searches * 1e3, 3) if self.searches else 0.0,
+            "loads": self.loads,
+        }
+
+
+knowledge_base = KnowledgeBase(
+    settings.KB_INDEX_DIR,
+    top_k=settings.KB_TOP_K,
+    probes=settings.KB_IVF_PROBES,
+    min_score=settings.KB_MIN_SCORE,
+)
@@ -0,0 +1,211 @@
+"""
+PowerPulse AI - Logging
+The handler installed by LOGGING never writes on the caller's thread: records
+go onto a bounded queue and one listener thread formats them and writes them
+to a size-rotated file (and stderr when LOG_CONSOLE is on). If the queue is
+full the record is dropped and counted, so a slow disk can never stall a
+request.
+
+Records carry the fields bound with log_context()/bind(): the flow binds the
+customer's number when it starts and the ticket ID once it is allotted, so
+every line a message produces - in the flow, the crew's threads or the
+dispatcher - can be found by ticket. With LOG_FORMAT=json each record is one
+JSON object per line.
+"""
+from __future__ import annotations
+import atexit
+import json
+import logging
+import queue
+import random
+import sys
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+# One dict per flow, shared (not copied) by every task and thread the flow
+# starts, so a ticket bound late in the flow is seen by all of them.
+_context: ContextVar[dict | None] = ContextVar('log_context', default=None)
+
+# Attributes every LogRecord has; anything else on a record came from `extra`.
+_RESERVED = frozenset(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'context'}
+CONTEXT_FIELDS = ('ticket', 'phone')
+
+_handlers: list[AsyncQueueHandler] = []
+
+
+@contextmanager
+def log_context(**fields):
+    """Bind `fields` (on top of any enclosing context) to every record logged inside the block."""
+    parent = _context.get()
+    token = _context.set({**(parent or {}), **fields})
+    try:
+        yield
+    finally:
+        _context.reset(token)
+
+
+def bind(**fields):
+    """Add fields to the current context, where every task and thread of the flow will see them."""
+    current = _context.get()
+    if current is None:
+        _context.set(dict(fields))
+    else:
+        current.update(fields)
+
+
+def current() -> dict:
+    return dict(_context.get() or {})
+
+
+class ContextFilter(logging.Filter):
+    """Copy the bound fields onto the record; runs on the caller's thread, where the context is."""
+
+    def filter(self, record):
+        for key, value in (_context.get() or {}).items():
+            if not key.startswith('_') and not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class SampleFilter(logging.Filter):
+    """Keep a `rate` share of flows: all of one flow's records or none of them."""
+
+    def __init__(self, rate: float = 1.0):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if self.rate >= 1:
+            return True
+        if self.rate <= 0:
+            return False
+        context = _context.get()
+        if context is None:
+            return random.random() < self.rate
+        if '_sampled' not in context:
+            context['_sampled'] = random.random() < self.rate
+        return context['_sampled']
+
+
+class JsonFormatter(logging.Formatter):
+
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RESERVED and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exc"] = record.exc_text
+        if record.stack_info:
+            entry["stack"] = record.stack_info
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """'<time> <level> <logger> [<ticket>] message' for people reading a terminal."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s%(context)s %(message)s")
+
+    def format(self, record):
+        fields = [str(getattr(record, key)) for key in CONTEXT_FIELDS if getattr(record, key, None)]
+        record.context = f" [{' '.join(fields)}]" if fields else ""
+        return super().format(record)
+
+
+class _Listener(QueueListener):
+
+    def enqueue_sentinel(self):
+        # The handler's queue is never full for long; the sentinel must not be dropped.
+        self.queue.put(self._sentinel)
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks: past `queue_size` waiting records a new
+    one is dropped and counted. The queue is a SimpleQueue, which costs the
+    caller less than queue.Queue; the bound is checked with qsize(), so under
+    contention it may be overshot by a record or two.
+    """
+
+    def __init__(self, handlers, queue_size: int):
+        super().__init__(queue.SimpleQueue())
+        self.queue_size = queue_size
+        self.addFilter(ContextFilter())
+        self.listener = _Listener(self.queue, *handlers, respect_handler_level=True)
+        self.dropped = 0
+        self.enqueued = 0
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def prepare(self, record):
+        # Resolve the message and traceback now, while the arguments still hold
+        # the values they had; the formatting itself is left to the listener.
+        # Done in place rather than on a copy (as QueueHandler does): any other
+        # handler on the record still gets the same text and exc_text.
+        record.msg, record.args = record.getMessage(), None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        # Counters are updated without a lock: a lost increment under a race is acceptable for stats.
+        if self.queue.qsize() >= self.queue_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+        self.enqueued += 1
+
+    def stop(self):
+        """Write out everything queued so far and stop the listener thread."""
+        if self.listener._thread is not None:
+            self.listener.stop()
+
+    def stats(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "dropped": self.dropped,
+            "queued": self.queue.qsize(),
+            "capacity": self.queue_size,
+        }
+
+
+def queue_handler(filename: str, max_bytes: int, backup_count: int, fmt: str = 'json', console: bool = False,
+                  queue_size: int = 10000) -> AsyncQueueHandler:
+    """LOGGING factory: a queue in front of a rotating file (and optionally stderr)."""
+    file_handler = RotatingFileHandler(filename, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8',
+                                       delay=True)
+    file_handler.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+    handlers = [file_handler]
+    if console:
+        stream = logging.StreamHandler(sys.stderr)
+        stream.setFormatter(TextFormatter())
+        handlers.append(stream)
+    handler = AsyncQueueHandler(handlers, queue_size)
+    _handlers.append(handler)
+    return handler
+
+
+def stats() -> dict:
+    """Counters of every queue handler in this process."""
+    totals = dict.fromkeys(("enqueued", "dropped", "queued", "capacity"), 0)
+    for handler in _handlers:
+        for key, value in handler.stats().items():
+            totals[key] += value
+    return totals
+
+
+def stop():
+    """Write out and stop every queue handler; for processes that exit without running atexit hooks."""
+    for handler in _handlers:
+        handler.stop()
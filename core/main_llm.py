@@ -1,8 +1,24 @@
 from django.conf import settings
 from crewai import LLM
 
-basic_llm = LLM(
+from core.profiling import usage_recorder
+
+
+class PowerPulseLLM(LLM):
+    """CrewAI's LLM, with each call's token usage charged to the flow profiler."""
+
+    def call(self, messages, tools=None, callbacks=None, available_functions=None):
+        return super().call(
+            messages,
+            tools=tools,
+            callbacks=[*(callbacks or []), usage_recorder],
+            available_functions=available_functions,
+        )
+
+
+basic_llm = PowerPulseLLM(
     model=settings.OPENAI_MODEL,
     temperature=settings.OPENAI_DEFAULT_TEMPERATURE,
-    api_key=settings.OPENAI_API_KEY
-)
\ No newline at end of file
+    api_key=settings.OPENAI_API_KEY,
+    stream=settings.REPLY_STREAMING,
+)
@@ -0,0 +1,77 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.broadcast import render, run_broadcast, targets
+from core.models import Broadcast
+
+
+class Command(BaseCommand):
+    help = "Send an outage notice to every consumer in a region and/or meter range, or resume an interrupted one."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--title', default="Planned Power Outage", help="First line of the notice")
+        parser.add_argument('--message', help="Body of the notice")
+        parser.add_argument('--image-url', help="Public image sent with the first message")
+        parser.add_argument('--region', default='', help="Consumers whose address contains this text")
+        parser.add_argument('--meter-prefix', default='', help="Consumers whose meter number starts with this")
+        parser.add_argument('--resume', type=int, metavar='ID', help="Continue broadcast ID where it stopped")
+        parser.add_argument('--batch-size', type=int, default=None, help="Default: BROADCAST_BATCH_SIZE")
+        parser.add_argument('--window', type=int, default=None, help="Default: BROADCAST_WINDOW")
+        parser.add_argument('--dry-run', action='store_true', help="Show the notice and recipient count without sending")
+
+    def handle(self, *args, **options):
+        if options['resume']:
+            try:
+                broadcast = Broadcast.objects.get(pk=options['resume'])
+            except Broadcast.DoesNotExist:
+                raise CommandError(f"Broadcast {options['resume']} does not exist")
+        else:
+            if not options['message']:
+                raise CommandError("--message is required for a new broadcast")
+            if not options['region'] and not options['meter_prefix']:
+                raise CommandError("Give --region and/or --meter-prefix; a broadcast never goes to everyone by accident")
+            broadcast = Broadcast(
+                title=options['title'],
+                message=options['message'],
+                image_url=options['image_url'],
+                region=options['region'],
+                meter_prefix=options['meter_prefix'],
+            )
+
+        if options['dry_run']:
+            parts = render(broadcast)
+            self.stdout.write("\n\n---\n\n".join(parts))
+            self.stdout.write(f"\n{targets(broadcast).count()} recipients, {len(parts)} message(s) each")
+            return
+
+        if broadcast.pk is None:
+            broadcast.save()
+        self.stdout.write(f"📣 Broadcast {broadcast.id}: {broadcast.title}")
+
+        stop = threading.Event()
+
+        def request_stop(signum, frame):
+            if stop.is_set():
+                raise KeyboardInterrupt
+            self.stdout.write("Stopping after the messages already queued (Ctrl-C again to abort)...")
+            stop.set()
+
+        signal.signal(signal.SIGINT, request_stop)
+        signal.signal(signal.SIGTERM, request_stop)
+
+        def progress(current):
+            self.stdout.write(f"  {current.sent}/{current.total} sent, {current.failed} failed")
+
+        broadcast = run_broadcast(
+            broadcast, batch_size=options['batch_size'], window=options['window'], stop=stop, progress=progress,
+        )
+        if broadcast.status == 'stopped':
+            self.stdout.write(self.style.WARNING(
+                f"Broadcast {broadcast.id} stopped; run with --resume {broadcast.id} to continue"
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(
+                f"Broadcast {broadcast.id} done: {broadcast.sent} sent, {broadcast.failed} failed"
+            ))
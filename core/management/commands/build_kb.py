@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.knowledge_base import KnowledgeBase, build_index
+
+
+class Command(BaseCommand):
+    help = "Index the grid codes and appliance manuals under KB_SOURCE_DIR for the agents' knowledge base."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--source', default=settings.KB_SOURCE_DIR, help="Directory of .md, .txt and .pdf files")
+        parser.add_argument('--rebuild', action='store_true', help="Re-embed every file, not only the changed ones")
+        parser.add_argument('--ivf', type=int, default=None,
+                            help=f"Number of IVF lists (0: exact search; default: sqrt(chunks) above {settings.KB_IVF_MIN_ROWS} chunks)")
+        parser.add_argument('--query', help="Run a search against the new index and print the passages")
+
+    def handle(self, *args, **options):
+        try:
+            result = build_index(options['source'], settings.KB_INDEX_DIR, rebuild=options['rebuild'], ivf_lists=options['ivf'])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not build the knowledge base: {e}")
+        if not result['files']:
+            self.stdout.write(self.style.WARNING(f"No .md, .txt or .pdf files under {options['source']}."))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {result['chunks']} chunks from {result['files']} files in {result['seconds']:.2f}s "
+            f"({result['embedded']} embedded, {result['reused']} unchanged, {result['removed']} removed, "
+            f"{result['ivf_lists'] or 'no'} IVF lists). Now serving {result['version']} from {settings.KB_INDEX_DIR}"
+        ))
+
+        if options['query']:
+            kb = KnowledgeBase(settings.KB_INDEX_DIR, top_k=settings.KB_TOP_K, probes=settings.KB_IVF_PROBES, min_score=0.0)
+            for passage in kb.search(options['query']):
+                self.stdout.write(f"\n{passage.score:.3f} [{passage.source}]\n{passage.text}")
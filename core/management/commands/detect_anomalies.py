@@ -0,0 +1,33 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.consumption import describe, detect_anomalies
+
+
+class Command(BaseCommand):
+    help = "Score every consumer's daily consumption against their own weekly pattern and record the anomalies."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help="Last day to score, YYYY-MM-DD (default: yesterday)")
+        parser.add_argument('--days', type=int, default=1, help="Score this many days ending at --date")
+        parser.add_argument('--tickets', action='store_true', default=None,
+                            help="Open a ticket for each new anomaly (default: CONSUMPTION_ANOMALY_TICKETS)")
+        parser.add_argument('--dry-run', action='store_true', help="Report anomalies without storing them")
+
+    def handle(self, *args, **options):
+        try:
+            last = date.fromisoformat(options['date']) if options['date'] else None
+        except ValueError:
+            raise CommandError(f"--date must be YYYY-MM-DD, not {options['date']!r}")
+        if options['days'] < 1:
+            raise CommandError("--days must be at least 1")
+
+        report = detect_anomalies(last, options['days'], create_tickets=options['tickets'], dry_run=options['dry_run'])
+        for anomaly in report['sample']:
+            self.stdout.write(f"  consumer {anomaly.consumer_id} {anomaly.kind:<5} z={anomaly.zscore:+.1f}  {describe(anomaly)}")
+        verb = "Would record" if options['dry_run'] else "Recorded"
+        self.stdout.write(self.style.SUCCESS(
+            f"Scored {report['scored']} consumer-days for {report['consumers']} consumers. "
+            f"{verb} {report['anomalies']} anomalies ({report['spikes']} spikes), opened {report['tickets']} tickets."
+        ))
@@ -0,0 +1,78 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.models import FlowMetrics
+from core.profiling import KINDS, percentile_table
+
+
+def _ms(seconds):
+    return f"{seconds * 1000:,.0f}ms"
+
+
+class Command(BaseCommand):
+    help = "Print p50/p95/p99 wall time, tokens and retries per flow step, crew task, LLM, tool and I/O call."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=float, default=24, help="Report on spans started in the last N hours")
+        parser.add_argument('--kind', choices=KINDS, action='append', help="Only these span kinds (repeatable)")
+        parser.add_argument('--ticket', help="Show the timeline of the run that produced this ticket instead")
+        parser.add_argument('--prune-days', type=int, help="Delete spans older than N days, then exit")
+
+    def handle(self, *args, **options):
+        if options['prune_days'] is not None:
+            cutoff = timezone.now() - timedelta(days=options['prune_days'])
+            deleted, _ = FlowMetrics.objects.filter(started_at__lt=cutoff).delete()
+            self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} spans older than {options['prune_days']} days"))
+            return
+        if options['ticket']:
+            self._timeline(options['ticket'])
+            return
+
+        since = timezone.now() - timedelta(hours=options['hours'])
+        spans = FlowMetrics.objects.filter(started_at__gte=since)
+        if options['kind']:
+            spans = spans.filter(kind__in=options['kind'])
+        rows = spans.values_list(
+            'kind', 'name', 'duration_ms', 'prompt_tokens', 'completion_tokens', 'retries', 'ok'
+        ).iterator(chunk_size=5000)
+        table = percentile_table(
+            (kind, name, duration_ms / 1000, prompt, completion, retries, ok)
+            for kind, name, duration_ms, prompt, completion, retries, ok in rows
+        )
+        if not table:
+            self.stdout.write(f"No spans recorded in the last {options['hours']:g} hours.")
+            return
+
+        flow_time = sum(row['total_s'] for row in table if row['kind'] == 'flow')
+        self.stdout.write(
+            f"{'kind':<5} {'name':<28} {'count':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'max':>9} "
+            f"{'share':>6} {'tokens in/out':>15} {'retries':>7} {'errors':>6}"
+        )
+        for row in table:
+            share = f"{row['total_s'] / flow_time:.0%}" if flow_time and row['kind'] != 'flow' else ""
+            tokens = f"{row['prompt_tokens']}/{row['completion_tokens']}" if row['prompt_tokens'] else ""
+            self.stdout.write(
+                f"{row['kind']:<5} {row['name'][:28]:<28} {row['count']:>6} {_ms(row['p50_s']):>9} "
+                f"{_ms(row['p95_s']):>9} {_ms(row['p99_s']):>9} {_ms(row['max_s']):>9} {share:>6} "
+                f"{tokens:>15} {row['retries']:>7} {row['errors']:>6}"
+            )
+
+    def _timeline(self, ticket_id):
+        trace_id = (
+            FlowMetrics.objects.filter(ticket_id=ticket_id).values_list('trace_id', flat=True).first()
+        )
+        if trace_id is None:
+            raise CommandError(f"No spans recorded for ticket {ticket_id}")
+        spans = list(FlowMetrics.objects.filter(trace_id=trace_id).order_by('started_at'))
+        origin = spans[0].started_at
+        self.stdout.write(f"Ticket {ticket_id} (trace {trace_id})")
+        for span in spans:
+            offset = (span.started_at - origin).total_seconds()
+            tokens = f"  tokens {span.prompt_tokens}/{span.completion_tokens}" if span.prompt_tokens else ""
+            retries = f"  retries {span.retries}" if span.retries else ""
+            status = "" if span.ok else "  FAILED"
+            self.stdout.write(
+                f"  +{_ms(offset):>9} {span.kind:<5} {span.name[:32]:<32} {span.duration_ms:>9,.0f}ms{tokens}{retries}{status}"
+            )
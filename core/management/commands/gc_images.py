@@ -0,0 +1,37 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.image_library import image_library
+
+
+def _megabytes(size):
+    return f"{size / (1024 * 1024):.1f} MB"
+
+
+class Command(BaseCommand):
+    help = "Report image library reuse and delete stored diagrams no response references any more."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grace-hours', type=int, default=settings.IMAGE_GC_GRACE_HOURS,
+                            help="Keep anything created or reused within this many hours")
+        parser.add_argument('--dry-run', action='store_true', help="Report what would be deleted without deleting")
+        parser.add_argument('--stats-only', action='store_true', help="Print library statistics and exit")
+
+    def handle(self, *args, **options):
+        stats = image_library.stats()
+        self.stdout.write(
+            f"Library: {stats['assets']} images ({_megabytes(stats['bytes_stored'])}), "
+            f"{stats['reuses']} reuses, hit rate {stats['hit_rate']:.1%}, "
+            f"saved {_megabytes(stats['bytes_saved'])} of downloads"
+        )
+        if options['stats_only']:
+            return
+
+        report = image_library.collect_garbage(timedelta(hours=options['grace_hours']), dry_run=options['dry_run'])
+        verb = "Would delete" if options['dry_run'] else "Deleted"
+        self.stdout.write(self.style.SUCCESS(
+            f"{verb} {report['assets_deleted']} unreferenced assets, {report['files_deleted']} files in total "
+            f"({_megabytes(report['bytes_freed'])})"
+        ))
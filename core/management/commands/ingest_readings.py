@@ -0,0 +1,56 @@
+import csv
+from datetime import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.consumption import ingest
+from core.models import EnergyConsumer
+
+
+class Command(BaseCommand):
+    help = "Load meter readings from CSV files (meter_number,read_at,wh) and refresh the consumption rollups."
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help="CSV files with a meter_number,read_at,wh header")
+        parser.add_argument('--batch-size', type=int, default=None, help="Default: CONSUMPTION_INGEST_BATCH_SIZE")
+
+    def handle(self, *args, **options):
+        meters = dict(
+            EnergyConsumer.objects.exclude(meter_number__isnull=True).values_list('meter_number', 'id').iterator(chunk_size=10000)
+        )
+        unknown = set()
+
+        def readings(path):
+            with open(path, newline='', encoding='utf-8') as f:
+                reader = csv.DictReader(f)
+                missing = {'meter_number', 'read_at', 'wh'} - set(reader.fieldnames or ())
+                if missing:
+                    raise CommandError(f"{path} has no {', '.join(sorted(missing))} column")
+                for line, row in enumerate(reader, start=2):
+                    consumer_id = meters.get(row['meter_number'])
+                    if consumer_id is None:
+                        unknown.add(row['meter_number'])
+                        continue
+                    try:
+                        read_at = datetime.fromisoformat(row['read_at'])
+                        wh = int(float(row['wh']))
+                    except ValueError as e:
+                        raise CommandError(f"{path}:{line}: {e}")
+                    if timezone.is_naive(read_at):
+                        read_at = timezone.make_aware(read_at)
+                    yield consumer_id, read_at, wh
+
+        for path in options['paths']:
+            try:
+                result = ingest(readings(path), batch_size=options['batch_size'])
+            except OSError as e:
+                raise CommandError(f"Could not read {path}: {e}")
+            self.stdout.write(self.style.SUCCESS(
+                f"{path}: {result['readings']} readings ({result['inserted']} new) for {result['consumers']} meters, "
+                f"{result['days']} daily rollups refreshed"
+            ))
+        if unknown:
+            self.stdout.write(self.style.WARNING(
+                f"Skipped readings for {len(unknown)} unknown meters, e.g. {', '.join(sorted(unknown)[:5])}"
+            ))
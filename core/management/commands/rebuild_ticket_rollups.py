@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.ticket_rollups import rebuild
+
+
+class Command(BaseCommand):
+    help = "Recount ServiceTicket into the hourly TicketRollup buckets (backfill, or repair after a QuerySet.update())."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=50000, help="Tickets counted per query")
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError("--chunk-size must be at least 1")
+
+        def progress(done, total):
+            self.stdout.write(f"  {done:,}/{total:,} ids counted")
+
+        result = rebuild(options['chunk_size'], progress=progress if options['verbosity'] else None)
+        self.stdout.write(self.style.SUCCESS(
+            f"Counted {result['tickets']:,} tickets into {result['buckets']:,} hourly buckets "
+            f"({result['corrected']:,} corrected)."
+        ))
@@ -0,0 +1,120 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def worker_main(index, lease_seconds, poll_interval, drain, stop_event):
+    # Module-level so it can be pickled when processes are spawned (Windows/macOS).
+    import django
+    django.setup()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    asyncio.run(_worker_loop(worker_id, lease_seconds, poll_interval, drain, stop_event))
+    # Child processes exit without running atexit hooks, so flush write-behind rows here.
+    from core import logs
+    from core.dispatch import dispatcher
+    from core.persistence import write_behind
+    from core.profiling import profiler
+    write_behind.flush()
+    profiler.writer.flush(5.0)
+    dispatcher.sid_writer.flush(5.0)
+    logs.stop()
+
+
+async def _heartbeat(job, lease_seconds):
+    from asgiref.sync import sync_to_async
+    from core.jobs import extend_lease
+
+    while True:
+        await asyncio.sleep(lease_seconds / 3)
+        await sync_to_async(extend_lease)(job, lease_seconds)
+
+
+async def _worker_loop(worker_id, lease_seconds, poll_interval, drain, stop_event):
+    from asgiref.sync import sync_to_async
+    from core import jobs
+    from core.media import deliver_queued_image
+    from core.views import process_message, resend_reply
+
+    logger.info(f"👷 Worker {worker_id} started")
+    while not stop_event.is_set():
+        job = await sync_to_async(jobs.claim_job)(worker_id, lease_seconds)
+        if job is None:
+            await sync_to_async(jobs.dead_letter_abandoned_jobs)()
+            if drain:
+                break
+            await asyncio.sleep(poll_interval)
+            continue
+
+        heartbeat = asyncio.create_task(_heartbeat(job, lease_seconds))
+        try:
+            if job.kind == 'media':
+                await deliver_queued_image(job.from_number, job.payload or {})
+            elif job.ticket_ref:
+                # An earlier attempt stored the answer but could not send it.
+                await resend_reply(job.ticket_ref, job.from_number)
+            else:
+                await process_message(job.message_body, job.from_number)
+        except Exception as e:
+            await sync_to_async(jobs.fail_job)(
+                job, f"{type(e).__name__}: {e}", ticket_ref=getattr(e, 'ticket_ref', None),
+            )
+        else:
+            await sync_to_async(jobs.complete_job)(job)
+            logger.info(f"✅ Worker {worker_id} finished Job #{job.id}")
+        finally:
+            heartbeat.cancel()
+    logger.info(f"👋 Worker {worker_id} stopped")
+
+
+class Command(BaseCommand):
+    help = "Drain the durable FlowJob queue with one or more worker processes."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=1, help="Number of worker processes")
+        parser.add_argument('--lease', type=int, default=None, help="Lease length in seconds (default: JOB_LEASE_SECONDS)")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty")
+        parser.add_argument('--drain', action='store_true', help="Exit once the queue is empty instead of polling")
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+
+        concurrency = max(1, options['concurrency'])
+        lease_seconds = options['lease'] or settings.JOB_LEASE_SECONDS
+        stop_event = multiprocessing.Event()
+
+        # Never hand an open DB connection to forked children.
+        connections.close_all()
+
+        processes = [
+            multiprocessing.Process(
+                target=worker_main,
+                args=(i, lease_seconds, options['poll_interval'], options['drain'], stop_event),
+                name=f"powerpulse-worker-{i}",
+            )
+            for i in range(concurrency)
+        ]
+        for process in processes:
+            process.start()
+        self.stdout.write(self.style.SUCCESS(f"Started {concurrency} worker process(es)"))
+
+        def request_stop(signum, frame):
+            stop_event.set()
+
+        signal.signal(signal.SIGTERM, request_stop)
+        try:
+            for process in processes:
+                process.join()
+        except KeyboardInterrupt:
+            self.stdout.write("Stopping workers after their current job...")
+            stop_event.set()
+            for process in processes:
+                process.join()
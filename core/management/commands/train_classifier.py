@@ -0,0 +1,41 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.classifier import CATEGORIES, HashedNgramModel
+from core.models import ServiceTicket
+
+
+class Command(BaseCommand):
+    help = "Train the fast-path request classifier from the categories the LLM gave stored tickets."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-samples', type=int, default=30, help="Refuse to train on fewer labelled tickets")
+        parser.add_argument('--epochs', type=int, default=200)
+        parser.add_argument('--limit', type=int, default=50000, help="Use at most this many of the newest tickets")
+
+    def handle(self, *args, **options):
+        # Only the LLM's labels: learning from the fast path's own (keywords,
+        # this model, a follow-up's carried-over category) or from the fallback
+        # default would only reinforce its mistakes. Tickets written before
+        # classified_by existed have no source and are left out too.
+        rows = list(
+            ServiceTicket.objects
+            .filter(ticket_id__isnull=False, category__in=CATEGORIES, classified_by='llm')
+            .order_by('-created_at')
+            .values_list('issue_description', 'category')[:options['limit']]
+        )
+        if len(rows) < options['min_samples']:
+            raise CommandError(f"Only {len(rows)} LLM-labelled tickets found (need {options['min_samples']}).")
+        if len({category for _, category in rows}) < 2:
+            raise CommandError("Training data contains a single category; nothing to learn.")
+
+        texts, labels = zip(*rows)
+        model = HashedNgramModel().fit(texts, labels, epochs=options['epochs'])
+
+        predicted = model.predict_proba(texts).argmax(axis=1)
+        accuracy = sum(CATEGORIES[p] == label for p, label in zip(predicted, labels)) / len(labels)
+
+        model.save(settings.CLASSIFIER_MODEL_PATH)
+        self.stdout.write(self.style.SUCCESS(
+            f"Trained on {len(rows)} tickets (training accuracy {accuracy:.1%}). Saved to {settings.CLASSIFIER_MODEL_PATH}"
+        ))
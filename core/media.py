@@ -0,0 +1,177 @@
+"""
+PowerPulse AI - Media Stage
+Diagram generation, download and delivery happen after the text reply has been
+sent, on the pipeline's "media" stage, so image latency never delays the first
+reply. With MESSAGE_QUEUE_BACKEND=database the delivery is queued as a 'media'
+FlowJob instead, since run_workers processes may exit (or restart) before
+their in-process pipeline gets to it. Before generating, the image library is asked for a stored diagram drawn
+for a similar query, which is sent instead. Stored diagrams go out as their
+IMAGE_DISPATCH_VARIANT (core/image_variants.py) rather than the full-size PNG.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+from concurrent.futures import Future
+from django.conf import settings
+from django.utils import timezone
+
+from core.image_library import image_library
+from core.jobs import enqueue_media
+from core.image_variants import image_variants
+from core.logs import log_context
+from core.models import GeneratedEnergyContent
+from core.pipeline import get_pipeline, stage
+from core.profiling import profiler
+from core.tools.dalle_tool import energy_visual_tool
+from core.tools.whatsapp_sender import send_energy_update_to_whatsapp
+from core.response_cache import IMAGE_URL_MAX_AGE
+from core.utils import download_image
+
+logger = logging.getLogger(__name__)
+
+
+def public_media_url(name: str) -> str | None:
+    """Absolute URL Twilio can fetch for a stored file, if the host is publicly reachable."""
+    if not settings.PUBLIC_BASE_URL:
+        return None
+    return f"{settings.PUBLIC_BASE_URL.rstrip('/')}{settings.MEDIA_URL}{name}"
+
+
+def _dispatch_variant() -> str | None:
+    variant = settings.IMAGE_DISPATCH_VARIANT
+    return variant if settings.IMAGE_VARIANTS_ENABLED and variant in image_variants.variants else None
+
+
+def dispatch_media_url(name: str) -> str | None:
+    """public_media_url() of the variant sent to WhatsApp, or of the original when variants are off."""
+    variant = _dispatch_variant()
+    return public_media_url(image_variants.url_name(name, variant) if variant else name)
+
+
+async def _prepare_media_url(name: str) -> str | None:
+    """Transcode the dispatch variant now, so Twilio's fetch is a cache hit; the original if that fails."""
+    url = dispatch_media_url(name)
+    variant = _dispatch_variant()
+    if url and variant and await image_variants.aensure(name, variant) is None:
+        return public_media_url(name)
+    return url
+
+
+def _library_context(content_id: int | None, prompt: str | None) -> tuple[str, str]:
+    """(subject, category) the library files an image under: the user's query, not the DALL-E template."""
+    row = None
+    if content_id:
+        row = GeneratedEnergyContent.objects.filter(id=content_id).values_list('prompt_used', 'ticket__category').first()
+    if row is None:
+        return prompt or '', ''
+    return row[0], row[1] or ''
+
+
+def _reusable_url(asset) -> str | None:
+    url = dispatch_media_url(asset.file.name)
+    if url:
+        return url
+    # Without a public host the only URL Twilio can fetch is the original DALL-E one.
+    if asset.source_url and (timezone.now() - asset.created_at).total_seconds() < IMAGE_URL_MAX_AGE:
+        return asset.source_url
+    return None
+
+
+def _find_reusable(content_id: int | None, prompt: str | None) -> str | None:
+    if not settings.IMAGE_LIBRARY_ENABLED:
+        return None
+    subject, category = _library_context(content_id, prompt)
+    match = image_library.find(subject, category)
+    if match is None:
+        return None
+    asset, score = match
+    url = _reusable_url(asset)
+    if url is None:
+        return None
+    image_library.reuse(asset, content_id)
+    logger.info(f"Reusing stored diagram {asset.file.name} (similarity {score:.2f}) for content {content_id}")
+    return url
+
+
+def _store_image(content_id: int | None, image_url: str, prompt: str | None = None) -> str | None:
+    if settings.IMAGE_LIBRARY_ENABLED:
+        subject, category = _library_context(content_id, prompt)
+        asset = image_library.store(image_url, subject, category, content_id)
+        return asset.file.name if asset else None
+    name = download_image(image_url)
+    if name and content_id:
+        GeneratedEnergyContent.objects.filter(id=content_id).update(generated_image=name, image_url=image_url)
+    return name
+
+
+async def deliver_image(content_id, to_number, ticket_ref=None, image_url=None, prompt=None):
+    # Pipeline workers are long-lived tasks, so the flow's log context is not inherited; bind it again.
+    with log_context(ticket=ticket_ref, phone=to_number.replace("whatsapp:", "").strip()):
+        return await _deliver_image(content_id, to_number, ticket_ref, image_url, prompt)
+
+
+async def _deliver_image(content_id, to_number, ticket_ref, image_url, prompt):
+    if isinstance(content_id, Future):
+        # Write-behind persistence: the row exists once its batch is committed.
+        try:
+            content_id = await asyncio.wrap_future(content_id)
+        except Exception as e:
+            logger.warning(f"Content for {ticket_ref} was not persisted ({e}); image will not be linked")
+            content_id = None
+    async with stage("media"):
+        if not image_url and prompt:
+            reused_url = await asyncio.to_thread(_find_reusable, content_id, prompt)
+            if reused_url:
+                return await _send_image(to_number, ticket_ref, reused_url)
+            result = await asyncio.to_thread(profiler.call, "tool", "energy_visual_tool", energy_visual_tool._run, prompt)
+            if not result.startswith("http"):
+                logger.warning(f"Follow-up diagram skipped for {to_number}: {result}")
+                return None
+            image_url = result
+        if not image_url:
+            return None
+
+        name = await asyncio.to_thread(_store_image, content_id, image_url, prompt)
+        media_url = (await _prepare_media_url(name) if name else None) or image_url
+        logger.info(f"Follow-up media for {to_number} stored as {name}")
+        return await _send_image(to_number, ticket_ref, media_url)
+
+
+async def _send_image(to_number, ticket_ref, media_url):
+    caption = f"🖼️ Visual guide for Ref ID: {ticket_ref}" if ticket_ref else "🖼️ Visual guide"
+    sid = await asyncio.to_thread(
+        profiler.call, "io", "twilio_send_media",
+        send_energy_update_to_whatsapp, to=to_number, text=caption, image_url=media_url,
+        key=f"{ticket_ref}:media" if ticket_ref else None,
+    )
+    logger.info(f"Follow-up media sent to {to_number}, SID {sid}")
+    return sid
+
+
+def _content_id(ticket_ref: str | None) -> int | None:
+    if not ticket_ref:
+        return None
+    return GeneratedEnergyContent.objects.filter(ticket__ticket_id=ticket_ref).values_list('id', flat=True).first()
+
+
+async def deliver_queued_image(to_number: str, payload: dict):
+    """Run a 'media' FlowJob (jobs.enqueue_media) in a worker."""
+    ticket_ref = payload.get("ticket_ref")
+    # A write-behind row had no id yet when the job was queued.
+    content_id = payload.get("content_id") or await asyncio.to_thread(_content_id, ticket_ref)
+    return await deliver_image(content_id, to_number, ticket_ref, payload.get("image_url"), payload.get("prompt"))
+
+
+def schedule_image_delivery(content_id, to_number, ticket_ref=None, image_url=None, prompt=None) -> bool:
+    """Queue the follow-up media message; safe to call from any thread."""
+    if not image_url and not prompt:
+        return False
+    if settings.MESSAGE_QUEUE_BACKEND == 'database':
+        enqueue_media(to_number, ticket_ref, content_id if isinstance(content_id, int) else None, image_url, prompt)
+        return True
+    queued = get_pipeline().submit(
+        deliver_image, content_id, to_number, ticket_ref, image_url, prompt, key=to_number, priority="background",
+    )
+    if not queued:
+        logger.warning(f"Media stage full, dropping follow-up image for {to_number}")
+    return queued
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.16 on 2026-10-18 10:45
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_flowjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageAsset',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.ImageField(upload_to='generated_images/')),
+                ('size_bytes', models.PositiveIntegerField(default=0)),
+                ('category', models.CharField(blank=True, default='', max_length=30)),
+                ('subject', models.TextField(help_text='Normalized user query the image was generated for')),
+                ('signature', models.BinaryField(help_text='MinHash signature of the subject')),
+                ('source_url', models.URLField(blank=True, max_length=1000, null=True)),
+                ('reuse_count', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='generatedenergycontent',
+            name='image_asset',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='contents', to='core.imageasset'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_imageasset'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='generatedenergycontent',
+            index=models.Index(fields=['-created_at'], name='content_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceticket',
+            index=models.Index(fields=['status', '-created_at'], name='ticket_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceticket',
+            index=models.Index(fields=['category', '-created_at'], name='ticket_category_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceticket',
+            index=models.Index(fields=['urgency', '-created_at'], name='ticket_urgency_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceticket',
+            index=models.Index(fields=['consumer', '-created_at'], name='ticket_consumer_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='serviceticket',
+            index=models.Index(condition=models.Q(('status', 'open'), ('urgency', 'high')), fields=['-created_at'], name='ticket_open_high_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:08
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_ticket_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConversationSession',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('phone_number', models.CharField(max_length=20, unique=True)),
+                ('summary', models.TextField(blank=True, default='')),
+                ('turns', models.JSONField(blank=True, default=list)),
+                ('last_category', models.CharField(blank=True, default='', max_length=30)),
+                ('last_ticket_id', models.CharField(blank=True, default='', max_length=20)),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.16 on 2026-10-18 11:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_conversationsession'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FlowMetrics',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('trace_id', models.CharField(db_index=True, help_text='Shared by every span of one flow run', max_length=32)),
+                ('ticket_id', models.CharField(blank=True, default='', max_length=20)),
+                ('kind', models.CharField(choices=[('flow', 'Flow run'), ('step', 'Flow step'), ('task', 'Crew task'), ('llm', 'LLM call'), ('tool', 'Tool call'), ('io', 'I/O call')], max_length=10)),
+                ('name', models.CharField(max_length=100)),
+                ('started_at', models.DateTimeField()),
+                ('duration_ms', models.FloatField()),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('completion_tokens', models.PositiveIntegerField(default=0)),
+                ('retries', models.PositiveSmallIntegerField(default=0)),
+                ('ok', models.BooleanField(default=True)),
+            ],
+            options={
+                'verbose_name_plural': 'flow metrics',
+                'indexes': [models.Index(fields=['started_at'], name='flowmetrics_started_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:08
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_broadcast'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MeterReading',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('read_at', models.DateTimeField()),
+                ('wh', models.PositiveIntegerField(help_text='Watt-hours used in the interval')),
+                ('consumer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='readings', to='core.energyconsumer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ConsumptionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.CharField(choices=[('day', 'Day'), ('month', 'Month')], max_length=5)),
+                ('period_start', models.DateField()),
+                ('kwh', models.FloatField()),
+                ('readings', models.PositiveIntegerField(default=0)),
+                ('peak_wh', models.PositiveIntegerField(default=0, help_text='Largest single reading in the period')),
+                ('consumer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='core.energyconsumer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ConsumptionAnomaly',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('kind', models.CharField(choices=[('spike', 'Spike'), ('drop', 'Drop')], max_length=10)),
+                ('kwh', models.FloatField()),
+                ('expected_kwh', models.FloatField()),
+                ('zscore', models.FloatField()),
+                ('detected_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('consumer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='core.energyconsumer')),
+                ('ticket', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='anomalies', to='core.serviceticket')),
+            ],
+            options={
+                'verbose_name_plural': 'consumption anomalies',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='meterreading',
+            constraint=models.UniqueConstraint(fields=('consumer', 'read_at'), name='meter_reading_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='consumptionrollup',
+            index=models.Index(fields=['period', 'period_start'], name='rollup_period_start_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='consumptionrollup',
+            constraint=models.UniqueConstraint(fields=('consumer', 'period', 'period_start'), name='consumption_rollup_unique'),
+        ),
+        migrations.AddIndex(
+            model_name='consumptionanomaly',
+            index=models.Index(fields=['-day'], name='anomaly_day_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='consumptionanomaly',
+            constraint=models.UniqueConstraint(fields=('consumer', 'day'), name='consumption_anomaly_unique'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_meterreading'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TicketRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hour', models.DateTimeField()),
+                ('category', models.CharField(choices=[('emergency', 'Emergency'), ('technical_fault', 'Technical Fault'), ('energy_advice', 'Energy Advice')], max_length=30)),
+                ('urgency', models.CharField(choices=[('low', 'Low (Consultation)'), ('high', 'High (Danger/Power Outage)')], max_length=20)),
+                ('status', models.CharField(choices=[('open', 'Open'), ('in_progress', 'In Progress'), ('resolved', 'Resolved')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ticketrollup',
+            constraint=models.UniqueConstraint(fields=('hour', 'category', 'urgency', 'status'), name='ticket_rollup_unique'),
+        ),
+    ]
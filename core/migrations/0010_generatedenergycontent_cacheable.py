@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 12:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_ticketrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='generatedenergycontent',
+            name='cacheable',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_generatedenergycontent_cacheable'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flowjob',
+            name='ticket_ref',
+            field=models.CharField(blank=True, help_text='Ticket of an answer already stored whose reply failed; a retry only resends it', max_length=20, null=True),
+        ),
+    ]
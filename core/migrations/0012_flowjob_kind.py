@@ -0,0 +1,23 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_flowjob_ticket_ref'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='flowjob',
+            name='kind',
+            field=models.CharField(choices=[('message', 'Inbound Message'), ('media', 'Follow-up Diagram')], default='message', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='flowjob',
+            name='payload',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.16 on 2026-10-18 13:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_flowjob_kind'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='serviceticket',
+            name='classified_by',
+            field=models.CharField(blank=True, default='', help_text='How the category was chosen: llm, keywords, model, keywords+model, conversation or default', max_length=20),
+        ),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 class EnergyConsumer(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, null=True, blank=True)
@@ -9,7 +10,8 @@ class EnergyConsumer(models.Model):
     average_consumption = models.FloatField(default=0.0, help_text="Average monthly consumption in kWh")
 
     def __str__(self):
-        return f"{self.phone_number} - {self.user.username if self.user else 'WhatsApp Guest'}"
+        # user_id is checked first so WhatsApp guests (no user) never cost a query.
+        return f"{self.phone_number} - {self.user.username if self.user_id else 'WhatsApp Guest'}"
 
 class ServiceTicket(models.Model):
     STATUS_CHOICES = [
@@ -31,11 +33,32 @@ class ServiceTicket(models.Model):
     ticket_id = models.CharField(max_length=20, unique=True, null=True, blank=True)
     issue_description = models.TextField()
     category = models.CharField(max_length=30, choices=CATEGORY_CHOICES, default='energy_advice')
+    classified_by = models.CharField(
+        max_length=20, blank=True, default='',
+        help_text="How the category was chosen: llm, keywords, model, keywords+model, conversation or default",
+    )
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='open')
     urgency = models.CharField(max_length=20, choices=URGENCY_CHOICES, default='low')
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # Admin changelist filters, newest first.
+            models.Index(fields=['status', '-created_at'], name='ticket_status_created_idx'),
+            models.Index(fields=['category', '-created_at'], name='ticket_category_created_idx'),
+            models.Index(fields=['urgency', '-created_at'], name='ticket_urgency_created_idx'),
+            # Per-consumer history.
+            models.Index(fields=['consumer', '-created_at'], name='ticket_consumer_created_idx'),
+            # The dispatcher's queue: open high-urgency tickets are a small slice of the table.
+            models.Index(
+                fields=['-created_at'],
+                name='ticket_open_high_idx',
+                condition=models.Q(status='open', urgency='high'),
+            ),
+        ]
+
     def __str__(self):
+        # Reads consumer: list with select_related('consumer') to avoid a query per row.
         return f"Ticket {self.ticket_id or self.id} - {self.consumer.phone_number}"
 
 class GeneratedEnergyContent(models.Model):
@@ -46,9 +69,255 @@ class GeneratedEnergyContent(models.Model):
     image_url = models.URLField(max_length=1000, null=True, blank=True)
     
     generated_image = models.ImageField(upload_to='generated_images/', null=True, blank=True)
+    image_asset = models.ForeignKey('ImageAsset', on_delete=models.SET_NULL, null=True, blank=True, related_name='contents')
     
     whatsapp_sid = models.CharField(max_length=100, null=True, blank=True) # تتبع حالة الإرسال في تويليو
     created_at = models.DateTimeField(auto_now_add=True)
+    # Whether the answer may be served to other numbers by the response cache;
+    # false for answers that depend on this consumer's conversation or meter readings.
+    cacheable = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at'], name='content_created_idx'),
+        ]
+
+    def __str__(self):
+        # Reads ticket: list with select_related('ticket') to avoid a query per row.
+        return f"AI Response for Ticket {self.ticket.ticket_id if self.ticket_id else 'N/A'}"
+
+class ImageAsset(models.Model):
+    """One stored diagram, named by the SHA-256 of its bytes and shared by every response that reuses it."""
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.ImageField(upload_to='generated_images/')
+    size_bytes = models.PositiveIntegerField(default=0)
+    category = models.CharField(max_length=30, blank=True, default='')
+    subject = models.TextField(help_text="Normalized user query the image was generated for")
+    signature = models.BinaryField(help_text="MinHash signature of the subject")
+    source_url = models.URLField(max_length=1000, null=True, blank=True)
+    reuse_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.file.name} ({self.category or 'uncategorized'}, reused {self.reuse_count}x)"
+
+class ConversationSession(models.Model):
+    """Per-number conversation memory: a rolling summary plus the last few turns (core/conversations.py)."""
+    phone_number = models.CharField(max_length=20, unique=True)
+    summary = models.TextField(blank=True, default='')
+    turns = models.JSONField(default=list, blank=True)
+    last_category = models.CharField(max_length=30, blank=True, default='')
+    last_ticket_id = models.CharField(max_length=20, blank=True, default='')
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Conversation {self.phone_number} ({len(self.turns)} recent turns)"
+
+class FlowMetrics(models.Model):
+    """One timed span of a flow run: the run itself, a step, a crew task, or an LLM, tool or I/O call (core/profiling.py)."""
+    KIND_CHOICES = [
+        ('flow', 'Flow run'),
+        ('step', 'Flow step'),
+        ('task', 'Crew task'),
+        ('llm', 'LLM call'),
+        ('tool', 'Tool call'),
+        ('io', 'I/O call'),
+    ]
+
+    trace_id = models.CharField(max_length=32, db_index=True, help_text="Shared by every span of one flow run")
+    ticket_id = models.CharField(max_length=20, blank=True, default='')
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    name = models.CharField(max_length=100)
+    started_at = models.DateTimeField()
+    duration_ms = models.FloatField()
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    completion_tokens = models.PositiveIntegerField(default=0)
+    retries = models.PositiveSmallIntegerField(default=0)
+    ok = models.BooleanField(default=True)
+
+    class Meta:
+        verbose_name_plural = 'flow metrics'
+        indexes = [
+            models.Index(fields=['started_at'], name='flowmetrics_started_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.name} {self.duration_ms:.0f}ms"
+
+class FlowJob(models.Model):
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('dead', 'Dead Letter'),
+    ]
+    KIND_CHOICES = [
+        ('message', 'Inbound Message'),
+        ('media', 'Follow-up Diagram'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES, default='message')
+    # deliver_image() arguments of a 'media' job (core/media.py).
+    payload = models.JSONField(null=True, blank=True)
+    message_body = models.TextField()
+    from_number = models.CharField(max_length=40)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    available_at = models.DateTimeField(default=timezone.now, help_text="Earliest time the job may be claimed")
+    locked_by = models.CharField(max_length=100, null=True, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True, help_text="Lease expiry; expired leases can be reclaimed")
+    last_error = models.TextField(null=True, blank=True)
+    ticket_ref = models.CharField(
+        max_length=20, null=True, blank=True,
+        help_text="Ticket of an answer already stored whose reply failed; a retry only resends it",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='flowjob_status_available_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job {self.id} ({self.status}) - {self.from_number}"
+
+class Broadcast(models.Model):
+    """One outage notice fanned out to every consumer matching a region and/or meter prefix (core/broadcast.py)."""
+    STATUS_CHOICES = [
+        ('pending', 'Pending'),
+        ('running', 'Running'),
+        ('stopped', 'Stopped'),
+        ('done', 'Done'),
+    ]
+
+    title = models.CharField(max_length=200)
+    message = models.TextField()
+    image_url = models.URLField(max_length=1000, null=True, blank=True)
+    region = models.CharField(max_length=200, blank=True, default='', help_text="Matched against the consumer's address")
+    meter_prefix = models.CharField(max_length=50, blank=True, default='')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    total = models.PositiveIntegerField(default=0)
+    sent = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Broadcast {self.id}: {self.title} ({self.status}, {self.sent}/{self.total})"
+
+class BroadcastDelivery(models.Model):
+    """Outcome per recipient; a resumed broadcast skips everyone already marked sent."""
+    STATUS_CHOICES = [
+        ('sent', 'Sent'),
+        ('failed', 'Failed'),
+    ]
+
+    broadcast = models.ForeignKey(Broadcast, on_delete=models.CASCADE, related_name='deliveries')
+    consumer = models.ForeignKey(EnergyConsumer, on_delete=models.CASCADE, related_name='broadcast_deliveries')
+    phone_number = models.CharField(max_length=20)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    whatsapp_sid = models.CharField(max_length=100, null=True, blank=True)
+    updated_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = 'broadcast deliveries'
+        constraints = [
+            models.UniqueConstraint(fields=['broadcast', 'consumer'], name='broadcast_delivery_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['broadcast', 'status'], name='broadcast_delivery_status_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.phone_number} ({self.status}) for broadcast {self.broadcast_id}"
+
+class MeterReading(models.Model):
+    """Energy used in the interval ending at `read_at`, as reported by the meter (core/consumption.py)."""
+    consumer = models.ForeignKey(EnergyConsumer, on_delete=models.CASCADE, related_name='readings')
+    read_at = models.DateTimeField()
+    # Whole watt-hours: SQLite stores small integers in 1-4 bytes, a REAL in 8.
+    wh = models.PositiveIntegerField(help_text="Watt-hours used in the interval")
+
+    class Meta:
+        constraints = [
+            # Also the index for per-consumer range scans; a re-sent file is ignored row by row.
+            models.UniqueConstraint(fields=['consumer', 'read_at'], name='meter_reading_unique'),
+        ]
+
+    def __str__(self):
+        return f"{self.consumer_id} @ {self.read_at:%Y-%m-%d %H:%M}: {self.wh} Wh"
+
+class ConsumptionRollup(models.Model):
+    """Total consumption per consumer per day or month, kept current by ingest."""
+    PERIOD_CHOICES = [
+        ('day', 'Day'),
+        ('month', 'Month'),
+    ]
+
+    consumer = models.ForeignKey(EnergyConsumer, on_delete=models.CASCADE, related_name='rollups')
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    period_start = models.DateField()
+    kwh = models.FloatField()
+    readings = models.PositiveIntegerField(default=0)
+    peak_wh = models.PositiveIntegerField(default=0, help_text="Largest single reading in the period")
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['consumer', 'period', 'period_start'], name='consumption_rollup_unique'),
+        ]
+        indexes = [
+            # The detector reads one period range across every consumer.
+            models.Index(fields=['period', 'period_start'], name='rollup_period_start_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.consumer_id} {self.period} {self.period_start}: {self.kwh:.1f} kWh"
+
+class ConsumptionAnomaly(models.Model):
+    """A day whose consumption is far from the consumer's own weekly pattern."""
+    KIND_CHOICES = [
+        ('spike', 'Spike'),
+        ('drop', 'Drop'),
+    ]
+
+    consumer = models.ForeignKey(EnergyConsumer, on_delete=models.CASCADE, related_name='anomalies')
+    day = models.DateField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    kwh = models.FloatField()
+    expected_kwh = models.FloatField()
+    zscore = models.FloatField()
+    ticket = models.ForeignKey(ServiceTicket, on_delete=models.SET_NULL, null=True, blank=True, related_name='anomalies')
+    detected_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        verbose_name_plural = 'consumption anomalies'
+        constraints = [
+            models.UniqueConstraint(fields=['consumer', 'day'], name='consumption_anomaly_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['-day'], name='anomaly_day_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} on {self.day} for consumer {self.consumer_id}: {self.kwh:.1f} kWh vs {self.expected_kwh:.1f}"
+
+class TicketRollup(models.Model):
+    """Tickets created in one hour, by their current category, urgency and status (core/ticket_rollups.py)."""
+    hour = models.DateTimeField()
+    category = models.CharField(max_length=30, choices=ServiceTicket.CATEGORY_CHOICES)
+    urgency = models.CharField(max_length=20, choices=ServiceTicket.URGENCY_CHOICES)
+    status = models.CharField(max_length=20, choices=ServiceTicket.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            # Leading on hour, it is also the index for dashboard range reads.
+            models.UniqueConstraint(fields=['hour', 'category', 'urgency', 'status'], name='ticket_rollup_unique'),
+        ]
 
     def __str__(self):
-        return f"AI Response for Ticket {self.ticket.ticket_id if self.ticket else 'N/A'}"
\ No newline at end of file
+        return f"{self.hour:%Y-%m-%d %H:00} {self.category}/{self.urgency}/{self.status}: {self.count}"
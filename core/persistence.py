@@ -0,0 +1,278 @@
+"""
+PowerPulse AI - Interaction Persistence
+Everything a handled message leaves in the database (consumer, one ServiceTicket,
+one GeneratedEnergyContent) is written as a single atomic unit. Ticket IDs are
+generated up front, so the reply can quote its Ref ID before the rows exist.
+That makes the optional write-behind mode possible: records are queued and a
+background thread group-commits them with bulk_create, turning N messages into a
+handful of queries inside one transaction.
+"""
+from __future__ import annotations
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from functools import partial
+
+from django.conf import settings
+from django.db import IntegrityError, connections, transaction
+
+from core.classifier import detect_emergency
+
+logger = logging.getLogger(__name__)
+
+
+def new_ticket_id() -> str:
+    return f"TIC-{uuid.uuid4().hex[:6].upper()}"
+
+
+@dataclass
+class InteractionRecord:
+    phone_number: str
+    user_query: str
+    category: str
+    generated_text: str
+    image_url: str | None = None
+    ticket_id: str = field(default_factory=new_ticket_id)
+    # May the response cache reuse this answer for other numbers (core/response_cache.py)?
+    cacheable: bool = False
+    # ServiceTicket.classified_by: how `category` was chosen.
+    classified_by: str = ''
+
+    @property
+    def urgency(self) -> str:
+        return 'high' if self.category == 'emergency' or detect_emergency(self.user_query) else 'low'
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """connection_created receiver: WAL lets readers and the single writer proceed concurrently."""
+    if connection.vendor != 'sqlite' or not settings.SQLITE_JOURNAL_MODE:
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+
+
+def _ensure_consumers(model, phones):
+    # INSERT ... ON CONFLICT DO NOTHING rather than get_or_create: it cannot race
+    # another writer into an IntegrityError, and on SQLite it takes the write lock
+    # as the transaction's first statement, so two transactions never deadlock
+    # trying to upgrade from a read lock.
+    model.objects.bulk_create(
+        [model(phone_number=phone, average_consumption=0.0) for phone in phones],
+        ignore_conflicts=True,
+    )
+
+
+def persist_interaction(record: InteractionRecord, reassign_ticket_id: bool = True) -> int:
+    """
+    Write one message's consumer, ticket and content in a single transaction;
+    returns the content id. Ticket IDs are short random strings, so a collision
+    is retried with a fresh ID unless the caller has already quoted this one.
+    """
+    from core.models import ServiceTicket
+
+    for attempt in range(3):
+        try:
+            return _persist_interaction(record)
+        except IntegrityError:
+            if not reassign_ticket_id or attempt == 2 or not ServiceTicket.objects.filter(ticket_id=record.ticket_id).exists():
+                raise
+            record.ticket_id = new_ticket_id()
+
+
+def _persist_interaction(record: InteractionRecord) -> int:
+    from core.models import EnergyConsumer, GeneratedEnergyContent, ServiceTicket
+
+    with transaction.atomic():
+        _ensure_consumers(EnergyConsumer, {record.phone_number})
+        consumer_id = EnergyConsumer.objects.filter(phone_number=record.phone_number).values_list('id', flat=True).get()
+        ticket = ServiceTicket.objects.create(
+            consumer_id=consumer_id,
+            ticket_id=record.ticket_id,
+            issue_description=record.user_query,
+            category=record.category,
+            classified_by=record.classified_by,
+            urgency=record.urgency,
+            status='open',
+        )
+        content = GeneratedEnergyContent.objects.create(
+            ticket=ticket,
+            prompt_used=record.user_query,
+            generated_text=record.generated_text,
+            image_url=record.image_url,
+            cacheable=record.cacheable,
+        )
+    return content.id
+
+
+def persist_batch(records: list[InteractionRecord]) -> list[int]:
+    """Group-commit many interactions: a fixed number of queries however large the batch is."""
+    from core.models import EnergyConsumer, GeneratedEnergyContent, ServiceTicket
+    from core.ticket_rollups import record_created
+
+    phones = {record.phone_number for record in records}
+    with transaction.atomic():
+        _ensure_consumers(EnergyConsumer, phones)
+        consumers = dict(
+            EnergyConsumer.objects.filter(phone_number__in=phones).values_list('phone_number', 'id')
+        )
+
+        tickets = ServiceTicket.objects.bulk_create([
+            ServiceTicket(
+                consumer_id=consumers[record.phone_number],
+                ticket_id=record.ticket_id,
+                issue_description=record.user_query,
+                category=record.category,
+                classified_by=record.classified_by,
+                urgency=record.urgency,
+                status='open',
+            )
+            for record in records
+        ])
+        # bulk_create sends no post_save.
+        record_created(tickets)
+        contents = GeneratedEnergyContent.objects.bulk_create([
+            GeneratedEnergyContent(
+                ticket=ticket,
+                prompt_used=record.user_query,
+                generated_text=record.generated_text,
+                image_url=record.image_url,
+                cacheable=record.cacheable,
+            )
+            for record, ticket in zip(records, tickets)
+        ])
+    return [content.id for content in contents]
+
+
+class WriteBehindBuffer:
+    """
+    Queues items and commits them from one background thread with one
+    long-lived connection. Each flush takes whatever has accumulated (up to
+    `batch_size`, waiting at most `linger` seconds for more) and hands it to
+    `commit_batch`, which returns one result per item; if that fails, each item
+    is retried through `commit_one` so a bad row cannot sink its batch. Batches
+    grow with load and a lone item is written almost immediately. Items still
+    queued when the process dies are lost unless the caller waits on its future.
+    """
+
+    def __init__(self, commit_batch, commit_one, batch_size: int, linger: float, name: str = "write-behind"):
+        self.commit_batch = commit_batch
+        self.commit_one = commit_one
+        self.batch_size = batch_size
+        self.linger = linger
+        self.name = name
+        self._lock = threading.Lock()
+        self._queue: queue.Queue | None = None
+        self._thread: threading.Thread | None = None
+        self._pid = None
+
+        self.batches = 0
+        self.records = 0
+        self.failures = 0
+        self.largest_batch = 0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._pid == os.getpid():
+                return
+            # Fresh queue and thread per process; a forked child inherits neither.
+            self._pid = os.getpid()
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run, name=f"powerpulse-{self.name}", daemon=True)
+            self._thread.start()
+
+    def submit(self, item) -> Future:
+        """Queue an item; the returned future resolves to its commit result once its batch is written."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _collect(self) -> list:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            self._commit(batch)
+            for _ in batch:
+                self._queue.task_done()
+
+    def _commit(self, batch: list):
+        items = [item for item, _ in batch]
+        try:
+            results = self.commit_batch(items)
+        except Exception as e:
+            logger.warning(f"Group commit of {len(batch)} {self.name} items failed ({e}); writing individually")
+            # Drop the connection in case it is what broke; the retries open a fresh one.
+            connections.close_all()
+            for item, future in batch:
+                try:
+                    future.set_result(self.commit_one(item))
+                except Exception as item_error:
+                    self.failures += 1
+                    logger.error(f"Could not persist {item!r}: {item_error}")
+                    future.set_exception(item_error)
+        else:
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+        self.batches += 1
+        self.records += len(batch)
+        self.largest_batch = max(self.largest_batch, len(batch))
+
+    def flush(self, timeout: float | None = None):
+        """Block until everything queued so far has been committed."""
+        if self._queue is None or self._pid != os.getpid():
+            return
+        if timeout is None:
+            self._queue.join()
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches,
+            "records": self.records,
+            "failures": self.failures,
+            "largest_batch": self.largest_batch,
+            "avg_batch": round(self.records / self.batches, 2) if self.batches else 0.0,
+        }
+
+
+write_behind = WriteBehindBuffer(
+    commit_batch=persist_batch,
+    # The reply has already quoted the record's ticket ID, so never reassign it.
+    commit_one=partial(persist_interaction, reassign_ticket_id=False),
+    batch_size=settings.PERSISTENCE_BATCH_SIZE,
+    linger=settings.PERSISTENCE_LINGER_MS / 1000,
+)
+atexit.register(write_behind.flush, 5.0)
+
+
+def save_interaction(record: InteractionRecord, reassign_ticket_id: bool = True):
+    """
+    Persist per PERSISTENCE_MODE: a content id ('atomic') or a Future of one
+    ('write_behind'). Pass reassign_ticket_id=False once the ticket ID has been quoted.
+    """
+    if settings.PERSISTENCE_MODE == 'write_behind':
+        return write_behind.submit(record)
+    return persist_interaction(record, reassign_ticket_id=reassign_ticket_id)
@@ -0,0 +1,405 @@
+"""
+PowerPulse AI - In-process Message Pipeline
+A fixed pool of asyncio workers running on one long-lived event loop.
+PIPELINE_WORKERS caps the jobs in flight. Jobs are admitted per sender number
+and scheduled fairly between numbers, with emergencies first (FairScheduler).
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("classifier", "crew", "dispatch", "media")
+PRIORITIES = ("emergency", "normal", "background")
+SHED_REASONS = ("queue_full", "per_number", "expired")
+
+# Priority of the job the current task is running; stage() lets emergencies through.
+_job_priority: ContextVar[str | None] = ContextVar("powerpulse_job_priority", default=None)
+
+# Executor threads one running job can hold at once: the crew kickoff (or any
+# other to_thread call on the flow's path: conversation, KB, usage and cache
+# lookups, persistence), the diagram drawn beside the answer, and the stream
+# sender. Stage caps don't bound these (lookups run outside any stage,
+# emergencies skip the caps), the worker count does.
+THREADS_PER_JOB = 3
+# Busy notices sent for expired jobs, which run outside the workers.
+SPARE_THREADS = 4
+
+
+class _LatencyCounter:
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def as_dict(self) -> dict:
+        avg = self.total / self.count if self.count else 0.0
+        return {"count": self.count, "avg_s": round(avg, 4), "max_s": round(self.max, 4)}
+
+
+@dataclass
+class _Job:
+    handler: object
+    args: tuple
+    key: str | None = None
+    priority: str = "normal"
+    on_shed: object = None
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class FairScheduler:
+    """
+    The pipeline's queue; used from its loop only.
+
+    Emergencies are served first, in arrival order. Every other job waits in a
+    FIFO lane for its key (the sender's number), and the lanes take turns, so
+    a number sending many messages gets the same share as everyone else. A
+    number already running `per_key_limit` replies has its next reply passed
+    over until one finishes. 'normal' work (replies) and 'background' work
+    (media follow-ups, not limited per number) split the turns by `weights`.
+    """
+
+    def __init__(self, per_key_limit: int, weights: dict):
+        self.per_key_limit = max(1, per_key_limit)
+        self.weights = {priority: max(1, weight) for priority, weight in weights.items()}
+        self._urgent: deque = deque()
+        self._lanes = {priority: {} for priority in self.weights}
+        self._turns = {priority: deque() for priority in self.weights}
+        self._credit = dict(self.weights)
+        self._running: Counter = Counter()
+        self._available = asyncio.Event()
+
+    def put(self, job: _Job):
+        if job.priority == "emergency":
+            self._urgent.append(job)
+        else:
+            lanes = self._lanes[job.priority]
+            lane = lanes.get(job.key)
+            if lane is None:
+                lane = lanes[job.key] = deque()
+                self._turns[job.priority].append(job.key)
+            lane.append(job)
+        self._available.set()
+
+    async def get(self) -> _Job:
+        while True:
+            job = self._next()
+            if job is not None:
+                if job.priority != "background":
+                    self._running[job.key] += 1
+                return job
+            self._available.clear()
+            await self._available.wait()
+
+    def done(self, job: _Job):
+        if job.priority == "background":
+            return
+        self._running[job.key] -= 1
+        if self._running[job.key] <= 0:
+            del self._running[job.key]
+        # A lane may have been waiting on this key.
+        self._available.set()
+
+    def _next(self) -> _Job | None:
+        if self._urgent:
+            return self._urgent.popleft()
+        # Each class spends its credit; once nothing runnable has any left, all are refilled.
+        for _ in range(2):
+            for priority in self._lanes:
+                if self._credit[priority] <= 0:
+                    continue
+                job = self._next_in(priority)
+                if job is not None:
+                    self._credit[priority] -= 1
+                    return job
+            self._credit = dict(self.weights)
+        return None
+
+    def _next_in(self, priority: str) -> _Job | None:
+        turns, lanes = self._turns[priority], self._lanes[priority]
+        for _ in range(len(turns)):
+            key = turns.popleft()
+            if priority == "normal" and key is not None and self._running[key] >= self.per_key_limit:
+                turns.append(key)
+                continue
+            lane = lanes[key]
+            job = lane.popleft()
+            if lane:
+                turns.append(key)
+            else:
+                del lanes[key]
+            return job
+        return None
+
+    @property
+    def lanes(self) -> int:
+        return sum(len(lanes) for lanes in self._lanes.values())
+
+
+class MessagePipeline:
+    """
+    Accepts jobs from request threads without blocking them and runs them on a
+    dedicated loop. `submit` never waits: when the queue is full it returns
+    False so the caller can answer immediately instead of piling up threads.
+    """
+
+    def __init__(self, workers: int, queue_size: int, stage_limits: dict, max_queued_per_key: int = 3,
+                 max_in_flight_per_key: int = 1, max_queue_wait: float = 0.0, weights: dict | None = None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.stage_limits = dict(stage_limits)
+        self.max_queued_per_key = max_queued_per_key
+        self.max_in_flight_per_key = max_in_flight_per_key
+        self.max_queue_wait = max_queue_wait
+        self.weights = dict(weights or {"normal": 3, "background": 1})
+        self.io_threads = workers * THREADS_PER_JOB + SPARE_THREADS
+
+        self._lock = threading.Lock()
+        self._started = threading.Event()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._scheduler: FairScheduler | None = None
+        self._semaphores: dict[str, asyncio.Semaphore] = {}
+
+        self._pending = 0
+        self._queued_per_key: Counter = Counter()
+        self.in_flight = 0
+        self.enqueued = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.admitted = {priority: 0 for priority in PRIORITIES}
+        self.shed = {reason: 0 for reason in SHED_REASONS}
+        self.queue_wait = _LatencyCounter()
+        self.service_time = _LatencyCounter()
+        self.stage_active = {name: 0 for name in self.stage_limits}
+        self.stage_waiting = {name: 0 for name in self.stage_limits}
+        self.stage_latency = {name: _LatencyCounter() for name in self.stage_limits}
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop | None:
+        return self._loop
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run_loop, name="powerpulse-pipeline", daemon=True)
+            self._thread.start()
+        self._started.wait()
+
+    def _run_loop(self):
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        # Every asyncio.to_thread call in a job lands here, so size it for the
+        # jobs in flight rather than the stage caps; otherwise a burst of lookups
+        # (or emergencies running over the caps) queues the stages behind them.
+        loop.set_default_executor(ThreadPoolExecutor(
+            max_workers=self.io_threads,
+            thread_name_prefix="powerpulse-io",
+        ))
+        self._scheduler = FairScheduler(self.max_in_flight_per_key, self.weights)
+        self._semaphores = {name: asyncio.Semaphore(limit) for name, limit in self.stage_limits.items()}
+        for i in range(self.workers):
+            loop.create_task(self._worker(i))
+        self._loop = loop
+        self._started.set()
+        logger.info(f"Pipeline started: {self.workers} workers, queue size {self.queue_size}, stages {self.stage_limits}")
+        loop.run_forever()
+
+    def submit(self, handler, *args, key: str | None = None, priority: str = "normal", on_shed=None) -> bool:
+        """
+        Queue `handler(*args)` (a coroutine function) for `key`, the sender's
+        number. Returns False when the queue is full or `key` already has
+        PIPELINE_MAX_QUEUED_PER_NUMBER replies waiting; emergencies are always
+        admitted. A 'normal' job still waiting after PIPELINE_MAX_QUEUE_WAIT is
+        dropped and `on_shed()` (a coroutine function) runs instead.
+        """
+        self.start()
+        job = _Job(handler, args, key, priority, on_shed)
+        with self._lock:
+            reason = None
+            if priority != "emergency" and self._pending >= self.queue_size:
+                reason = "queue_full"
+            elif priority == "normal" and key is not None and self._queued_per_key[key] >= self.max_queued_per_key:
+                reason = "per_number"
+            if reason is not None:
+                self.rejected += 1
+                self.shed[reason] += 1
+                logger.warning(f"Pipeline shed a {priority} job for {key}: {reason}")
+                return False
+            self._pending += 1
+            if priority == "normal" and key is not None:
+                self._queued_per_key[key] += 1
+            self.enqueued += 1
+            self.admitted[priority] += 1
+        self._loop.call_soon_threadsafe(self._scheduler.put, job)
+        return True
+
+    async def _worker(self, index: int):
+        while True:
+            job = await self._scheduler.get()
+            with self._lock:
+                self._pending -= 1
+                if job.priority == "normal" and job.key is not None:
+                    self._queued_per_key[job.key] -= 1
+                    if self._queued_per_key[job.key] <= 0:
+                        del self._queued_per_key[job.key]
+            started = time.monotonic()
+            self.queue_wait.observe(started - job.queued_at)
+            if job.priority == "normal" and self.max_queue_wait and started - job.queued_at > self.max_queue_wait:
+                self._expire(job)
+                continue
+            self.in_flight += 1
+            token = _job_priority.set(job.priority)
+            try:
+                await job.handler(*job.args)
+                self.completed += 1
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Pipeline worker {index} job failed: {e}")
+            finally:
+                _job_priority.reset(token)
+                self.in_flight -= 1
+                self.service_time.observe(time.monotonic() - started)
+                self._scheduler.done(job)
+
+    def _expire(self, job: _Job):
+        self.shed["expired"] += 1
+        self._scheduler.done(job)
+        logger.warning(f"Pipeline dropped a job for {job.key} after {time.monotonic() - job.queued_at:.0f}s in the queue")
+        if job.on_shed is not None:
+            self._loop.create_task(self._run_on_shed(job))
+
+    async def _run_on_shed(self, job: _Job):
+        try:
+            await job.on_shed()
+        except Exception as e:
+            logger.error(f"Shed callback for {job.key} failed: {e}")
+
+    @asynccontextmanager
+    async def stage(self, name: str):
+        semaphore = self._semaphores.get(name)
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        if semaphore is None or running_loop is not self._loop:
+            # Outside the pipeline loop (scripts, management commands): no cap.
+            yield
+            return
+        if _job_priority.get() == "emergency":
+            # Never queued behind routine work; emergencies are rare enough to run over the cap.
+            self.stage_active[name] += 1
+            try:
+                yield
+            finally:
+                self.stage_active[name] -= 1
+            return
+
+        self.stage_waiting[name] += 1
+        async with semaphore:
+            self.stage_waiting[name] -= 1
+            self.stage_active[name] += 1
+            started = time.monotonic()
+            try:
+                yield
+            finally:
+                self.stage_active[name] -= 1
+                self.stage_latency[name].observe(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "io_threads": self.io_threads,
+            "queue_size": self.queue_size,
+            "queue_depth": self._pending,
+            "in_flight": self.in_flight,
+            "enqueued": self.enqueued,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "failed": self.failed,
+            "admitted": dict(self.admitted),
+            "shed": dict(self.shed),
+            "numbers_queued": len(self._queued_per_key),
+            "lanes": self._scheduler.lanes if self._scheduler is not None else 0,
+            "queue_wait": self.queue_wait.as_dict(),
+            "service_time": self.service_time.as_dict(),
+            "stages": {
+                name: {
+                    "limit": limit,
+                    "active": self.stage_active[name],
+                    "waiting": self.stage_waiting[name],
+                    "latency": self.stage_latency[name].as_dict(),
+                }
+                for name, limit in self.stage_limits.items()
+            },
+        }
+
+    def prometheus(self) -> str:
+        """Admission and load-shedding counters in Prometheus text format (served with the profiler's)."""
+        lines = [
+            "# HELP powerpulse_pipeline_admitted_total Jobs accepted into the pipeline.",
+            "# TYPE powerpulse_pipeline_admitted_total counter",
+            *(f'powerpulse_pipeline_admitted_total{{priority="{p}"}} {n}' for p, n in self.admitted.items()),
+            "# HELP powerpulse_pipeline_shed_total Jobs turned away (queue_full, per_number) or dropped after waiting too long (expired).",
+            "# TYPE powerpulse_pipeline_shed_total counter",
+            *(f'powerpulse_pipeline_shed_total{{reason="{r}"}} {n}' for r, n in self.shed.items()),
+            "# HELP powerpulse_pipeline_queue_depth Jobs waiting for a worker.",
+            "# TYPE powerpulse_pipeline_queue_depth gauge",
+            f"powerpulse_pipeline_queue_depth {self._pending}",
+            "# HELP powerpulse_pipeline_in_flight Jobs running.",
+            "# TYPE powerpulse_pipeline_in_flight gauge",
+            f"powerpulse_pipeline_in_flight {self.in_flight}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+_pipeline: MessagePipeline | None = None
+_pipeline_lock = threading.Lock()
+
+
+def get_pipeline() -> MessagePipeline:
+    global _pipeline
+    if _pipeline is None:
+        with _pipeline_lock:
+            if _pipeline is None:
+                _pipeline = MessagePipeline(
+                    workers=settings.PIPELINE_WORKERS,
+                    queue_size=settings.PIPELINE_QUEUE_SIZE,
+                    stage_limits={
+                        "classifier": settings.PIPELINE_CLASSIFIER_CONCURRENCY,
+                        "crew": settings.PIPELINE_CREW_CONCURRENCY,
+                        "dispatch": settings.PIPELINE_DISPATCH_CONCURRENCY,
+                        "media": settings.PIPELINE_MEDIA_CONCURRENCY,
+                    },
+                    max_queued_per_key=settings.PIPELINE_MAX_QUEUED_PER_NUMBER,
+                    max_in_flight_per_key=settings.PIPELINE_MAX_IN_FLIGHT_PER_NUMBER,
+                    max_queue_wait=settings.PIPELINE_MAX_QUEUE_WAIT,
+                    weights={
+                        "normal": settings.PIPELINE_REPLY_WEIGHT,
+                        "background": settings.PIPELINE_BACKGROUND_WEIGHT,
+                    },
+                )
+    return _pipeline
+
+
+def stage(name: str):
+    """Async context manager capping concurrent work for one pipeline stage."""
+    return get_pipeline().stage(name)
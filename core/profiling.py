@@ -0,0 +1,416 @@
+"""
+PowerPulse AI - Flow Profiling
+Times every PowerPulseFlow step, crew task, LLM call and tool call, plus the
+database writes and Twilio sends, and records prompt/completion tokens and
+retries. The spans of one flow run share a trace, held in a ContextVar so it
+follows the flow into asyncio.to_thread and the crew's worker thread. When the
+run ends they are published together: into an in-memory ring buffer behind the
+Prometheus endpoint, and through a write-behind buffer into FlowMetrics for
+`manage.py flow_profile`. Step, task, LLM and tool timings come from CrewAI's
+event bus, so nothing inside the crew is wrapped.
+"""
+from __future__ import annotations
+import atexit
+import logging
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.conf import settings
+
+from core.persistence import WriteBehindBuffer
+
+logger = logging.getLogger(__name__)
+
+KINDS = ("flow", "step", "task", "llm", "tool", "io")
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+@dataclass
+class Span:
+    kind: str
+    name: str
+    started_at: float
+    duration: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    retries: int = 0
+    ok: bool = True
+    trace_id: str = ""
+    ticket_id: str = ""
+    clock: float = field(default=0.0, repr=False)
+
+
+class FlowTrace:
+    """The spans of one flow run; `open` holds spans still waiting for their finished event."""
+
+    def __init__(self, name: str):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.ticket_id = ""
+        self.spans: list[Span] = []
+        self.open: dict[tuple, Span] = {}
+        self.lock = threading.Lock()
+
+    def begin(self, key: tuple, kind: str, name: str) -> Span:
+        span = Span(kind, name, time.time(), trace_id=self.trace_id, clock=time.perf_counter())
+        with self.lock:
+            self.open[key] = span
+        return span
+
+    def end(self, key: tuple, ok: bool = True) -> Span | None:
+        with self.lock:
+            span = self.open.pop(key, None)
+            if span is None:
+                return None
+            span.duration = time.perf_counter() - span.clock
+            span.ok = ok
+            self.spans.append(span)
+        if not ok:
+            self.count_retry()
+        return span
+
+    def count_retry(self):
+        """A failed call inside a step or task is retried (or the step fails); charge it to both."""
+        with self.lock:
+            for span in self.open.values():
+                if span.kind in ("step", "task"):
+                    span.retries += 1
+
+    def innermost(self, *kinds) -> Span | None:
+        with self.lock:
+            for span in reversed(list(self.open.values())):
+                if span.kind in kinds:
+                    return span
+        return None
+
+
+_current_trace: ContextVar[FlowTrace | None] = ContextVar("powerpulse_flow_trace", default=None)
+
+
+def current_trace() -> FlowTrace | None:
+    return _current_trace.get()
+
+
+def _thread_key(kind: str, *parts) -> tuple:
+    return (kind, threading.get_ident(), *parts)
+
+
+def _labels(**pairs) -> str:
+    escape = lambda value: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")  # noqa: E731
+    return ",".join(f'{key}="{escape(value)}"' for key, value in pairs.items())
+
+
+def percentile_table(rows) -> list[dict]:
+    """Group (kind, name, duration_s, prompt, completion, retries, ok) rows into per-span percentiles."""
+    groups: dict[tuple, list] = {}
+    for kind, name, duration, prompt, completion, retries, ok in rows:
+        groups.setdefault((kind, name), []).append((duration, prompt, completion, retries, ok))
+
+    table = []
+    for (kind, name), samples in groups.items():
+        values = np.array(samples, dtype=float)
+        p50, p95, p99 = np.percentile(values[:, 0], [q * 100 for q in QUANTILES])
+        table.append({
+            "kind": kind,
+            "name": name,
+            "count": len(samples),
+            "p50_s": float(p50),
+            "p95_s": float(p95),
+            "p99_s": float(p99),
+            "max_s": float(values[:, 0].max()),
+            "total_s": float(values[:, 0].sum()),
+            "prompt_tokens": int(values[:, 1].sum()),
+            "completion_tokens": int(values[:, 2].sum()),
+            "retries": int(values[:, 3].sum()),
+            "errors": int((values[:, 4] == 0).sum()),
+        })
+    table.sort(key=lambda row: (KINDS.index(row["kind"]) if row["kind"] in KINDS else len(KINDS), -row["total_s"]))
+    return table
+
+
+def _write_spans(spans: list[Span]) -> list[int]:
+    from core.models import FlowMetrics
+
+    rows = FlowMetrics.objects.bulk_create([
+        FlowMetrics(
+            trace_id=span.trace_id,
+            ticket_id=span.ticket_id or "",
+            kind=span.kind,
+            name=span.name[:100],
+            started_at=datetime.fromtimestamp(span.started_at, tz=dt_timezone.utc),
+            duration_ms=span.duration * 1000,
+            prompt_tokens=span.prompt_tokens,
+            completion_tokens=span.completion_tokens,
+            retries=span.retries,
+            ok=span.ok,
+        )
+        for span in spans
+    ])
+    return [row.id for row in rows]
+
+
+class FlowProfiler:
+
+    def __init__(self, enabled: bool, buffer_size: int, persist: bool):
+        self.enabled = enabled
+        self.persist = persist
+        self._recent: deque[Span] = deque(maxlen=buffer_size)
+        self._totals: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+        self._installed = False
+        self.writer = WriteBehindBuffer(
+            commit_batch=_write_spans,
+            commit_one=lambda span: _write_spans([span])[0],
+            batch_size=500,
+            linger=1.0,
+            name="flow-metrics",
+        )
+
+    # -- publishing ---------------------------------------------------------
+
+    def publish(self, spans: list[Span]):
+        with self._lock:
+            self._recent.extend(spans)
+            for span in spans:
+                totals = self._totals.setdefault((span.kind, span.name), [0, 0.0, 0, 0, 0, 0])
+                totals[0] += 1
+                totals[1] += span.duration
+                totals[2] += span.prompt_tokens
+                totals[3] += span.completion_tokens
+                totals[4] += span.retries
+                totals[5] += 0 if span.ok else 1
+        if self.persist:
+            for span in spans:
+                self.writer.submit(span)
+
+    @contextmanager
+    def trace(self, name: str):
+        """Collect every span of one flow run; published when the block exits."""
+        if not self.enabled:
+            yield None
+            return
+        self.install()
+        trace = FlowTrace(name)
+        token = _current_trace.set(trace)
+        root = trace.begin(("flow",), "flow", name)
+        ok = False
+        try:
+            yield trace
+            ok = True
+        finally:
+            trace.end(("flow",), ok=ok)
+            _current_trace.reset(token)
+            with trace.lock:
+                # Anything still open never got its finished event (e.g. the flow was cancelled).
+                for span in trace.open.values():
+                    span.duration, span.ok = time.perf_counter() - span.clock, False
+                spans = trace.spans + list(trace.open.values())
+            for span in spans:
+                span.ticket_id = trace.ticket_id
+                if span is root:
+                    span.retries = sum(s.retries for s in spans if s.kind == "step")
+                    span.prompt_tokens = sum(s.prompt_tokens for s in spans if s.kind == "llm")
+                    span.completion_tokens = sum(s.completion_tokens for s in spans if s.kind == "llm")
+            self.publish(spans)
+
+    @contextmanager
+    def span(self, kind: str, name: str, ticket_id: str = ""):
+        """Time a block explicitly (I/O, or a tool called outside the crew)."""
+        if not self.enabled:
+            yield
+            return
+        trace = _current_trace.get()
+        if trace is not None:
+            key = _thread_key(kind, name, uuid.uuid4().hex)
+            trace.begin(key, kind, name)
+            ok = False
+            try:
+                yield
+                ok = True
+            finally:
+                trace.end(key, ok=ok)
+            return
+
+        span = Span(kind, name, time.time(), ticket_id=ticket_id, clock=time.perf_counter())
+        try:
+            yield
+        except BaseException:
+            span.ok = False
+            raise
+        finally:
+            span.duration = time.perf_counter() - span.clock
+            self.publish([span])
+
+    def call(self, kind: str, name: str, func, *args, **kwargs):
+        """func(*args, **kwargs) inside a span; convenient with asyncio.to_thread."""
+        with self.span(kind, name):
+            return func(*args, **kwargs)
+
+    def record_usage(self, prompt_tokens: int, completion_tokens: int):
+        trace = _current_trace.get()
+        if trace is None:
+            return
+        span = trace.open.get(_thread_key("llm")) or trace.innermost("llm")
+        if span is not None:
+            span.prompt_tokens += prompt_tokens or 0
+            span.completion_tokens += completion_tokens or 0
+
+    # -- CrewAI event bus ---------------------------------------------------
+
+    def install(self):
+        """Subscribe to CrewAI's event bus once per process."""
+        if self._installed:
+            return
+        with self._lock:
+            if self._installed:
+                return
+            self._installed = True
+
+        from crewai.utilities.events import crewai_event_bus
+        from crewai.utilities.events.flow_events import (
+            MethodExecutionFailedEvent, MethodExecutionFinishedEvent, MethodExecutionStartedEvent,
+        )
+        from crewai.utilities.events.llm_events import LLMCallCompletedEvent, LLMCallFailedEvent, LLMCallStartedEvent
+        from crewai.utilities.events.task_events import TaskCompletedEvent, TaskFailedEvent, TaskStartedEvent
+        from crewai.utilities.events.tool_usage_events import (
+            ToolUsageErrorEvent, ToolUsageFinishedEvent, ToolUsageStartedEvent,
+        )
+
+        def handler(event_type):
+            def register(func):
+                def safe(source, event):
+                    trace = _current_trace.get()
+                    if trace is None:
+                        return
+                    try:
+                        func(trace, source, event)
+                    except Exception as e:
+                        # Profiling must never break the flow it is measuring.
+                        logger.debug(f"Profiler could not handle {event_type.__name__}: {e}")
+                crewai_event_bus.register_handler(event_type, safe)
+                return func
+            return register
+
+        @handler(MethodExecutionStartedEvent)
+        def step_started(trace, source, event):
+            trace.begin(("step", event.method_name), "step", event.method_name)
+
+        @handler(MethodExecutionFinishedEvent)
+        def step_finished(trace, source, event):
+            trace.end(("step", event.method_name))
+
+        @handler(MethodExecutionFailedEvent)
+        def step_failed(trace, source, event):
+            trace.end(("step", event.method_name), ok=False)
+
+        @handler(TaskStartedEvent)
+        def task_started(trace, source, event):
+            trace.begin(_thread_key("task"), "task", getattr(source, "name", None) or "task")
+
+        @handler(TaskCompletedEvent)
+        def task_completed(trace, source, event):
+            trace.end(_thread_key("task"))
+
+        @handler(TaskFailedEvent)
+        def task_failed(trace, source, event):
+            trace.end(_thread_key("task"), ok=False)
+
+        @handler(LLMCallStartedEvent)
+        def llm_started(trace, source, event):
+            # Named after what it serves: the crew task, or the flow step for direct calls.
+            owner = trace.innermost("task", "step")
+            trace.begin(_thread_key("llm"), "llm", owner.name if owner else "llm")
+
+        @handler(LLMCallCompletedEvent)
+        def llm_completed(trace, source, event):
+            trace.end(_thread_key("llm"))
+
+        @handler(LLMCallFailedEvent)
+        def llm_failed(trace, source, event):
+            if trace.end(_thread_key("llm"), ok=False) is None:
+                trace.count_retry()
+
+        @handler(ToolUsageStartedEvent)
+        def tool_started(trace, source, event):
+            trace.begin(_thread_key("tool", event.tool_name), "tool", event.tool_name)
+
+        @handler(ToolUsageFinishedEvent)
+        def tool_finished(trace, source, event):
+            trace.end(_thread_key("tool", event.tool_name))
+
+        @handler(ToolUsageErrorEvent)
+        def tool_failed(trace, source, event):
+            trace.end(_thread_key("tool", event.tool_name), ok=False)
+
+    # -- reporting ------------------------------------------------------------
+
+    def recent(self) -> list[Span]:
+        with self._lock:
+            return list(self._recent)
+
+    def summary(self) -> list[dict]:
+        return percentile_table(
+            (s.kind, s.name, s.duration, s.prompt_tokens, s.completion_tokens, s.retries, s.ok)
+            for s in self.recent()
+        )
+
+    def prometheus(self) -> str:
+        """Prometheus text exposition: quantiles over the ring buffer, sums and counts since start."""
+        with self._lock:
+            totals = {key: list(values) for key, values in self._totals.items()}
+        quantiles = {(row["kind"], row["name"]): row for row in self.summary()}
+
+        lines = [
+            "# HELP powerpulse_span_seconds Wall time of flow runs, flow steps, crew tasks, LLM, tool and I/O calls.",
+            "# TYPE powerpulse_span_seconds summary",
+        ]
+        for (kind, name), (count, seconds, *_rest) in sorted(totals.items()):
+            row = quantiles.get((kind, name))
+            if row:
+                for q, key in zip(QUANTILES, ("p50_s", "p95_s", "p99_s")):
+                    lines.append(f"powerpulse_span_seconds{{{_labels(kind=kind, name=name, quantile=q)}}} {row[key]:.6f}")
+            lines.append(f"powerpulse_span_seconds_sum{{{_labels(kind=kind, name=name)}}} {seconds:.6f}")
+            lines.append(f"powerpulse_span_seconds_count{{{_labels(kind=kind, name=name)}}} {count}")
+
+        lines += [
+            "# HELP powerpulse_llm_tokens_total Prompt and completion tokens used.",
+            "# TYPE powerpulse_llm_tokens_total counter",
+        ]
+        for (kind, name), (_, _, prompt, completion, _, _) in sorted(totals.items()):
+            if kind == "llm":
+                lines.append(f"powerpulse_llm_tokens_total{{{_labels(kind=kind, name=name, type='prompt')}}} {prompt}")
+                lines.append(f"powerpulse_llm_tokens_total{{{_labels(kind=kind, name=name, type='completion')}}} {completion}")
+
+        for metric, index, help_text in (
+            ("powerpulse_span_retries_total", 4, "Failed LLM/tool calls retried inside a step or task."),
+            ("powerpulse_span_errors_total", 5, "Spans that ended in an error."),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+            for (kind, name), values in sorted(totals.items()):
+                lines.append(f"{metric}{{{_labels(kind=kind, name=name)}}} {values[index]}")
+        return "\n".join(lines) + "\n"
+
+
+class UsageRecorder:
+    """LLM callback (same hook as CrewAI's TokenCalcHandler) that charges token usage to the open LLM span."""
+
+    def log_success_event(self, kwargs, response_obj, start_time, end_time):
+        usage = response_obj.get("usage") if isinstance(response_obj, dict) else None
+        if usage is not None:
+            profiler.record_usage(getattr(usage, "prompt_tokens", 0), getattr(usage, "completion_tokens", 0))
+
+
+profiler = FlowProfiler(
+    enabled=settings.FLOW_METRICS_ENABLED,
+    buffer_size=settings.FLOW_METRICS_BUFFER_SIZE,
+    persist=settings.FLOW_METRICS_PERSIST,
+)
+usage_recorder = UsageRecorder()
+atexit.register(profiler.writer.flush, 5.0)
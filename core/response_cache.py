@@ -0,0 +1,203 @@
+"""
+PowerPulse AI - Semantic Response Cache
+Sits in front of PowerPulseCrew. Lookups try an exact match on the normalized
+query first, then a MinHash/LSH near-duplicate index; a near match also needs
+the same numbers and appliance words (similarity.salient_terms), since "my 2
+ton AC" and "my 1 ton AC" share most of their shingles. Entries expire after
+RESPONSE_CACHE_TTL seconds and the least recently used entry is evicted once
+RESPONSE_CACHE_MAX_ENTRIES is reached. The cache is warmed from
+GeneratedEnergyContent history so answers written by other workers (or before a
+restart) are reused too; only rows marked `cacheable` are loaded, never answers
+written for one consumer.
+"""
+from __future__ import annotations
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from core.similarity import band_keys, estimate_similarity, minhash_signature, normalize_query, salient_terms
+
+logger = logging.getLogger(__name__)
+
+# DALL-E result URLs are signed and expire after about an hour.
+IMAGE_URL_MAX_AGE = 50 * 60
+
+
+@dataclass
+class CacheEntry:
+    key: str
+    category: str
+    text: str
+    image_url: str | None
+    created_at: float
+    signature: np.ndarray = field(repr=False)
+    terms: frozenset = frozenset()
+
+
+@dataclass(frozen=True)
+class CacheHit:
+    text: str
+    image_url: str | None
+    kind: str
+    similarity: float
+
+
+class ResponseCache:
+
+    def __init__(self, max_entries: int, ttl: float, similarity_threshold: float, bypass_categories=()):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.bypass_categories = set(bypass_categories)
+
+        self._entries: OrderedDict[tuple, CacheEntry] = OrderedDict()
+        self._bands: dict[tuple, set] = {}
+        self._lock = threading.RLock()
+
+        self._history_cursor = 0
+        self._history_checked_at = 0.0
+
+        self.metrics = dict.fromkeys(
+            ("hits_exact", "hits_near", "misses", "bypassed", "stores", "evictions", "expirations", "history_loaded"), 0
+        )
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        return now - entry.created_at > self.ttl
+
+    def _remove(self, cache_key: tuple):
+        entry = self._entries.pop(cache_key, None)
+        if entry is None:
+            return
+        for band_key in band_keys(entry.signature):
+            bucket = self._bands.get((entry.category,) + band_key)
+            if bucket is not None:
+                bucket.discard(cache_key)
+                if not bucket:
+                    del self._bands[(entry.category,) + band_key]
+
+    def _hit(self, entry: CacheEntry, kind: str, similarity: float, now: float) -> CacheHit:
+        self._entries.move_to_end((entry.category, entry.key))
+        self.metrics[f"hits_{kind}"] += 1
+        image_url = entry.image_url if now - entry.created_at < IMAGE_URL_MAX_AGE else None
+        return CacheHit(entry.text, image_url, kind, similarity)
+
+    def lookup(self, query: str, category: str) -> CacheHit | None:
+        if category in self.bypass_categories:
+            with self._lock:
+                self.metrics["bypassed"] += 1
+            return None
+
+        self._refresh_from_history()
+        key = normalize_query(query)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((category, key))
+            if entry is not None:
+                if not self._expired(entry, now):
+                    return self._hit(entry, "exact", 1.0, now)
+                self._remove((category, key))
+                self.metrics["expirations"] += 1
+
+            signature = minhash_signature(key)
+            terms = salient_terms(key)
+            candidates = set()
+            for band_key in band_keys(signature):
+                candidates |= self._bands.get((category,) + band_key, set())
+
+            best, best_score = None, 0.0
+            for cache_key in candidates:
+                candidate = self._entries[cache_key]
+                if self._expired(candidate, now):
+                    self._remove(cache_key)
+                    self.metrics["expirations"] += 1
+                    continue
+                if candidate.terms != terms:
+                    continue
+                score = estimate_similarity(signature, candidate.signature)
+                if score > best_score:
+                    best, best_score = candidate, score
+
+            if best is not None and best_score >= self.similarity_threshold:
+                return self._hit(best, "near", best_score, now)
+            self.metrics["misses"] += 1
+            return None
+
+    def store(self, query: str, category: str, text: str, image_url: str | None = None, created_at: float | None = None):
+        if category in self.bypass_categories or not text:
+            return
+        key = normalize_query(query)
+        if not key:
+            return
+        entry = CacheEntry(key, category, text, image_url, created_at or time.time(), minhash_signature(key),
+                           salient_terms(key))
+        cache_key = (category, key)
+        with self._lock:
+            self._remove(cache_key)
+            self._entries[cache_key] = entry
+            for band_key in band_keys(entry.signature):
+                self._bands.setdefault((category,) + band_key, set()).add(cache_key)
+            self.metrics["stores"] += 1
+            while len(self._entries) > self.max_entries:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.metrics["evictions"] += 1
+
+    def _refresh_from_history(self):
+        """Pull answers persisted since the last refresh (by any process) into the cache."""
+        now = time.time()
+        if now - self._history_checked_at < settings.RESPONSE_CACHE_HISTORY_REFRESH:
+            return
+        self._history_checked_at = now
+
+        from core.models import GeneratedEnergyContent
+
+        try:
+            rows = list(
+                GeneratedEnergyContent.objects
+                .filter(
+                    id__gt=self._history_cursor,
+                    created_at__gte=timezone.now() - timedelta(seconds=self.ttl),
+                    ticket__category__in=[c for c in ("energy_advice", "technical_fault") if c not in self.bypass_categories],
+                    generated_text__isnull=False,
+                    # Follow-ups (and other per-consumer answers) are not for other numbers.
+                    cacheable=True,
+                )
+                .order_by('-id')
+                .values_list('id', 'prompt_used', 'ticket__category', 'generated_text', 'image_url', 'created_at')
+                [:self.max_entries]
+            )
+        except Exception as e:
+            logger.warning(f"Response cache history refresh failed: {e}")
+            return
+
+        for row_id, prompt, category, text, image_url, created_at in reversed(rows):
+            self.store(prompt, category, text, image_url, created_at=created_at.timestamp())
+            self._history_cursor = max(self._history_cursor, row_id)
+        with self._lock:
+            self.metrics["history_loaded"] += len(rows)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.metrics["hits_exact"] + self.metrics["hits_near"] + self.metrics["misses"]
+            hits = self.metrics["hits_exact"] + self.metrics["hits_near"]
+            return {
+                **self.metrics,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+response_cache = ResponseCache(
+    max_entries=settings.RESPONSE_CACHE_MAX_ENTRIES,
+    ttl=settings.RESPONSE_CACHE_TTL,
+    similarity_threshold=settings.RESPONSE_CACHE_SIMILARITY,
+    bypass_categories=settings.RESPONSE_CACHE_BYPASS_CATEGORIES,
+)
@@ -0,0 +1,84 @@
+"""
+PowerPulse AI - Near-duplicate Text Matching
+MinHash signatures over character shingles plus the LSH banding used to find
+candidate matches without comparing against every stored entry. Shared by the
+response cache and the image library.
+"""
+from __future__ import annotations
+import re
+import zlib
+
+import numpy as np
+
+from core.classifier import normalize_text
+
+_PUNCTUATION = re.compile(r"[^\w\s]")
+_NUMBER = re.compile(r"^\d+$")
+
+# Words that change what a question is about even when the rest of it reads the
+# same ("my 2 ton AC at night" vs "my heater at night"), mapped to one form so
+# plurals and Arabic spellings agree.
+_SALIENT_TERMS = {
+    "ac": "ac", "aircon": "ac", "conditioner": "ac", "conditioning": "ac", "مكيف": "ac", "المكيف": "ac",
+    "تكييف": "ac", "التكييف": "ac",
+    "heater": "heater", "heaters": "heater", "heating": "heater", "geyser": "heater", "boiler": "heater",
+    "سخان": "heater", "السخان": "heater", "تدفئه": "heater", "التدفئه": "heater",
+    "water": "water", "مياه": "water", "الماء": "water", "ماء": "water",
+    "solar": "solar", "شمسيه": "solar", "الشمسيه": "solar",
+    "panel": "panel", "panels": "panel", "الواح": "panel", "لوح": "panel",
+    "fridge": "fridge", "fridges": "fridge", "refrigerator": "fridge", "ثلاجه": "fridge", "الثلاجه": "fridge",
+    "freezer": "freezer", "فريزر": "freezer",
+    "washer": "washer", "washing": "washer", "غساله": "washer", "الغساله": "washer",
+    "dryer": "dryer", "dishwasher": "dishwasher", "oven": "oven", "stove": "oven", "microwave": "microwave",
+    "kettle": "kettle", "iron": "iron", "pump": "pump", "pool": "pool", "fan": "fan", "fans": "fan",
+    "مروحه": "fan",
+    "light": "light", "lights": "light", "lighting": "light", "bulb": "light", "bulbs": "light", "lamp": "light",
+    "lamps": "light", "اضاءه": "light", "لمبه": "light",
+    "tv": "tv", "television": "tv", "computer": "computer", "pc": "computer",
+    "inverter": "inverter", "battery": "battery", "batteries": "battery", "بطاريه": "battery",
+    "ev": "ev", "car": "ev", "charger": "charger", "charging": "charger", "meter": "meter", "عداد": "meter",
+    "العداد": "meter",
+    "night": "night", "day": "day", "daytime": "day", "morning": "day", "summer": "summer", "winter": "winter",
+    "ليل": "night", "الليل": "night", "الصيف": "summer", "صيف": "summer", "الشتاء": "winter", "شتاء": "winter",
+}
+
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = np.random.RandomState(1337)
+_PERM_A = _rng.randint(1, 1 << 31, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+_PERM_B = _rng.randint(0, 1 << 31, size=NUM_PERM, dtype=np.int64).astype(np.uint64)
+
+
+def normalize_query(text: str) -> str:
+    return " ".join(_PUNCTUATION.sub(" ", normalize_text(text)).split())
+
+
+def salient_terms(normalized: str) -> frozenset:
+    """
+    The numbers and appliance/time-of-day words in a normalize_query() string.
+    Two queries this differs for are about different things however similar
+    their signatures are, so a near-duplicate match requires it to be equal.
+    """
+    return frozenset(
+        token if _NUMBER.match(token) else _SALIENT_TERMS[token]
+        for token in normalized.split()
+        if _NUMBER.match(token) or token in _SALIENT_TERMS
+    )
+
+
+def minhash_signature(normalized: str, shingle_size: int = 4) -> np.ndarray:
+    padded = f" {normalized} "
+    shingles = {padded[i:i + shingle_size] for i in range(max(1, len(padded) - shingle_size + 1))}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    permuted = (hashes[:, None] * _PERM_A[None, :] + _PERM_B[None, :]) % np.uint64(_MERSENNE_PRIME)
+    return permuted.min(axis=0)
+
+
+def estimate_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+def band_keys(signature: np.ndarray):
+    return [(band, signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND].tobytes()) for band in range(BANDS)]
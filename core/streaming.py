@@ -0,0 +1,260 @@
+"""
+PowerPulse AI - Streaming Replies
+Sends the final agent's answer to WhatsApp while the LLM is still writing it
+(REPLY_STREAMING). CrewAI emits an LLMStreamChunkEvent per token; the handlers
+below route each one to the ReplyStream of the flow run it belongs to, held in
+a ContextVar that follows the flow into the crew's worker thread. The stream
+skips the agent's ReAct preamble up to "Final Answer:", cuts the answer into
+WhatsApp-sized messages on paragraph or sentence boundaries and hands each to
+an asyncio task that sends them in order. Whatever the stream did not deliver
+is sent from the crew's final result, so nothing is dropped or truncated.
+"""
+from __future__ import annotations
+import asyncio
+import logging
+import re
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+FINAL_ANSWER = "Final Answer:"
+
+_PARAGRAPH = re.compile(r"\n[ \t]*\n\s*")
+# End of a sentence (not "1." in a numbered list) or of a line.
+_SENTENCE = re.compile(r"(?<!\d)[.!?؟…][\"')\]*_]*\s+|\n\s*")
+_SPACE = re.compile(r"\s+")
+
+
+def _last_cut(pattern, text: str, start: int, end: int) -> int | None:
+    """Index just past the last `pattern` match ending in text[start:end], or None."""
+    cut = None
+    for match in pattern.finditer(text, 0, end):
+        if match.end() >= start:
+            cut = match.end()
+    return cut
+
+
+def split_message(text: str, limit: int | None = None) -> list[str]:
+    """Split `text` into messages of at most `limit` characters, on the latest paragraph, sentence or word break."""
+    limit = limit or settings.WHATSAPP_MAX_CHARS
+    parts = []
+    text = text.strip()
+    while len(text) > limit:
+        cut = (
+            _last_cut(_PARAGRAPH, text, limit // 2, limit)
+            or _last_cut(_SENTENCE, text, limit // 2, limit)
+            or _last_cut(_SPACE, text, 1, limit)
+            or limit
+        )
+        parts.append(text[:cut].strip())
+        text = text[cut:].lstrip()
+    if text:
+        parts.append(text)
+    return parts
+
+
+class MessageChunker:
+    """
+    Incremental splitter: feed() text as it arrives and get back the messages
+    that are complete. A message ends at the first paragraph break after
+    `min_chars`; a paragraph running past twice that is cut at its last
+    sentence break instead, and nothing exceeds `max_chars`.
+    """
+
+    def __init__(self, min_chars: int, max_chars: int):
+        self.max_chars = max_chars
+        self.min_chars = min(min_chars, max_chars)
+        self.buffer = ""
+        self.consumed = 0
+
+    def feed(self, text: str) -> list[str]:
+        self.buffer += text
+        ready = []
+        while True:
+            cut = self._cut()
+            if cut is None:
+                return ready
+            chunk = self.buffer[:cut].strip()
+            self.buffer = self.buffer[cut:]
+            self.consumed += cut
+            if chunk:
+                ready.append(chunk)
+
+    def _cut(self) -> int | None:
+        buffer = self.buffer
+        paragraph = _PARAGRAPH.search(buffer, self.min_chars)
+        if paragraph and paragraph.end() <= self.max_chars:
+            return paragraph.end()
+        # Keep waiting for a paragraph break until the buffer is clearly one long paragraph.
+        if len(buffer) < min(2 * self.min_chars, self.max_chars):
+            return None
+        end = min(len(buffer), self.max_chars)
+        cut = _last_cut(_SENTENCE, buffer, self.min_chars, end)
+        if cut is not None or len(buffer) < self.max_chars:
+            return cut
+        return _last_cut(_SPACE, buffer, 1, self.max_chars) or self.max_chars
+
+
+class ReplyStream:
+    """
+    One flow run's streamed reply. `send(text)` is blocking (it is run with
+    asyncio.to_thread); messages go out strictly in order, the first one
+    carrying `prefix` (the Ref ID line).
+    """
+
+    def __init__(self, send, task_name: str, prefix: str = "", min_chars: int | None = None,
+                 max_chars: int | None = None):
+        self.send = send
+        self.task_name = task_name
+        self.prefix = prefix
+        self.chunker = MessageChunker(
+            min_chars or settings.REPLY_STREAM_MIN_CHARS,
+            max_chars or settings.WHATSAPP_MAX_CHARS,
+        )
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.sids: list = []
+        self.streamed = 0
+        self.active = False
+        self.closed = False
+        self._raw = ""
+        self._answer = None
+        self._lock = threading.Lock()
+        self._sender = asyncio.create_task(self._drain())
+
+    @property
+    def started(self) -> bool:
+        return self.streamed > 0
+
+    # -- crew worker thread --------------------------------------------------
+
+    def task_started(self, task):
+        self.active = getattr(task, "name", None) == self.task_name
+
+    def llm_started(self):
+        with self._lock:
+            if not self.active:
+                return
+            if self.started:
+                # The agent went back to the model after we began sending (a rejected
+                # answer, a retry): stop here and let finish() reconcile with the result.
+                self.closed = True
+                return
+            self._raw, self._answer = "", None
+            self.chunker = MessageChunker(self.chunker.min_chars, self.chunker.max_chars)
+
+    def chunk(self, text: str):
+        with self._lock:
+            if not self.active or self.closed:
+                return
+            if self._answer is None:
+                self._raw += text
+                index = self._raw.find(FINAL_ANSWER)
+                if index < 0:
+                    return
+                self._answer = ""
+                text = self._raw[index + len(FINAL_ANSWER):]
+            if not self._answer:
+                text = text.lstrip()
+            self._answer += text
+            for message in self.chunker.feed(text):
+                self._emit(message)
+
+    def _emit(self, message: str):
+        if not self.streamed:
+            message = f"{self.prefix}{message}"
+        self.streamed += 1
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, message)
+
+    # -- flow event loop ------------------------------------------------------
+
+    async def _drain(self):
+        while True:
+            message = await self.queue.get()
+            if message is None:
+                return
+            try:
+                self.sids.append(await asyncio.to_thread(self.send, message))
+            except Exception as e:
+                logger.error(f"Streaming send failed: {e}")
+                self.sids.append(None)
+
+    def remainder(self, final_text: str) -> list[str]:
+        """The messages still owed once the crew has returned `final_text`."""
+        with self._lock:
+            self.closed = True
+            delivered = (self._answer or "")[:self.chunker.consumed]
+            final_text = final_text.strip()
+            if final_text.startswith(delivered):
+                return split_message(final_text[len(delivered):], self.chunker.max_chars)
+            logger.warning("Streamed text diverged from the final answer; sending the final answer in full")
+            return split_message(final_text, self.chunker.max_chars)
+
+    async def finish(self, final_text: str | None = None) -> list:
+        """Send what the stream still owes (when given the final text), wait for the sender; returns the SIDs."""
+        if final_text is not None:
+            for message in self.remainder(final_text):
+                self._emit(message)
+        else:
+            self.closed = True
+        # Behind any message the crew thread has scheduled but not yet queued.
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, None)
+        await self._sender
+        return self.sids
+
+    def finish_threadsafe(self, final_text: str | None = None) -> list:
+        """finish() from a worker thread (the flow's dispatch step runs in asyncio.to_thread)."""
+        return asyncio.run_coroutine_threadsafe(self.finish(final_text), self.loop).result()
+
+
+_current_stream: ContextVar[ReplyStream | None] = ContextVar("powerpulse_reply_stream", default=None)
+_install_lock = threading.Lock()
+_installed = False
+
+
+def _install():
+    """Subscribe to CrewAI's event bus once per process."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        _installed = True
+
+    from crewai.utilities.events import crewai_event_bus
+    from crewai.utilities.events.llm_events import LLMCallStartedEvent, LLMStreamChunkEvent
+    from crewai.utilities.events.task_events import TaskStartedEvent
+
+    def handler(event_type, func):
+        def safe(source, event):
+            stream = _current_stream.get()
+            if stream is None:
+                return
+            try:
+                func(stream, source, event)
+            except Exception as e:
+                logger.debug(f"Reply stream could not handle {event_type.__name__}: {e}")
+        crewai_event_bus.register_handler(event_type, safe)
+
+    handler(TaskStartedEvent, lambda stream, source, event: stream.task_started(source))
+    handler(LLMCallStartedEvent, lambda stream, source, event: stream.llm_started())
+    handler(LLMStreamChunkEvent, lambda stream, source, event: stream.chunk(event.chunk))
+
+
+def open_stream(send, task_name: str, prefix: str = "") -> ReplyStream:
+    """A stream for the answer of `task_name`; call from the flow's event loop, then run the crew inside attached()."""
+    _install()
+    return ReplyStream(send, task_name, prefix)
+
+
+@contextmanager
+def attached(stream: ReplyStream | None):
+    """Route the crew's stream events to `stream` for the duration of the block."""
+    token = _current_stream.set(stream)
+    try:
+        yield stream
+    finally:
+        _current_stream.reset(token)
@@ -1,3 +1,898 @@
-from django.test import TestCase
+import asyncio
+import io
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from functools import partial
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.core.management import call_command
+from django.db import IntegrityError
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from benchmarks.fakes import install_fakes
+from benchmarks.stub_server import StubServer
+from core import consumption, jobs, ticket_rollups, views
+from core.classifier import classify
+from core.crews import ROUTED_TASKS, TASK_ORDER, CrewFactory
+from core.dispatch import OutboundDispatcher, SendError, dispatcher
+from core.knowledge_base import KnowledgeBase, build_index
+from core.management.commands.run_workers import _worker_loop
+from core.flows.energy_flow import PowerPulseFlow
+from core.inbound import InboundCoalescer
+from core.models import ConsumptionAnomaly, EnergyConsumer, FlowJob, GeneratedEnergyContent, ServiceTicket, TicketRollup
+from core.pipeline import FairScheduler, MessagePipeline, _Job
+from core.persistence import InteractionRecord, WriteBehindBuffer, persist_batch, persist_interaction, write_behind
+from core.profiling import profiler
+from core.response_cache import ResponseCache
+from core.streaming import MessageChunker, ReplyStream, split_message
+
+# Keep the flow on its fast path: no cache, memory, meter or knowledge-base
+# lookups. The diagram is drawn alongside the answer and sent with it, so
+# nothing is left running in the media stage (or written to MEDIA_ROOT) after
+# a test.
+OFFLINE_FLOW = override_settings(
+    RESPONSE_CACHE_ENABLED=False,
+    CONVERSATION_MEMORY_ENABLED=False,
+    CONSUMPTION_CONTEXT_ENABLED=False,
+    KB_ENABLED=False,
+    REPLY_STREAMING=False,
+    MEDIA_ASYNC=False,
+    CREW_EXECUTION_MODE='routed',
+)
+
+
+class FlowTestCase(TransactionTestCase):
+    """
+    Runs PowerPulseFlow against the fake LLM, DALL-E and Twilio from
+    benchmarks/fakes.py, as the offline runs do. The flow reaches the database
+    from other threads, so rows must be committed rather than held in a
+    TestCase transaction.
+    """
+
+    def setUp(self):
+        self.fakes = install_fakes()
+        self.addCleanup(self.fakes.close)
+        # Let the background writers commit before the tables are flushed.
+        self.addCleanup(flush_writers)
+
+
+def flush_writers():
+    for writer in (write_behind, profiler.writer, dispatcher.sid_writer, jobs.job_writer):
+        writer.flush(5.0)
+
+
+
+class FlowJobQueueTests(TestCase):
+
+    def enqueue(self, body="no power since noon"):
+        return jobs.enqueue_message(body, "whatsapp:+10000000001")
+
+    def expire_lease(self, job):
+        FlowJob.objects.filter(id=job.id).update(locked_until=timezone.now() - timedelta(seconds=1))
+
+    def test_claim_leases_the_oldest_job_once(self):
+        first, second = self.enqueue(), self.enqueue()
+        claimed = [jobs.claim_job("w1"), jobs.claim_job("w2"), jobs.claim_job("w3")]
+        self.assertEqual([job.id if job else None for job in claimed], [first.id, second.id, None])
+        self.assertEqual((claimed[0].status, claimed[0].attempts, claimed[0].locked_by), ('running', 1, "w1"))
+
+    def test_job_is_not_claimed_before_it_is_available(self):
+        jobs.enqueue_message("hi", "whatsapp:+10000000001", available_at=timezone.now() + timedelta(minutes=1))
+        self.assertIsNone(jobs.claim_job("w1"))
+
+    def test_failed_job_is_retried_after_a_backoff(self):
+        self.enqueue()
+        job = jobs.claim_job("w1")
+        jobs.fail_job(job, "RuntimeError: LLM unavailable")
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('pending', None))
+        self.assertGreater(job.available_at, timezone.now())
+        self.assertIsNone(jobs.claim_job("w1"))
+
+    def test_failure_on_the_last_attempt_dead_letters_the_job(self):
+        job = self.enqueue()
+        FlowJob.objects.filter(id=job.id).update(attempts=job.max_attempts - 1)
+        jobs.fail_job(jobs.claim_job("w1"), "RuntimeError: LLM unavailable")
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'dead')
+        self.assertEqual(jobs.requeue_dead_jobs(), 1)
+        self.assertEqual(jobs.claim_job("w1").id, job.id)
+
+    def test_expired_lease_is_taken_over_and_the_old_worker_cannot_complete_it(self):
+        self.enqueue()
+        stale = jobs.claim_job("w1")
+        self.expire_lease(stale)
+        job = jobs.claim_job("w2")
+        self.assertEqual((job.id, job.attempts), (stale.id, 2))
+        jobs.complete_job(stale)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.locked_by), ('running', "w2"))
+
+    def test_expired_lease_on_the_last_attempt_is_dead_lettered(self):
+        job = self.enqueue()
+        FlowJob.objects.filter(id=job.id).update(attempts=job.max_attempts - 1)
+        self.expire_lease(jobs.claim_job("w1"))
+        self.assertIsNone(jobs.claim_job("w2"))
+        self.assertEqual(jobs.dead_letter_abandoned_jobs(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'dead')
+
+
+@override_settings(CLASSIFIER_MODEL_PATH="/nonexistent/classifier.npz")
+class ClassifierFastPathTests(SimpleTestCase):
+    """The keyword classifier alone, as it runs before any model is trained."""
+
+    def assertFastPath(self, text, category):
+        result = classify(text)
+        self.assertEqual(result.category, category, text)
+        self.assertGreaterEqual(result.confidence, settings.CLASSIFIER_CONFIDENCE_THRESHOLD, text)
+
+    def test_emergency_keyword_is_decisive(self):
+        result = classify("my AC is buzzing and now there are sparks and a burning smell")
+        self.assertEqual((result.category, result.confidence, result.source), ("emergency", 1.0, "keywords"))
+
+    def test_clear_messages_skip_the_llm(self):
+        self.assertFastPath("Why is my electricity bill so high this month?", "energy_advice")
+        self.assertFastPath("We have had no power since noon", "technical_fault")
+        self.assertFastPath("في شرارة من العداد", "emergency")
+        self.assertFastPath("الفاتورة عالية جدا", "energy_advice")
+
+    def test_fire_and_smoke_need_a_hazard_to_be_an_emergency(self):
+        for text in ("my smoke detector keeps beeping", "how long should I fire up the heater before bed?"):
+            self.assertLess(classify(text).confidence, settings.CLASSIFIER_CONFIDENCE_THRESHOLD, text)
+        for text in ("the socket is on fire", "there is smoke coming out of the meter box", "smoke and sparks from the fuse box"):
+            self.assertEqual(classify(text).category, "emergency", text)
+            self.assertEqual(classify(text).confidence, 1.0, text)
+
+    def test_unclear_messages_go_to_the_llm(self):
+        self.assertLess(classify("hello, can someone help me?").confidence, settings.CLASSIFIER_CONFIDENCE_THRESHOLD)
+        self.assertLess(classify("the outlet in the kitchen").confidence, settings.CLASSIFIER_CONFIDENCE_THRESHOLD)
+
+
+class TrainClassifierTests(TestCase):
+
+    def test_trains_only_on_llm_labels(self):
+        consumer = EnergyConsumer.objects.create(phone_number="+10000000001")
+        for i, (text, category, source) in enumerate([
+            ("my bill doubled this month", 'energy_advice', 'llm'),
+            ("no power in the kitchen since noon", 'technical_fault', 'llm'),
+            ("how can I save on my bill", 'energy_advice', 'keywords'),
+            ("the breaker keeps tripping", 'technical_fault', 'model'),
+            ("and the other room?", 'technical_fault', 'conversation'),
+            ("hello?", 'energy_advice', 'default'),
+        ]):
+            ServiceTicket.objects.create(consumer=consumer, ticket_id=f"PP-{i}", issue_description=text,
+                                         category=category, classified_by=source)
+        out = io.StringIO()
+        with tempfile.TemporaryDirectory() as root:
+            with override_settings(CLASSIFIER_MODEL_PATH=os.path.join(root, "classifier.npz")):
+                call_command('train_classifier', min_samples=2, epochs=5, stdout=out)
+        self.assertIn("Trained on 2 tickets", out.getvalue())
+
+@OFFLINE_FLOW
+class WorkerLoopTests(FlowTestCase):
+
+    def drain(self):
+        asyncio.run(_worker_loop("test-worker", 60, 0.01, True, threading.Event()))
+
+    def test_crew_failure_leaves_the_job_pending_for_a_retry(self):
+        job = jobs.enqueue_message("my AC keeps tripping the breaker", "whatsapp:+10000000001")
+        with mock.patch('core.flows.energy_flow.crew_factory.acquire', side_effect=RuntimeError("LLM unavailable")):
+            self.drain()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'pending')
+        self.assertEqual(job.attempts, 1)
+        self.assertIn("LLM unavailable", job.last_error)
+        self.assertIsNone(job.locked_by)
+
+    def test_crew_failure_on_the_last_attempt_dead_letters_the_job(self):
+        job = jobs.enqueue_message("my AC keeps tripping the breaker", "whatsapp:+10000000001")
+        FlowJob.objects.filter(id=job.id).update(attempts=job.max_attempts - 1)
+        with mock.patch('core.flows.energy_flow.crew_factory.acquire', side_effect=RuntimeError("LLM unavailable")):
+            self.drain()
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'dead')
+        self.assertEqual(job.attempts, job.max_attempts)
+
+    def test_follow_up_diagram_is_queued_as_a_job_of_its_own(self):
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MESSAGE_QUEUE_BACKEND='database', MEDIA_ASYNC=True, MEDIA_ROOT=media_root):
+            job = jobs.enqueue_message("How can I lower my electricity bill?", "whatsapp:+10000000001")
+            self.drain()
+
+        media = FlowJob.objects.get(kind='media')
+        ticket = ServiceTicket.objects.get()
+        self.assertEqual(media.payload["ticket_ref"], ticket.ticket_id)
+        self.assertEqual(list(FlowJob.objects.values_list('id', 'status')), [(job.id, 'done'), (media.id, 'done')])
+        reply, diagram = self.fakes.sender.deliveries
+        self.assertIn(ticket.ticket_id, diagram.text)
+        self.assertIsNotNone(diagram.image_url)
+
+    def test_failed_send_is_retried_as_a_resend_of_the_stored_answer(self):
+        job = jobs.enqueue_message("How can I lower my electricity bill?", "whatsapp:+10000000001")
+        with mock.patch('core.flows.energy_flow.send_energy_update_to_whatsapp', return_value=None):
+            self.drain()
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('pending', 1))
+        ticket = ServiceTicket.objects.get()
+        self.assertEqual(job.ticket_ref, ticket.ticket_id)
+
+        FlowJob.objects.filter(id=job.id).update(available_at=timezone.now())
+        with mock.patch('core.flows.energy_flow.crew_factory.acquire', side_effect=AssertionError("flow ran again")):
+            self.drain()
+        job.refresh_from_db()
+        self.assertEqual(job.status, 'done')
+        self.assertEqual(ServiceTicket.objects.count(), 1)
+        [delivery] = self.fakes.sender.deliveries
+        self.assertTrue(delivery.text.startswith(f"*Ref ID: {ticket.ticket_id}*"))
+
+
+
+@OFFLINE_FLOW
+class MediaStageTests(FlowTestCase):
+
+    def test_diagram_is_drawn_and_sent_after_the_text_reply(self):
+        drawn_before_reply = []
+        self.fakes.sender.listen("+10000000001", lambda delivery: drawn_before_reply.append(self.fakes.visual.calls))
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ASYNC=True, IMAGE_LIBRARY_ENABLED=False, MEDIA_ROOT=media_root):
+            asyncio.run(PowerPulseFlow().kickoff_async("How can I lower my electricity bill?", "whatsapp:+10000000001"))
+            deadline = time.monotonic() + 5
+            while len(self.fakes.sender.deliveries) < 2 and time.monotonic() < deadline:
+                time.sleep(0.01)
+            content = GeneratedEnergyContent.objects.get()
+        reply, diagram = self.fakes.sender.deliveries
+        self.assertEqual(drawn_before_reply[0], 0)
+        self.assertIsNone(reply.image_url)
+        self.assertIn(content.ticket.ticket_id, diagram.text)
+        self.assertIsNotNone(diagram.image_url)
+        self.assertTrue(content.generated_image)
+
+@override_settings(RESPONSE_CACHE_HISTORY_REFRESH=0)
+class ResponseCacheHistoryTests(TestCase):
+
+    def persist(self, phone, query, text, cacheable):
+        persist_interaction(InteractionRecord(
+            phone_number=phone, user_query=query, category='energy_advice', generated_text=text, cacheable=cacheable,
+        ))
+
+    def cache(self):
+        return ResponseCache(max_entries=100, ttl=3600, similarity_threshold=0.8)
+
+    def test_history_refresh_loads_cacheable_answers(self):
+        self.persist("+10000000001", "How do I lower my bill in summer?", "Raise the AC setpoint to 24C.", True)
+        hit = self.cache().lookup("How do I lower my bill in summer?", 'energy_advice')
+        self.assertIsNotNone(hit)
+        self.assertEqual(hit.kind, "exact")
+
+    def test_history_refresh_skips_follow_up_answers(self):
+        self.persist("+10000000001", "and what about the heater?", "As we discussed, your heater...", False)
+        self.assertIsNone(self.cache().lookup("and what about the heater?", 'energy_advice'))
+
+
+class ResponseCacheMatchTests(TestCase):
+
+    def cache(self, *queries):
+        cache = ResponseCache(max_entries=100, ttl=3600, similarity_threshold=0.8)
+        for query in queries:
+            cache.store(query, 'energy_advice', f"answer to: {query}")
+        return cache
+
+    def test_rewording_is_a_near_hit(self):
+        hit = self.cache("How can I reduce my electricity bill?").lookup("how can i reduce my electricty bill", 'energy_advice')
+        self.assertEqual((hit.kind, hit.text), ("near", "answer to: How can I reduce my electricity bill?"))
+
+    def test_different_numbers_or_appliances_are_misses(self):
+        pairs = [
+            ("How much does a 2 ton AC cost to run?", "How much does a 1 ton AC cost to run?"),
+            ("How do I save on my AC at night?", "How do I save on my heater at night?"),
+            ("What is the price of installing solar panels on my roof in this city?",
+             "What is the price of installing solar water heater on my roof in this city?"),
+            ("كم يستهلك المكيف في الصيف؟", "كم يستهلك السخان في الصيف؟"),
+        ]
+        for stored, asked in pairs:
+            self.assertIsNone(self.cache(stored).lookup(asked, 'energy_advice'), (stored, asked))
+
+
+@override_settings(CONSUMPTION_CONTEXT_ENABLED=True, RESPONSE_CACHE_HISTORY_REFRESH=0)
+@OFFLINE_FLOW
+class PersonalizedAnswerTests(FlowTestCase):
+
+    QUERY = "Why is my electricity bill so high this month?"
+
+    def run_flow(self, phone, usage):
+        with mock.patch('core.flows.energy_flow.usage_context', return_value=usage):
+            asyncio.run(PowerPulseFlow().kickoff_async(self.QUERY, f"whatsapp:{phone}"))
+        return GeneratedEnergyContent.objects.get(ticket__consumer__phone_number=phone)
+
+    def test_answer_built_on_meter_readings_is_not_shared(self):
+        content = self.run_flow("+10000000001", "Meter MTR-1: 912 kWh in October 2026, usual month 400 kWh.")
+        self.assertFalse(content.cacheable)
+        cache = ResponseCache(max_entries=100, ttl=3600, similarity_threshold=0.8)
+        self.assertIsNone(cache.lookup(self.QUERY, 'energy_advice'))
+
+    def test_answer_without_readings_is_shared(self):
+        content = self.run_flow("+10000000002", "")
+        self.assertTrue(content.cacheable)
+        cache = ResponseCache(max_entries=100, ttl=3600, similarity_threshold=0.8)
+        self.assertEqual(cache.lookup(self.QUERY, 'energy_advice').text, content.generated_text)
+
+
+@override_settings(RESPONSE_CACHE_ENABLED=True, RESPONSE_CACHE_HISTORY_REFRESH=0)
+@OFFLINE_FLOW
+class CachedAnswerTests(FlowTestCase):
+
+    QUERY = "How can I lower my electricity bill in summer?"
+
+    def test_served_copy_is_not_reloaded_into_the_cache(self):
+        cache = ResponseCache(max_entries=100, ttl=3600, similarity_threshold=0.8)
+        with mock.patch('core.flows.energy_flow.response_cache', cache):
+            for phone in ("+10000000001", "+10000000002"):
+                asyncio.run(PowerPulseFlow().kickoff_async(self.QUERY, f"whatsapp:{phone}"))
+        written, served = GeneratedEnergyContent.objects.order_by('id')
+        self.assertEqual(served.generated_text, written.generated_text)
+        self.assertEqual((written.cacheable, served.cacheable), (True, False))
+        self.assertEqual(cache.stats()["hits_exact"], 1)
+
+
+class CrewInputTests(SimpleTestCase):
+
+    def inputs(self, cacheable):
+        flow = PowerPulseFlow()
+        flow.state.user_query = "How do I lower my bill?"
+        flow.state.conversation_context = "Customer: my AC trips the breaker\nPowerPulse (ticket PP-ABC123): ..."
+        flow.state.cacheable = cacheable
+        return flow._crew_inputs()
+
+    def test_cacheable_answer_is_written_without_the_conversation(self):
+        self.assertNotIn("PP-ABC123", self.inputs(cacheable=True)["conversation_context"])
+
+    def test_follow_up_answer_sees_the_conversation(self):
+        self.assertIn("PP-ABC123", self.inputs(cacheable=False)["conversation_context"])
+
+
+class CrewFactoryTests(SimpleTestCase):
+
+    def test_each_kickoff_gets_its_own_agents_and_tasks(self):
+        factory = CrewFactory()
+        with factory.acquire() as first:
+            first.tasks[0].output = "stale"
+        with factory.acquire() as second:
+            self.assertIsNone(second.tasks[0].output)
+            self.assertFalse({id(a) for a in first.agents} & {id(a) for a in second.agents})
+        self.assertEqual([t.name for t in second.tasks], list(TASK_ORDER))
+
+    def test_routed_crew_without_tools(self):
+        task_name, _ = ROUTED_TASKS["energy_advice"]
+        with CrewFactory().acquire((task_name,), tools=False) as crew:
+            self.assertEqual([t.name for t in crew.tasks], [task_name])
+            self.assertEqual(crew.agents[0].tools, [])
+
+
+class SendErrorTests(SimpleTestCase):
+
+    def test_classification(self):
+        cases = {
+            # (status, reached_server): (retryable, ambiguous)
+            (None, False): (True, False),   # connection refused: nothing was sent
+            (None, True): (True, True),     # read timeout: Twilio may have taken it
+            (429, True): (True, False),
+            (503, True): (True, False),
+            (502, True): (True, True),
+            (400, True): (False, False),
+        }
+        for (status, reached_server), expected in cases.items():
+            error = SendError("x", status=status, reached_server=reached_server)
+            self.assertEqual((error.retryable, error.ambiguous), expected, (status, reached_server))
+
+
+class DispatcherRetryTests(SimpleTestCase):
+
+    def send(self, server, max_attempts=3):
+        dispatcher = OutboundDispatcher(rate=100, burst=10, concurrency=2, max_attempts=max_attempts,
+                                        backoff=0.01, backoff_max=0.05)
+        with override_settings(TWILIO_API_BASE_URL=server.url if server else "http://127.0.0.1:9"):
+            sid = dispatcher.send("+10000000001", "Your meter reading is due", from_="+10000000000")
+        return sid, dispatcher.stats()
+
+    def test_throttled_send_is_retried(self):
+        with StubServer(overrides=[(429, {"code": 20429, "message": "Too Many Requests"}, {"Retry-After": "0"})]) as server:
+            sid, stats = self.send(server)
+        self.assertEqual([m[0] for m in server.messages], [sid])
+        self.assertEqual((stats["retries"], stats["throttled"]), (1, 1))
+
+    def test_lost_answer_is_looked_up_instead_of_sent_again(self):
+        with StubServer(overrides=[(None, None, None)]) as server:
+            sid, stats = self.send(server)
+        self.assertEqual(len(server.messages), 1)
+        self.assertEqual(sid, server.messages[0][0])
+        self.assertEqual(stats["recovered"], 1)
+
+    @override_settings(WHATSAPP_DISPATCHER_ENABLED=False)
+    def test_sdk_path_sends_to_the_same_twilio_api(self):
+        from core.tools.whatsapp_sender import send_energy_update_to_whatsapp
+
+        with StubServer() as server, override_settings(TWILIO_API_BASE_URL=server.url):
+            sid = send_energy_update_to_whatsapp("+10000000001", "Your meter reading is due")
+        self.assertEqual([(m[0], m[1]["Body"]) for m in server.messages], [(sid, "Your meter reading is due")])
+
+    def test_refused_connection_is_retried_then_given_up(self):
+        sid, stats = self.send(None, max_attempts=2)
+        self.assertIsNone(sid)
+        self.assertEqual((stats["retries"], stats["failed"]), (1, 1))
+
+
+class InboundRetryTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(views, 'coalescer', InboundCoalescer(window=0, max_wait=0, max_messages=1))
+        self.coalescer = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def accept(self, **patches):
+        with mock.patch.object(views, 'hold_or_enqueue', **patches) as hold_or_enqueue:
+            asyncio.run(views.accept_message("my meter is blank", "whatsapp:+10000000001", "SM1"))
+        return hold_or_enqueue
+
+    def test_twilio_retry_of_an_accepted_message_is_dropped(self):
+        self.accept(return_value=True)
+        self.assertFalse(self.accept(return_value=True).called)
+        self.assertEqual(self.coalescer.stats()["duplicates"], 1)
+
+    def test_twilio_retry_after_a_failed_enqueue_is_processed(self):
+        with self.assertRaises(RuntimeError):
+            self.accept(side_effect=RuntimeError("database is locked"))
+        self.assertTrue(self.accept(return_value=True).called)
+        self.assertEqual(self.coalescer.stats()["duplicates"], 0)
+
+
+@override_settings(MESSAGE_QUEUE_BACKEND='database')
+class QueuedBurstTests(TransactionTestCase):
+
+    def setUp(self):
+        self.coalescer = InboundCoalescer(window=60, max_wait=120, max_messages=8)
+
+    def hold(self, *messages, number="whatsapp:+10000000001"):
+        async def hold_all():
+            return [await self.coalescer.hold_queued(number, message) for message in messages]
+        return asyncio.run(hold_all())
+
+    def test_burst_is_one_job_no_worker_can_claim_yet(self):
+        job_ids = self.hold("hi", "my AC", "is making a buzzing noise")
+        self.assertEqual(len(set(job_ids)), 1)
+        job = FlowJob.objects.get()
+        self.assertEqual(job.message_body, "hi\nmy AC\nis making a buzzing noise")
+        self.assertIsNone(jobs.claim_job("test-worker"))
+
+    def test_emergency_releases_the_burst_at_once(self):
+        self.hold("hi", "there are sparks coming from my meter and a burning smell")
+        job = jobs.claim_job("test-worker")
+        self.assertEqual(job.message_body, "hi\nthere are sparks coming from my meter and a burning smell")
+
+    def test_message_after_the_job_was_claimed_starts_a_new_one(self):
+        self.hold("hi")
+        FlowJob.objects.update(available_at=timezone.now())
+        self.assertIsNotNone(jobs.claim_job("test-worker"))
+        self.hold("my AC is making a buzzing noise")
+        self.assertEqual(FlowJob.objects.count(), 2)
+
+
+class TicketRollupTests(TestCase):
+
+    def setUp(self):
+        self.consumer = EnergyConsumer.objects.create(phone_number="+10000000001")
+
+    def ticket(self, **fields):
+        return ServiceTicket.objects.create(consumer=self.consumer, issue_description="no power", **fields)
+
+    def counts(self):
+        return {(category, urgency, status): n for category, urgency, status, n in
+                TicketRollup.objects.filter(count__gt=0).values_list(*ticket_rollups.KEY_FIELDS, 'count')}
+
+    def test_signals_move_a_ticket_between_buckets(self):
+        ticket = self.ticket(category='technical_fault')
+        self.ticket(category='technical_fault')
+        ticket.status = 'resolved'
+        ticket.save()
+        self.ticket(category='emergency', urgency='high').delete()
+        self.assertEqual(self.counts(), {
+            ('technical_fault', 'low', 'open'): 1,
+            ('technical_fault', 'low', 'resolved'): 1,
+        })
+
+    def test_rebuild_repairs_a_queryset_update(self):
+        self.ticket()
+        ServiceTicket.objects.update(status='in_progress')
+        result = ticket_rollups.rebuild()
+        self.assertEqual(self.counts(), {('energy_advice', 'low', 'in_progress'): 1})
+        self.assertEqual(result["corrected"], 2)
+
+    def test_rebuild_keeps_status_changes_made_while_it_counts(self):
+        first, _ = self.ticket(), self.ticket()
+
+        def resolve_first(done, total):
+            # Already counted as open; only the signal's delta records the change.
+            if done == 1:
+                first.status = 'resolved'
+                first.save()
+
+        ticket_rollups.rebuild(chunk_size=1, progress=resolve_first)
+        self.assertEqual(self.counts(), {('energy_advice', 'low', 'open'): 1, ('energy_advice', 'low', 'resolved'): 1})
+
+
+class PipelineTests(SimpleTestCase):
+    """MessagePipeline on its own loop, with handlers held at a gate until the test lets them finish."""
+
+    def pipeline(self, **options):
+        options = {"workers": 1, "queue_size": 10, "stage_limits": {"crew": 1}, **options}
+        pipeline = MessagePipeline(**options)
+        pipeline.start()
+        return pipeline
+
+    def held(self, gate, ran=None, stage=None, pipeline=None):
+        async def handler(name):
+            if stage is None:
+                await asyncio.to_thread(gate.wait, 30)
+            else:
+                async with pipeline.stage(stage):
+                    ran.append(pipeline.stage_active[stage])
+                    await asyncio.to_thread(gate.wait, 30)
+            if ran is not None and stage is None:
+                ran.append(name)
+        return handler
+
+    def wait_until(self, condition):
+        deadline = time.monotonic() + 5
+        while not condition():
+            self.assertLess(time.monotonic(), deadline, "pipeline did not get there in time")
+            time.sleep(0.005)
+
+    def test_full_queue_sheds_routine_jobs_but_admits_emergencies(self):
+        pipeline, gate = self.pipeline(queue_size=1), threading.Event()
+        handler = self.held(gate)
+        self.assertTrue(pipeline.submit(handler, "running", key="a"))
+        self.wait_until(lambda: pipeline.in_flight == 1)
+        self.assertTrue(pipeline.submit(handler, "queued", key="b"))
+        self.assertFalse(pipeline.submit(handler, "shed", key="c"))
+        self.assertTrue(pipeline.submit(handler, "urgent", key="c", priority="emergency"))
+        gate.set()
+        self.wait_until(lambda: pipeline.completed == 3)
+        self.assertEqual(pipeline.stats()["shed"], {"queue_full": 1, "per_number": 0, "expired": 0})
+
+    def test_stage_cap_holds_across_workers_and_emergencies_run_over_it(self):
+        pipeline, gate, active = self.pipeline(workers=3), threading.Event(), []
+        handler = self.held(gate, active, "crew", pipeline)
+        for key in ("a", "b"):
+            pipeline.submit(handler, key, key=key)
+        self.wait_until(lambda: pipeline.stage_waiting["crew"] == 1)
+        pipeline.submit(handler, "urgent", key="c", priority="emergency")
+        self.wait_until(lambda: len(active) == 2)
+        self.assertEqual(active, [1, 2])
+        gate.set()
+        self.wait_until(lambda: pipeline.completed == 3)
+        self.assertEqual(pipeline.stats()["stages"]["crew"]["active"], 0)
+
+    def test_lookups_outside_a_stage_do_not_starve_the_stages(self):
+        pipeline, gate, answered = self.pipeline(workers=9), threading.Event(), threading.Event()
+        handler = self.held(gate)
+        for key in "abcdefgh":
+            pipeline.submit(handler, key, key=key)
+        self.wait_until(lambda: pipeline.in_flight == 8)
+
+        async def reply(_):
+            async with pipeline.stage("crew"):
+                await asyncio.to_thread(answered.set)
+
+        # Eight threads are parked in lookups; a pool sized by the stage caps (1 + 4) would have none left.
+        pipeline.submit(reply, "reply", key="i")
+        self.assertTrue(answered.wait(2))
+        gate.set()
+        self.wait_until(lambda: pipeline.completed == 9)
+
+    def test_number_with_replies_waiting_is_shed_and_stale_replies_expire(self):
+        pipeline, gate, notices = self.pipeline(max_queued_per_key=1, max_queue_wait=0.05), threading.Event(), []
+        handler = self.held(gate)
+
+        async def busy_notice():
+            notices.append("busy")
+
+        self.assertTrue(pipeline.submit(handler, "running", key="a"))
+        self.wait_until(lambda: pipeline.in_flight == 1)
+        self.assertTrue(pipeline.submit(handler, "queued", key="a", on_shed=busy_notice))
+        self.assertFalse(pipeline.submit(handler, "third", key="a"))
+        self.assertTrue(pipeline.submit(handler, "other number", key="b"))
+        time.sleep(0.1)
+        gate.set()
+        self.wait_until(lambda: pipeline.completed == 1 and pipeline.shed["expired"] == 2 and notices)
+        self.assertEqual(notices, ["busy"])
+        self.assertEqual(pipeline.shed["per_number"], 1)
+
+
+class FairSchedulerTests(SimpleTestCase):
+
+    def order(self, jobs, per_key_limit=1, weights=None, finish=True):
+        """The order the scheduler hands out `jobs` ((key, priority) pairs), finishing each one when `finish`."""
+        async def run():
+            scheduler = FairScheduler(per_key_limit, weights or {"normal": 3, "background": 1})
+            for key, priority in jobs:
+                scheduler.put(_Job(None, (), key, priority))
+            served = []
+            for _ in jobs:
+                try:
+                    job = await asyncio.wait_for(scheduler.get(), 0.05)
+                except asyncio.TimeoutError:
+                    break
+                served.append((job.key, job.priority))
+                if finish:
+                    scheduler.done(job)
+            return served
+        return asyncio.run(run())
+
+    def test_numbers_take_turns(self):
+        jobs = [("a", "normal")] * 3 + [("b", "normal"), ("c", "normal")]
+        self.assertEqual([key for key, _ in self.order(jobs)], ["a", "b", "c", "a", "a"])
+
+    def test_a_number_runs_one_reply_at_a_time(self):
+        jobs = [("a", "normal"), ("a", "normal"), ("b", "normal")]
+        self.assertEqual([key for key, _ in self.order(jobs, finish=False)], ["a", "b"])
+
+    def test_emergencies_jump_the_queue(self):
+        jobs = [("a", "normal"), ("b", "normal"), ("c", "emergency")]
+        self.assertEqual(self.order(jobs)[0], ("c", "emergency"))
+
+    def test_background_work_gets_its_weighted_share(self):
+        jobs = [(f"n{i}", "normal") for i in range(5)] + [(f"m{i}", "background") for i in range(2)]
+        self.assertEqual([priority[0] for _, priority in self.order(jobs)], list("nnnbnnb"))
+
+
+class PersistenceTests(TransactionTestCase):
+
+    def record(self, query="no power since noon", **fields):
+        return InteractionRecord(phone_number="+10000000001", user_query=query, category='technical_fault',
+                                 generated_text="Check the main breaker.", **fields)
+
+    def test_failed_content_write_leaves_no_ticket_behind(self):
+        with mock.patch.object(GeneratedEnergyContent.objects, 'create', side_effect=RuntimeError("disk full")):
+            with self.assertRaises(RuntimeError):
+                persist_interaction(self.record())
+        self.assertFalse(ServiceTicket.objects.exists())
+        self.assertFalse(EnergyConsumer.objects.exists())
+
+    def test_colliding_ticket_id_is_replaced_unless_already_quoted(self):
+        persist_interaction(self.record(ticket_id="TIC-AAAAAA"))
+        content_id = persist_interaction(self.record(ticket_id="TIC-AAAAAA"))
+        self.assertNotEqual(GeneratedEnergyContent.objects.get(id=content_id).ticket.ticket_id, "TIC-AAAAAA")
+        with self.assertRaises(IntegrityError):
+            persist_interaction(self.record(ticket_id="TIC-AAAAAA"), reassign_ticket_id=False)
+        self.assertEqual(ServiceTicket.objects.count(), 2)
+        self.assertEqual(GeneratedEnergyContent.objects.count(), 2)
+
+    def test_group_commit_with_a_bad_record_writes_every_other_message_once(self):
+        buffer = WriteBehindBuffer(persist_batch, partial(persist_interaction, reassign_ticket_id=False),
+                                   batch_size=10, linger=0.05, name="test-write-behind")
+        records = [self.record("first", ticket_id="TIC-AAAAAA"), self.record("clash", ticket_id="TIC-AAAAAA"),
+                   self.record("third", ticket_id="TIC-BBBBBB")]
+        futures = [buffer.submit(record) for record in records]
+        buffer.flush(5.0)
+        self.assertIsInstance(futures[1].exception(), IntegrityError)
+        self.assertEqual(
+            sorted(ServiceTicket.objects.values_list('ticket_id', 'issue_description', 'ai_content__id')),
+            [("TIC-AAAAAA", "first", futures[0].result()), ("TIC-BBBBBB", "third", futures[2].result())],
+        )
+        self.assertEqual(buffer.stats()["failures"], 1)
+
+
+class StreamingTests(SimpleTestCase):
+
+    ANSWER = (
+        "Your AC is the biggest load in summer. Set it to 24C and clean the filter monthly.\n\n"
+        "Run the washing machine and dishwasher after 10pm, when the tariff is lower. "
+        "Unplug chargers and TVs at the wall overnight.\n\n"
+        "Check the fridge door seal with a sheet of paper: if it slides out easily, replace the seal."
+    )
+
+    def words(self, messages):
+        return " ".join(messages).split()
+
+    def test_split_message_keeps_every_word_within_the_limit(self):
+        parts = split_message(self.ANSWER, 120)
+        self.assertTrue(all(len(part) <= 120 for part in parts), parts)
+        self.assertEqual(self.words(parts), self.ANSWER.split())
+        self.assertTrue(parts[0].endswith("24C and clean the filter monthly."), parts[0])
+
+    def test_chunker_releases_paragraphs_as_tokens_arrive(self):
+        chunker, messages = MessageChunker(min_chars=80, max_chars=200), []
+        for token in re.findall(r"\S+\s*", self.ANSWER):
+            messages += chunker.feed(token)
+        self.assertEqual(messages, self.ANSWER.split("\n\n")[:2])
+        self.assertEqual(self.ANSWER[chunker.consumed:], self.ANSWER.split("\n\n")[2])
+
+    def stream(self, tokens, final_text):
+        sent = []
+
+        async def run():
+            stream = ReplyStream(sent.append, "consultation_brief_task", prefix="*Ref ID: TIC-AAAAAA*\n\n",
+                                 min_chars=40, max_chars=200)
+            stream.task_started(SimpleNamespace(name="consultation_brief_task"))
+            stream.llm_started()
+            for token in tokens:
+                await asyncio.to_thread(stream.chunk, token)
+            await stream.finish(final_text)
+            return stream
+
+        return asyncio.run(run()), sent
+
+    def test_stream_skips_the_preamble_and_sends_the_rest_from_the_result(self):
+        tokens = ["Thought: I know the answer.\n", "Final ", "Answer: "] + re.findall(r"\S+\s*", self.ANSWER)[:30]
+        stream, sent = self.stream(tokens, self.ANSWER)
+        self.assertGreater(stream.streamed, 1)
+        self.assertTrue(sent[0].startswith("*Ref ID: TIC-AAAAAA*\n\nYour AC"), sent[0])
+        self.assertEqual(self.words(sent)[3:], self.ANSWER.split())
+
+    def test_answer_that_diverged_is_sent_again_in_full(self):
+        tokens = ["Final Answer: "] + re.findall(r"\S+\s*", self.ANSWER)
+        revised = "Switch off the main breaker and call an electrician before touching the AC."
+        _, sent = self.stream(tokens, revised)
+        self.assertEqual(sent[-1], revised)
+
+
+class KnowledgeBaseTests(SimpleTestCase):
+
+    DOCS = {
+        "grid_code.md": "Meter boxes need a clear working space of 1 metre in front of the panel.\n\n"
+                        "Service cables entering the meter box must be sealed against water.",
+        "manuals/ac.txt": "To reset the air conditioner, switch off the isolator for five minutes. "
+                          "Clean the air filter every month to keep the compressor efficient.",
+        "manuals/heater.txt": "The water heater thermostat should be set to 60 degrees to prevent legionella.",
+    }
+
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.source_dir, self.index_dir = os.path.join(root.name, "docs"), os.path.join(root.name, "index")
+        for path, text in self.DOCS.items():
+            self.write(path, text)
+
+    def write(self, path, text):
+        path = os.path.join(self.source_dir, path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+
+    def kb(self):
+        return KnowledgeBase(self.index_dir, top_k=2, probes=4, min_score=0.08, check_interval=0)
+
+    def test_search_ranks_the_passage_that_answers_the_question_first(self):
+        build_index(self.source_dir, self.index_dir)
+        kb = self.kb()
+        self.assertEqual(kb.search("how much clearance in front of the meter box?")[0].source, "grid_code.md")
+        self.assertEqual(kb.search("what temperature for the water heater thermostat")[0].source, "manuals/heater.txt")
+        self.assertEqual(kb.search("zzqx vbnm"), [])
+        self.assertTrue(kb.context("reset the air conditioner").startswith("[manuals/ac.txt] To reset"))
+
+    def test_ivf_index_finds_what_the_flat_scan_finds(self):
+        build_index(self.source_dir, self.index_dir)
+        flat = [p.source for p in self.kb().search("air filter compressor")]
+        build_index(self.source_dir, self.index_dir, rebuild=True, ivf_lists=2)
+        self.assertEqual(self.kb().stats()["ivf_lists"], 2)
+        self.assertEqual([p.source for p in self.kb().search("air filter compressor")], flat)
+
+    def test_rebuild_embeds_only_changed_files_and_is_picked_up_by_readers(self):
+        build_index(self.source_dir, self.index_dir)
+        kb = self.kb()
+        self.assertNotIn("manuals/heater.txt", [p.source for p in kb.search("solar inverter earthing")])
+        self.write("manuals/heater.txt", "Solar inverter frames must be earthed with a 6 mm2 conductor.")
+        result = build_index(self.source_dir, self.index_dir)
+        self.assertEqual((result["embedded"], result["reused"]), (1, 2))
+        self.assertEqual(kb.search("solar inverter earthing")[0].source, "manuals/heater.txt")
+        self.assertEqual(kb.stats()["loads"], 2)
+
+
+class AnomalyScoringTests(SimpleTestCase):
+    """score() on a synthetic matrix: weekends use twice the weekday load."""
+
+    WINDOW, DAYS = 28, 7
+
+    def matrix(self):
+        rng = np.random.default_rng(7)
+        columns = np.arange(self.WINDOW + self.DAYS)
+        usual = np.where(columns % 7 >= 5, 20.0, 10.0)    # column 0 is a Monday
+        matrix = usual + rng.normal(0, 0.3, (4, len(columns)))
+        matrix[1, -1] *= 3                                 # Sunday spike
+        matrix[2, self.WINDOW + 2] = 0.5                   # Wednesday the meter nearly stops
+        matrix[3, :self.WINDOW + 2] = np.nan               # new consumer, no history yet
+        return matrix
+
+    def test_flags_spikes_and_drops_against_the_weekday_profile(self):
+        expected, z = consumption.score(self.matrix(), first_weekday=0, window=self.WINDOW, min_days=14)
+        self.assertEqual(z.shape, (4, self.DAYS))
+        self.assertTrue(np.all(np.abs(z[0]) < 4), z[0])
+        self.assertGreater(z[1, -1], 4)
+        self.assertLess(z[2, 2], -4)
+        self.assertTrue(np.all(np.isnan(z[3])))
+        # Saturday and Sunday are expected to be busier (the profile is shrunk towards flat with 4 weeks of history).
+        self.assertGreater(expected[0, 5:].min(), 1.5 * expected[0, :5].max())
+
+    def test_missing_days_are_skipped_not_counted_as_zero(self):
+        matrix = self.matrix()[:1]
+        matrix[0, 3:10] = np.nan
+        _, z = consumption.score(matrix, first_weekday=0, window=self.WINDOW, min_days=14)
+        self.assertTrue(np.all(np.abs(z) < 4), z)
+
+
+class AnomalyDetectionTests(TestCase):
+
+    def test_detected_spike_is_stored_once_with_one_ticket(self):
+        quiet, noisy = (EnergyConsumer.objects.create(phone_number=f"+1000000000{i}") for i in (1, 2))
+        last = date(2026, 3, 29)
+        readings = []
+        for offset in range(35):
+            day = last - timedelta(days=34 - offset)
+            read_at = timezone.make_aware(datetime.combine(day, datetime.min.time()) + timedelta(hours=12))
+            readings.append((quiet.id, read_at, 10000 + 100 * (offset % 3)))
+            readings.append((noisy.id, read_at, 40000 if day == last else 10000 + 100 * (offset % 3)))
+        consumption.ingest(readings)
+
+        for _ in range(2):
+            report = consumption.detect_anomalies(last, create_tickets=True)
+        self.assertEqual((report["consumers"], report["anomalies"], report["spikes"]), (2, 1, 1))
+        anomaly = ConsumptionAnomaly.objects.get()
+        self.assertEqual((anomaly.consumer_id, anomaly.day, anomaly.kind, anomaly.kwh), (noisy.id, last, 'spike', 40.0))
+        self.assertEqual(ServiceTicket.objects.get().anomalies.get(), anomaly)
+
+
+class ServeFileTests(SimpleTestCase):
+
+    BODY = bytes(range(256)) * 4
+
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix=".jpg")
+        self.addCleanup(os.remove, self.path)
+        with os.fdopen(handle, "wb") as f:
+            f.write(self.BODY)
+        self.factory = RequestFactory()
+
+    def get(self, **headers):
+        return views._serve_file(self.factory.get("/media/variants/whatsapp/x.jpg", headers=headers),
+                                 self.path, "image/jpeg")
+
+    def test_full_response_carries_validators(self):
+        response = self.get()
+        self.assertEqual((response.status_code, response.content), (200, self.BODY))
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertTrue(response["ETag"].startswith('"'))
+        self.assertIn("Last-Modified", response)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get()["ETag"]
+        response = self.get(if_none_match=etag)
+        self.assertEqual((response.status_code, response.content, response["ETag"]), (304, b"", etag))
+
+    def test_byte_ranges(self):
+        size = len(self.BODY)
+        for header, start, end in (("bytes=10-19", 10, 19), ("bytes=1000-", 1000, size - 1),
+                                   ("bytes=-4", size - 4, size - 1), ("bytes=1020-5000", 1020, size - 1)):
+            response = self.get(range=header)
+            self.assertEqual(response.status_code, 206, header)
+            self.assertEqual(response.content, self.BODY[start:end + 1], header)
+            self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/{size}", header)
+
+    def test_unsatisfiable_range(self):
+        response = self.get(range=f"bytes={len(self.BODY)}-")
+        self.assertEqual((response.status_code, response["Content-Range"]), (416, f"bytes */{len(self.BODY)}"))
+
+    def test_range_with_a_stale_if_range_gets_the_whole_file(self):
+        etag = self.get()["ETag"]
+        self.assertEqual(self.get(range="bytes=0-9", if_range=etag).status_code, 206)
+        response = self.get(range="bytes=0-9", if_range='"stale"')
+        self.assertEqual((response.status_code, response.content), (200, self.BODY))
@@ -0,0 +1,206 @@
+"""
+PowerPulse AI - Ticket Rollups
+Hourly ticket counts by category, urgency and status, kept in TicketRollup as
+tickets are written, so the operations dashboard reads a few hundred buckets
+instead of grouping the whole ServiceTicket table. A ticket counts in the hour
+it was created, under its current category, urgency and status: creating it
+adds one to its bucket, a status (or category/urgency) change moves that one to
+the new bucket, and deleting it takes it away.
+
+Saves and deletes are tracked through model signals; bulk writes
+(persistence.persist_batch, consumption) call record_created() themselves.
+QuerySet.update() bypasses both, so run `manage.py rebuild_ticket_rollups`
+after a mass update, or to backfill.
+"""
+from __future__ import annotations
+import logging
+from collections import Counter
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.db import NotSupportedError, connection, transaction
+from django.db.models import Count, F
+from django.db.models.functions import TruncHour
+from django.utils import timezone
+
+from core.models import ServiceTicket, TicketRollup
+
+logger = logging.getLogger(__name__)
+
+KEY_FIELDS = ('category', 'urgency', 'status')
+
+
+def hour_of(moment: datetime) -> datetime:
+    return moment.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def _key(ticket: ServiceTicket) -> tuple:
+    return (hour_of(ticket.created_at), ticket.category, ticket.urgency, ticket.status)
+
+
+def apply(deltas) -> None:
+    """Add each (hour, category, urgency, status) -> delta to its bucket, in the caller's transaction if there is one."""
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic():
+        TicketRollup.objects.bulk_create(
+            [TicketRollup(hour=hour, category=category, urgency=urgency, status=status)
+             for hour, category, urgency, status in deltas],
+            ignore_conflicts=True,
+        )
+        # An UPDATE per bucket adds to the stored count, so concurrent writers never overwrite each other.
+        for (hour, category, urgency, status), delta in deltas.items():
+            TicketRollup.objects.filter(hour=hour, category=category, urgency=urgency, status=status).update(
+                count=F('count') + delta
+            )
+
+
+def record_created(tickets) -> None:
+    """Count tickets written without signals (bulk_create)."""
+    apply(Counter(_key(ticket) for ticket in tickets))
+
+
+# -- signals -----------------------------------------------------------------------
+
+def remember_bucket(sender, instance, raw=False, **kwargs):
+    """pre_save: note the bucket an existing ticket is counted in before it changes."""
+    instance._rollup_key = None
+    if raw or instance._state.adding or instance.pk is None:
+        return
+    old = sender.objects.filter(pk=instance.pk).values_list('created_at', *KEY_FIELDS).first()
+    if old is not None:
+        instance._rollup_key = (hour_of(old[0]), *old[1:])
+
+
+def count_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    new = _key(instance)
+    old = None if created else getattr(instance, '_rollup_key', None)
+    if old == new:
+        return
+    deltas = Counter({new: 1})
+    if old is not None:
+        deltas[old] -= 1
+    apply(deltas)
+
+
+def count_deleted(sender, instance, **kwargs):
+    apply({_key(instance): -1})
+
+
+# -- reads -------------------------------------------------------------------------
+
+def summary(hours: int = 24, until: datetime | None = None) -> dict:
+    """Per-hour totals and breakdowns for the last `hours` hours; reads one row per non-empty bucket."""
+    last = hour_of(until or timezone.now())
+    first = last - timedelta(hours=hours - 1)
+    rows = TicketRollup.objects.filter(hour__gte=first, hour__lte=last, count__gt=0).values_list('hour', *KEY_FIELDS, 'count')
+
+    series = {first + timedelta(hours=i): {"total": 0, **{field: Counter() for field in KEY_FIELDS}} for i in range(hours)}
+    totals = {"total": 0, **{field: Counter() for field in KEY_FIELDS}}
+    buckets = 0
+    for hour, category, urgency, status, count in rows:
+        buckets += 1
+        # Aware datetimes hash by their UTC value, so the stored hour finds its slot directly.
+        for entry in (series[hour], totals):
+            entry["total"] += count
+            entry["category"][category] += count
+            entry["urgency"][urgency] += count
+            entry["status"][status] += count
+    return {
+        "from": first.isoformat(),
+        "to": (last + timedelta(hours=1)).isoformat(),
+        "buckets_read": buckets,
+        "totals": {name: dict(value) if isinstance(value, Counter) else value for name, value in totals.items()},
+        "hours": [
+            {"hour": hour.isoformat(), **{name: dict(value) if isinstance(value, Counter) else value for name, value in entry.items()}}
+            for hour, entry in series.items()
+        ],
+    }
+
+
+# -- backfill ----------------------------------------------------------------------
+
+def _snapshot():
+    """
+    Make the rest of the current transaction read one snapshot. SQLite's WAL
+    journal already does (without holding up writers); Postgres' default READ
+    COMMITTED takes a new one per query, which would count a change twice, in
+    a later chunk and in its signal delta.
+    """
+    # Only possible as a transaction's first statement; nested in another, it reads whatever that one does.
+    if connection.vendor == 'postgresql' and not connection.savepoint_ids:
+        with connection.cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ")
+
+
+def _lock_rollups(deltas):
+    """Keep apply() from changing any count until the current transaction ends."""
+    if connection.vendor == 'postgresql':
+        # EXCLUSIVE still lets the dashboard read; apply()'s INSERT and UPDATE wait.
+        with connection.cursor() as cursor:
+            cursor.execute(f"LOCK TABLE {TicketRollup._meta.db_table} IN EXCLUSIVE MODE")
+        return
+    # On SQLite the first write takes the database's write lock, so it is an INSERT.
+    TicketRollup.objects.bulk_create(
+        [TicketRollup(hour=hour, category=category, urgency=urgency, status=status)
+         for hour, category, urgency, status in deltas],
+        ignore_conflicts=True,
+    )
+
+
+def rebuild(chunk_size: int = 50000, progress=None) -> dict:
+    """
+    Recount every ticket in primary-key chunks and correct the rollups by the
+    difference. Safe while tickets are being written (SQLite and Postgres):
+    the rollups and the tickets are read from one snapshot (_snapshot()), and
+    the difference is then added to the counts as they stand under a write
+    lock (_lock_rollups()), so deltas recorded by signals in between are kept.
+    Changes made with QuerySet.update() while it runs bypass the signals and
+    are only picked up if they land before the snapshot; run it again after
+    such a mass update.
+    """
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        raise NotSupportedError(f"rebuild() has no snapshot and lock strategy for {connection.vendor}")
+    stored = Counter()
+    counts = Counter()
+
+    def tally(tickets):
+        rows = (
+            tickets.annotate(hour=TruncHour('created_at', tzinfo=dt_timezone.utc))
+            .values('hour', *KEY_FIELDS).annotate(n=Count('id')).order_by()
+        )
+        for row in rows:
+            counts[(row['hour'], row['category'], row['urgency'], row['status'])] += row['n']
+
+    def buckets():
+        return TicketRollup.objects.values_list('hour', *KEY_FIELDS, 'count')
+
+    with transaction.atomic():
+        _snapshot()
+        for hour, category, urgency, status, n in buckets():
+            stored[(hour, category, urgency, status)] = n
+        bounds = ServiceTicket.objects.order_by('pk').values_list('pk', flat=True)
+        first_id, last_id = bounds.first(), bounds.last()
+        if first_id is not None:
+            for low in range(first_id, last_id + 1, chunk_size):
+                tally(ServiceTicket.objects.filter(pk__gte=low, pk__lt=min(low + chunk_size, last_id + 1)))
+                if progress is not None:
+                    progress(min(low + chunk_size, last_id + 1) - first_id, last_id + 1 - first_id)
+
+    deltas = Counter(counts)
+    deltas.subtract(stored)
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if deltas:
+        with transaction.atomic():
+            _lock_rollups(deltas)
+            current = Counter({(hour, category, urgency, status): n for hour, category, urgency, status, n in buckets()})
+            current.update(deltas)
+            TicketRollup.objects.all().delete()
+            TicketRollup.objects.bulk_create(
+                [TicketRollup(hour=hour, category=category, urgency=urgency, status=status, count=n)
+                 for (hour, category, urgency, status), n in current.items() if n],
+                batch_size=5000,
+            )
+    return {"tickets": sum(counts.values()), "buckets": len(counts), "corrected": len(deltas)}
@@ -1,6 +1,5 @@
 from crewai.tools import BaseTool
-from openai import OpenAI
-from django.conf import settings
+from core.clients import get_openai_client
 
 class Dalle3EnergyVisualizer(BaseTool):
     name: str = "DALL-E 3 Energy Visualizer"
@@ -10,7 +9,7 @@ class Dalle3EnergyVisualizer(BaseTool):
     )
 
     def _run(self, prompt: str) -> str:
-        client = OpenAI(api_key=settings.OPENAI_API_KEY)
+        client = get_openai_client()
         try:
             enhanced_prompt = f"Professional technical illustration of: {prompt}. Minimalist, safe, and educational style."
             response = client.images.generate(
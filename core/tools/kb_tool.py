@@ -0,0 +1,18 @@
+from crewai.tools import BaseTool
+from core.knowledge_base import knowledge_base
+
+class KnowledgeBaseSearch(BaseTool):
+    name: str = "Grid Code and Manual Search"
+    description: str = (
+        "Searches the indexed grid codes, utility regulations and appliance manuals. "
+        "Use this for exact limits, ratings, safety clearances or procedures, and cite the source in brackets."
+    )
+
+    def _run(self, query: str) -> str:
+        try:
+            context = knowledge_base.context(query)
+        except Exception as e:
+            return f"Knowledge base search failed: {str(e)}"
+        return context or "No matching passages in the knowledge base."
+
+knowledge_base_tool = KnowledgeBaseSearch()
@@ -6,6 +6,9 @@ Author: Mohammad Amaierh
 from __future__ import annotations
 import logging
 from django.conf import settings
+from core import clients
+from core.dispatch import dispatcher
+from core.streaming import split_message
 
 logger = logging.getLogger(__name__)
 
@@ -25,15 +28,14 @@ def get_twilio_client():
     token = settings.TWILIO_AUTH_TOKEN
     if not sid or not token:
         raise ValueError("TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN must be set in settings/.env")
-    return Client(sid, token)
+    return clients.get_twilio_client()
 
 
-def send_energy_update_to_whatsapp(to: str, text: str = "", image_url: str = None) -> str | None:
-    
-    if not _TWILIO_AVAILABLE:
-        logger.error("twilio package not installed. Run: pip install twilio")
-        return None
-
+def send_energy_update_to_whatsapp(to: str, text: str = "", image_url: str = None, key: str = None) -> str | None:
+    """
+    Send a reply and return the SID of its first message. A repeat with the same
+    `key` in this process is not sent again (core/dispatch.py).
+    """
     from_number = settings.TWILIO_WHATSAPP_NUMBER
     if not from_number.startswith("whatsapp:"):
         from_number = f"whatsapp:{from_number}"
@@ -45,10 +47,10 @@ def send_energy_update_to_whatsapp(to: str, text: str = "", image_url: str = Non
         logger.warning(f"Skipping send to {to}: No text or image provided.")
         return None
 
-   
-    if text and len(text) > 1550:
-        logger.warning(f"⚠️ Message body too long ({len(text)} chars). Truncating...")
-        text = text[:1550] + "...\n\n(Content shortened to fit WhatsApp limits)"
+    # Long replies go out as several messages, in order, instead of being cut short.
+    parts = split_message(text, settings.WHATSAPP_MAX_CHARS) if text else [""]
+    if len(parts) > 1:
+        logger.info(f"Message body is {len(text)} chars; sending it as {len(parts)} messages")
 
     final_media_url = None
     if image_url and any(domain in image_url for domain in ["http://", "https://"]):
@@ -58,18 +60,49 @@ def send_energy_update_to_whatsapp(to: str, text: str = "", image_url: str = Non
         else:
             logger.warning("⚠️ Localhost image URL detected. Twilio cannot access local files.")
 
+    if settings.WHATSAPP_DISPATCHER_ENABLED:
+        futures = [
+            dispatcher.submit(
+                to, body,
+                media_url=final_media_url[0] if final_media_url and index == 0 else None,
+                key=f"{key}:{index}" if key else None,
+            )
+            for index, body in enumerate(parts)
+        ]
+        sids = [future.result() for future in futures]
+        return next((sid for sid in sids if sid), None)
+
+    if not _TWILIO_AVAILABLE:
+        logger.error("twilio package not installed. Run: pip install twilio")
+        return None
+
     try:
         client = get_twilio_client()
-        
+    except Exception as e:
+        logger.error(f"❌ Unexpected Error during WhatsApp dispatch: {str(e)}")
+        return None
+
+    first_sid = None
+    for index, body in enumerate(parts):
         message_args = {
             "from_": from_number,
             "to": to,
-            "body": text or ""
+            "body": body
         }
-        
-        if final_media_url:
+
+        if final_media_url and index == 0:
             message_args["media_url"] = final_media_url
 
+        sid = _create_message(client, message_args)
+        if sid is None:
+            return first_sid
+        first_sid = first_sid or sid
+    return first_sid
+
+
+def _create_message(client, message_args) -> str | None:
+    to = message_args["to"]
+    try:
         resp = client.messages.create(**message_args)
         
         logger.info(f"✅ WhatsApp Sent Successfully! SID: {resp.sid} | Recipient: {to}")
@@ -87,4 +120,4 @@ def send_energy_update_to_whatsapp(to: str, text: str = "", image_url: str = Non
         return None
     except Exception as e:
         logger.error(f"❌ Unexpected Error during WhatsApp dispatch: {str(e)}")
-        return None
\ No newline at end of file
+        return None
@@ -1,19 +1,43 @@
+import hashlib
+import logging
 import os
-import requests
 import uuid
 from django.conf import settings
+from core.clients import get_http_session
 
-def download_and_save_image(image_url):
+logger = logging.getLogger(__name__)
+
+def fetch_to_file(image_url, file_path):
+    """Stream `image_url` into `file_path` (atomically) and return (sha256 hex digest, size in bytes), or None."""
+    tmp_path = f'{file_path}.{uuid.uuid4().hex[:8]}.part'
+    digest = hashlib.sha256()
+    size = 0
     try:
-        response = requests.get(image_url, stream=True)
-        if response.status_code == 200:
-            os.makedirs(os.path.join(settings.MEDIA_ROOT, 'generated_images'), exist_ok=True)
-            filename = f'energy_fault_{uuid.uuid4().hex[:8]}.png'
-            file_path = os.path.join(settings.MEDIA_ROOT, 'generated_images', filename)
-            with open(file_path, 'wb') as f:
-                for chunk in response.iter_content(1024):
+        with get_http_session().get(image_url, stream=True, timeout=settings.HTTP_TIMEOUT) as response:
+            if response.status_code != 200:
+                logger.warning(f'Error saving image: HTTP {response.status_code}')
+                return None
+            with open(tmp_path, 'wb') as f:
+                for chunk in response.iter_content(64 * 1024):
+                    digest.update(chunk)
+                    size += len(chunk)
                     f.write(chunk)
-            return f'{settings.MEDIA_URL}generated_images/{filename}'
+        os.replace(tmp_path, file_path)
+        return digest.hexdigest(), size
     except Exception as e:
-        print(f'Error saving image: {e}')
+        logger.warning(f'Error saving image: {e}')
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
     return None
+
+def download_image(image_url, subdir='generated_images'):
+    """Stream `image_url` into MEDIA_ROOT/<subdir>/ and return its storage name (relative to MEDIA_ROOT)."""
+    os.makedirs(os.path.join(settings.MEDIA_ROOT, subdir), exist_ok=True)
+    filename = f'energy_fault_{uuid.uuid4().hex[:8]}.png'
+    if fetch_to_file(image_url, os.path.join(settings.MEDIA_ROOT, subdir, filename)) is None:
+        return None
+    return f'{subdir}/{filename}'
+
+def download_and_save_image(image_url):
+    name = download_image(image_url)
+    return f'{settings.MEDIA_URL}{name}' if name else None
@@ -1,58 +1,261 @@
-from django.http import HttpResponse
-from django.views.decorators.csrf import csrf_exempt
-from twilio.twiml.messaging_response import MessagingResponse
-from asgiref.sync import sync_to_async
 import asyncio
-import threading
+import logging
+import mimetypes
+import os
+import re
+from functools import partial
 
-from django.contrib.auth.models import User
-from core.models import EnergyConsumer, ServiceTicket
-from core.flows.energy_flow import PowerPulseFlow 
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from django.contrib.admin.views.decorators import staff_member_required
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.crypto import constant_time_compare
+from django.utils.http import http_date
+from twilio.twiml.messaging_response import MessagingResponse
 
-def start_flow_thread(message_body, from_number):
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    loop.run_until_complete(run_flow_logic(message_body, from_number))
-    loop.close()
+from core.flows.energy_flow import PowerPulseFlow, ReplyNotSent
+from core.models import GeneratedEnergyContent
+from core.pipeline import get_pipeline
+from core.jobs import aenqueue_message
+from core.persistence import write_behind
+from core.dispatch import dispatcher
+from core.response_cache import response_cache
+from core.image_library import image_library
+from core.image_variants import image_variants
+from core.conversations import conversations
+from core.knowledge_base import knowledge_base
+from core.inbound import coalescer
+from core.classifier import detect_emergency
+from core.tools.whatsapp_sender import send_energy_update_to_whatsapp
+from core.profiling import profiler
+from core import logs, ticket_rollups
+from core.logs import log_context
 
-async def run_flow_logic(message_body, from_number):
-    try:
-        user, _ = await sync_to_async(User.objects.get_or_create)(username="whatsapp_user")
-        consumer, _ = await sync_to_async(EnergyConsumer.objects.get_or_create)(
-            user=user,
-            defaults={'meter_number': f'WA-{from_number[-8:]}', 'average_consumption': 350.0}
-        )
-        ticket = await sync_to_async(ServiceTicket.objects.create)(
-            consumer=consumer,
-            issue_description=message_body,
-            urgency='high' if any(word in message_body.lower() for word in ['spark', 'fire', 'smoke']) else 'normal'
-        )
+logger = logging.getLogger(__name__)
+
+def _phone(from_number):
+    return from_number.replace("whatsapp:", "").strip()
 
-        print(f"⚙️ PowerPulse AI Flow started for Ticket #{ticket.id}")
+async def process_message(message_body, from_number):
+    # The flow writes the message's single ticket (and its content) atomically
+    # once the reply is ready; see core/persistence.py.
+    with log_context(phone=_phone(from_number)):
+        logger.info(f"⚙️ PowerPulse AI Flow started for {from_number}")
         flow = PowerPulseFlow()
-        
-        
+
         await flow.kickoff_async(
-            user_query=message_body, 
+            user_query=message_body,
             whatsapp_to=from_number
         )
-        
-        print(f"🏁 Flow completed for Ticket #{ticket.id}")
+
+        logger.info(f"🏁 Flow completed for {from_number} (Ticket {flow.state.ticket_ref})", extra={"ticket": flow.state.ticket_ref})
+
+def _send_stored_reply(ticket_ref, from_number):
+    content = (
+        GeneratedEnergyContent.objects.filter(ticket__ticket_id=ticket_ref)
+        .only('id', 'generated_text', 'image_url').first()
+    )
+    if content is None:
+        # Still in the write-behind buffer of the process that wrote it.
+        raise ReplyNotSent(f"Ticket {ticket_ref} has no stored answer yet", ticket_ref=ticket_ref)
+    sid = send_energy_update_to_whatsapp(
+        to=from_number,
+        text=f"*Ref ID: {ticket_ref}*\n\n{content.generated_text}",
+        # With MEDIA_ASYNC the diagram was handed to the media stage on the first attempt.
+        image_url=None if settings.MEDIA_ASYNC else content.image_url,
+        key=f"{ticket_ref}:reply",
+    )
+    if not sid:
+        raise ReplyNotSent(f"No reply could be sent to {from_number} (Ticket {ticket_ref})", ticket_ref=ticket_ref)
+    dispatcher.record_sid(content.id, sid)
+
+async def resend_reply(ticket_ref, from_number):
+    """Send a stored answer whose reply failed, without running the flow (and writing a ticket) again."""
+    with log_context(phone=_phone(from_number), ticket=ticket_ref):
+        logger.info(f"🔁 Resending the stored reply for Ticket {ticket_ref} to {from_number}")
+        await asyncio.to_thread(_send_stored_reply, ticket_ref, from_number)
+
+async def run_flow_logic(message_body, from_number):
+    try:
+        await process_message(message_body, from_number)
     except Exception as e:
-        print(f"❌ Error in Flow Logic: {e}")
+        logger.exception(f"❌ Error in Flow Logic: {e}", extra={"phone": _phone(from_number)})
+        # Counted as failed by the pipeline.
+        raise
+
+async def notify_busy(from_number):
+    # For messages turned away after the webhook was answered, so TwiML can't carry the notice.
+    await asyncio.to_thread(send_energy_update_to_whatsapp, from_number, settings.PIPELINE_BUSY_MESSAGE)
+
+async def enqueue_message(message_body, from_number):
+    """Hand one query to the configured backend; False when the in-process pipeline sheds it."""
+    if settings.MESSAGE_QUEUE_BACKEND == 'database':
+        job_id = await aenqueue_message(message_body, from_number)
+        logger.info(f"📥 Queued as Job #{job_id}")
+        return True
+    return get_pipeline().submit(
+        run_flow_logic, message_body, from_number,
+        key=from_number,
+        priority='emergency' if detect_emergency(message_body) else 'normal',
+        on_shed=partial(notify_busy, from_number),
+    )
+
+async def accept_message(incoming_msg, from_number, message_sid=None):
+    """Queue one inbound WhatsApp message and return the TwiML to answer Twilio with."""
+    with log_context(phone=_phone(from_number)):
+        resp = MessagingResponse()
+        if coalescer.seen(message_sid):
+            logger.info(f"♻️ Ignoring Twilio retry of {message_sid} from {from_number}")
+            return str(resp)
+        logger.info(f"✅ Received from {from_number}: {incoming_msg}")
+        try:
+            if not await hold_or_enqueue(incoming_msg, from_number):
+                logger.warning(f"⏳ Pipeline busy, asking {from_number} to retry later")
+                resp.message(settings.PIPELINE_BUSY_MESSAGE)
+        except Exception:
+            # Not held or queued: let Twilio's retry of this MessageSid through.
+            coalescer.accepted(message_sid, ok=False)
+            raise
+        coalescer.accepted(message_sid)
+        return str(resp)
+
+async def hold_or_enqueue(message_body, from_number):
+    """Queue a message as part of its burst (core/inbound.py); False if the pipeline is full."""
+    if settings.MESSAGE_QUEUE_BACKEND == 'database' and coalescer.enabled:
+        return await coalescer.hold_queued(from_number, message_body)
+    # Held in memory; queued with the rest once the number goes quiet.
+    query = coalescer.hold(from_number, message_body)
+    return query is None or await enqueue_message(query, from_number)
 
-@csrf_exempt
-def whatsapp_webhook(request):
+async def whatsapp_webhook(request):
+    # Async end to end: the database backend awaits a group-committed insert
+    # (core/jobs.py) and the in-process pipeline's submit() is a non-blocking
+    # hand-off to its own event loop. Under ASGI, config/asgi.py normally
+    # answers this URL before Django's middleware; see core/asgi.py.
     if request.method == 'POST':
         incoming_msg = request.POST.get('Body', '').strip()
         from_number = request.POST.get('From', '').strip()
+        twiml = await accept_message(incoming_msg, from_number, request.POST.get('MessageSid'))
+        return HttpResponse(twiml, content_type='application/xml')
 
-        print(f"✅ Received from {from_number}: {incoming_msg}")
+    return HttpResponse("Method Not Allowed", status=405)
 
-        thread = threading.Thread(target=start_flow_thread, args=(incoming_msg, from_number))
-        thread.start()
+# Django 4.2's csrf_exempt() wraps views in a sync function, which would hide
+# that this one is a coroutine; set the flag it sets directly.
+whatsapp_webhook.csrf_exempt = True
 
-        resp = MessagingResponse()
-        return HttpResponse(str(resp), content_type='application/xml')
-    
-    return HttpResponse("Method Not Allowed", status=405)
\ No newline at end of file
+@staff_member_required
+def pipeline_stats(request):
+    return JsonResponse({
+        **get_pipeline().stats(), "write_behind": write_behind.stats(), "dispatch": dispatcher.stats(),
+        "inbound": coalescer.stats(), "logging": logs.stats(),
+    })
+
+@staff_member_required
+def response_cache_stats(request):
+    return JsonResponse(response_cache.stats())
+
+@staff_member_required
+def image_library_stats(request):
+    return JsonResponse({**image_library.stats(), "variants": image_variants.stats()})
+
+@staff_member_required
+def conversation_stats(request):
+    return JsonResponse(conversations.stats())
+
+@staff_member_required
+def knowledge_base_stats(request):
+    return JsonResponse(knowledge_base.stats())
+
+@staff_member_required
+def ticket_stats(request):
+    """Hourly ticket counts for the dashboard, from the TicketRollup buckets; `?hours=` (1-720, default 24)."""
+    try:
+        hours = int(request.GET.get('hours', 24))
+    except ValueError:
+        hours = 0
+    if not 1 <= hours <= 720:
+        return JsonResponse({"error": "hours must be a whole number from 1 to 720"}, status=400)
+    return JsonResponse(ticket_rollups.summary(hours))
+
+def flow_metrics(request):
+    """Prometheus text exposition of the flow profiler; staff, or `Authorization: Bearer FLOW_METRICS_TOKEN`."""
+    token = settings.FLOW_METRICS_TOKEN
+    authorized = (token and constant_time_compare(request.headers.get('Authorization', ''), f"Bearer {token}")) or (
+        request.user.is_active and request.user.is_staff
+    )
+    if not authorized:
+        return HttpResponse("Forbidden", status=403, content_type="text/plain")
+    return HttpResponse(
+        profiler.prometheus() + get_pipeline().prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8",
+    )
+
+_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+def _serve_file(request, path, content_type):
+    """A file with ETag/Last-Modified validators and single byte-range support; small images are read whole."""
+    stat = os.stat(path)
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": http_date(last_modified),
+        "Accept-Ranges": "bytes",
+        # Variant files never change in place; a new IMAGE_VARIANTS spec writes a new file.
+        "Cache-Control": f"public, max-age={settings.IMAGE_VARIANT_MAX_AGE}",
+    }
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        for name, value in headers.items():
+            not_modified[name] = value
+        return not_modified
+
+    size = stat.st_size
+    start, end = 0, size - 1
+    match = _RANGE.match(request.headers.get('Range', ''))
+    # A Range with a stale If-Range validator gets the whole (new) file.
+    if_range = request.headers.get('If-Range')
+    if match and if_range and if_range not in (etag, headers["Last-Modified"]):
+        match = None
+    if match:
+        first, last = match.groups()
+        if first:
+            start, end = int(first), min(int(last), size - 1) if last else size - 1
+        elif last:
+            start = max(0, size - int(last))
+        if not (first or last) or start > end:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{size}"
+            return response
+    with open(path, 'rb') as f:
+        f.seek(start)
+        body = f.read(end - start + 1)
+    response = HttpResponse(body, content_type=content_type, status=206 if match else 200)
+    for name, value in headers.items():
+        response[name] = value
+    if match:
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+    return response
+
+async def media_variant(request, variant, name):
+    """
+    MEDIA_URL/variants/<variant>/<name>: a stored image re-encoded for
+    WhatsApp, transcoded on first request (core/image_variants.py). If the
+    transcode fails the original file is served instead.
+    """
+    if request.method not in ('GET', 'HEAD') or variant not in image_variants.variants:
+        raise Http404("No such image variant")
+    try:
+        source = safe_join(settings.MEDIA_ROOT, name)
+    except Exception:
+        raise Http404("No such image")
+    if name.startswith(f"{image_variants.subdir}/") or not os.path.isfile(source):
+        raise Http404("No such image")
+
+    path = await image_variants.aensure(name, variant)
+    if path is None:
+        return await asyncio.to_thread(
+            _serve_file, request, source, mimetypes.guess_type(source)[0] or 'application/octet-stream',
+        )
+    return await asyncio.to_thread(_serve_file, request, path, image_variants.content_type(variant))
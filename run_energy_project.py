@@ -1,49 +1,53 @@
+import argparse
+import asyncio
 import os
+
 import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 django.setup()
 
-from django.contrib.auth.models import User
-from core.models import EnergyConsumer, ServiceTicket
-from core.flows.energy_flow import EnergyManagementFlow
-from asgiref.sync import sync_to_async
-import asyncio
+from django.conf import settings
+from core.flows.energy_flow import PowerPulseFlow
+from core.pipeline import get_pipeline
+
+DEFAULT_QUERY = "There is a strange burning smell near the main circuit breaker panel."
+
 
-async def run_test_scenario():
+async def run_test_scenario(query, whatsapp_to):
     print("🚀 Starting PowerPulse AI Test Scenario...")
 
-    user, _ = await sync_to_async(User.objects.get_or_create)(username="mohammad_tester")
-    
-    consumer, _ = await sync_to_async(EnergyConsumer.objects.get_or_create)(
-        user=user,
-        defaults={
-            'meter_number': 'JO-998877',
-            'address': 'Amman, Jordan',
-            'average_consumption': 450.5
-        }
-    )
-
-    ticket = await sync_to_async(ServiceTicket.objects.create)(
-        consumer=consumer,
-        issue_description="There is a strange burning smell near the main circuit breaker panel.",
-        urgency='high'
-    )
-
-    flow = EnergyManagementFlow()
-    flow.state['user_query'] = ticket.issue_description
-    flow.state['consumer_id'] = consumer.id
-    flow.state['ticket_id'] = ticket.id
-    
-    print(f"--- Processing Ticket ID: {ticket.id} ---")
-    
-    result = await flow.kickoff_async()
-    
+    flow = PowerPulseFlow()
+    result = await flow.kickoff_async(user_query=query, whatsapp_to=whatsapp_to)
+
+    # The diagram follows the text as a pipeline job; let it go out before exiting.
+    while get_pipeline().stats()["queue_depth"] or get_pipeline().stats()["in_flight"]:
+        await asyncio.sleep(0.1)
+
     print("\n" + "="*50)
     print("✅ TEST COMPLETED")
     print("="*50)
-    print(f"AI Final Output: {result}")
+    print(f"Ticket: {flow.state.ticket_ref}")
+    print(f"AI Final Output: {result or flow.state.final_output}")
     print("="*50)
 
+
 if __name__ == "__main__":
-    asyncio.run(run_test_scenario())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run one message through PowerPulseFlow.")
+    parser.add_argument('query', nargs='?', default=DEFAULT_QUERY)
+    parser.add_argument('--to', default=settings.TWILIO_WHATSAPP_TO, help="WhatsApp number to reply to")
+    parser.add_argument('--offline', action='store_true',
+                        help="Use the local OpenAI, DALL-E and Twilio fakes from benchmarks/fakes.py")
+    args = parser.parse_args()
+
+    fakes = None
+    if args.offline:
+        from benchmarks.fakes import install_fakes
+        fakes = install_fakes()
+    try:
+        asyncio.run(run_test_scenario(args.query, args.to))
+    finally:
+        if fakes is not None:
+            for delivery in fakes.sender.deliveries:
+                print(f"📤 {delivery.to}: {delivery.text[:120]!r}{' + image' if delivery.image_url else ''}")
+            fakes.close()